@@ -0,0 +1,139 @@
+"""
+agent_plugins.py
+Plugins del ADK para observar al agente sin tocar las tools ni el prompt.
+
+- TracingPlugin: un span "llm" por cada llamada al modelo y un span "tool"
+  por cada tool call, colgados de la traza del turno (ver tracing.py).
+- MetricsPlugin: latencias y errores de tools y llamadas al modelo como
+  métricas Prometheus (ver metrics.py).
+"""
+
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from google.adk.plugins.base_plugin import BasePlugin
+
+import metrics
+import tracing
+
+
+class TracingPlugin(BasePlugin):
+    def __init__(self):
+        super().__init__(name="retail_tracing")
+        # Los callbacks before/after no comparten stack: indexamos el span abierto
+        self._llm_spans: Dict[str, tracing.Span] = {}
+        self._tool_spans: Dict[str, tracing.Span] = {}
+
+    # -------------------------
+    # Modelo
+    # -------------------------
+    async def before_model_callback(self, *, callback_context, llm_request) -> Optional[Any]:
+        s = tracing.begin_span(
+            "llm_call",
+            "llm",
+            model=getattr(llm_request, "model", None),
+            agent=callback_context.agent_name,
+        )
+        if s is not None:
+            self._llm_spans[callback_context.invocation_id] = s
+        return None
+
+    async def after_model_callback(self, *, callback_context, llm_response) -> Optional[Any]:
+        s = self._llm_spans.pop(callback_context.invocation_id, None)
+        if s is not None:
+            usage = getattr(llm_response, "usage_metadata", None)
+            s.end(
+                status="error" if getattr(llm_response, "error_code", None) else "ok",
+                prompt_tokens=getattr(usage, "prompt_token_count", None),
+                output_tokens=getattr(usage, "candidates_token_count", None),
+            )
+        return None
+
+    async def on_model_error_callback(self, *, callback_context, llm_request, error) -> Optional[Any]:
+        s = self._llm_spans.pop(callback_context.invocation_id, None)
+        if s is not None:
+            s.end(status="error", error=f"{type(error).__name__}: {error}")
+        return None
+
+    # -------------------------
+    # Tools
+    # -------------------------
+    async def before_tool_callback(self, *, tool, tool_args, tool_context) -> Optional[dict]:
+        s = tracing.begin_span(tool.name, "tool")
+        if s is not None:
+            self._tool_spans[tool_context.function_call_id or tool.name] = s
+        return None
+
+    async def after_tool_callback(self, *, tool, tool_args, tool_context, result) -> Optional[dict]:
+        s = self._tool_spans.pop(tool_context.function_call_id or tool.name, None)
+        if s is not None:
+            status = result.get("status") if isinstance(result, dict) else None
+            s.end(status="error" if status == "error" else "ok", result_status=status)
+        return None
+
+    async def on_tool_error_callback(self, *, tool, tool_args, tool_context, error) -> Optional[dict]:
+        s = self._tool_spans.pop(tool_context.function_call_id or tool.name, None)
+        if s is not None:
+            s.end(status="error", error=f"{type(error).__name__}: {error}")
+        return None
+
+
+# -------------------------
+# Métricas
+# -------------------------
+AGENT_TOOL_CALLS = metrics.counter("agent_tool_calls_total", "Tool calls del agente", ("tool", "status"))
+AGENT_TOOL_LATENCY = metrics.histogram("agent_tool_duration_seconds", "Latencia de tool calls", ("tool",))
+AGENT_LLM_CALLS = metrics.counter("agent_llm_calls_total", "Llamadas al modelo", ("model", "status"))
+AGENT_LLM_LATENCY = metrics.histogram("agent_llm_call_duration_seconds", "Latencia de llamadas al modelo", ("model",))
+
+
+class MetricsPlugin(BasePlugin):
+    def __init__(self):
+        super().__init__(name="retail_metrics")
+        self._llm_started: Dict[str, Tuple[float, str]] = {}
+        self._tool_started: Dict[str, float] = {}
+
+    # -------------------------
+    # Modelo
+    # -------------------------
+    async def before_model_callback(self, *, callback_context, llm_request) -> Optional[Any]:
+        model = str(getattr(llm_request, "model", None) or "unknown")
+        self._llm_started[callback_context.invocation_id] = (time.perf_counter(), model)
+        return None
+
+    def _end_llm(self, callback_context, status: str):
+        started = self._llm_started.pop(callback_context.invocation_id, None)
+        if started is not None:
+            t0, model = started
+            AGENT_LLM_LATENCY.observe(time.perf_counter() - t0, model=model)
+            AGENT_LLM_CALLS.inc(model=model, status=status)
+
+    async def after_model_callback(self, *, callback_context, llm_response) -> Optional[Any]:
+        self._end_llm(callback_context, "error" if getattr(llm_response, "error_code", None) else "ok")
+        return None
+
+    async def on_model_error_callback(self, *, callback_context, llm_request, error) -> Optional[Any]:
+        self._end_llm(callback_context, "error")
+        return None
+
+    # -------------------------
+    # Tools
+    # -------------------------
+    async def before_tool_callback(self, *, tool, tool_args, tool_context) -> Optional[dict]:
+        self._tool_started[tool_context.function_call_id or tool.name] = time.perf_counter()
+        return None
+
+    def _end_tool(self, tool, tool_context, status: str):
+        t0 = self._tool_started.pop(tool_context.function_call_id or tool.name, None)
+        if t0 is not None:
+            AGENT_TOOL_LATENCY.observe(time.perf_counter() - t0, tool=tool.name)
+        AGENT_TOOL_CALLS.inc(tool=tool.name, status=status)
+
+    async def after_tool_callback(self, *, tool, tool_args, tool_context, result) -> Optional[dict]:
+        status = result.get("status") if isinstance(result, dict) else None
+        self._end_tool(tool, tool_context, "error" if status == "error" else "ok")
+        return None
+
+    async def on_tool_error_callback(self, *, tool, tool_args, tool_context, error) -> Optional[dict]:
+        self._end_tool(tool, tool_context, "error")
+        return None
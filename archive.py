@@ -0,0 +1,380 @@
+"""
+archive.py
+Archivado de datos fríos fuera de retail.db.
+
+Órdenes pagadas (con su carrito, ítems y reservas confirmadas) y carritos
+expirados más viejos que ARCHIVE_AFTER_MONTHS se mueven a archivos SQLite
+particionados por fecha de creación:
+
+    ARCHIVE_DIR/retail_archive_2024.db        (ARCHIVE_PARTITION=year, default)
+    ARCHIVE_DIR/retail_archive_2024_03.db     (ARCHIVE_PARTITION=month)
+
+Cada lote (ARCHIVE_BATCH_SIZE órdenes/carritos) se mueve así:
+1) ATTACH del archivo de la partición
+2) transacción 1: INSERT OR REPLACE de las filas en el archivo
+3) transacción 2: DELETE en la base caliente solo de las filas que ya
+   están en el archivo
+Si el proceso se corta entre 1 y 2 quedan duplicados (nunca pérdidas); la
+próxima corrida los vuelve a copiar y borra. Las lecturas prefieren la fila
+caliente.
+
+Lectura transparente: `reading(conn, include_archive)` adjunta los archivos
+y crea vistas TEMP all_orders / all_carts / all_cart_items (base caliente
+UNION ALL archivos, con la columna `source`); sin include_archive devuelve
+los nombres de las tablas calientes y no adjunta nada. SQLite adjunta como
+máximo 10 bases: se leen las ARCHIVE_MAX_ATTACHED particiones más recientes.
+
+Con varias tiendas (shards.py) cada base tiene sus particiones en
+ARCHIVE_DIR/<tienda>/ (los ids de órdenes se repiten entre tiendas).
+
+Config (env):
+- ARCHIVE_ENABLED         agenda el job archive_cold_data (default false)
+- ARCHIVE_DIR             carpeta de los archivos (default ./archive)
+- ARCHIVE_AFTER_MONTHS    antigüedad mínima (default 6)
+- ARCHIVE_PARTITION       year | month (default year)
+- ARCHIVE_BATCH_SIZE      órdenes/carritos por transacción (default 500)
+- ARCHIVE_INTERVAL        segundos entre corridas del job (default 86400)
+- ARCHIVE_MAX_ATTACHED    particiones que se leen con include_archive (default 8)
+
+Uso:
+    python archive.py run --months 6        # corrida manual
+    python archive.py stats                 # tamaño de la base caliente y de cada archivo
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import metrics
+import shards
+
+BASE_DIR = Path(__file__).resolve().parent
+
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "false").lower() == "true"
+ARCHIVE_DIR = Path(os.getenv("ARCHIVE_DIR", str(BASE_DIR / "archive")))
+ARCHIVE_AFTER_MONTHS = int(os.getenv("ARCHIVE_AFTER_MONTHS", "6"))
+ARCHIVE_PARTITION = os.getenv("ARCHIVE_PARTITION", "year").lower()
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "86400"))
+ARCHIVE_MAX_ATTACHED = int(os.getenv("ARCHIVE_MAX_ATTACHED", "8"))
+
+# Tablas archivables y la columna que las liga a la unidad (orden / carrito)
+ARCHIVED_TABLES = ("orders", "carts", "cart_items", "stock_reservations")
+_KEY = {"orders": "id", "carts": "id", "cart_items": "cart_id", "stock_reservations": "cart_id"}
+
+ARCHIVED_ROWS = metrics.counter("archive_rows_moved_total", "Filas movidas a archivos fríos", ("table",))
+DB_SIZE = metrics.gauge("sqlite_db_size_bytes", "Tamaño en disco de la base (incluye -wal)", ("db",), mode="max")
+
+_PART_RE = re.compile(r"^retail_archive_(\d{4}(?:_\d{2})?)\.db$")
+
+
+# -------------------------
+# Particiones
+# -------------------------
+def partition_of(created_at: str) -> str:
+    """'2024-03-15 10:00:00' -> '2024' (year) o '2024_03' (month)."""
+    year, month = created_at[:4], created_at[5:7]
+    return f"{year}_{month}" if ARCHIVE_PARTITION == "month" else year
+
+
+def archive_dir(hot_path) -> Path:
+    """Carpeta de particiones de una base: ARCHIVE_DIR, o ARCHIVE_DIR/<tienda> para el shard de una tienda."""
+    store = shards.store_of_path(hot_path)
+    return ARCHIVE_DIR / store if store else ARCHIVE_DIR
+
+
+def _conn_archive_dir(conn: sqlite3.Connection) -> Path:
+    main = next(r for r in conn.execute("PRAGMA database_list") if r[1] == "main")
+    return archive_dir(main[2])
+
+
+def partition_path(part: str, directory: Path = ARCHIVE_DIR) -> Path:
+    return directory / f"retail_archive_{part}.db"
+
+
+def list_partitions(directory: Path = ARCHIVE_DIR) -> List[str]:
+    """Particiones existentes, de la más nueva a la más vieja."""
+    if not directory.exists():
+        return []
+    parts = [m.group(1) for p in directory.iterdir() if (m := _PART_RE.match(p.name))]
+    return sorted(parts, reverse=True)
+
+
+def _columns(conn: sqlite3.Connection, schema: str, table: str) -> List[str]:
+    return [r[1] for r in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def _attach(conn: sqlite3.Connection, part: str, create: bool) -> str:
+    alias = f"arch_{part}"
+    attached = {r[1] for r in conn.execute("PRAGMA database_list")}
+    if alias not in attached:
+        directory = _conn_archive_dir(conn)
+        path = partition_path(part, directory)
+        if create:
+            directory.mkdir(parents=True, exist_ok=True)
+            conn.execute("ATTACH DATABASE ? AS " + alias, (str(path),))
+        else:
+            conn.execute("ATTACH DATABASE ? AS " + alias, (f"file:{path}?mode=ro",))
+    if create:
+        for table in ARCHIVED_TABLES:
+            _ensure_table(conn, alias, table)
+    return alias
+
+
+def _ensure_table(conn: sqlite3.Connection, alias: str, table: str):
+    """Misma lista de columnas que la tabla caliente (columnas nuevas se agregan)."""
+    hot_cols = [(r[1], r[2]) for r in conn.execute(f"PRAGMA main.table_info({table})")]
+    have = set(_columns(conn, alias, table))
+    if not have:
+        cols = ", ".join(f"{name} {ctype}{' PRIMARY KEY' if name == 'id' else ''}" for name, ctype in hot_cols)
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {alias}.{table} ({cols})")
+        if _KEY[table] != "id":
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {alias}.idx_{table}_{_KEY[table]} ON {table}({_KEY[table]})")
+        if table == "orders":
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {alias}.idx_orders_user_created ON orders(user_id, created_at)")
+        return
+    for name, ctype in hot_cols:
+        if name not in have:
+            conn.execute(f"ALTER TABLE {alias}.{table} ADD COLUMN {name} {ctype}")
+
+
+# -------------------------
+# Mover datos
+# -------------------------
+def _candidates(conn: sqlite3.Connection, months: int, limit: int) -> List[Tuple[str, Optional[int], int]]:
+    """(created_at, order_id | None, cart_id) de lo archivable, lo más viejo primero."""
+    cutoff = f"-{months} months"
+    rows = conn.execute(
+        """
+        SELECT o.created_at, o.id, o.cart_id
+        FROM orders o
+        WHERE o.payment_status = 'paid' AND o.created_at < datetime('now', ?)
+        ORDER BY o.created_at
+        LIMIT ?
+        """,
+        (cutoff, limit),
+    ).fetchall()
+    if len(rows) < limit:
+        rows += conn.execute(
+            """
+            SELECT c.created_at, NULL, c.id
+            FROM carts c
+            WHERE c.status = 'expired' AND c.created_at < datetime('now', ?)
+              AND NOT EXISTS (SELECT 1 FROM orders o WHERE o.cart_id = c.id)
+            ORDER BY c.created_at
+            LIMIT ?
+            """,
+            (cutoff, limit - len(rows)),
+        ).fetchall()
+    return [(r[0], r[1], r[2]) for r in rows]
+
+
+def _move(conn: sqlite3.Connection, alias: str, order_ids: List[int], cart_ids: List[int]) -> Dict[str, int]:
+    ids_for = {"orders": order_ids, "carts": cart_ids, "cart_items": cart_ids, "stock_reservations": cart_ids}
+
+    # 1) Copiar (si se corta acá, la base caliente sigue intacta)
+    conn.execute("BEGIN IMMEDIATE")
+    for table in ARCHIVED_TABLES:
+        ids = ids_for[table]
+        if not ids:
+            continue
+        cols = ", ".join(_columns(conn, "main", table))
+        marks = ",".join("?" * len(ids))
+        conn.execute(
+            f"INSERT OR REPLACE INTO {alias}.{table} ({cols}) "
+            f"SELECT {cols} FROM main.{table} WHERE {_KEY[table]} IN ({marks})",
+            ids,
+        )
+    conn.commit()
+
+    # 2) Borrar de la base caliente solo lo que ya está en el archivo (hijos primero)
+    moved = {}
+    conn.execute("BEGIN IMMEDIATE")
+    for table in ("cart_items", "stock_reservations", "orders", "carts"):
+        ids = ids_for[table]
+        if not ids:
+            continue
+        marks = ",".join("?" * len(ids))
+        key = _KEY[table]
+        cur = conn.execute(
+            f"DELETE FROM main.{table} WHERE {key} IN ({marks}) "
+            f"AND id IN (SELECT id FROM {alias}.{table} WHERE {key} IN ({marks}))",
+            ids + ids,
+        )
+        moved[table] = cur.rowcount
+    conn.commit()
+    for table, n in moved.items():
+        if n:
+            ARCHIVED_ROWS.inc(n, table=table)
+    return moved
+
+
+def archive_batch(conn: sqlite3.Connection, months: int = ARCHIVE_AFTER_MONTHS, limit: int = ARCHIVE_BATCH_SIZE) -> Dict[str, int]:
+    """Mueve un lote. Devuelve filas movidas por tabla (vacío = no queda nada)."""
+    if conn.in_transaction:
+        conn.commit()  # ATTACH no se puede dentro de una transacción
+    by_part: Dict[str, Tuple[List[int], List[int]]] = {}
+    for created_at, order_id, cart_id in _candidates(conn, months, limit):
+        orders, carts = by_part.setdefault(partition_of(created_at), ([], []))
+        if order_id is not None:
+            orders.append(order_id)
+        carts.append(cart_id)
+
+    totals: Dict[str, int] = {}
+    for part, (order_ids, cart_ids) in sorted(by_part.items()):
+        alias = _attach(conn, part, create=True)
+        try:
+            for table, n in _move(conn, alias, order_ids, cart_ids).items():
+                totals[table] = totals.get(table, 0) + n
+        finally:
+            conn.execute(f"DETACH DATABASE {alias}")
+    return totals
+
+
+def archive_cold_data(conn: sqlite3.Connection, max_seconds: float = 10.0, pause: float = 0.05) -> Dict[str, Any]:
+    """Job: lotes hasta que no quede nada o se agote el tiempo."""
+    deadline = time.monotonic() + max_seconds
+    totals: Dict[str, int] = {}
+    more = True
+    while time.monotonic() < deadline:
+        moved = archive_batch(conn)
+        if not moved:
+            more = False
+            break
+        for table, n in moved.items():
+            totals[table] = totals.get(table, 0) + n
+        time.sleep(pause)
+    return {**totals, "more": more}
+
+
+# -------------------------
+# Lectura transparente
+# -------------------------
+_VIEWS = {"all_orders": "orders", "all_carts": "carts", "all_cart_items": "cart_items"}
+
+
+@contextmanager
+def with_archive(conn: sqlite3.Connection, include: bool = True) -> Iterator[List[str]]:
+    """
+    Crea vistas TEMP all_orders / all_carts / all_cart_items sobre la base
+    caliente y (si include) las particiones más recientes. Una fila que está
+    en caliente y en archivo (corrida cortada) aparece una sola vez.
+    Devuelve las particiones adjuntadas.
+    """
+    aliases = []
+    if include:
+        if conn.in_transaction:
+            conn.commit()
+        for part in list_partitions(_conn_archive_dir(conn))[:ARCHIVE_MAX_ATTACHED]:
+            try:
+                aliases.append((part, _attach(conn, part, create=False)))
+            except sqlite3.OperationalError as e:
+                print(f"⚠️  No pude adjuntar el archivo {part}: {e}")
+    try:
+        for view, table in _VIEWS.items():
+            cols = _columns(conn, "main", table)
+            selects = [f"SELECT {', '.join(cols)}, 'hot' AS source FROM main.{table}"]
+            for part, alias in aliases:
+                have = set(_columns(conn, alias, table))
+                exprs = ", ".join(c if c in have else f"NULL AS {c}" for c in cols)
+                selects.append(
+                    f"SELECT {exprs}, '{part}' AS source FROM {alias}.{table} "
+                    f"WHERE id NOT IN (SELECT id FROM main.{table})"
+                )
+            conn.execute(f"DROP VIEW IF EXISTS temp.{view}")
+            conn.execute(f"CREATE TEMP VIEW {view} AS " + " UNION ALL ".join(selects))
+        yield [part for part, _ in aliases]
+    finally:
+        for view in _VIEWS:
+            conn.execute(f"DROP VIEW IF EXISTS temp.{view}")
+        if conn.in_transaction:
+            conn.commit()
+        for _, alias in aliases:
+            conn.execute(f"DETACH DATABASE {alias}")
+
+
+def tables(include: bool) -> Dict[str, str]:
+    """Nombres a usar en el SQL: vistas all_* con include_archive, tablas calientes si no."""
+    if include:
+        return {"orders": "all_orders", "carts": "all_carts", "cart_items": "all_cart_items", "source": "source"}
+    return {"orders": "orders", "carts": "carts", "cart_items": "cart_items", "source": "'hot'"}
+
+
+@contextmanager
+def reading(conn: sqlite3.Connection, include: bool) -> Iterator[Dict[str, str]]:
+    """`with archive.reading(conn, include_archive) as t: ... FROM {t['orders']} ...`"""
+    if not include:
+        yield tables(False)
+        return
+    with with_archive(conn):
+        yield tables(True)
+
+
+# -------------------------
+# Tamaños
+# -------------------------
+def _file_size(path: Path) -> int:
+    return sum(p.stat().st_size for p in (path, Path(f"{path}-wal")) if p.exists())
+
+
+def sizes(hot_path: Path) -> Dict[str, int]:
+    out = {"hot": _file_size(Path(hot_path))}
+    directory = archive_dir(hot_path)
+    for part in list_partitions(directory):
+        out[f"archive_{part}"] = _file_size(partition_path(part, directory))
+    return out
+
+
+def track_sizes(hot_paths: List[Path]):
+    """Expone sqlite_db_size_bytes{db=hot|archive} en /metrics (suma de todas las tiendas)."""
+    def collect():
+        hot = archived = 0
+        for path in hot_paths:
+            s = sizes(path)
+            hot += s.pop("hot")
+            archived += sum(s.values())
+        return [(("hot",), float(hot)), (("archive",), float(archived))]
+    DB_SIZE.set_function(collect)
+
+
+# -------------------------
+# CLI
+# -------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Archivado de datos fríos de retail.db")
+    parser.add_argument("command", choices=["run", "stats"])
+    parser.add_argument("--db", type=Path, default=Path(os.getenv("RETAIL_DB_PATH", str(BASE_DIR / "retail.db"))))
+    parser.add_argument("--months", type=int, default=ARCHIVE_AFTER_MONTHS)
+    parser.add_argument("--batch", type=int, default=ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        for name, size in sizes(args.db).items():
+            print(f"{name:<24} {size / 1024 / 1024:>10.2f} MB")
+        return
+
+    conn = sqlite3.connect(args.db, timeout=30)
+    conn.execute("PRAGMA journal_mode = WAL")
+    before = _file_size(args.db)
+    totals: Dict[str, int] = {}
+    t0 = time.perf_counter()
+    while True:
+        moved = archive_batch(conn, args.months, args.batch)
+        if not moved:
+            break
+        for table, n in moved.items():
+            totals[table] = totals.get(table, 0) + n
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    print(f"📦 Archivado en {time.perf_counter() - t0:.1f} s: {totals or 'nada para mover'}")
+    print(f"   Base caliente: {before / 1024 / 1024:.2f} MB -> {_file_size(args.db) / 1024 / 1024:.2f} MB "
+          f"(el espacio libre se reutiliza; VACUUM para achicar el archivo)")
+
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,8 @@ import base64
 import sqlite3
 import csv
 import io
+import time
+import asyncio
 
 from urllib.parse import quote_plus
 
@@ -33,45 +35,66 @@ from fastapi import (
     File,
     UploadFile,
     Query,
-    Header
+    Header,
+    Response,
 )
-from fastapi.responses import RedirectResponse, HTMLResponse
+from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel, EmailStr, Field
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.sessions import SessionMiddleware
 
-import time
-from collections import defaultdict, deque
-
-LOGIN_RATE_WINDOW = 60      # segundos
-LOGIN_RATE_MAX = 5          # intentos
-_login_attempts = defaultdict(deque)
+import archive
+import catalog_snapshot
+import change_events
+import inventory
+import jobs
+import live_feed
+import metrics
+import payments
+import recommendations
+import shards
+import shopping_list
+import slow_queries
+import storage
+import tracing
+from normalization import fold_text, normalize_phone
+
+import math
+from rate_limit import build_limiter_from_env
+
+# Token bucket acotado (LOGIN_RATE_MAX intentos cada LOGIN_RATE_WINDOW s);
+# LOGIN_RATE_BACKEND=sqlite lo comparte entre workers
+login_limiter = build_limiter_from_env("login")
 
 def rate_limit_login(key: str):
-    now = time.time()
-    q = _login_attempts[key]
-
-    while q and now - q[0] > LOGIN_RATE_WINDOW:
-        q.popleft()
-
-    if len(q) >= LOGIN_RATE_MAX:
+    if login_limiter is None:
+        return
+    allowed, retry_after = login_limiter.hit(key)
+    if not allowed:
         raise HTTPException(
             status_code=429,
-            detail="Demasiados intentos. Esperá un minuto."
+            detail="Demasiados intentos. Esperá un minuto.",
+            headers={"Retry-After": str(math.ceil(retry_after))},
         )
 
-    q.append(now)
-
 # -------------------------
 # Paths base
 # -------------------------
 BASE_DIR = Path(__file__).resolve().parent
-DB_PATH = BASE_DIR / "retail.db"
+# RETAIL_DB_PATH permite apuntar a otra base (benchmarks / load tests)
+DB_PATH = Path(os.getenv("RETAIL_DB_PATH", str(BASE_DIR / "retail.db")))
 SCHEMA_PATH = BASE_DIR / "schema.sql"
+# Espera máxima por el lock de escritura (checkouts concurrentes)
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "10"))
 CHECKOUT_BASE_URL = os.getenv(
     "CHECKOUT_BASE_URL", "http://localhost:8001/index.html"
 )
+# Pasarela de pago (payment_gateway_stub.py en local): el checkout web le manda el pago
+PAYMENT_GATEWAY_URL = os.getenv("PAYMENT_GATEWAY_URL", "")
+# Órdenes recientes por tienda en /admin/stores
+ADMIN_STORES_LATEST = int(os.getenv("ADMIN_STORES_LATEST", "30"))
 
 # -------------------------
 # Config admin (simple)
@@ -87,7 +110,8 @@ if not BACKOFFICE_API_KEY:
     raise RuntimeError("BACKOFFICE_API_KEY no configurada")
 
 def require_api_key(x_api_key: str = Header(default="")):
-    if x_api_key != BACKOFFICE_API_KEY:
+    # Clave interna o clave de una tienda (STORE_API_KEYS, ver shards.py)
+    if not shards.is_api_key(x_api_key, BACKOFFICE_API_KEY):
         raise HTTPException(status_code=401, detail="Unauthorized")
 
 app = FastAPI(
@@ -96,37 +120,276 @@ app = FastAPI(
     version="0.1.0",
 )
 
+# Tienda del request (una base por tienda, ver shards.py). Se registra antes
+# que SessionMiddleware para quedar adentro y poder leer la tienda elegida en el admin.
+@app.middleware("http")
+async def route_store(request: Request, call_next):
+    requested = (
+        request.headers.get(shards.STORE_HEADER)
+        or request.query_params.get("store")
+        or request.scope.get("session", {}).get("store")
+    )
+    try:
+        store = shards.resolve_store(request.headers.get("x-api-key", ""), requested)
+    except shards.UnknownStore:
+        return JSONResponse(status_code=404, content={"detail": f"Tienda desconocida: {requested}"})
+    with shards.use_store(store):
+        return await call_next(request)
+
 # Sessions para login
 app.add_middleware(
     SessionMiddleware,
     secret_key=os.getenv("SESSION_SECRET_KEY", "dev-only"),
 )
 
+# Tracing: continúa la traza del turno (header x-trace-context) o abre una nueva
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    with tracing.start_trace(
+        f"{request.method} {tracing.route_name(request.url.path)}",
+        "http_server",
+        parent_header=request.headers.get(tracing.TRACE_HEADER),
+    ) as s:
+        response = await call_next(request)
+        if s is not None:
+            s.set(status_code=response.status_code)
+    return response
+
+# Métricas Prometheus: latencias por ruta, in-flight y GET /metrics
+metrics.instrument_app(app, "backoffice")
+
 # Static & templates
 app.mount("/static", StaticFiles(directory=BASE_DIR / "static"), name="static")
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
+# Selector de tienda en admin_base.html
+templates.env.globals["stores"] = shards.STORES if shards.SHARDED else []
+templates.env.globals["current_store"] = shards.current_store
 
 
 # -------------------------
 # DB utils
 # -------------------------
-def get_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+# Una base por tienda con su pool de conexiones; con RETAIL_STORES vacío, solo DB_PATH
+shard_set = shards.ShardSet(DB_PATH, DB_BUSY_TIMEOUT)
+
+
+def current_db_path() -> Path:
+    return shard_set.path(shards.current_store())
+
+
+# Statements sobre SLOW_QUERY_MS quedan en /admin/slow-queries con su EXPLAIN,
+# corrido sobre la base de la tienda del statement
+slow_queries.install(current_db_path)
+
+
+def get_connection(store: Optional[str] = None):
+    # Del pool de la tienda del request; las conexiones cronometran cada statement (spans "sql")
+    return shard_set.connect(store)
+
+
+# Camino de compra (carrito y checkout) sobre las mismas conexiones (ver storage.py)
+checkout_storage = storage.build_storage_from_env(get_connection)
 
 
 def init_db():
-    if not DB_PATH.exists():
-        print(f"Creando base de datos en {DB_PATH}")
-    with get_connection() as conn, open(SCHEMA_PATH, "r", encoding="utf-8") as f:
+    for store in shard_set.stores:
+        with shards.use_store(store):
+            _init_store_db(store)
+
+
+def _init_store_db(store: str):
+    path = shard_set.path(store)
+    if not path.exists():
+        print(f"Creando base de datos en {path}")
+    with get_connection(store) as conn, open(SCHEMA_PATH, "r", encoding="utf-8") as f:
+        # WAL: lectores no bloquean al escritor de las reservas de stock
+        conn.execute("PRAGMA journal_mode = WAL")
+        # Columnas derivadas nuevas: se completan antes del schema (índices y triggers)
+        _migrate_users(conn)
+        fts_exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'users_fts'").fetchone()
         conn.executescript(f.read())
         conn.commit()
+        if not fts_exists:
+            conn.execute("INSERT INTO users_fts(users_fts) VALUES ('rebuild')")
+            conn.commit()
+        inventory.begin_write(conn)
+        released = inventory.release_expired(conn)
+        conn.commit()
+    if released:
+        print(f"📦 Stock liberado de reservas vencidas ({store}): {released} unidades")
+
+
+def _migrate_users(conn: sqlite3.Connection):
+    """
+    Bases anteriores a users.phone_norm / users.name_fold: agrega las columnas
+    antes del schema (que las indexa) y completa las filas que falten. El
+    backfill corre en cada arranque y no sólo en el proceso que agregó la
+    columna: si ese worker se cayó a mitad de camino, el siguiente termina.
+    """
+    if not _add_user_columns(conn):
+        return
+    phones = backfill_phone_norm(conn)
+    if phones:
+        print(f"📞 Teléfonos normalizados (phone_norm): {phones} usuarios")
+    names = backfill_name_fold(conn)
+    if names:
+        print(f"🔎 Nombres normalizados (name_fold): {names} usuarios")
+
+
+def _add_user_columns(conn: sqlite3.Connection) -> bool:
+    """
+    Agrega las columnas que falten. Los workers de uvicorn arrancan a la vez:
+    mirar y agregar van bajo el lock de escritura (BEGIN IMMEDIATE), así el
+    segundo ve las columnas del primero en vez de fallar con "duplicate
+    column name". Devuelve False si la tabla todavía no existe (base nueva).
+    """
+    inventory.begin_write(conn)
+    try:
+        cols = [r[1] for r in conn.execute("PRAGMA table_info(users)")]
+        for c in ("phone_norm", "name_fold"):
+            if cols and c not in cols:
+                conn.execute(f"ALTER TABLE users ADD COLUMN {c} TEXT")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return bool(cols)
+
+
+def _backfill_users(conn: sqlite3.Connection, column: str, source: str, fn, batch: int = 5000) -> int:
+    done = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            f"SELECT id, {source} FROM users WHERE {column} IS NULL AND {source} IS NOT NULL AND id > ? "
+            "ORDER BY id LIMIT ?",
+            (last_id, batch),
+        ).fetchall()
+        if not rows:
+            return done
+        last_id = rows[-1][0]
+        updates = [(value, r[0]) for r in rows if (value := fn(r[1]))]
+        conn.executemany(f"UPDATE users SET {column} = ? WHERE id = ?", updates)
+        conn.commit()
+        done += len(updates)
+
+
+def backfill_phone_norm(conn: sqlite3.Connection) -> int:
+    """
+    Completa phone_norm de los usuarios que no lo tienen (migración de bases
+    viejas). Los teléfonos que no se pueden normalizar quedan en NULL.
+    Devuelve cuántos normalizó.
+    """
+    return _backfill_users(conn, "phone_norm", "phone", normalize_phone)
+
+
+def backfill_name_fold(conn: sqlite3.Connection) -> int:
+    """Completa name_fold (nombre sin acentos ni mayúsculas, lo que indexa users_fts)."""
+    return _backfill_users(conn, "name_fold", "name", fold_text)
+
+
+def _phone_condition(phone: str):
+    """(condición, valor) por teléfono: índice sobre phone_norm si se puede normalizar; si no, igualdad literal."""
+    norm = normalize_phone(phone)
+    return ("phone_norm = ?", norm) if norm else ("phone = ?", phone)
+
+
+def _users_query(conditions: List[str], params: list, text: Optional[str] = None):
+    """
+    (sql, params) del listado de usuarios: filtros AND sobre el alias u.
+    Con `text` busca en nombre y email por el índice users_fts (trigramas):
+    cada palabra de 3+ letras es un substring/prefijo por índice, las más
+    cortas se filtran sobre name_fold. Orden: nombre que empieza con el texto,
+    relevancia (bm25; el nombre pesa más que el email) y después los más recientes.
+    """
+    conditions, params = list(conditions), list(params)
+    join, order, order_params = "", "u.created_at DESC", []
+    words = fold_text(text).split() if text else []
+    for w in words:
+        if len(w) < 3:
+            conditions.append("instr(u.name_fold, ?) > 0")
+            params.append(w)
+    indexed = [w for w in words if len(w) >= 3]
+    if indexed:
+        join = "JOIN users_fts ON users_fts.rowid = u.id"
+        conditions.insert(0, "users_fts MATCH ?")
+        params.insert(0, " ".join('"' + w.replace('"', '""') + '"' for w in indexed))
+        order = "(u.name_fold LIKE ?) DESC, bm25(users_fts, 10.0, 1.0), u.created_at DESC"
+        order_params.append(" ".join(words) + "%")
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    sql = f"""
+        SELECT u.id, u.name, u.email, u.phone, u.segment, u.created_at
+        FROM users u
+        {join}
+        {where}
+        ORDER BY {order}
+        """
+    return sql, params + order_params
+
+
+def get_control_connection():
+    """Base de la tienda default: lease e historial de jobs (tablas de control)."""
+    return get_connection(shards.DEFAULT_STORE)
+
+
+# Barrida de carritos abandonados y reservas vencidas (un solo worker corre los jobs,
+# con varias tiendas cada corrida recorre todas las bases)
+scheduler = jobs.register_retail_jobs(
+    get_control_connection,
+    each_store=shard_set.for_each if shards.SHARDED else None,
+)
+# Tamaño de la base caliente y de los archivos fríos en /metrics
+archive.track_sizes([shard_set.path(s) for s in shard_set.stores])
+# Snapshot mapeado del catálogo por tienda: lo arma el líder de jobs, lo leen todos los workers
+catalogs = {
+    store: catalog_snapshot.CatalogStore(catalog_snapshot.snapshot_dir(shard_set.path(store)))
+    for store in shard_set.stores
+}
+catalog_builders = [
+    catalog_snapshot.SnapshotBuilder(
+        lambda store=store: get_connection(store),
+        catalogs[store],
+        should_build=lambda: scheduler.is_leader or not jobs.JOBS_ENABLED,
+    )
+    for store in shard_set.stores
+]
+
+
+def current_catalog() -> catalog_snapshot.CatalogStore:
+    return catalogs[shards.current_store()]
+
+
+# Admin en vivo: un lector del log de cambios por tienda para todas las pestañas
+live_feeds = {
+    store: live_feed.LiveFeed(
+        store,
+        lambda store=store: get_connection(store),
+        lambda name, context: templates.get_template(name).render(**context),
+    )
+    for store in shard_set.stores
+}
 
 
 @app.on_event("startup")
 def on_startup():
     init_db()
+    scheduler.start()
+    for builder in catalog_builders:
+        # El primer snapshot lo arma el thread del líder: hasta entonces la búsqueda es degradada
+        builder.start()
+
+
+@app.on_event("shutdown")
+def on_shutdown():
+    for builder in catalog_builders:
+        builder.stop()
+    for feed in live_feeds.values():
+        feed.stop()
+    scheduler.stop()
+    for committer in payment_committers.values():
+        committer.stop()
+    checkout_storage.close()
+    shard_set.close()
 
 
 # -------------------------
@@ -175,7 +438,12 @@ class CartAddItemRequest(BaseModel):
     user_id: int
     product_id: int
     quantity: int = 1
-    
+
+
+class ShoppingListRequest(BaseModel):
+    items: List[str] = Field(..., min_length=1, max_length=50, description="Ingredientes o productos genéricos")
+    per_item: int = Field(default=3, ge=1, le=10)
+
 class CheckoutRequest(BaseModel):
     user_id: int
     email: EmailStr
@@ -234,6 +502,8 @@ def admin_logout(request: Request):
 @app.get("/admin", response_class=HTMLResponse)
 def admin_dashboard(request: Request, _: bool = Depends(get_current_admin)):
     with get_connection() as conn:
+        # Antes de contar: lo que pase en el medio llega por el stream en vivo
+        live_after = change_events.last_seq(conn)
         users_count = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
         products_count = conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
         orders_count = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
@@ -244,10 +514,155 @@ def admin_dashboard(request: Request, _: bool = Depends(get_current_admin)):
             "users_count": users_count,
             "products_count": products_count,
             "orders_count": orders_count,
+            "live_after": live_after,
+        },
+    )
+
+
+@app.get("/admin/events/stream")
+async def admin_events_stream(
+    request: Request,
+    after: Optional[int] = Query(None, ge=0, description="seq con el que se renderizó la página"),
+    _: bool = Depends(get_current_admin),
+):
+    """
+    Server-Sent Events para dashboard.html, orders.html y carts.html:
+    contadores y filas ya renderizadas, desde un único lector del log de
+    cambios por tienda (live_feed.py). Al reconectar, EventSource manda
+    Last-Event-ID y se retoma desde ahí.
+    """
+    last_event_id = request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        after = int(last_event_id)
+    feed = live_feeds[shards.current_store()]
+    try:
+        sub, backlog = await run_in_threadpool(feed.subscribe, asyncio.get_running_loop(), after)
+    except live_feed.TooManyClients as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return StreamingResponse(
+        feed.sse(sub, backlog, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/admin/slow-queries", response_class=HTMLResponse)
+def admin_slow_queries(
+    request: Request,
+    order_by: str = Query("total_ms"),
+    _: bool = Depends(get_current_admin),
+):
+    if order_by not in ("total_ms", "max_ms", "avg_ms", "count"):
+        order_by = "total_ms"
+    log = slow_queries.slow_log
+    return templates.TemplateResponse(
+        "slow_queries.html",
+        {
+            "request": request,
+            "queries": log.top(100, order_by) if log else [],
+            "order_by": order_by,
+            "threshold_ms": slow_queries.SLOW_QUERY_MS,
+            "enabled": log is not None,
+        },
+    )
+
+
+@app.post("/admin/slow-queries/reset")
+def admin_slow_queries_reset(_: bool = Depends(get_current_admin)):
+    if slow_queries.slow_log:
+        slow_queries.slow_log.reset()
+    return RedirectResponse(url="/admin/slow-queries", status_code=status.HTTP_303_SEE_OTHER)
+
+
+@app.get("/admin/jobs", response_class=HTMLResponse)
+def admin_jobs(request: Request, _: bool = Depends(get_current_admin)):
+    with get_control_connection() as conn:
+        job_list = scheduler.summary(conn)
+        runs = scheduler.recent_runs(conn, 50)
+    return templates.TemplateResponse(
+        "jobs.html",
+        {
+            "request": request,
+            "jobs": job_list,
+            "runs": runs,
+            "leader": scheduler.leader(),
+            "enabled": jobs.JOBS_ENABLED,
+        },
+    )
+
+
+@app.post("/admin/jobs/{job_name}/run")
+def admin_job_run(job_name: str, _: bool = Depends(get_current_admin)):
+    try:
+        scheduler.run_now(job_name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+    return RedirectResponse(url="/admin/jobs", status_code=status.HTTP_303_SEE_OTHER)
+
+
+# -------------------------
+# ADMIN HTML: TIENDAS (vista cruzada)
+# -------------------------
+def _store_summary(store: str, conn: sqlite3.Connection) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    row = conn.execute(
+        """
+        SELECT (SELECT COUNT(*) FROM users) AS users,
+               (SELECT COUNT(*) FROM products) AS products,
+               (SELECT COUNT(*) FROM carts WHERE status = 'open') AS open_carts,
+               (SELECT COUNT(*) FROM orders) AS orders,
+               (SELECT COALESCE(SUM(total), 0) FROM orders WHERE payment_status = 'paid') AS paid_total
+        """
+    ).fetchone()
+    latest = conn.execute(
+        """
+        SELECT o.id, o.user_id, u.name AS user_name, o.total, o.payment_status, o.created_at
+        FROM orders o
+        LEFT JOIN users u ON u.id = o.user_id
+        ORDER BY o.created_at DESC, o.id DESC
+        LIMIT ?
+        """,
+        (ADMIN_STORES_LATEST,),
+    ).fetchall()
+    return {
+        **dict(row),
+        "store": store,
+        "size_mb": round(archive.sizes(shard_set.path(store))["hot"] / 1024 / 1024, 1),
+        "latest": latest,
+        "ms": round((time.perf_counter() - t0) * 1000, 1),
+    }
+
+
+@app.get("/admin/stores", response_class=HTMLResponse)
+def admin_stores(request: Request, _: bool = Depends(get_current_admin)):
+    # Una query por tienda, en paralelo; las órdenes recientes se mezclan por fecha
+    t0 = time.perf_counter()
+    results = shard_set.fan_out(_store_summary)
+    elapsed_ms = round((time.perf_counter() - t0) * 1000, 1)
+    return templates.TemplateResponse(
+        "stores.html",
+        {
+            "request": request,
+            "summaries": list(results.values()),
+            "latest": shards.merge_rows(
+                {s: r["latest"] for s, r in results.items()}, "created_at", limit=ADMIN_STORES_LATEST
+            ),
+            "elapsed_ms": elapsed_ms,
+            "sharded": shards.SHARDED,
         },
     )
 
 
+@app.post("/admin/stores/select")
+def admin_store_select(request: Request, store: str = Form(...), _: bool = Depends(get_current_admin)):
+    """Tienda sobre la que trabajan las demás páginas del admin (queda en la sesión)."""
+    try:
+        request.session["store"] = shards.check_store(store)
+    except shards.UnknownStore:
+        raise HTTPException(status_code=404, detail="Tienda desconocida")
+    return RedirectResponse(url=request.headers.get("referer") or "/admin", status_code=status.HTTP_303_SEE_OTHER)
+
+
 # -------------------------
 # ADMIN HTML: USERS
 # -------------------------
@@ -263,31 +678,20 @@ def admin_users(
     conditions = []
     params = []
 
-    if q_name:
-        conditions.append("LOWER(name) LIKE ?")
-        params.append(f"%{q_name.lower()}%")
     if q_email:
-        conditions.append("email = ?")
+        conditions.append("u.email = ?")
         params.append(q_email)
     if q_phone:
-        conditions.append("phone = ?")
-        params.append(q_phone)
+        cond, value = _phone_condition(q_phone)
+        conditions.append(f"u.{cond}")
+        params.append(value)
     if q_segment:
-        conditions.append("segment = ?")
+        conditions.append("u.segment = ?")
         params.append(q_segment)
 
-    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
-
+    sql, params = _users_query(conditions, params, q_name)
     with get_connection() as conn:
-        rows = conn.execute(
-            f"""
-            SELECT id, name, email, phone, segment, created_at
-            FROM users
-            {where}
-            ORDER BY created_at DESC
-            """,
-            params,
-        ).fetchall()
+        rows = conn.execute(sql, params).fetchall()
 
     return templates.TemplateResponse(
         "users.html",
@@ -334,10 +738,10 @@ def admin_user_edit_save(
             cur = conn.execute(
                 """
                 UPDATE users
-                SET name = ?, email = ?, phone = ?, segment = ?
+                SET name = ?, name_fold = ?, email = ?, phone = ?, phone_norm = ?, segment = ?
                 WHERE id = ?
                 """,
-                (name, email, phone or None, segment or None, user_id),
+                (name, fold_text(name), email, phone or None, normalize_phone(phone), segment or None, user_id),
             )
             conn.commit()
         except sqlite3.IntegrityError:
@@ -359,6 +763,7 @@ def admin_user_delete(
 ):
     with get_connection() as conn:
         cur = conn.cursor()
+        inventory.begin_write(conn)
 
         user = cur.execute("SELECT id FROM users WHERE id = ?", (user_id,)).fetchone()
         if not user:
@@ -369,13 +774,28 @@ def admin_user_delete(
             (user_id,),
         ).fetchall()]
 
+        order_ids = [r["id"] for r in cur.execute(
+            "SELECT id FROM orders WHERE user_id = ?",
+            (user_id,),
+        ).fetchall()]
+
         if cart_ids:
+            # Lo retenido por sus carritos vuelve al stock; las reservas confirmadas se borran
+            for cart_id in cart_ids:
+                inventory.release_cart(conn, cart_id, reason="user_deleted")
             placeholders = ",".join(["?"] * len(cart_ids))
+            cur.execute(f"DELETE FROM stock_reservations WHERE cart_id IN ({placeholders})", cart_ids)
             cur.execute(f"DELETE FROM cart_items WHERE cart_id IN ({placeholders})", cart_ids)
 
         cur.execute("DELETE FROM orders WHERE user_id = ?", (user_id,))
         cur.execute("DELETE FROM carts WHERE user_id = ?", (user_id,))
         cur.execute("DELETE FROM users WHERE id = ?", (user_id,))
+        # Un evento por fila borrada: los contadores en vivo no se desfasan
+        for order_id in order_ids:
+            change_events.record(conn, "order", order_id, "deleted", user_id=user_id)
+        for cart_id in cart_ids:
+            change_events.record(conn, "cart", cart_id, "deleted", user_id=user_id)
+        change_events.record(conn, "user", user_id, "deleted")
         conn.commit()
 
     return RedirectResponse(url="/admin/users", status_code=status.HTTP_303_SEE_OTHER)
@@ -392,13 +812,14 @@ def admin_create_user(
 ):
     with get_connection() as conn:
         try:
-            conn.execute(
+            cur = conn.execute(
                 """
-                INSERT INTO users (name, email, phone, segment)
-                VALUES (?, ?, ?, ?)
+                INSERT INTO users (name, name_fold, email, phone, phone_norm, segment)
+                VALUES (?, ?, ?, ?, ?, ?)
                 """,
-                (name, email, phone or None, segment or "nuevo"),
+                (name, fold_text(name), email, phone or None, normalize_phone(phone), segment or "nuevo"),
             )
+            change_events.record(conn, "user", cur.lastrowid, "created", segment=segment or "nuevo")
             conn.commit()
         except sqlite3.IntegrityError:
             pass
@@ -424,15 +845,16 @@ async def admin_import_users(
             if not name or not email:
                 continue
             try:
-                conn.execute(
+                cur = conn.execute(
                     """
-                    INSERT INTO users (name, email, phone, segment)
-                    VALUES (?, ?, ?, ?)
+                    INSERT INTO users (name, name_fold, email, phone, phone_norm, segment)
+                    VALUES (?, ?, ?, ?, ?, ?)
                     """,
-                    (name, email, phone or None, segment),
+                    (name, fold_text(name), email, phone or None, normalize_phone(phone), segment),
                 )
             except sqlite3.IntegrityError:
                 continue
+            change_events.record(conn, "user", cur.lastrowid, "created", segment=segment, source="import")
         conn.commit()
     return RedirectResponse(
         url="/admin/users", status_code=status.HTTP_303_SEE_OTHER
@@ -495,6 +917,7 @@ def admin_products(
 def admin_product_edit_page(
     product_id: int,
     request: Request,
+    error: Optional[str] = Query(None),
     _: bool = Depends(get_current_admin),
 ):
     with get_connection() as conn:
@@ -505,11 +928,14 @@ def admin_product_edit_page(
             """,
             (product_id,),
         ).fetchone()
+        held = inventory.held_units(conn, product_id) if product else 0
     if not product:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
+    # El form edita el stock físico; products.stock es el disponible (sin lo retenido)
+    on_hand = product["stock"] + held if product["stock"] is not None else None
     return templates.TemplateResponse(
         "product_edit.html",
-        {"request": request, "product": product},
+        {"request": request, "product": product, "held": held, "on_hand": on_hand, "error": error},
     )
 
 
@@ -525,7 +951,20 @@ def admin_product_edit_save(
     is_offer: Optional[str] = Form(None),
     _: bool = Depends(get_current_admin),
 ):
+    """
+    `stock` es el stock físico: el disponible se guarda sin lo que retienen
+    los carritos abiertos, así al liberar esas reservas no se suma dos veces.
+    """
     with get_connection() as conn:
+        inventory.begin_write(conn)
+        held = inventory.held_units(conn, product_id)
+        if stock < held:
+            conn.rollback()
+            return RedirectResponse(
+                url=f"/admin/products/{product_id}/edit?error=held",
+                status_code=status.HTTP_303_SEE_OTHER,
+            )
+        available = stock - held
         try:
             cur = conn.execute(
                 """
@@ -540,10 +979,16 @@ def admin_product_edit_save(
                     description or None,
                     price,
                     1 if is_offer else 0,
-                    stock,
+                    available,
                     product_id,
                 ),
             )
+            if cur.rowcount:
+                change_events.record(
+                    conn, "product", product_id, "updated",
+                    sku=sku, name=name, category=category or None, price=price,
+                    is_offer=bool(is_offer), stock=available, on_hand=stock, held=held,
+                )
             conn.commit()
         except sqlite3.IntegrityError:
             # SKU duplicado
@@ -569,9 +1014,11 @@ def admin_product_delete(
         if not prod:
             raise HTTPException(status_code=404, detail="Producto no encontrado")
 
-        # Evita problemas de FK
+        # Evita problemas de FK (las reservas no devuelven stock: el producto deja de existir)
+        cur.execute("DELETE FROM stock_reservations WHERE product_id = ?", (product_id,))
         cur.execute("DELETE FROM cart_items WHERE product_id = ?", (product_id,))
         cur.execute("DELETE FROM products WHERE id = ?", (product_id,))
+        change_events.record(conn, "product", product_id, "deleted")
         conn.commit()
 
     return RedirectResponse(url="/admin/products", status_code=status.HTTP_303_SEE_OTHER)
@@ -590,7 +1037,7 @@ def admin_create_product(
 ):
     with get_connection() as conn:
         try:
-            conn.execute(
+            cur = conn.execute(
                 """
                 INSERT INTO products (sku, name, category, description, price, is_offer, stock)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
@@ -605,6 +1052,10 @@ def admin_create_product(
                     stock,
                 ),
             )
+            change_events.record(
+                conn, "product", cur.lastrowid, "created",
+                sku=sku, name=name, category=category or None, price=price, is_offer=bool(is_offer), stock=stock,
+            )
             conn.commit()
         except sqlite3.IntegrityError:
             pass
@@ -649,7 +1100,7 @@ async def admin_import_products(
                 "y",
             )
             try:
-                conn.execute(
+                cur = conn.execute(
                 """
                 INSERT INTO products (sku, name, category, description, price, is_offer, stock)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
@@ -666,6 +1117,12 @@ async def admin_import_products(
             )
             except sqlite3.IntegrityError:
                 continue
+            # Mismo commit que el lote importado
+            change_events.record(
+                conn, "product", cur.lastrowid, "created",
+                sku=sku, name=name, category=category or None, price=price, is_offer=is_offer, stock=stock,
+                source="import",
+            )
         conn.commit()
     return RedirectResponse(
         url="/admin/products", status_code=status.HTTP_303_SEE_OTHER
@@ -681,6 +1138,7 @@ def admin_orders(
     q_user: Optional[str] = Query(None),
     q_email: Optional[str] = Query(None),
     q_status: Optional[str] = Query(None),
+    include_archive: bool = Query(False),
     _: bool = Depends(get_current_admin),
 ):
     conditions = []
@@ -698,13 +1156,14 @@ def admin_orders(
 
     where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
 
-    with get_connection() as conn:
+    with get_connection() as conn, archive.reading(conn, include_archive) as t:
+        live_after = change_events.last_seq(conn)
         rows = conn.execute(
             f"""
             SELECT
                 o.id, o.user_id, u.name AS user_name, u.email AS user_email,
-                o.cart_id, o.total, o.payment_status, o.created_at
-            FROM orders o
+                o.cart_id, o.total, o.payment_status, o.created_at, {t['source']} AS source
+            FROM {t['orders']} o
             JOIN users u ON u.id = o.user_id
             {where}
             ORDER BY o.created_at DESC
@@ -714,13 +1173,22 @@ def admin_orders(
 
     return templates.TemplateResponse(
         "orders.html",
-        {"request": request, "orders": rows, "q_user": q_user, "q_email": q_email, "q_status": q_status},
+        {
+            "request": request,
+            "orders": rows,
+            "q_user": q_user,
+            "q_email": q_email,
+            "q_status": q_status,
+            "include_archive": include_archive,
+            "live_after": live_after,
+        },
     )
 
 @app.get("/admin/orders/{order_id}/edit", response_class=HTMLResponse)
 def admin_order_edit_page(
     order_id: int,
     request: Request,
+    error: Optional[str] = Query(None),
     _: bool = Depends(get_current_admin),
 ):
     with get_connection() as conn:
@@ -737,7 +1205,7 @@ def admin_order_edit_page(
         ).fetchone()
     if not order:
         raise HTTPException(status_code=404, detail="Orden no encontrada")
-    return templates.TemplateResponse("order_edit.html", {"request": request, "order": order})
+    return templates.TemplateResponse("order_edit.html", {"request": request, "order": order, "error": error})
 
 @app.post("/admin/orders/{order_id}/edit")
 def admin_order_edit_save(
@@ -746,13 +1214,28 @@ def admin_order_edit_save(
     _: bool = Depends(get_current_admin),
 ):
     with get_connection() as conn:
-        cur = conn.execute(
+        inventory.begin_write(conn)
+        previous = conn.execute("SELECT payment_status, cart_id FROM orders WHERE id = ?", (order_id,)).fetchone()
+        if not previous:
+            raise HTTPException(status_code=404, detail="Orden no encontrada")
+        # Mismo efecto sobre el stock que el webhook de pagos (entrar / salir de failed)
+        try:
+            extra = payments.stock_effects(conn, previous["cart_id"], previous["payment_status"], payment_status)
+        except payments.StockUnavailable:
+            conn.rollback()
+            return RedirectResponse(
+                url=f"/admin/orders/{order_id}/edit?error=stock", status_code=status.HTTP_303_SEE_OTHER
+            )
+        conn.execute(
             "UPDATE orders SET payment_status = ? WHERE id = ?",
             (payment_status, order_id),
         )
+        if previous["payment_status"] != payment_status:
+            change_events.record(
+                conn, "order", order_id, "status_changed",
+                payment_status=payment_status, previous=previous["payment_status"], source="admin", **extra,
+            )
         conn.commit()
-    if cur.rowcount == 0:
-        raise HTTPException(status_code=404, detail="Orden no encontrada")
     return RedirectResponse(url=f"/admin/orders/{order_id}", status_code=status.HTTP_303_SEE_OTHER)
 
 @app.post("/admin/orders/{order_id}/delete")
@@ -762,6 +1245,8 @@ def admin_order_delete(
 ):
     with get_connection() as conn:
         cur = conn.execute("DELETE FROM orders WHERE id = ?", (order_id,))
+        if cur.rowcount:
+            change_events.record(conn, "order", order_id, "deleted")
         conn.commit()
     if cur.rowcount == 0:
         raise HTTPException(status_code=404, detail="Orden no encontrada")
@@ -771,11 +1256,12 @@ def admin_order_delete(
 def admin_order_detail(
     order_id: int,
     request: Request,
+    include_archive: bool = Query(False),
     _: bool = Depends(get_current_admin),
 ):
-    with get_connection() as conn:
+    with get_connection() as conn, archive.reading(conn, include_archive) as t:
         order = conn.execute(
-            """
+            f"""
             SELECT
                 o.id,
                 o.user_id,
@@ -784,8 +1270,9 @@ def admin_order_detail(
                 o.cart_id,
                 o.total,
                 o.payment_status,
-                o.created_at
-            FROM orders o
+                o.created_at,
+                {t['source']} AS source
+            FROM {t['orders']} o
             JOIN users u ON u.id = o.user_id
             WHERE o.id = ?
             """,
@@ -794,14 +1281,14 @@ def admin_order_detail(
         if not order:
             raise HTTPException(status_code=404, detail="Orden no encontrada")
         items = conn.execute(
-            """
+            f"""
             SELECT
                 p.sku,
                 p.name AS product_name,
                 ci.quantity,
                 ci.unit_price,
                 (ci.quantity * ci.unit_price) AS line_total
-            FROM cart_items ci
+            FROM {t['cart_items']} ci
             JOIN products p ON p.id = ci.product_id
             WHERE ci.cart_id = ?
             ORDER BY p.name
@@ -838,6 +1325,7 @@ def admin_carts(
     where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
 
     with get_connection() as conn:
+        live_after = change_events.last_seq(conn)
         rows = conn.execute(
             f"""
             SELECT
@@ -857,7 +1345,14 @@ def admin_carts(
 
     return templates.TemplateResponse(
         "carts.html",
-        {"request": request, "carts": rows, "q_user": q_user, "q_email": q_email, "q_status": q_status},
+        {
+            "request": request,
+            "carts": rows,
+            "q_user": q_user,
+            "q_email": q_email,
+            "q_status": q_status,
+            "live_after": live_after,
+        },
     )
     
 @app.get("/admin/carts/{cart_id}/edit", response_class=HTMLResponse)
@@ -897,6 +1392,11 @@ def admin_cart_edit_save(
             "UPDATE carts SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
             (status_val, cart_id),
         )
+        if status_val not in ("open", "checked_out"):
+            # Carrito cerrado a mano: lo que retenía vuelve al stock
+            inventory.release_cart(conn, cart_id)
+        if cur.rowcount:
+            change_events.record(conn, "cart", cart_id, "status_changed", status=status_val)
         conn.commit()
     if cur.rowcount == 0:
         raise HTTPException(status_code=404, detail="Carrito no encontrado")
@@ -912,8 +1412,11 @@ def admin_cart_delete(
         cart = cur.execute("SELECT id FROM carts WHERE id = ?", (cart_id,)).fetchone()
         if not cart:
             raise HTTPException(status_code=404, detail="Carrito no encontrado")
+        inventory.release_cart(conn, cart_id)
+        cur.execute("DELETE FROM stock_reservations WHERE cart_id = ?", (cart_id,))
         cur.execute("DELETE FROM cart_items WHERE cart_id = ?", (cart_id,))
         cur.execute("DELETE FROM carts WHERE id = ?", (cart_id,))
+        change_events.record(conn, "cart", cart_id, "deleted")
         conn.commit()
     return RedirectResponse(url="/admin/carts", status_code=status.HTTP_303_SEE_OTHER)
 
@@ -964,44 +1467,6 @@ def admin_cart_detail(cart_id: int, request: Request, _: bool = Depends(get_curr
     )
 
 
-# -------------------------
-# Helpers para carritos
-# -------------------------
-def build_cart_summary(conn: sqlite3.Connection, cart_id: int) -> Dict[str, Any]:
-    rows = conn.execute(
-        """
-        SELECT
-            ci.product_id,
-            p.name AS product_name,
-            ci.quantity,
-            ci.unit_price,
-            (ci.quantity * ci.unit_price) AS line_total
-        FROM cart_items ci
-        JOIN products p ON p.id = ci.product_id
-        WHERE ci.cart_id = ?
-        ORDER BY p.name
-        """,
-        (cart_id,),
-    ).fetchall()
-    items = []
-    total = 0.0
-    for r in rows:
-        item = {
-            "product_id": r["product_id"],
-            "name": r["product_name"],
-            "quantity": r["quantity"],
-            "unit_price": r["unit_price"],
-            "line_total": r["line_total"],
-        }
-        items.append(item)
-        total += float(r["line_total"])
-    return {
-        "cart_id": cart_id,
-        "items": items,
-        "total": total,
-    }
-
-
 # -------------------------
 # API JSON: USERS
 # -------------------------
@@ -1011,13 +1476,14 @@ def create_user(user: UserCreate, _: bool = Depends(require_api_key)):
         try:
             cur = conn.execute(
                 """
-                INSERT INTO users (name, email, phone, segment)
-                VALUES (?, ?, ?, ?)
+                INSERT INTO users (name, name_fold, email, phone, phone_norm, segment)
+                VALUES (?, ?, ?, ?, ?, ?)
                 """,
-                (user.name, user.email, user.phone, user.segment),
+                (user.name, fold_text(user.name), user.email, user.phone, normalize_phone(user.phone), user.segment),
             )
-            conn.commit()
             user_id = cur.lastrowid
+            change_events.record(conn, "user", user_id, "created", segment=user.segment)
+            conn.commit()
         except sqlite3.IntegrityError:
             raise HTTPException(status_code=400, detail="Email ya registrado")
         row = conn.execute(
@@ -1059,28 +1525,22 @@ def search_users(
     _: bool = Depends(require_api_key)
 ):
     """
-    Busca usuarios por uno o más criterios usando lógica OR.
-    Devuelve TODOS los usuarios que coincidan con al menos uno de los criterios.
+    Busca usuarios por uno o más criterios (deben cumplirse todos).
+    Con name, los resultados vienen por relevancia y después los más recientes.
     """
     conditions = []
     params = []
     if email:
-        conditions.append("email = ?")
+        conditions.append("u.email = ?")
         params.append(email)
     if phone:
-        conditions.append("phone = ?")
-        params.append(phone)
-    if name:
-        conditions.append("LOWER(name) LIKE ?")
-        params.append(f"%{name.lower()}%")
-    if not conditions:
+        cond, value = _phone_condition(phone)
+        conditions.append(f"u.{cond}")
+        params.append(value)
+    if not conditions and not (name and name.strip()):
         return []
-    sql = f"""
-        SELECT id, name, email, phone, segment, created_at
-        FROM users
-        WHERE {' AND '.join(conditions)}
-        ORDER BY created_at DESC
-        """
+    # name: substring de nombre o email por índice (users_fts), sin acentos
+    sql, params = _users_query(conditions, params, name)
     with get_connection() as conn:
         rows = conn.execute(sql, params).fetchall()
     return [User(**dict(r)) for r in rows]
@@ -1104,85 +1564,10 @@ def get_user(user_id: int, _: bool = Depends(require_api_key)):
 def api_cart_add_item(payload: CartAddItemRequest, _: bool = Depends(require_api_key)) -> Dict[str, Any]:
     if payload.quantity <= 0:
         raise HTTPException(status_code=400, detail="La cantidad debe ser mayor a 0.")
-    with get_connection() as conn:
-        cur = conn.cursor()
-        user = cur.execute(
-            "SELECT id, name, email FROM users WHERE id = ?",
-            (payload.user_id,),
-        ).fetchone()
-        if not user:
-            raise HTTPException(status_code=404, detail="Usuario no encontrado")
-        product = cur.execute(
-            "SELECT id, price, stock FROM products WHERE id = ?",
-            (payload.product_id,),
-        ).fetchone()
-        if not product:
-            raise HTTPException(status_code=404, detail="Producto no encontrado")
-        # CRÍTICO: Validación de stock mejorada
-        stock_available = product["stock"] if product["stock"] is not None else 999999
-        if stock_available < payload.quantity:
-            raise HTTPException(
-                status_code=400,
-                detail=f"No hay stock suficiente. Disponible: {stock_available}"
-            )
-        cart = cur.execute(
-            """
-            SELECT id
-            FROM carts
-            WHERE user_id = ? AND status = 'open'
-            ORDER BY created_at DESC
-            LIMIT 1
-            """,
-            (payload.user_id,),
-        ).fetchone()
-        if cart:
-            cart_id = cart["id"]
-        else:
-            cur.execute(
-                "INSERT INTO carts (user_id, status) VALUES (?, 'open')",
-                (payload.user_id,),
-            )
-            cart_id = cur.lastrowid
-        existing_item = cur.execute(
-            """
-            SELECT id, quantity
-            FROM cart_items
-            WHERE cart_id = ? AND product_id = ?
-            """,
-            (cart_id, payload.product_id),
-        ).fetchone()
-        if existing_item:
-            new_qty = existing_item["quantity"] + payload.quantity
-            
-            # CRÍTICO: Validar stock con nueva cantidad total
-            if stock_available < new_qty:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"No hay stock suficiente. Disponible: {stock_available}, ya tenés {existing_item['quantity']} en el carrito"
-                )
-            
-            cur.execute(
-                """
-                UPDATE cart_items
-                SET quantity = ?, unit_price = ?
-                WHERE id = ?
-                """,
-                (new_qty, product["price"], existing_item["id"]),
-            )
-        else:
-            cur.execute(
-                """
-                INSERT INTO cart_items (cart_id, product_id, quantity, unit_price)
-                VALUES (?, ?, ?, ?)
-                """,
-                (cart_id, payload.product_id, payload.quantity, product["price"]),
-            )
-        cur.execute(
-            "UPDATE carts SET updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-            (cart_id,),
-        )
-        conn.commit()
-        summary = build_cart_summary(conn, cart_id)
+    try:
+        summary = checkout_storage.add_item(payload.user_id, payload.product_id, payload.quantity)
+    except storage.StorageError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     return {
         "cart_id": summary["cart_id"],
         "user_id": payload.user_id,
@@ -1193,25 +1578,7 @@ def api_cart_add_item(payload: CartAddItemRequest, _: bool = Depends(require_api
 
 @app.get("/carts/summary")
 def api_cart_summary(user_id: int = Query(...), _: bool = Depends(require_api_key)) -> Dict[str, Any]:
-    with get_connection() as conn:
-        cart = conn.execute(
-            """
-            SELECT id
-            FROM carts
-            WHERE user_id = ? AND status = 'open'
-            ORDER BY created_at DESC
-            LIMIT 1
-            """,
-            (user_id,),
-        ).fetchone()
-        if not cart:
-            return {
-                "cart_id": None,
-                "user_id": user_id,
-                "items": [],
-                "total": 0.0,
-            }
-        summary = build_cart_summary(conn, cart["id"])
+    summary = checkout_storage.cart_summary(user_id)
     return {
         "cart_id": summary["cart_id"],
         "user_id": user_id,
@@ -1224,138 +1591,55 @@ class CartClearRequest(BaseModel):
 
 @app.post("/carts/clear")
 def api_cart_clear(payload: CartClearRequest, _: bool = Depends(require_api_key)) -> Dict[str, Any]:
-    with get_connection() as conn:
-        cur = conn.cursor()
-
-        # Buscar carrito abierto más reciente
-        cart = cur.execute(
-            """
-            SELECT id
-            FROM carts
-            WHERE user_id = ? AND status = 'open'
-            ORDER BY created_at DESC
-            LIMIT 1
-            """,
-            (payload.user_id,),
-        ).fetchone()
-
-        if not cart:
-            # No hay carrito abierto → devolvemos "ok" con carrito vacío
-            return {
-                "status": "success",
-                "message": "No había carrito abierto. Ya está vacío.",
-                "cart_id": None,
-                "user_id": payload.user_id,
-                "items": [],
-                "total": 0.0,
-            }
-
-        cart_id = cart["id"]
-
-        # Borrar items del carrito abierto
-        cur.execute("DELETE FROM cart_items WHERE cart_id = ?", (cart_id,))
-        cur.execute(
-            "UPDATE carts SET updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-            (cart_id,),
-        )
-        conn.commit()
-
-        # Resumen vacío post-clear
+    # Devuelve el stock retenido y borra los items del carrito abierto más reciente
+    cart_id = checkout_storage.clear_cart(payload.user_id)
+    if cart_id is None:
+        # No hay carrito abierto → devolvemos "ok" con carrito vacío
         return {
             "status": "success",
-            "message": "Carrito reiniciado.",
-            "cart_id": cart_id,
+            "message": "No había carrito abierto. Ya está vacío.",
+            "cart_id": None,
             "user_id": payload.user_id,
             "items": [],
             "total": 0.0,
         }
+    # Resumen vacío post-clear
+    return {
+        "status": "success",
+        "message": "Carrito reiniciado.",
+        "cart_id": cart_id,
+        "user_id": payload.user_id,
+        "items": [],
+        "total": 0.0,
+    }
 
 # -------------------------
 # API JSON: CHECKOUT
 # -------------------------
 @app.post("/orders/checkout")
 def api_checkout(payload: CheckoutRequest, _: bool = Depends(require_api_key)) -> Dict[str, Any]:
-    with get_connection() as conn:
-        cur = conn.cursor()
-        user = cur.execute(
-            "SELECT id, name, email FROM users WHERE id = ?",
-            (payload.user_id,),
-        ).fetchone()
-        if not user:
-            raise HTTPException(status_code=404, detail="Usuario no encontrado")
-        cart = cur.execute(
-            """
-            SELECT id
-            FROM carts
-            WHERE user_id = ? AND status = 'open'
-            ORDER BY created_at DESC
-            LIMIT 1
-            """,
-            (payload.user_id,),
-        ).fetchone()
-        if not cart:
-            raise HTTPException(
-                status_code=400,
-                detail="El usuario no tiene un carrito abierto para checkout.",
-            )
-        cart_id = cart["id"]
-        rows = cur.execute(
-            """
-            SELECT
-                p.id   AS product_id,
-                p.name AS product_name,
-                ci.quantity,
-                ci.unit_price,
-                (ci.quantity * ci.unit_price) AS line_total
-            FROM cart_items ci
-            JOIN products p ON p.id = ci.product_id
-            WHERE ci.cart_id = ?
-            """,
-            (cart_id,),
-        ).fetchall()
-        if not rows:
-            raise HTTPException(status_code=400, detail="El carrito está vacío.")
-        items: List[Dict[str, Any]] = []
-        total = 0.0
-        for r in rows:
-            line = {
-                "product_id": r["product_id"],
-                "name": r["product_name"],
-                "quantity": r["quantity"],
-                "unit_price": r["unit_price"],
-                "line_total": r["line_total"],
-            }
-            items.append(line)
-            total += float(r["line_total"])
-        cur.execute(
-            """
-            INSERT INTO orders (user_id, cart_id, total, payment_status)
-            VALUES (?, ?, ?, ?)
-            """,
-            (payload.user_id, cart_id, total, "pending"),
-        )
-        order_id = cur.lastrowid
-        cur.execute(
-            "UPDATE carts SET status = 'checked_out', updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-            (cart_id,),
-        )
-        conn.commit()
-        user_name = user["name"]
-        user_email = user["email"] or payload.email
-        items_payload = base64.urlsafe_b64encode(
-            json.dumps(items).encode("utf-8")
-        ).decode("utf-8")
-        payment_url = (
-            f"{CHECKOUT_BASE_URL}"
-            f"?user_id={quote_plus(str(user['id']))}"
-            f"&name={quote_plus(user_name)}"
-            f"&email={quote_plus(user_email)}"
-            f"&amount={total:.2f}"
-            f"&items={items_payload}"
-        )
+    try:
+        order = checkout_storage.checkout(payload.user_id)
+    except storage.StorageError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    user = order["user"]
+    total = order["total"]
+    user_email = user["email"] or payload.email
+    items_payload = base64.urlsafe_b64encode(
+        json.dumps(order["items"]).encode("utf-8")
+    ).decode("utf-8")
+    payment_url = (
+        f"{CHECKOUT_BASE_URL}"
+        f"?order_id={order['order_id']}"
+        f"&user_id={quote_plus(str(user['id']))}"
+        f"&name={quote_plus(user['name'])}"
+        f"&email={quote_plus(user_email)}"
+        f"&amount={total:.2f}"
+        f"&items={items_payload}"
+    )
     return {
-        "order_id": order_id,
-        "cart_id": cart_id,
+        "order_id": order["order_id"],
+        "cart_id": order["cart_id"],
         "total": total,
         "payment_status": "pending",
         "payment_url": payment_url,
@@ -1437,12 +1721,19 @@ def redirect_checkout(order_id: int,):
 
     # Armamos el querystring como antes, pero acá adentro
     params = {
+        "order_id": order["id"],
         "user_id": user["id"],
         "name": user["name"],
         "email": user["email"],
         "amount": f"{float(order['total']):.2f}",
         "items": items_b64,
+        "status": order["payment_status"],
     }
+    if PAYMENT_GATEWAY_URL:
+        # El botón de pagar del checkout web le avisa a la pasarela
+        params["gateway"] = PAYMENT_GATEWAY_URL
+    if shards.SHARDED:
+        params["store"] = shards.current_store()
 
     query_string = "&".join(
         f"{key}={quote_plus(str(value))}" for key, value in params.items()
@@ -1453,6 +1744,108 @@ def redirect_checkout(order_id: int,):
     return RedirectResponse(url=final_url)
 
 
+# -------------------------
+# API JSON: EVENTS (log de cambios)
+# -------------------------
+@app.get("/events")
+def api_events(
+    after: int = Query(0, ge=0, description="último seq ya procesado"),
+    limit: Optional[int] = Query(None, ge=1),
+    wait: float = Query(0.0, ge=0, description="segundos de espera si no hay eventos nuevos (long polling)"),
+    entity: Optional[str] = Query(None, description="cart | order | product | user"),
+    _: bool = Depends(require_api_key),
+):
+    """
+    Eventos con seq > after de la tienda del request, uno por línea (NDJSON),
+    en orden. El consumidor guarda el último seq y vuelve a pedir desde ahí.
+    """
+    store = shards.current_store()
+    events = change_events.stream(lambda: get_connection(store), after, limit, wait, entity)
+    return StreamingResponse(
+        (json.dumps(ev, ensure_ascii=False) + "\n" for ev in events),
+        media_type="application/x-ndjson",
+    )
+
+
+# -------------------------
+# API JSON: PAYMENTS (pasarela de pago, ver payments.py)
+# -------------------------
+def _apply_payments(store: str, updates: List[Dict[str, Any]], source: str = "webhook") -> List[Dict[str, Any]]:
+    with get_connection(store) as conn:
+        return payments.apply_updates(conn, updates, source)
+
+
+# Un escritor por tienda: las notificaciones concurrentes se confirman juntas
+payment_committers = {
+    store: payments.GroupCommitter(store, lambda updates, store=store: _apply_payments(store, updates))
+    for store in shard_set.stores
+}
+
+_PAYMENT_STATUS_CODES = {
+    "applied": 200,
+    "unchanged": 200,
+    "duplicate": 200,
+    "not_found": 404,
+    "illegal_transition": 409,
+    "amount_mismatch": 409,
+}
+
+
+def handle_payment_notification(body: bytes, signature: str) -> JSONResponse:
+    """Verifica, valida y aplica una notificación (sync: corre en el threadpool)."""
+    if not payments.PAYMENT_WEBHOOK_SECRET:
+        raise HTTPException(status_code=503, detail="PAYMENT_WEBHOOK_SECRET no configurada")
+    try:
+        payments.verify(body, signature, payments.PAYMENT_WEBHOOK_SECRET)
+    except payments.InvalidSignature as e:
+        payments.PAYMENT_UPDATES.inc(source="webhook", result="bad_signature")
+        raise HTTPException(status_code=401, detail=str(e))
+    try:
+        update = payments.parse_notification(body)
+        store = shards.check_store(update.pop("store") or shards.DEFAULT_STORE)
+    except payments.InvalidNotification as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except shards.UnknownStore as e:
+        raise HTTPException(status_code=404, detail=f"Tienda desconocida: {e}")
+    if payments.PAYMENT_GROUP_COMMIT:
+        try:
+            result = payment_committers[store].submit(update)
+        except TimeoutError:
+            raise HTTPException(status_code=503, detail="Notificación demorada, reintentar")
+    else:
+        result = _apply_payments(store, [update])[0]
+    return JSONResponse(status_code=_PAYMENT_STATUS_CODES[result["result"]], content=result)
+
+
+@app.post("/payments/webhook")
+async def api_payment_webhook(request: Request):
+    """
+    Notificación de la pasarela (firmada, sin x-api-key). 200 si quedó
+    aplicada o ya lo estaba (reintentos), 404 orden inexistente, 409
+    transición no permitida o monto distinto, 401 firma inválida.
+    """
+    body = await request.body()
+    return await run_in_threadpool(
+        handle_payment_notification, body, request.headers.get(payments.SIGNATURE_HEADER, "")
+    )
+
+
+@app.post("/payments/reconcile")
+async def api_payment_reconcile(
+    file: UploadFile = File(...),
+    _: bool = Depends(require_api_key),
+) -> Dict[str, Any]:
+    """CSV de conciliación de la pasarela (order_id, status[, amount][, event_id]) de la tienda del request."""
+    text = (await file.read()).decode("utf-8-sig")
+    store = shards.current_store()
+
+    def run():
+        with get_connection(store) as conn:
+            return payments.reconcile(conn, text)
+
+    return await run_in_threadpool(run)
+
+
 # -------------------------
 # API JSON: PRODUCTS
 # -------------------------
@@ -1475,8 +1868,13 @@ def api_create_product(product: ProductCreate, _: bool = Depends(require_api_key
                     product.stock,
                 ),
             )
-            conn.commit()
             product_id = cur.lastrowid
+            change_events.record(
+                conn, "product", product_id, "created",
+                sku=product.sku, name=product.name, category=product.category, price=product.price,
+                is_offer=product.is_offer, stock=product.stock,
+            )
+            conn.commit()
         except sqlite3.IntegrityError:
             raise HTTPException(status_code=400, detail="SKU ya existente")
         row = conn.execute(
@@ -1491,8 +1889,21 @@ def api_create_product(product: ProductCreate, _: bool = Depends(require_api_key
     return Product(**data)
 
 
+def _product_from_row(r) -> Product:
+    d = dict(r)
+    d["is_offer"] = bool(d["is_offer"])
+    return Product(**d)
+
+
 @app.get("/products", response_model=List[Product])
 def api_list_products(_: bool = Depends(require_api_key)):
+    snap = current_catalog().current()
+    if snap is not None:
+        catalog_snapshot.CATALOG_READS.inc(source="snapshot")
+        rows = [snap.row(i) for i in snap.by_updated()]
+        with get_connection() as conn:
+            return [Product(**r) for r in catalog_snapshot.live_stock(conn, rows)]
+    catalog_snapshot.CATALOG_READS.inc(source="sqlite")
     with get_connection() as conn:
         rows = conn.execute(
             """
@@ -1501,16 +1912,135 @@ def api_list_products(_: bool = Depends(require_api_key)):
             ORDER BY updated_at DESC
             """
         ).fetchall()
-    result = []
-    for r in rows:
-        d = dict(r)
-        d["is_offer"] = bool(d["is_offer"])
-        result.append(Product(**d))
-    return result
+    return [_product_from_row(r) for r in rows]
+
+
+def _catalog_searcher():
+    """
+    search(q, category, only_offers, limit, mode) -> filas tipo Product, sin acentos.
+    Sale del snapshot mapeado; si todavía no hay snapshot, filtra desde SQLite
+    (el catálogo se lee una vez por request, no por búsqueda).
+
+    mode: exact (substring), fuzzy (tolerante a errores de tipeo, ver fuzzy.py),
+    semantic (similitud vectorial, ver semantic.py), hybrid (léxico + vectorial)
+    o auto (exact; si no encuentra nada, fuzzy; si tampoco, semantic).
+    Sin snapshot siempre es exact: la función queda con exact_only=True y los
+    endpoints lo avisan (header X-Search-Degraded / "degraded").
+    """
+    snap = current_catalog().current()
+    if snap is not None:
+        catalog_snapshot.CATALOG_READS.inc(source="snapshot")
+
+        def search(q, category=None, only_offers=False, limit=25, mode="auto"):
+            if not q or mode == "exact":
+                rows = snap.search(q, category, only_offers, limit)
+            elif mode == "fuzzy":
+                rows = snap.fuzzy_search(q, category, only_offers, limit)
+            elif mode == "semantic":
+                rows = snap.semantic_search(q, category, only_offers, limit)
+            elif mode == "hybrid":
+                rows = snap.hybrid_search(q, category, only_offers, limit)
+            else:
+                rows = (
+                    snap.search(q, category, only_offers, limit)
+                    or snap.fuzzy_search(q, category, only_offers, limit)
+                    or snap.semantic_search(q, category, only_offers, limit)
+                )
+            # Stock al día (el snapshot no se rearma por cambios de stock)
+            with get_connection() as conn:
+                return catalog_snapshot.live_stock(conn, [snap.row(i) for i in rows])
+        search.exact_only = False
+        return search
+
+    catalog_snapshot.CATALOG_READS.inc(source="sqlite")
+    with get_connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT id, sku, name, category, description, price, is_offer, stock, updated_at
+            FROM products
+            ORDER BY id
+            """
+        ).fetchall()
+    keyed = [
+        (fold_text(" ".join(str(r[k] or "") for k in ("name", "description", "category", "sku"))), r)
+        for r in rows
+    ]
+
+    def search(q, category=None, only_offers=False, limit=25, mode="exact"):
+        query = fold_text(q)
+        cat = fold_text(category) if category else ""
+        result = []
+        for key, r in keyed:
+            if query and query not in key:
+                continue
+            if cat and cat not in fold_text(r["category"]):
+                continue
+            if only_offers and not r["is_offer"]:
+                continue
+            result.append(_product_from_row(r).model_dump())
+            if len(result) >= limit:
+                break
+        return result
+    search.exact_only = True
+    return search
+
+
+# Declaradas antes de /products/{product_id} para que "search" no matchee como id
+@app.get("/products/search", response_model=List[Product])
+def api_search_products(
+    response: Response,
+    q: str = Query(default=""),
+    category: Optional[str] = Query(default=None),
+    only_offers: bool = Query(default=False),
+    limit: int = Query(default=25, ge=1, le=100),
+    mode: str = Query(default="auto", pattern="^(auto|exact|fuzzy|semantic|hybrid)$"),
+    _: bool = Depends(require_api_key),
+):
+    """
+    Búsqueda de catálogo sin acentos sobre nombre, descripción, categoría y sku.
+    mode=auto (default) reintenta con tolerancia a errores de tipeo y después por
+    similitud si no hay resultados exactos. mode=hybrid mezcla léxico y vectorial
+    (consultas descriptivas: "algo para el desayuno", "bebida sin alcohol").
+    """
+    search = _catalog_searcher()
+    if search.exact_only and mode != "exact":
+        response.headers["X-Search-Degraded"] = "exact-only"
+    return [Product(**p) for p in search(q, category, only_offers, limit, mode)]
+
+
+@app.post("/products/resolve")
+def api_resolve_shopping_list(req: ShoppingListRequest, _: bool = Depends(require_api_key)):
+    """
+    Lista de ingredientes genéricos -> mejores productos con stock para cada uno,
+    en una sola llamada (tool resolve_shopping_list del agente).
+    """
+    search = _catalog_searcher()
+    items = shopping_list.resolve_shopping_list(
+        req.items,
+        # Sin fallback semántico: para un ingrediente, mejor not_found que un producto "parecido"
+        lambda q, limit: search(q, limit=limit, mode="exact") or search(q, limit=limit, mode="fuzzy"),
+        per_item=req.per_item,
+    )
+    for it in items:
+        it["candidates"] = [
+            {k: p[k] for k in ("id", "sku", "name", "category", "price", "is_offer", "stock")}
+            for p in it["candidates"]
+        ]
+    # Sin snapshot no hay tolerancia a errores de tipeo: not_found puede ser falso
+    return {"items": items, "degraded": search.exact_only}
 
 
 @app.get("/products/{product_id}", response_model=Product)
 def api_get_product(product_id: int, _: bool = Depends(require_api_key)):
+    snap = current_catalog().current()
+    if snap is not None:
+        catalog_snapshot.CATALOG_READS.inc(source="snapshot")
+        data = snap.get(product_id)
+        if data is None:
+            raise HTTPException(status_code=404, detail="Producto no encontrado")
+        with get_connection() as conn:
+            return Product(**catalog_snapshot.live_stock(conn, [data])[0])
+    catalog_snapshot.CATALOG_READS.inc(source="sqlite")
     with get_connection() as conn:
         row = conn.execute(
             """
@@ -1521,9 +2051,19 @@ def api_get_product(product_id: int, _: bool = Depends(require_api_key)):
         ).fetchone()
     if not row:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
-    d = dict(row)
-    d["is_offer"] = bool(d["is_offer"])
-    return Product(**d)
+    return _product_from_row(row)
+
+
+@app.get("/products/{product_id}/related")
+def api_related_products(
+    product_id: int,
+    limit: int = Query(default=5, ge=1, le=recommendations.RECO_TOP_K),
+    _: bool = Depends(require_api_key),
+):
+    """Productos que se compran junto con este (top-k precalculado por el job refresh_recommendations)."""
+    with get_connection() as conn:
+        items = recommendations.related(conn, product_id, limit)
+    return {"product_id": product_id, "items": items}
 
 
 # -------------------------
@@ -1601,18 +2141,21 @@ def api_get_last_order(user_id: int = Query(...), _: bool = Depends(require_api_
 @app.get("/orders/by_user")
 def api_orders_by_user(
     user_id: int = Query(...),
-    limit: int = Query(3, ge=1, le=50), _: bool = Depends(require_api_key)
+    limit: int = Query(3, ge=1, le=50),
+    include_archive: bool = Query(False),
+    _: bool = Depends(require_api_key),
 ):
     """
     Devuelve los últimos pedidos de un usuario (incluye items).
     Pensado para que el agente pueda responder "¿cómo va mi último pedido?"
     o "¿qué pedí la vez pasada?".
+    Con include_archive=true también busca en los archivos fríos (archive.py).
     """
-    with get_connection() as conn:
+    with get_connection() as conn, archive.reading(conn, include_archive) as t:
         orders = conn.execute(
-            """
-            SELECT id, user_id, cart_id, total, payment_status, created_at
-            FROM orders
+            f"""
+            SELECT id, user_id, cart_id, total, payment_status, created_at, {t['source']} AS source
+            FROM {t['orders']}
             WHERE user_id = ?
             ORDER BY created_at DESC
             LIMIT ?
@@ -1623,14 +2166,14 @@ def api_orders_by_user(
         result = []
         for o in orders:
             items_rows = conn.execute(
-                """
+                f"""
                 SELECT
                     p.sku,
                     p.name AS product_name,
                     ci.quantity,
                     ci.unit_price,
                     (ci.quantity * ci.unit_price) AS line_total
-                FROM cart_items ci
+                FROM {t['cart_items']} ci
                 JOIN products p ON p.id = ci.product_id
                 WHERE ci.cart_id = ?
                 ORDER BY p.name
@@ -1658,12 +2201,50 @@ def api_orders_by_user(
                     "total": float(o["total"]),
                     "payment_status": o["payment_status"],
                     "created_at": o["created_at"],
+                    "archived": o["source"] != "hot",
                     "items": items,
                 }
             )
 
     return result
 
+@app.get("/orders/payment_link")
+def api_get_order_payment_link(
+    request: Request,
+    order_id: int = Query(...),
+    _: bool = Depends(require_api_key),
+) -> Dict[str, Any]:
+    """
+    Link corto de pago (/checkout/{id} en este backoffice) de una orden ya
+    creada. Si ya se pagó o falló no hay link: devuelve el estado.
+    """
+    with get_connection() as conn:
+        order = conn.execute(
+            "SELECT id, payment_status FROM orders WHERE id = ?",
+            (order_id,),
+        ).fetchone()
+
+    if not order:
+        return {
+            "status": "not_found",
+            "message": "No existe esa orden."
+        }
+    if order["payment_status"] != "pending":
+        return {
+            "status": order["payment_status"],
+            "order_id": order_id,
+            "message": f"La orden ya está {order['payment_status']}.",
+        }
+
+    payment_url = str(request.url_for("redirect_checkout", order_id=order_id))
+    if shards.SHARDED:
+        payment_url += f"?store={quote_plus(shards.current_store())}"
+    return {
+        "status": "found",
+        "order_id": order_id,
+        "payment_url": payment_url,
+    }
+
 @app.get("/orders/{order_id}", response_model=Order)
 def api_get_order(order_id: int, _: bool = Depends(require_api_key)):
     with get_connection() as conn:
@@ -1678,42 +2259,3 @@ def api_get_order(order_id: int, _: bool = Depends(require_api_key)):
     if not row:
         raise HTTPException(status_code=404, detail="Orden no encontrada")
     return Order(**dict(row))
-
-
-
-@app.get("/orders/payment_link")
-def api_get_order_payment_link(order_id: int = Query(...), _: bool = Depends(require_api_key)) -> Dict[str, Any]:
-    """
-    Devuelve el link de pago para una orden ya creada.
-    Si ya existe, lo devuelve.
-    Si no existe, genera uno simple basado en el checkout.
-    """
-
-    with get_connection() as conn:
-        order = conn.execute(
-            """
-            SELECT id, user_id, cart_id, total, payment_status
-            FROM orders
-            WHERE id = ?
-            """,
-            (order_id,),
-        ).fetchone()
-
-        if not order:
-            return {
-                "status": "not_found",
-                "message": "No existe esa orden."
-            }
-
-        # Generamos un link simple basado en los datos de la orden
-        # (para demo es perfecto)
-        payment_url = (
-            f"http://localhost:8001/index.html"
-            f"?order_id={order['id']}&user_id={order['user_id']}&total={order['total']}"
-        )
-
-        return {
-            "status": "found",
-            "order_id": order_id,
-            "payment_url": payment_url,
-        }
\ No newline at end of file
@@ -0,0 +1,375 @@
+"""
+bench_backoffice.py
+Benchmark de los endpoints JSON del backoffice a distintas escalas.
+
+- Por cada escala (filas por tabla) genera una base SQLite con schema.sql
+  y datos sintéticos (users, products, carts, cart_items, orders).
+- Corre cada escala en un subproceso aparte, así el pico de RSS es
+  de esa escala y no se arrastra memoria entre corridas.
+- Le pega a la app real (backoffice_app) in-process con httpx + ASGITransport.
+- Guarda percentiles de latencia, throughput y pico de RSS en un JSON
+  pensado para diffear entre commits.
+
+Uso:
+    python bench_backoffice.py                        # 1k, 100k y 1M filas
+    python bench_backoffice.py --scales 1000,100000 --out bench.json
+    python bench_backoffice.py --requests 50 --max-seconds 5 --data-dir .bench_data
+
+Con --data-dir las bases sembradas se reutilizan entre corridas (cada
+corrida trabaja sobre una copia, porque el benchmark escribe carritos y órdenes).
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+try:
+    import resource  # no existe en Windows
+except ImportError:
+    resource = None
+
+from gen_dataset import deferred_users_fts
+
+BASE_DIR = Path(__file__).resolve().parent
+SCHEMA_PATH = BASE_DIR / "schema.sql"
+API_KEY = "bench-key"
+CHUNK = 50_000
+
+CATEGORIES = ["Almacén", "Lácteos", "Bebidas", "Limpieza", "Perfumería", "Frescos", "Congelados"]
+WORDS = ["Leche", "Arroz", "Yerba", "Fideos", "Aceite", "Azúcar", "Harina", "Café", "Galletitas", "Queso"]
+
+
+# -------------------------
+# Seed
+# -------------------------
+def _chunks(rows, size=CHUNK):
+    batch = []
+    for r in rows:
+        batch.append(r)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def seed_db(path: Path, n: int, seed: int = 42):
+    """n filas por tabla. Carritos: 20% abiertos, el resto con orden asociada."""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA_PATH.read_text(encoding="utf-8"))
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+
+    users = (
+        (f"Cliente {i}", f"cliente {i}", f"cliente{i}@bench.example.com", f"54911{i:08d}", f"+54911{i:08d}", "nuevo")
+        for i in range(1, n + 1)
+    )
+    with deferred_users_fts(conn):
+        for batch in _chunks(users):
+            conn.executemany(
+                "INSERT INTO users (name, name_fold, email, phone, phone_norm, segment) VALUES (?, ?, ?, ?, ?, ?)", batch
+            )
+
+    products = (
+        (
+            f"SKU{i:07d}",
+            f"{WORDS[i % len(WORDS)]} {i}",
+            CATEGORIES[i % len(CATEGORIES)],
+            None,
+            round(rng.uniform(100, 5000), 2),
+            int(i % 10 == 0),
+            rng.randint(0, 500),
+        )
+        for i in range(1, n + 1)
+    )
+    for batch in _chunks(products):
+        conn.executemany(
+            "INSERT INTO products (sku, name, category, description, price, is_offer, stock) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            batch,
+        )
+
+    carts = ((rng.randint(1, n), "open" if i % 5 == 0 else "checked_out") for i in range(1, n + 1))
+    for batch in _chunks(carts):
+        conn.executemany("INSERT INTO carts (user_id, status) VALUES (?, ?)", batch)
+
+    items = ((i, rng.randint(1, n), rng.randint(1, 5), round(rng.uniform(100, 5000), 2)) for i in range(1, n + 1))
+    for batch in _chunks(items):
+        conn.executemany(
+            "INSERT INTO cart_items (cart_id, product_id, quantity, unit_price) VALUES (?, ?, ?, ?)", batch
+        )
+
+    orders = conn.execute(
+        "SELECT c.user_id, c.id, ci.quantity * ci.unit_price FROM carts c "
+        "JOIN cart_items ci ON ci.cart_id = c.id WHERE c.status = 'checked_out'"
+    )
+    for batch in _chunks(orders):
+        conn.executemany(
+            "INSERT INTO orders (user_id, cart_id, total, payment_status) VALUES (?, ?, ?, 'pending')", batch
+        )
+    conn.commit()
+    conn.close()
+
+
+# -------------------------
+# Escenarios
+# -------------------------
+def _pct(values, p):
+    if not values:
+        return 0.0
+    return values[max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))]
+
+
+def _stats(latencies: list, errors: int, elapsed: float) -> dict:
+    ms = sorted(x * 1000 for x in latencies)
+    return {
+        "requests": len(ms),
+        "errors": errors,
+        "rps": round(len(ms) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(ms) / len(ms), 3) if ms else 0.0,
+        "p50_ms": round(_pct(ms, 50), 3),
+        "p90_ms": round(_pct(ms, 90), 3),
+        "p99_ms": round(_pct(ms, 99), 3),
+        "max_ms": round(ms[-1], 3) if ms else 0.0,
+    }
+
+
+async def run_endpoints(app, n: int, args) -> dict:
+    import httpx
+
+    rng = random.Random(args.seed)
+    headers = {"x-api-key": API_KEY}
+    any_user = lambda: rng.randint(1, n)  # noqa: E731
+    any_product = lambda: rng.randint(1, n)  # noqa: E731
+
+    async def add_item(client):
+        return await client.post(
+            "/carts/add_item",
+            json={"user_id": any_user(), "product_id": any_product(), "quantity": 1},
+            headers=headers,
+        )
+
+    async def checkout_setup(client):
+        # El checkout consume el carrito: cada iteración arma uno nuevo (fuera del cronómetro)
+        user_id = any_user()
+        for _ in range(3):
+            r = await client.post(
+                "/carts/add_item",
+                json={"user_id": user_id, "product_id": any_product(), "quantity": 1},
+                headers=headers,
+            )
+            if r.status_code == 200:
+                break
+        return user_id
+
+    # nombre -> (setup opcional, request, status esperados)
+    scenarios = {
+        "GET /products": (None, lambda c, _: c.get("/products", headers=headers), (200,)),
+        "GET /products/search": (
+            None,
+            lambda c, _: c.get("/products/search", params={"q": rng.choice(("leche", "cafe", "galletitas"))}, headers=headers),
+            (200,),
+        ),
+        "GET /users/search?phone": (
+            None,
+            lambda c, _: c.get("/users/search", params={"phone": f"54911{any_user():08d}"}, headers=headers),
+            (200,),
+        ),
+        "GET /users/search?name": (
+            None,
+            lambda c, _: c.get("/users/search", params={"name": f"cliente {any_user()}"}, headers=headers),
+            (200,),
+        ),
+        # 400 = sin stock para ese producto: sigue siendo una respuesta válida
+        "POST /carts/add_item": (None, lambda c, _: add_item(c), (200, 400)),
+        "GET /carts/summary": (
+            None,
+            lambda c, _: c.get("/carts/summary", params={"user_id": any_user()}, headers=headers),
+            (200,),
+        ),
+        "POST /orders/checkout": (
+            checkout_setup,
+            lambda c, uid: c.post(
+                "/orders/checkout",
+                json={"user_id": uid, "email": f"cliente{uid}@bench.example.com"},
+                headers=headers,
+            ),
+            (200, 400, 409),
+        ),
+        "GET /orders/by_user": (
+            None,
+            lambda c, _: c.get("/orders/by_user", params={"user_id": any_user()}, headers=headers),
+            (200,),
+        ),
+        "GET /checkout/{id}": (
+            None,
+            lambda c, _: c.get(f"/checkout/{rng.randint(1, max(1, int(n * 0.8)))}"),
+            (307, 404),
+        ),
+    }
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", follow_redirects=False) as client:
+        for name, (setup, request, expected) in scenarios.items():
+            if args.only and not any(o in name for o in args.only):
+                continue
+            latencies, errors = [], 0
+            budget_end = time.perf_counter() + args.max_seconds
+            timed = 0.0
+            for _ in range(args.requests):
+                state = await setup(client) if setup else None
+                t0 = time.perf_counter()
+                resp = await request(client, state)
+                dt = time.perf_counter() - t0
+                timed += dt
+                latencies.append(dt)
+                if resp.status_code not in expected:
+                    errors += 1
+                if time.perf_counter() > budget_end:
+                    break
+            results[name] = _stats(latencies, errors, timed)
+            print(f"   {name:<28} p50={results[name]['p50_ms']:>9} ms  n={results[name]['requests']}")
+    return results
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux: KB, macOS: bytes
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+
+
+# -------------------------
+# Worker (una escala por proceso)
+# -------------------------
+def run_worker(args):
+    n = args.scale
+    data_dir = Path(args.data_dir) if args.data_dir else Path(tempfile.mkdtemp(prefix="bench_seed_"))
+    data_dir.mkdir(parents=True, exist_ok=True)
+    seeded = data_dir / f"retail_{n}.db"
+
+    seed_s = 0.0
+    if not seeded.exists():
+        t0 = time.perf_counter()
+        seed_db(seeded, n, args.seed)
+        seed_s = time.perf_counter() - t0
+        print(f"🌱 {n} filas por tabla sembradas en {seed_s:.1f} s")
+
+    workdir = Path(tempfile.mkdtemp(prefix="bench_run_"))
+    db_path = workdir / "retail.db"
+    shutil.copy(seeded, db_path)
+
+    os.environ["RETAIL_DB_PATH"] = str(db_path)
+    os.environ["ENV"] = "bench"
+    os.environ["ADMIN_USER"] = "bench"
+    os.environ["ADMIN_PASSWORD"] = "bench"
+    os.environ["BACKOFFICE_API_KEY"] = API_KEY
+    os.environ["TRACE_ENABLED"] = "false"
+    sys.path.insert(0, str(BASE_DIR))
+
+    try:
+        from backoffice_app import app, init_db
+
+        init_db()
+        rss_before = peak_rss_mb()
+        endpoints = asyncio.run(run_endpoints(app, n, args))
+        result = {
+            "rows_per_table": n,
+            "seed_s": round(seed_s, 2),
+            "db_mb": round(db_path.stat().st_size / (1024 * 1024), 1),
+            "peak_rss_mb_before": rss_before,
+            "peak_rss_mb": peak_rss_mb(),
+            "endpoints": endpoints,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    Path(args.worker_out).write_text(json.dumps(result), encoding="utf-8")
+
+
+# -------------------------
+# Orquestador
+# -------------------------
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de los endpoints JSON del backoffice")
+    parser.add_argument("--scales", default="1000,100000,1000000", help="filas por tabla, separadas por coma")
+    parser.add_argument("--requests", type=int, default=200, help="requests máximos por endpoint")
+    parser.add_argument("--max-seconds", type=float, default=10.0, help="tiempo máximo por endpoint")
+    parser.add_argument("--only", nargs="*", help="correr solo endpoints que contengan estos textos")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data-dir", help="carpeta para cachear las bases sembradas")
+    parser.add_argument("--out", type=Path, default=Path("bench_backoffice.json"))
+    # modo interno
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--scale", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--worker-out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    report = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "requests_per_endpoint": args.requests,
+        "scales": {},
+    }
+    for scale in [int(s) for s in args.scales.split(",") if s.strip()]:
+        print(f"🚀 Escala {scale} filas por tabla")
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
+            worker_out = tmp.name
+        cmd = [
+            sys.executable, __file__, "--worker",
+            "--scale", str(scale),
+            "--worker-out", worker_out,
+            "--requests", str(args.requests),
+            "--max-seconds", str(args.max_seconds),
+            "--seed", str(args.seed),
+        ]
+        if args.data_dir:
+            cmd += ["--data-dir", args.data_dir]
+        if args.only:
+            cmd += ["--only", *args.only]
+        try:
+            subprocess.run(cmd, check=True)
+            report["scales"][str(scale)] = json.loads(Path(worker_out).read_text(encoding="utf-8"))
+        except subprocess.CalledProcessError as e:
+            print(f"❌ Falló la escala {scale}: {e}")
+            report["scales"][str(scale)] = {"error": str(e)}
+        finally:
+            Path(worker_out).unlink(missing_ok=True)
+
+    args.out.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"✅ Resultados en {args.out}")
+
+
+if __name__ == "__main__":
+    main()
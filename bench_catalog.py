@@ -0,0 +1,254 @@
+"""
+bench_catalog.py
+Benchmark del snapshot de catálogo (catalog_snapshot.py) contra SQLite.
+
+Mide, sobre la misma base:
+- sqlite_scan: el camino anterior de search_products (SELECT de todo el
+  catálogo + filtro sin acentos en Python)
+- sqlite_like: SELECT ... WHERE name/description LIKE ? LIMIT 25 (sin fold)
+- snapshot: búsqueda sobre el archivo mapeado
+- fuzzy: consultas con errores de tipeo ("cerbeza") sobre el índice de
+  trigramas del snapshot, con recall (¿aparece la palabra original?) y p95;
+  objetivo < 10 ms a 100k SKUs
+- semantic / hybrid: consultas descriptivas ("algo para el desayuno") con el
+  producto matriz-vector sobre los vectores del snapshot (semantic.py)
+- lookup por id en ambos caminos
+- build del snapshot, tamaño, costo de abrirlo y RSS de N procesos lectores
+  (las páginas mapeadas las comparte el sistema operativo)
+
+Uso:
+    python bench_catalog.py --products 100000
+    python bench_catalog.py --db retail_big.db --queries 500 --procs 4
+    python bench_catalog.py --json catalog.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import catalog_snapshot
+from normalization import fold_text
+
+BASE_DIR = Path(__file__).resolve().parent
+
+
+def _rss_mb() -> float:
+    # ru_maxrss: KiB en Linux, bytes en macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _timed(fn, items) -> dict:
+    lat = []
+    hits = 0
+    for it in items:
+        t0 = time.perf_counter()
+        hits += fn(it)
+        lat.append(time.perf_counter() - t0)
+    elapsed = sum(lat)
+    lat.sort()
+    return {
+        "ops": len(items),
+        "ops_per_s": round(len(items) / elapsed, 1),
+        "ms_per_op": round(elapsed / len(items) * 1000, 3),
+        "p95_ms": round(lat[int(len(lat) * 0.95)] * 1000, 3),
+        "hits": hits,
+    }
+
+
+def typo(word: str, rng: random.Random) -> str:
+    """Un error de tipeo: cambio, borrado, transposición o letra de más."""
+    if len(word) < 4:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    kind = rng.choice(("sub", "del", "swap", "ins"))
+    if kind == "sub":
+        return word[:i] + rng.choice("abcdefghijlmnoprstuvyz") + word[i + 1:]
+    if kind == "del":
+        return word[:i] + word[i + 1:]
+    if kind == "swap":
+        return word[:i - 1] + word[i] + word[i - 1] + word[i + 1:]
+    return word[:i] + rng.choice("aeiou") + word[i:]
+
+
+def pick_queries(conn: sqlite3.Connection, n: int, rng: random.Random):
+    names = [r[0] for r in conn.execute("SELECT name FROM products ORDER BY RANDOM() LIMIT ?", (n,))]
+    queries = []
+    for name in names:
+        words = [w for w in name.split() if len(w) > 3] or name.split()
+        queries.append(rng.choice(words).lower())
+    # Algunas que no existen: recorren todo el catálogo
+    queries[: max(1, n // 10)] = ["zzzinexistente"] * max(1, n // 10)
+    return queries
+
+
+def sqlite_scan(conn, limit):
+    def run(q):
+        fq = fold_text(q)
+        rows = conn.execute(
+            "SELECT id, sku, name, category, description, price, is_offer, stock, updated_at FROM products ORDER BY updated_at DESC"
+        ).fetchall()
+        out = [r for r in rows if fq in fold_text(" ".join(str(x or "") for x in (r[2], r[4], r[3], r[1])))]
+        return len(out[:limit])
+    return run
+
+
+def sqlite_like(conn, limit):
+    def run(q):
+        pat = f"%{q}%"
+        rows = conn.execute(
+            """
+            SELECT id, sku, name, category, description, price, is_offer, stock, updated_at
+            FROM products WHERE name LIKE ? OR description LIKE ? OR category LIKE ? OR sku LIKE ?
+            LIMIT ?
+            """,
+            (pat, pat, pat, pat, limit),
+        ).fetchall()
+        return len(rows)
+    return run
+
+
+def snapshot_search(snap, limit):
+    def run(q):
+        return len([snap.row(i) for i in snap.search(q, limit=limit)])
+    return run
+
+
+def fuzzy_search(snap, limit):
+    def run(pair):
+        original, q = pair
+        rows = snap.fuzzy_search(q, limit=limit)
+        # Acierto: algún resultado contiene la palabra original
+        return int(any(original in fold_text(snap.text("name", i)) for i in rows))
+    return run
+
+
+DESCRIPTIVE = [
+    "algo para el desayuno", "bebida sin alcohol", "cosas para limpiar", "algo dulce",
+    "para el asado", "merienda", "productos para el bebe", "snack para la picada",
+    "verduras para la ensalada", "algo para tomar",
+]
+
+
+def semantic_search(snap, limit, mode):
+    fn = snap.hybrid_search if mode == "hybrid" else snap.semantic_search
+
+    def run(q):
+        return len(fn(q, limit=limit))
+    return run
+
+
+def _reader(args):
+    directory, queries = args
+    before = _rss_mb()
+    t0 = time.perf_counter()
+    snap = catalog_snapshot.CatalogStore(Path(directory)).current()
+    open_ms = (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()
+    for q in queries:
+        [snap.row(i) for i in snap.search(q, limit=25)]
+    elapsed = time.perf_counter() - t0
+    return {"open_ms": round(open_ms, 2), "searches_per_s": round(len(queries) / elapsed, 1),
+            "rss_delta_mb": round(_rss_mb() - before, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del snapshot de catálogo vs SQLite")
+    parser.add_argument("--db", type=Path, help="base existente (si no, se genera con gen_dataset.py)")
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--scan-queries", type=int, default=20, help="búsquedas para sqlite_scan (es lento)")
+    parser.add_argument("--lookups", type=int, default=20_000)
+    parser.add_argument("--limit", type=int, default=25)
+    parser.add_argument("--procs", type=int, default=4, help="procesos lectores del snapshot")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", type=Path, help="guardar el resultado en JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db = args.db
+        if db is None:
+            db = Path(tmp) / "catalog.db"
+            print(f"🛠️  Generando {args.products:,} productos...")
+            subprocess.run(
+                [sys.executable, str(BASE_DIR / "gen_dataset.py"), "--out", str(db),
+                 "--users", "100", "--products", str(args.products), "--carts", "0"],
+                check=True, stdout=subprocess.DEVNULL,
+            )
+        conn = sqlite3.connect(db)
+        conn.executescript((BASE_DIR / "schema.sql").read_text(encoding="utf-8"))
+        count = conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+        directory = Path(tmp) / "snap"
+        t0 = time.perf_counter()
+        path = catalog_snapshot.build_snapshot(conn, directory)
+        results["build"] = {
+            "products": count,
+            "seconds": round(time.perf_counter() - t0, 3),
+            "size_mb": round(path.stat().st_size / 1024 / 1024, 2),
+        }
+        snap = catalog_snapshot.Snapshot(path)
+
+        queries = pick_queries(conn, args.queries, rng)
+        scan_queries = queries[: args.scan_queries]
+        results["search"] = {
+            "sqlite_scan": _timed(sqlite_scan(conn, args.limit), scan_queries),
+            "sqlite_like": _timed(sqlite_like(conn, args.limit), queries),
+            "snapshot": _timed(snapshot_search(snap, args.limit), queries),
+        }
+        typos = [(fold_text(q), typo(fold_text(q), rng)) for q in queries if len(q) >= 4 and q != "zzzinexistente"]
+        results["search"]["fuzzy"] = _timed(fuzzy_search(snap, args.limit), typos)
+        results["search"]["fuzzy"]["recall"] = round(results["search"]["fuzzy"]["hits"] / max(len(typos), 1), 3)
+        descriptive = [DESCRIPTIVE[i % len(DESCRIPTIVE)] for i in range(args.queries)]
+        snap.vectors()  # la primera consulta no paga el mapeo de la matriz
+        for mode in ("semantic", "hybrid"):
+            results["search"][mode] = _timed(semantic_search(snap, args.limit, mode), descriptive)
+
+        ids = [r[0] for r in conn.execute("SELECT id FROM products")]
+        sample = [rng.choice(ids) for _ in range(args.lookups)]
+        results["lookup"] = {
+            "sqlite": _timed(
+                lambda pid: conn.execute(
+                    "SELECT id, sku, name, category, description, price, is_offer, stock, updated_at FROM products WHERE id = ?",
+                    (pid,),
+                ).fetchone() is not None,
+                sample,
+            ),
+            "snapshot": _timed(lambda pid: snap.get(pid) is not None, sample),
+        }
+        conn.close()
+
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(args.procs) as pool:
+            results["readers"] = pool.map(_reader, [(str(directory), queries)] * args.procs)
+
+    b = results["build"]
+    print(f"📚 Build: {b['products']:,} productos en {b['seconds']} s, {b['size_mb']} MB")
+    for kind in ("search", "lookup"):
+        for name, r in results[kind].items():
+            print(f"⏱️  {kind:<6} {name:<12} {r['ops_per_s']:>12,.1f} ops/s  {r['ms_per_op']:>9.3f} ms/op  p95 {r['p95_ms']:.3f} ms")
+    for i, r in enumerate(results["readers"]):
+        print(f"👥 lector {i}: abrir {r['open_ms']} ms, {r['searches_per_s']:,} búsquedas/s, RSS +{r['rss_delta_mb']} MB")
+    fz = results["search"]["fuzzy"]
+    print(f"🔤 fuzzy: recall {fz['recall']:.0%} con un error de tipeo, p95 {fz['p95_ms']} ms {'✅' if fz['p95_ms'] < 10 else '❌'} (< 10 ms)")
+    sem, hyb = results["search"]["semantic"], results["search"]["hybrid"]
+    print(f"🧭 consultas descriptivas: semantic p95 {sem['p95_ms']} ms, hybrid p95 {hyb['p95_ms']} ms")
+    speedup = results["search"]["sqlite_scan"]["ms_per_op"] / max(results["search"]["snapshot"]["ms_per_op"], 1e-6)
+    print(f"🚀 snapshot vs sqlite_scan: x{speedup:,.0f}")
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
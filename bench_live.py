@@ -0,0 +1,169 @@
+"""
+bench_live.py
+Fan-out del admin en vivo (live_feed.py): N pestañas suscriptas al mismo
+LiveFeed mientras compradores hacen add_item → checkout (storage.py) sobre
+la base de stress_stock.py. Sin red ni servidor: las pestañas son colas en
+un event loop, como las del endpoint SSE.
+
+Por cada cantidad de pestañas reporta:
+- statements SQL del lector (deberían ser los mismos con 1 o con 500)
+- los que harían esas pestañas recargando /admin/orders cada
+  LIVE_POLL_INTERVAL (la query del listado, una por pestaña y recarga)
+- latencia commit → mensaje en la cola de cada pestaña (p50/p95)
+
+Falla si alguna pestaña no recibió todas las órdenes, las recibió
+desordenadas o fue cortada por cola llena.
+
+Uso:
+    python bench_live.py
+    python bench_live.py --clients 1,50,500 --buyers 2000 --json live.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from jinja2 import Environment, FileSystemLoader
+
+import shards
+import stress_stock
+
+BASE_DIR = Path(__file__).resolve().parent
+
+
+class CountingPool(shards.ConnectionPool):
+    """Pool que cuenta los statements que corren sus conexiones."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements = 0
+
+    def acquire(self):
+        conn = super().acquire()
+        conn.set_trace_callback(self._count)
+        return conn
+
+    def _count(self, _sql):
+        self.statements += 1
+
+
+def run(db_path: Path, clients: int, buyers: int, first_uid: int) -> dict:
+    import live_feed
+    from storage import SQLiteStorage, StorageError
+
+    env = Environment(loader=FileSystemLoader(str(BASE_DIR / "templates")), autoescape=True)
+    feed_pool = CountingPool("live", db_path, timeout=30, size=2)
+    feed = live_feed.LiveFeed("bench", feed_pool.acquire, lambda name, ctx: env.get_template(name).render(**ctx))
+    store = SQLiteStorage(shards.ConnectionPool("bench", db_path, timeout=30, size=2).acquire)
+    committed = {}  # order_id -> perf_counter del commit
+
+    def shop():
+        for uid in range(first_uid, first_uid + buyers):
+            try:
+                store.add_item(uid, 1 + uid % 5, 1)
+                order = store.checkout(uid)
+            except StorageError:
+                continue
+            committed[order["order_id"]] = time.perf_counter()
+
+    async def tab(sub, received, latencies):
+        while True:
+            msg = await sub.queue.get()
+            if msg is None:
+                return "dropped"
+            now = time.perf_counter()
+            data = json.loads(msg.split("\ndata: ", 1)[1])
+            if data["entity"] == "order" and data["action"] == "created":
+                received.append(data["id"])
+                if data["id"] in committed:
+                    latencies.append((now - committed[data["id"]]) * 1000)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        subs = [feed.subscribe(loop, None)[0] for _ in range(clients)]
+        received = [[] for _ in subs]
+        latencies = []
+        tasks = [asyncio.create_task(tab(s, received[i], latencies)) for i, s in enumerate(subs)]
+        before = feed_pool.statements
+        t0 = time.perf_counter()
+        writer = threading.Thread(target=shop)
+        writer.start()
+        await loop.run_in_executor(None, writer.join)
+        # Que el lector alcance el último commit y vacíe las colas
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline and any(len(r) < len(committed) for r in received):
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - t0
+        statements = feed_pool.statements - before
+        dropped = sum(1 for t in tasks if t.done() and t.result() == "dropped")
+        for t in tasks:
+            t.cancel()
+        for s in subs:
+            feed.unsubscribe(s)
+        return received, latencies, elapsed, statements, dropped
+
+    received, latencies, elapsed, statements, dropped = asyncio.run(main())
+    feed.stop()
+    expected = sorted(committed)
+    failures = []
+    if dropped:
+        failures.append(f"{dropped} pestañas cortadas por cola llena")
+    bad = [i for i, r in enumerate(received) if r != expected]
+    if bad:
+        failures.append(f"{len(bad)} pestañas con órdenes faltantes o desordenadas")
+    q = statistics.quantiles(latencies, n=100) if len(latencies) >= 2 else [0.0] * 99
+    reloads = int(clients * elapsed / live_feed.LIVE_POLL_INTERVAL)
+    return {
+        "clients": clients,
+        "orders": len(committed),
+        "seconds": round(elapsed, 2),
+        "feed_statements": statements,
+        "reload_statements": reloads,
+        "p50_ms": round(q[49], 1),
+        "p95_ms": round(q[94], 1),
+        "failures": failures,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fan-out del admin en vivo (SSE)")
+    parser.add_argument("--clients", default="1,10,100", help="pestañas suscriptas (lista)")
+    parser.add_argument("--buyers", type=int, default=500, help="compras por medición")
+    parser.add_argument("--json", type=Path)
+    args = parser.parse_args()
+
+    clients_list = [int(c) for c in args.clients.split(",")]
+    os.environ.setdefault("LIVE_POLL_INTERVAL", "0.2")
+    os.environ.setdefault("LIVE_CLIENT_QUEUE", str(max(256, args.buyers * 3)))
+    rows, failures = [], []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "live.db"
+        stress_stock.seed(db_path, buyers=args.buyers * len(clients_list), products=5,
+                          stock=args.buyers * len(clients_list))
+        for i, clients in enumerate(clients_list):
+            row = run(db_path, clients, args.buyers, 1 + i * args.buyers)
+            rows.append(row)
+            failures += row.pop("failures")
+            print(f"📡 {clients:>4} pestañas: {row['orders']} órdenes en {row['seconds']} s, "
+                  f"{row['feed_statements']} statements del lector (recargando: ~{row['reload_statements']}), "
+                  f"p50 {row['p50_ms']} ms, p95 {row['p95_ms']} ms")
+
+    if args.json:
+        args.json.write_text(json.dumps(rows, indent=2), encoding="utf-8")
+        print(f"💾 Resultados en {args.json}")
+    if failures:
+        for f in failures:
+            print(f"❌ {f}")
+        sys.exit(1)
+    print("✅ Todas las pestañas recibieron todas las órdenes, en orden")
+
+
+if __name__ == "__main__":
+    main()
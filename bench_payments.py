@@ -0,0 +1,170 @@
+"""
+bench_payments.py
+Throughput de las notificaciones de pago (payments.py) contra los handlers
+reales del backoffice, sin red: base temporal con órdenes pendientes y
+notificaciones firmadas como las de payment_gateway_stub.py.
+
+Mide, cada una sobre órdenes distintas:
+- webhook con group commit (default): N threads, un lote por transacción
+- webhook sin group commit: una transacción por notificación
+- conciliación: un CSV con todas las órdenes, PAYMENT_RECONCILE_BATCH filas por transacción
+
+Una fracción (--dup-rate) se reenvía con el mismo event_id (reintentos de la
+pasarela) y otra (--conflict-rate) pide la transición contraria después de
+la primera (illegal_transition). Al final verifica que cada orden quedó
+en el estado de su primera notificación y que hay un evento status_changed
+por cada cambio aplicado.
+
+Uso:
+    python bench_payments.py
+    python bench_payments.py --orders 20000 --threads 1,16,64 --json payments.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import stress_stock
+
+SECRET = "bench-payments-secret"
+
+
+def seed_orders(path: Path, orders: int):
+    stress_stock.seed(path, buyers=100, products=5, stock=10)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO carts (id, user_id, status) VALUES (?, ?, 'checked_out')",
+        [(i, 1 + i % 100) for i in range(1, orders + 1)],
+    )
+    conn.executemany(
+        "INSERT INTO orders (id, user_id, cart_id, total, payment_status) VALUES (?, ?, ?, ?, 'pending')",
+        [(i, 1 + i % 100, i, 1000.0 + i % 997) for i in range(1, orders + 1)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def plan(order_ids, rng, dup_rate: float, conflict_rate: float):
+    """
+    Notificaciones a mandar y estado esperado por orden. Reintentos y
+    conflictos van después de las originales (en paralelo no habría orden).
+    """
+    from payment_gateway_stub import notification
+
+    first, later, expected = [], [], {}
+    for oid in order_ids:
+        status = "failed" if rng.random() < 0.1 else "paid"
+        body = notification(oid, 1000.0 + oid % 997, status)
+        expected[oid] = status
+        first.append(body)
+        if rng.random() < dup_rate:
+            later.append(body)
+        if rng.random() < conflict_rate:
+            later.append(notification(oid, 1000.0 + oid % 997, "failed" if status == "paid" else "paid"))
+    return first + later, len(first), expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput de notificaciones de pago")
+    parser.add_argument("--orders", type=int, default=5000, help="órdenes por medición")
+    parser.add_argument("--threads", default="16", help="threads del webhook (lista)")
+    parser.add_argument("--dup-rate", type=float, default=0.05)
+    parser.add_argument("--conflict-rate", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", type=Path)
+    args = parser.parse_args()
+
+    threads_list = [int(t) for t in args.threads.split(",")]
+    runs = [("webhook", True, t) for t in threads_list] + [("webhook", False, t) for t in threads_list]
+    runs.append(("reconcile", None, 1))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "payments.db"
+        seed_orders(db_path, args.orders * len(runs))
+        os.environ.update(stress_stock.STRESS_ENV)
+        os.environ.update({"RETAIL_DB_PATH": str(db_path), "JOBS_ENABLED": "false", "PAYMENT_WEBHOOK_SECRET": SECRET})
+        import backoffice_app as bo
+        import payments
+
+        rng = random.Random(args.seed)
+        rows, failures, expected_all = [], [], {}
+
+        for i, (mode, group, threads) in enumerate(runs):
+            ids = range(i * args.orders + 1, (i + 1) * args.orders + 1)
+            bodies, n_first, expected = plan(ids, rng, args.dup_rate, args.conflict_rate)
+            expected_all.update(expected)
+            results = {}
+            t0 = time.perf_counter()
+            if mode == "reconcile":
+                csv_text = "order_id,status,amount\n" + "".join(
+                    f"{oid},{st},{1000.0 + oid % 997:.2f}\n" for oid, st in expected.items()
+                )
+                with bo.get_connection(bo.shards.DEFAULT_STORE) as conn:
+                    results = payments.reconcile(conn, csv_text)["results"]
+                latencies = []
+                sent = len(expected)
+            else:
+                payments.PAYMENT_GROUP_COMMIT = group
+
+                def post(body):
+                    t = time.perf_counter()
+                    resp = bo.handle_payment_notification(body, payments.sign(body, SECRET))
+                    return json.loads(resp.body)["result"], (time.perf_counter() - t) * 1000
+
+                with ThreadPoolExecutor(max_workers=threads) as pool:
+                    done = list(pool.map(post, bodies[:n_first]))
+                    done += list(pool.map(post, bodies[n_first:]))
+                latencies = sorted(ms for _, ms in done)
+                for r, _ in done:
+                    results[r] = results.get(r, 0) + 1
+                sent = len(bodies)
+            elapsed = time.perf_counter() - t0
+            q = statistics.quantiles(latencies, n=100) if len(latencies) >= 2 else [0.0] * 99
+            label = mode if mode == "reconcile" else f"webhook {'group commit' if group else '1 tx/notif'}"
+            row = {
+                "mode": label,
+                "threads": threads,
+                "notifications": sent,
+                "per_s": round(sent / elapsed, 1),
+                "p50_ms": round(q[49], 2),
+                "p95_ms": round(q[94], 2),
+                "results": results,
+            }
+            rows.append(row)
+            print(f"💳 {label:<24} {threads:>3} threads: {row['per_s']:>8} notif/s, "
+                  f"p50 {row['p50_ms']} ms, p95 {row['p95_ms']} ms {results}")
+
+        for committer in bo.payment_committers.values():
+            committer.stop()
+        conn = sqlite3.connect(db_path)
+        actual = dict(conn.execute("SELECT id, payment_status FROM orders"))
+        changes = conn.execute(
+            "SELECT COUNT(*) FROM change_events WHERE entity = 'order' AND action = 'status_changed'"
+        ).fetchone()[0]
+        conn.close()
+        wrong = [oid for oid, st in expected_all.items() if actual.get(oid) != st]
+        if wrong:
+            failures.append(f"{len(wrong)} órdenes en un estado distinto al esperado (ej. {wrong[:5]})")
+        if changes != len(expected_all):
+            failures.append(f"{changes} eventos status_changed para {len(expected_all)} órdenes")
+
+    if args.json:
+        args.json.write_text(json.dumps(rows, indent=2), encoding="utf-8")
+        print(f"💾 Resultados en {args.json}")
+    if failures:
+        for f in failures:
+            print(f"❌ {f}")
+        sys.exit(1)
+    print("✅ Transiciones consistentes: un cambio por orden, duplicados y conflictos rechazados")
+
+
+if __name__ == "__main__":
+    main()
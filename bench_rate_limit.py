@@ -0,0 +1,124 @@
+"""
+bench_rate_limit.py
+Benchmark del rate limiter de login (rate_limit.py).
+
+Para cada backend mide:
+- chequeos por segundo con N threads sobre un pool de claves "calientes"
+- credential stuffing: un chequeo por IP distinta (--stuffing-ips) y el
+  tamaño final de la estructura / RSS, que debe quedar acotado por --max-keys
+
+Uso:
+    python bench_rate_limit.py
+    python bench_rate_limit.py --backends memory,sqlite --threads 1,4 --checks 200000
+    python bench_rate_limit.py --json rate_limit.json
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from rate_limit import MemoryRateLimiter, SQLiteRateLimiter
+
+
+def _rss_mb() -> float:
+    # ru_maxrss: KiB en Linux, bytes en macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def build(backend: str, max_keys: int, tmp: Path):
+    if backend == "sqlite":
+        # Un archivo por medición: que no arrastre claves de la anterior
+        fd, path = tempfile.mkstemp(suffix=".db", dir=tmp)
+        os.close(fd)
+        return SQLiteRateLimiter("bench", Path(path), 5, 60, max_keys)
+    return MemoryRateLimiter("bench", 5, 60, max_keys)
+
+
+def throughput(limiter, checks: int, threads: int, hot_keys: int) -> dict:
+    per_thread = checks // threads
+    limited = [0] * threads
+
+    def work(idx: int):
+        n = 0
+        for i in range(per_thread):
+            if not limiter.hit(f"10.{idx}.{(i % hot_keys) >> 8}.{i % 256}")[0]:
+                n += 1
+        limited[idx] = n
+
+    pool = [threading.Thread(target=work, args=(i,)) for i in range(threads)]
+    t0 = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    total = per_thread * threads
+    return {
+        "threads": threads,
+        "checks": total,
+        "checks_per_s": round(total / elapsed),
+        "us_per_check": round(elapsed / total * 1e6, 2),
+        "limited": sum(limited),
+    }
+
+
+def stuffing(limiter, ips: int) -> dict:
+    t0 = time.perf_counter()
+    for i in range(ips):
+        limiter.hit(f"{(i >> 24) & 255}.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}")
+    elapsed = time.perf_counter() - t0
+    if hasattr(limiter, "prune"):
+        limiter.prune()
+    return {
+        "ips": ips,
+        "checks_per_s": round(ips / elapsed),
+        "keys_kept": len(limiter),
+        "max_keys": limiter.max_keys,
+        "rss_mb": _rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del rate limiter de login")
+    parser.add_argument("--backends", default="memory,sqlite")
+    parser.add_argument("--threads", default="1,4", help="lista de cantidades de threads")
+    parser.add_argument("--checks", type=int, default=200_000, help="chequeos por medición (memory)")
+    parser.add_argument("--sqlite-checks", type=int, default=50_000, help="chequeos por medición (sqlite)")
+    parser.add_argument("--hot-keys", type=int, default=1000)
+    parser.add_argument("--stuffing-ips", type=int, default=500_000)
+    parser.add_argument("--max-keys", type=int, default=50_000)
+    parser.add_argument("--json", type=Path, help="guardar el resultado en JSON")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+            checks = args.sqlite_checks if backend == "sqlite" else args.checks
+            runs = []
+            for threads in [int(t) for t in args.threads.split(",")]:
+                r = throughput(build(backend, args.max_keys, Path(tmp)), checks, threads, args.hot_keys)
+                runs.append(r)
+                print(f"⏱️  {backend:<6} {threads} thread(s): {r['checks_per_s']:>9,} chequeos/s ({r['us_per_check']} µs)")
+
+            ips = args.stuffing_ips if backend == "memory" else min(args.stuffing_ips, checks * 2)
+            s = stuffing(build(backend, args.max_keys, Path(tmp)), ips)
+            bounded = s["keys_kept"] <= s["max_keys"]
+            print(
+                f"🧱 {backend:<6} stuffing {s['ips']:,} IPs: {s['checks_per_s']:,} chequeos/s, "
+                f"{s['keys_kept']:,} claves (tope {s['max_keys']:,}) {'✅' if bounded else '❌'} RSS {s['rss_mb']} MB"
+            )
+            results[backend] = {"throughput": runs, "stuffing": s}
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+bench_startup.py
+Benchmark de arranque en frío de main.py.
+
+1) Digest de `python -X importtime -c "import main"`: tiempo total de
+   import y los módulos más caros (acumulado y propio).
+2) Tiempo hasta el primer /healthz: levanta `uvicorn main:app` en un
+   subproceso y mide hasta la primera respuesta 200 (varias corridas).
+
+Objetivo: primer /healthz en menos de 1 s (--target-ms).
+
+Uso:
+    python bench_startup.py
+    python bench_startup.py --runs 5 --top 15 --json startup.json
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+
+# Lo mínimo para que backoffice_app / whatsapp_server importen sin .env
+BENCH_ENV = {
+    "ENV": "bench",
+    "ADMIN_USER": "bench",
+    "ADMIN_PASSWORD": "bench",
+    "BACKOFFICE_API_KEY": "bench-key",
+    "BACKOFFICE_BASE_URL": "http://127.0.0.1:9",
+    "CHECKOUT_BASE_URL": "http://localhost:8001/index.html",
+    "TRACE_ENABLED": "false",
+}
+
+
+def _env(extra=None):
+    env = dict(os.environ)
+    for k, v in BENCH_ENV.items():
+        env.setdefault(k, v)
+    env.update(extra or {})
+    return env
+
+
+# -------------------------
+# -X importtime
+# -------------------------
+def import_profile(top: int) -> dict:
+    """Parsea las líneas 'import time: self [us] | cumulative | package' de stderr."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BASE_DIR, env=_env(), capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import main falló:\n{proc.stderr[-2000:]}")
+
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        except ValueError:
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+
+    total_us = sum(m[1] for m in modules)
+    # top-level: los que importa directamente main (nivel 1) + main
+    roots: dict = {}
+    for name, _, cumulative, depth in modules:
+        root = name.split(".")[0]
+        if depth <= 1:
+            roots[root] = max(roots.get(root, 0), cumulative)
+
+    def ms(us):
+        return round(us / 1000, 1)
+
+    return {
+        "total_ms": ms(total_us),
+        "modules": len(modules),
+        "top_cumulative": [
+            {"module": n, "ms": ms(c)}
+            for n, _, c, _ in sorted(modules, key=lambda m: m[2], reverse=True)[:top]
+        ],
+        "top_self": [
+            {"module": n, "ms": ms(s)}
+            for n, s, _, _ in sorted(modules, key=lambda m: m[1], reverse=True)[:top]
+        ],
+        "heavy_packages_loaded": sorted(
+            p for p in ("google.adk", "google.genai", "twilio") if any(m[0] == p for m in modules)
+        ),
+    }
+
+
+# -------------------------
+# Tiempo hasta /healthz
+# -------------------------
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_to_healthz(timeout: float = 30.0) -> float:
+    port = _free_port()
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BASE_DIR, env=_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - t0 < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError("uvicorn terminó antes de responder /healthz")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=0.5) as resp:
+                    if resp.status == 200:
+                        return time.perf_counter() - t0
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError(f"/healthz no respondió en {timeout} s")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de cold start de main.py")
+    parser.add_argument("--runs", type=int, default=3, help="arranques de uvicorn a medir")
+    parser.add_argument("--top", type=int, default=10, help="módulos a listar en el digest")
+    parser.add_argument("--target-ms", type=float, default=1000.0)
+    parser.add_argument("--json", type=Path, help="guardar el resultado en JSON")
+    args = parser.parse_args()
+
+    profile = import_profile(args.top)
+    print(f"📦 import main: {profile['total_ms']} ms ({profile['modules']} módulos)")
+    for m in profile["top_cumulative"]:
+        print(f"   {m['ms']:>8} ms  {m['module']}")
+    if profile["heavy_packages_loaded"]:
+        print(f"⚠️  Se importan al arrancar: {', '.join(profile['heavy_packages_loaded'])}")
+
+    runs = [round(time_to_healthz() * 1000, 1) for _ in range(args.runs)]
+    best = min(runs)
+    ok = best <= args.target_ms
+    print(f"🩺 Primer /healthz: {runs} ms  →  mejor {best} ms {'✅' if ok else '❌'} (objetivo {args.target_ms:.0f} ms)")
+
+    if args.json:
+        result = {"import": profile, "healthz_ms": runs, "target_ms": args.target_ms, "meets_target": ok}
+        args.json.write_text(json.dumps(result, indent=2), encoding="utf-8")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
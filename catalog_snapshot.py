@@ -0,0 +1,720 @@
+"""
+catalog_snapshot.py
+Snapshot inmutable del catálogo en un archivo columnar mapeado en memoria.
+
+El ~95% del tráfico del agente son lecturas de catálogo (search_products,
+chequeos de stock). En vez de materializar filas SQLite en cada request,
+el catálogo se vuelca a un archivo de solo lectura que cualquier worker
+mapea con mmap (las páginas las comparte el sistema operativo, sin copias):
+
+    [magic 8 bytes][largo del header u64][header JSON][columnas alineadas a 8]
+
+- Columnas numéricas como arrays contiguos: id (int64), price (float64),
+  stock (int64, NULL = STOCK_NULL), is_offer (int8), orden por updated_at.
+- Columnas de texto como offsets uint64 + blob UTF-8: sku, name, category,
+  description, updated_at y `key`, la clave de búsqueda precomputada
+  (fold_text de nombre + descripción + categoría + sku).
+- La búsqueda es mmap.find sobre el blob de claves (C, sin decodificar) y
+  bisect sobre los offsets para saber a qué fila cae cada match.
+- Índice de trigramas para errores de tipeo (fuzzy.py) y vectores para
+  búsqueda por similitud (semantic.py), en el mismo archivo.
+
+Rebuild: triggers sobre products incrementan catalog_meta.version; el
+builder (un thread, solo en el worker líder de jobs) reconstruye cuando la
+versión cambió, con un mínimo de CATALOG_SNAPSHOT_MIN_INTERVAL segundos
+entre builds. Cada build es un archivo nuevo y el puntero CURRENT se
+reemplaza atómicamente (os.replace): los lectores ven el snapshot viejo
+o el nuevo, nunca uno a medio escribir.
+
+El stock no dispara rebuilds (cambia en cada carrito y checkout, y un build
+con índices fuzzy y semánticos tarda segundos): el trigger solo mira las
+columnas de catálogo. La columna stock del snapshot es la del build; quien
+sirve filas la pisa con la de SQLite (live_stock, por id).
+
+Config (env):
+- CATALOG_SNAPSHOT_ENABLED        (default true)
+- CATALOG_SNAPSHOT_DIR            (default: .<nombre de la base>_catalog/ junto a la base)
+- CATALOG_SNAPSHOT_POLL           segundos entre chequeos de versión (default 1)
+- CATALOG_SNAPSHOT_MIN_INTERVAL   segundos mínimos entre builds (default 2)
+
+Uso:
+    python catalog_snapshot.py build --db retail.db
+    python catalog_snapshot.py info --db retail.db
+    python catalog_snapshot.py search "dulce de leche" --db retail.db
+    python catalog_snapshot.py search "algo para el desayuno" --mode hybrid
+"""
+
+import argparse
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import fuzzy
+import metrics
+import semantic
+from normalization import fold_text
+
+BASE_DIR = Path(__file__).resolve().parent
+
+CATALOG_SNAPSHOT_ENABLED = os.getenv("CATALOG_SNAPSHOT_ENABLED", "true").lower() == "true"
+CATALOG_SNAPSHOT_DIR = os.getenv("CATALOG_SNAPSHOT_DIR", "")
+CATALOG_SNAPSHOT_POLL = float(os.getenv("CATALOG_SNAPSHOT_POLL", "1"))
+CATALOG_SNAPSHOT_MIN_INTERVAL = float(os.getenv("CATALOG_SNAPSHOT_MIN_INTERVAL", "2"))
+
+MAGIC = b"RCATSNP3"  # v2: + índice de trigramas (fuzzy.py); v3: + vectores (semantic.py)
+STOCK_NULL = -(2 ** 63)
+_CHECK_EVERY = 0.5  # segundos entre lecturas del puntero CURRENT
+_MAX_POOL = 1_600  # candidatos que se recorren buscando variedad (ver Snapshot._top)
+_VARY_RATIO = 0.6
+
+NUMERIC_COLUMNS = {
+    "id": "q", "price": "d", "stock": "q", "is_offer": "b", "by_updated": "q",
+    # Índice fuzzy (ver fuzzy.build_index)
+    "gram_keys": "Q", "gram_offsets": "Q", "gram_words": "I", "word_grams": "H",
+    "word_offsets": "Q", "word_rows": "I",
+    # Vectores TF-IDF (ver semantic.build_matrix), por dimensión: dim x count
+    # int8 (cuantizados, ver vector_scale en el header) + idf float32. Se leen con NumPy
+    "vectors": "b", "idf": "f",
+}
+TEXT_COLUMNS = ("sku", "name", "category", "description", "updated_at", "key", "vocab")
+
+SNAPSHOT_BUILDS = metrics.counter("catalog_snapshot_builds_total", "Builds del snapshot de catálogo", ("status",))
+SNAPSHOT_BUILD_SECONDS = metrics.histogram(
+    "catalog_snapshot_build_seconds", "Duración del build del snapshot",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+CATALOG_READS = metrics.counter("catalog_reads_total", "Lecturas de catálogo por origen", ("source",))
+
+
+def snapshot_dir(db_path: Path) -> Path:
+    if CATALOG_SNAPSHOT_DIR:
+        return Path(CATALOG_SNAPSHOT_DIR)
+    db_path = Path(db_path)
+    return db_path.parent / f".{db_path.stem}_catalog"
+
+
+def _pad8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+# -------------------------
+# Build
+# -------------------------
+def _text_column(values: List[Optional[str]]):
+    offsets = array("Q", [0])
+    chunks = []
+    total = 0
+    for v in values:
+        b = (v or "").encode("utf-8")
+        chunks.append(b)
+        total += len(b)
+        offsets.append(total)
+    return offsets, b"".join(chunks)
+
+
+def _key_column(keys: List[str]):
+    # "\n" al final de cada clave: un match nunca cruza de una fila a otra
+    return _text_column([k + "\n" for k in keys])
+
+
+def _search_keys(rows, key_cache: Optional[Dict[int, Any]]):
+    """
+    Texto derivado de cada producto: clave de búsqueda (nombre, descripción,
+    categoría, sku), texto del índice fuzzy (nombre y categoría) y features del
+    vector semántico. Reusa todo si el texto no cambió desde el build anterior.
+    """
+    keys, names, feats = [], [], []
+    for r in rows:
+        raw = " ".join(str(x or "") for x in (r[2], r[4], r[3], r[1]))
+        cached = key_cache.get(r[0]) if key_cache is not None else None
+        if cached is None or cached[0] != raw:
+            names_text = fold_text(f"{r[2] or ''} {r[3] or ''}")
+            described = f"{names_text} {fold_text(r[4])}"
+            cached = (
+                raw,
+                fold_text(raw),
+                names_text,
+                # (buckets, valores) en arrays compactos: el cache vive entre builds
+                semantic.features(described, folded=True),
+            )
+            if key_cache is not None:
+                key_cache[r[0]] = cached
+        keys.append(cached[1])
+        names.append(cached[2])
+        feats.append(cached[3])
+    return keys, names, feats
+
+
+def build_snapshot(conn: sqlite3.Connection, directory: Path, key_cache: Optional[Dict[int, Any]] = None) -> Path:
+    """
+    Vuelca products a un snapshot nuevo y mueve el puntero CURRENT. Devuelve el path.
+    key_cache (id -> (texto, clave, texto fuzzy, features)) evita re-normalizar
+    productos que solo cambiaron de stock.
+    """
+    t0 = time.perf_counter()
+    if conn.in_transaction:
+        conn.commit()
+    # Versión y filas desde la misma foto de la base (transacción de lectura)
+    conn.execute("BEGIN")
+    try:
+        version = conn.execute("SELECT version FROM catalog_meta WHERE id = 1").fetchone()[0]
+        rows = conn.execute(
+            """
+            SELECT id, sku, name, category, description, price, is_offer, stock, updated_at
+            FROM products ORDER BY id
+            """
+        ).fetchall()
+    finally:
+        conn.commit()
+
+    n = len(rows)
+    keys, names, feats = _search_keys(rows, key_cache)
+    index = fuzzy.build_index(names)
+    vectors, idf = semantic.build_matrix(feats, n)
+    vector_scale = semantic.quantize_scale(vectors)
+    cols: Dict[str, Any] = {
+        "id": array("q", (r[0] for r in rows)),
+        "price": array("d", (float(r[5] or 0) for r in rows)),
+        "stock": array("q", (STOCK_NULL if r[7] is None else int(r[7]) for r in rows)),
+        "is_offer": array("b", (1 if r[6] else 0 for r in rows)),
+        "by_updated": array("q", sorted(range(n), key=lambda i: (rows[i][8] or "", rows[i][0]), reverse=True)),
+        **{k: v for k, v in index.items() if k != "vocab"},
+        # Transpuesta: una consulta toca pocas dimensiones y cada una es contigua
+        "vectors": semantic.quantize(vectors.T, vector_scale),
+        "idf": idf,
+    }
+    text = {
+        "sku": _text_column([r[1] for r in rows]),
+        "name": _text_column([r[2] for r in rows]),
+        "category": _text_column([r[3] for r in rows]),
+        "description": _text_column([r[4] for r in rows]),
+        "updated_at": _text_column([r[8] for r in rows]),
+        "key": _key_column(keys),
+        "vocab": _text_column(index["vocab"]),
+    }
+
+    sections: List[bytes] = []
+    layout: Dict[str, Dict[str, Any]] = {}
+    offset = 0
+
+    def add(data: bytes) -> int:
+        nonlocal offset
+        start = offset
+        sections.append(data)
+        pad = _pad8(len(data)) - len(data)
+        if pad:
+            sections.append(b"\0" * pad)
+        offset += len(data) + pad
+        return start
+
+    for name, arr in cols.items():
+        data = arr.tobytes()
+        typecode = arr.typecode if isinstance(arr, array) else arr.dtype.char  # array o numpy
+        layout[name] = {"type": typecode, "offset": add(data), "length": len(data)}
+    for name, (offsets, blob) in text.items():
+        off_bytes = offsets.tobytes()
+        layout[name] = {
+            "type": "str",
+            "offsets": add(off_bytes),
+            "offsets_length": len(off_bytes),
+            "offset": add(blob),
+            "length": len(blob),
+        }
+
+    header = json.dumps(
+        {"version": version, "count": n, "dim": semantic.SEMANTIC_DIM, "vector_scale": vector_scale,
+         "built_at": time.time(), "columns": layout},
+        separators=(",", ":"),
+    ).encode("utf-8")
+    prefix = MAGIC + struct.pack("<Q", len(header)) + header
+    prefix += b"\0" * (_pad8(len(prefix)) - len(prefix))
+
+    directory.mkdir(parents=True, exist_ok=True)
+    final = directory / f"catalog_v{version}_{int(time.time() * 1000)}.snap"
+    tmp = final.with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        f.write(prefix)
+        for chunk in sections:
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, final)
+
+    # Puntero atómico: los lectores abren el archivo que nombra CURRENT
+    pointer_tmp = directory / f"CURRENT.{os.getpid()}.tmp"
+    pointer_tmp.write_text(final.name, encoding="utf-8")
+    os.replace(pointer_tmp, directory / "CURRENT")
+
+    _cleanup(directory, keep={final.name})
+    elapsed = time.perf_counter() - t0
+    SNAPSHOT_BUILDS.inc(status="ok")
+    SNAPSHOT_BUILD_SECONDS.observe(elapsed)
+    print(f"📚 Snapshot de catálogo v{version}: {n} productos en {elapsed * 1000:.0f} ms ({final.name})")
+    return final
+
+
+def _cleanup(directory: Path, keep: set, keep_last: int = 2):
+    """Borra snapshots viejos (deja los últimos: puede haber lectores con el anterior mapeado)."""
+    snaps = sorted(directory.glob("catalog_v*.snap"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for p in snaps[keep_last:]:
+        if p.name in keep:
+            continue
+        try:
+            p.unlink()
+        except OSError:
+            pass  # Windows: todavía mapeado por algún proceso; se borra en el próximo build
+
+
+# -------------------------
+# Lectura
+# -------------------------
+class Snapshot:
+    """Vista de solo lectura sobre un archivo de snapshot mapeado."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:8] != MAGIC:
+            raise ValueError(f"{self.path} no es un snapshot de catálogo")
+        (header_len,) = struct.unpack("<Q", self._mm[8:16])
+        header = json.loads(self._mm[16:16 + header_len])
+        base = _pad8(16 + header_len)
+        self.version = header["version"]
+        self.count = header["count"]
+        self.built_at = header["built_at"]
+        self.dim = header["dim"]
+        self._vector_scale = header["vector_scale"]
+        self._vectors_spec = (base + header["columns"]["vectors"]["offset"], base + header["columns"]["idf"]["offset"])
+        self._vectors = None
+
+        mv = memoryview(self._mm)
+        self._num = {}
+        self._text = {}
+        for name, spec in header["columns"].items():
+            start = base + spec["offset"]
+            if name in ("vectors", "idf"):
+                continue  # ver vectors()
+            if spec["type"] == "str":
+                ostart = base + spec["offsets"]
+                self._text[name] = (mv[ostart:ostart + spec["offsets_length"]].cast("Q"), start)
+            else:
+                self._num[name] = mv[start:start + spec["length"]].cast(spec["type"])
+        self.ids = self._num["id"]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def text(self, column: str, i: int) -> str:
+        offsets, start = self._text[column]
+        return self._mm[start + offsets[i]:start + offsets[i + 1]].decode("utf-8")
+
+    def row(self, i: int) -> Dict[str, Any]:
+        stock = self._num["stock"][i]
+        return {
+            "id": self.ids[i],
+            "sku": self.text("sku", i),
+            "name": self.text("name", i),
+            "category": self.text("category", i) or None,
+            "description": self.text("description", i) or None,
+            "price": self._num["price"][i],
+            "is_offer": bool(self._num["is_offer"][i]),
+            "stock": None if stock == STOCK_NULL else stock,
+            "updated_at": self.text("updated_at", i),
+        }
+
+    def index_of(self, product_id: int) -> Optional[int]:
+        i = bisect_left(self.ids, product_id)
+        return i if i < self.count and self.ids[i] == product_id else None
+
+    def get(self, product_id: int) -> Optional[Dict[str, Any]]:
+        i = self.index_of(product_id)
+        return None if i is None else self.row(i)
+
+    def by_updated(self) -> Iterator[int]:
+        """Índices de fila en el orden de GET /products (updated_at DESC)."""
+        return iter(self._num["by_updated"])
+
+    def _passes(self, i: int, category: Optional[str], only_offers: bool) -> bool:
+        if only_offers and not self._num["is_offer"][i]:
+            return False
+        if category and category not in _fold_cached(self.text("category", i)):
+            return False
+        return True
+
+    def search(self, query: str, category: Optional[str] = None, only_offers: bool = False, limit: int = 25) -> List[int]:
+        """Filas cuya clave contiene `query` (sin acentos), en orden de id."""
+        q = fold_text(query).encode("utf-8")
+        cat = fold_text(category) if category else None
+        out: List[int] = []
+        if not q:
+            for i in range(self.count):
+                if self._passes(i, cat, only_offers):
+                    out.append(i)
+                    if len(out) >= limit:
+                        break
+            return out
+
+        offsets, start = self._text["key"]
+        end = start + offsets[self.count]
+        pos = start
+        mm = self._mm
+        while len(out) < limit:
+            hit = mm.find(q, pos, end)
+            if hit < 0:
+                break
+            i = bisect_right(offsets, hit - start) - 1
+            if self._passes(i, cat, only_offers):
+                out.append(i)
+            pos = start + offsets[i + 1]  # siguiente fila
+        return out
+
+    def _word_rows(self, wid: int):
+        offsets = self._num["word_offsets"]
+        return self._num["word_rows"][offsets[wid]:offsets[wid + 1]]
+
+    def similar_words(self, word: str) -> List[tuple]:
+        """[(palabra del vocabulario, score)] parecidas a `word`."""
+        n = self._num
+        found = fuzzy.similar_words(
+            word, lambda wid: self.text("vocab", wid),
+            n["gram_keys"], n["gram_offsets"], n["gram_words"], n["word_grams"],
+        )
+        return [(self.text("vocab", wid), score) for wid, score in found]
+
+    def fuzzy_search(self, query: str, category: Optional[str] = None, only_offers: bool = False,
+                     limit: int = 25) -> List[int]:
+        """
+        Filas cuyo nombre/categoría tiene, para CADA palabra de la consulta, una
+        palabra parecida (errores de tipeo). Mejor score primero.
+        """
+        return [r for _, r in self.fuzzy_scored(query, category, only_offers, limit)]
+
+    def fuzzy_scored(self, query: str, category: Optional[str] = None, only_offers: bool = False,
+                     limit: int = 25) -> List[tuple]:
+        """Como fuzzy_search, con el score promedio por palabra (0..1): [(score, fila)]."""
+        n = self._num
+        words = [w for w in fold_text(query).split() if len(w) >= 2]
+        if not words:
+            return []
+        per_word = []
+        for w in words:
+            cands = fuzzy.similar_words(
+                w, lambda wid: self.text("vocab", wid),
+                n["gram_keys"], n["gram_offsets"], n["gram_words"], n["word_grams"],
+            )
+            if not cands:
+                return []
+            per_word.append([(self._word_rows(wid), score) for wid, score in cands])
+
+        # La palabra con menos filas manda; el resto se chequea por bisect en postings ordenados
+        per_word.sort(key=lambda cands: sum(len(rows) for rows, _ in cands))
+        scores: Dict[int, float] = {}
+        for rows, score in per_word[0]:
+            for r in rows:
+                if score > scores.get(r, 0.0):
+                    scores[r] = score
+
+        cat = fold_text(category) if category else None
+        ranked = []
+        for r, total in scores.items():
+            for cands in per_word[1:]:
+                best = 0.0
+                for rows, score in cands:
+                    if score > best:
+                        i = bisect_left(rows, r)
+                        if i < len(rows) and rows[i] == r:
+                            best = score
+                if not best:
+                    break
+                total += best
+            else:
+                if self._passes(r, cat, only_offers):
+                    ranked.append((-total, r))
+        ranked.sort()
+        return [(-total / len(words), r) for total, r in ranked[:limit]]
+
+    # -------------------------
+    # Vectores (semantic.py)
+    # -------------------------
+    def vectors(self):
+        """(matriz dim x count int8, idf) como arrays de NumPy sobre el mmap, sin copiar."""
+        if self._vectors is None:
+            import numpy as np
+
+            vstart, istart = self._vectors_spec
+            matrix = np.frombuffer(self._mm, dtype=np.int8, count=self.count * self.dim, offset=vstart)
+            idf = np.frombuffer(self._mm, dtype=np.float32, count=self.dim, offset=istart)
+            self._vectors = (matrix.reshape(self.dim, self.count), idf)
+        return self._vectors
+
+    def semantic_scores(self, query: str):
+        """
+        Coseno de la consulta contra todo el catálogo, o None. Solo se leen las
+        filas de la matriz (dimensiones) donde la consulta no es cero.
+        """
+        import numpy as np
+
+        matrix, idf = self.vectors()
+        q = semantic.query_vector(query, idf, self.dim)
+        if q is None or not self.count:
+            return None
+        q = q / np.float32(self._vector_scale)  # deshace la cuantización en la consulta
+        scores = np.zeros(self.count, dtype=np.float32)
+        tmp = np.empty(self.count, dtype=np.float32)
+        for d in np.flatnonzero(q).tolist():
+            np.multiply(matrix[d], q[d], out=tmp)
+            scores += tmp
+        return scores
+
+    def _vary(self, ranked: List[tuple], limit: int, per_group: Optional[int]):
+        """
+        Como mucho per_group productos del mismo tipo (primera palabra del nombre:
+        "leche", "detergente") antes de repetir; sin eso, 25 marcas de lo mismo
+        tapan el resto. Variedad solo entre los que puntúan cerca del mejor
+        (_VARY_RATIO): si "yerba" trae 800 yerbas, no se intercala maní.
+        Los que sobran completan al final, en orden. Devuelve (resultado, relleno).
+        """
+        if not per_group or not ranked:
+            return ranked[:limit], 0
+        floor = ranked[0][0] * _VARY_RATIO
+        out, extra, groups = [], [], {}
+        for item in ranked:
+            key = self.text("key", item[1]).split(" ", 1)[0]
+            groups[key] = groups.get(key, 0) + 1
+            (out if groups[key] <= per_group and item[0] >= floor else extra).append(item)
+            if len(out) >= limit:
+                break
+        fill = extra[:limit - len(out)]
+        return out + fill, len(fill)
+
+    def _top(self, scores, category: Optional[str], only_offers: bool, limit: int, min_score: float,
+             per_group: Optional[int] = None) -> List[tuple]:
+        """[(coseno, fila)] mejor primero, con filtros y coseno >= min_score."""
+        import numpy as np
+
+        cat = fold_text(category) if category else None
+        pool = min(self.count, max(limit * 8, 200))
+        while True:
+            idx = np.argpartition(-scores, pool - 1)[:pool] if pool < self.count else np.arange(self.count)
+            idx = idx[np.argsort(-scores[idx], kind="stable")]
+            ranked = []
+            exhausted = False
+            for r in idx.tolist():
+                sc = float(scores[r])
+                if sc < min_score:
+                    exhausted = True
+                    break
+                if self._passes(r, cat, only_offers):
+                    ranked.append((sc, r))
+            out, fill = self._vary(ranked, limit, per_group)
+            if exhausted or pool >= self.count:
+                return out
+            # Faltan resultados (filtros muy selectivos): se agranda el pool.
+            # Sobran pero repetidos (un solo tipo arriba): se agranda hasta _MAX_POOL.
+            if len(out) >= limit and (not fill or pool >= _MAX_POOL):
+                return out
+            pool = min(self.count, pool * 8)
+
+    def semantic_search(self, query: str, category: Optional[str] = None, only_offers: bool = False,
+                        limit: int = 25) -> List[int]:
+        """Top-k por coseno, con coseno >= SEMANTIC_MIN_SCORE."""
+        scores = self.semantic_scores(query)
+        if scores is None:
+            return []
+        return [r for _, r in self._top(scores, category, only_offers, limit, semantic.SEMANTIC_MIN_SCORE,
+                                        semantic.SEMANTIC_PER_GROUP)]
+
+    def hybrid_search(self, query: str, category: Optional[str] = None, only_offers: bool = False,
+                      limit: int = 25, alpha: float = semantic.SEMANTIC_ALPHA) -> List[int]:
+        """
+        alpha * léxico + (1 - alpha) * coseno. Léxico: 1.0 si la consulta (sin
+        stopwords) está tal cual en el producto, el score fuzzy si no, 0 si ninguno.
+        """
+        pool = max(limit * 4, 50)
+        lexical: Dict[int, float] = {}
+        words = semantic.content_words(query)
+        if words:
+            lexical = {r: 1.0 for r in self.search(" ".join(words), category, only_offers, pool)}
+            # Sin fuzzy sobre palabras de intención: "tomar" no es un error de tipeo de "tomate"
+            typed = " ".join(w for w in words if not semantic.concept_terms(w))
+            if typed and len(lexical) < pool:
+                for sc, r in self.fuzzy_scored(typed, category, only_offers, pool):
+                    lexical.setdefault(r, sc)
+        scores = self.semantic_scores(query)
+        vector: Dict[int, float] = {}
+        if scores is not None:
+            vector = {r: sc for sc, r in self._top(scores, category, only_offers, pool, semantic.SEMANTIC_MIN_SCORE,
+                                                   semantic.SEMANTIC_PER_GROUP)}
+        ranked = []
+        for r in set(lexical) | set(vector):
+            cos = vector.get(r)
+            if cos is None and scores is not None:
+                cos = float(scores[r])
+            ranked.append((alpha * lexical.get(r, 0.0) + (1 - alpha) * (cos or 0.0), r))
+        ranked.sort(key=lambda t: (-t[0], t[1]))
+        return [r for _, r in self._vary(ranked, limit, semantic.SEMANTIC_PER_GROUP)[0]]
+
+
+@lru_cache(maxsize=4096)
+def _fold_cached(text: str) -> str:
+    return fold_text(text)
+
+
+class CatalogStore:
+    """Snapshot vigente para este proceso; sigue al puntero CURRENT."""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self._lock = threading.Lock()
+        self._snapshot: Optional[Snapshot] = None
+        self._name: Optional[str] = None
+        self._checked = 0.0
+
+    def current(self) -> Optional[Snapshot]:
+        if not CATALOG_SNAPSHOT_ENABLED:
+            return None
+        now = time.monotonic()
+        if now - self._checked < _CHECK_EVERY:
+            return self._snapshot
+        with self._lock:
+            self._checked = now
+            try:
+                name = (self.directory / "CURRENT").read_text(encoding="utf-8").strip()
+            except OSError:
+                return self._snapshot
+            if name != self._name:
+                try:
+                    # El viejo se desmapea cuando no quedan lecturas usándolo
+                    self._snapshot = Snapshot(self.directory / name)
+                    self._name = name
+                except (OSError, ValueError) as e:
+                    print(f"⚠️  No pude abrir el snapshot {name}: {e}")
+        return self._snapshot
+
+
+# -------------------------
+# Builder en background
+# -------------------------
+def live_stock(conn: sqlite3.Connection, rows: List[Dict[str, Any]], chunk: int = 500) -> List[Dict[str, Any]]:
+    """Pisa el stock de las filas del snapshot con el actual de products (por primary key)."""
+    ids = [r["id"] for r in rows]
+    stock: Dict[int, Optional[int]] = {}
+    for i in range(0, len(ids), chunk):
+        part = ids[i:i + chunk]
+        stock.update(conn.execute(
+            f"SELECT id, stock FROM products WHERE id IN ({','.join('?' * len(part))})", part
+        ).fetchall())
+    for r in rows:
+        if r["id"] in stock:
+            r["stock"] = stock[r["id"]]
+    return rows
+
+
+def catalog_version(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT version FROM catalog_meta WHERE id = 1").fetchone()
+    return row[0] if row else 0
+
+
+class SnapshotBuilder:
+    def __init__(self, connect: Callable[[], sqlite3.Connection], store: CatalogStore,
+                 should_build: Callable[[], bool] = lambda: True):
+        self._connect = connect
+        self.store = store
+        self._should_build = should_build
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_build = 0.0
+        self._key_cache: Dict[int, Any] = {}
+
+    def start(self):
+        if not CATALOG_SNAPSHOT_ENABLED or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="catalog-snapshot", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if self._should_build():
+                    self.build_if_stale()
+            except Exception as e:
+                SNAPSHOT_BUILDS.inc(status="error")
+                print(f"⚠️  Build del snapshot de catálogo falló: {e}")
+            self._stop.wait(CATALOG_SNAPSHOT_POLL)
+
+    def build_if_stale(self, force: bool = False) -> bool:
+        """
+        Sin ningún snapshot (primer arranque) arma uno sin esperar el intervalo
+        mínimo. Corre en el thread del builder: mientras tanto se atiende igual
+        y las búsquedas son solo por substring (X-Search-Degraded).
+        """
+        current = self.store.current()
+        if (not force and current is not None
+                and time.monotonic() - self._last_build < CATALOG_SNAPSHOT_MIN_INTERVAL):
+            return False
+        conn = self._connect()
+        try:
+            if not force and current is not None and current.version == catalog_version(conn):
+                return False
+            build_snapshot(conn, self.store.directory, self._key_cache)
+        finally:
+            conn.close()
+        self._last_build = time.monotonic()
+        self.store._checked = 0.0  # que este proceso vea el nuevo ya
+        return True
+
+
+# -------------------------
+# CLI
+# -------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Snapshot columnar del catálogo")
+    parser.add_argument("command", choices=["build", "info", "search"])
+    parser.add_argument("query", nargs="?", default="")
+    parser.add_argument("--db", type=Path, default=Path(os.getenv("RETAIL_DB_PATH", str(BASE_DIR / "retail.db"))))
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--mode", choices=["exact", "fuzzy", "semantic", "hybrid"], default="exact")
+    args = parser.parse_args()
+
+    directory = snapshot_dir(args.db)
+    if args.command == "build":
+        conn = sqlite3.connect(args.db)
+        build_snapshot(conn, directory)
+        conn.close()
+        return
+
+    snap = CatalogStore(directory).current()
+    if snap is None:
+        print(f"No hay snapshot en {directory} (python catalog_snapshot.py build)")
+        return
+    if args.command == "info":
+        size = snap.path.stat().st_size
+        print(f"{snap.path.name}: v{snap.version}, {snap.count} productos, {size / 1024 / 1024:.2f} MB, "
+              f"armado {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snap.built_at))}")
+        return
+    t0 = time.perf_counter()
+    search = {"exact": snap.search, "fuzzy": snap.fuzzy_search, "semantic": snap.semantic_search,
+              "hybrid": snap.hybrid_search}[args.mode]
+    hits = search(args.query, limit=args.limit)
+    elapsed = (time.perf_counter() - t0) * 1e6
+    for i in hits:
+        r = snap.row(i)
+        print(f"  #{r['id']:<7} {r['name']:<50} ${r['price']:>10.2f}  stock {r['stock']}")
+    print(f"{len(hits)} resultados en {elapsed:.0f} µs")
+
+
+if __name__ == "__main__":
+    main()
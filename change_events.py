@@ -0,0 +1,182 @@
+"""
+change_events.py
+Log de cambios (outbox transaccional): cada mutación de carritos, órdenes,
+catálogo y usuarios agrega una fila a change_events en la MISMA
+transacción que el cambio. Si la transacción hace rollback, el evento
+tampoco existe; si hace commit, el evento queda con un seq mayor que todos
+los anteriores.
+
+- seq: INTEGER PRIMARY KEY AUTOINCREMENT, nunca se reusa ni retrocede (una
+  base por tienda: la secuencia es por tienda).
+- entity / entity_id / action: "cart" 12 "item_added", "order" 7
+  "status_changed", "product" 3 "updated"...
+- payload: JSON con lo que cambió (estado nuevo y, si aplica, el anterior).
+
+Consumidores (dashboard, caches, exports): GET /events?after=<último seq
+visto> devuelve NDJSON en orden de seq; con wait=N espera hasta N segundos
+a que haya eventos nuevos (long polling). Guardan el último seq y retoman
+desde ahí: nada de re-escanear tablas.
+
+SQLite tiene un solo escritor a la vez: los commits salen en orden de seq y
+un lector nunca ve el 11 sin el 10, así que leer "seq > after" no saltea
+eventos.
+
+Config (env):
+- EVENTS_PAGE_SIZE        filas por lectura del stream (default 500)
+- EVENTS_MAX_WAIT         tope de ?wait= en segundos (default 30)
+- EVENTS_POLL_INTERVAL    cada cuánto mira la tabla mientras espera (default 0.5)
+- EVENTS_RETENTION_DAYS   el job prune_change_events borra los más viejos (default 30; 0 = no borra)
+
+Uso:
+    python change_events.py tail --after 0 --db retail.db
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import inventory
+import metrics
+
+BASE_DIR = Path(__file__).resolve().parent
+
+EVENTS_PAGE_SIZE = int(os.getenv("EVENTS_PAGE_SIZE", "500"))
+EVENTS_MAX_WAIT = float(os.getenv("EVENTS_MAX_WAIT", "30"))
+EVENTS_POLL_INTERVAL = float(os.getenv("EVENTS_POLL_INTERVAL", "0.5"))
+EVENTS_RETENTION_DAYS = float(os.getenv("EVENTS_RETENTION_DAYS", "30"))
+
+CHANGE_EVENTS = metrics.counter(
+    "change_events_total", "Eventos agregados al log de cambios", ("entity", "action")
+)
+
+
+# -------------------------
+# Escritura (dentro de la transacción del llamador)
+# -------------------------
+def record(conn: sqlite3.Connection, entity: str, entity_id: Optional[int], action: str, **payload) -> int:
+    """
+    Agrega un evento. NO hace commit: va en la transacción de la mutación.
+    Devuelve su seq.
+    """
+    cur = conn.execute(
+        "INSERT INTO change_events (entity, entity_id, action, payload) VALUES (?, ?, ?, ?)",
+        (entity, entity_id, action, json.dumps(payload, ensure_ascii=False, default=str)),
+    )
+    CHANGE_EVENTS.inc(entity=entity, action=action)
+    return cur.lastrowid
+
+
+# -------------------------
+# Lectura
+# -------------------------
+def _row(r) -> Dict[str, Any]:
+    return {
+        "seq": r[0],
+        "entity": r[1],
+        "entity_id": r[2],
+        "action": r[3],
+        "payload": json.loads(r[4]) if r[4] else {},
+        "created_at": r[5],
+    }
+
+
+def read_after(conn: sqlite3.Connection, after: int, limit: int = EVENTS_PAGE_SIZE,
+               entity: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Eventos con seq > after, en orden (búsqueda por PK)."""
+    sql = "SELECT seq, entity, entity_id, action, payload, created_at FROM change_events WHERE seq > ?"
+    params: List[Any] = [after]
+    if entity:
+        sql += " AND entity = ?"
+        params.append(entity)
+    sql += " ORDER BY seq LIMIT ?"
+    params.append(limit)
+    return [_row(r) for r in conn.execute(sql, params)]
+
+
+def last_seq(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT MAX(seq) FROM change_events").fetchone()
+    return row[0] or 0
+
+
+def stream(connect, after: int, limit: Optional[int] = None, wait: float = 0.0,
+           entity: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Recorre el log desde `after` en páginas de EVENTS_PAGE_SIZE (una conexión
+    por página: no retiene el pool mientras el cliente lee). Sin eventos
+    nuevos espera hasta `wait` segundos; termina al llegar a `limit` o al
+    quedar al día.
+    """
+    sent = 0
+    deadline = time.monotonic() + min(max(wait, 0.0), EVENTS_MAX_WAIT)
+    while limit is None or sent < limit:
+        page = EVENTS_PAGE_SIZE if limit is None else min(EVENTS_PAGE_SIZE, limit - sent)
+        with connect() as conn:
+            rows = read_after(conn, after, page, entity)
+        yield from rows
+        if rows:
+            sent += len(rows)
+            after = rows[-1]["seq"]
+            if len(rows) < page:
+                return  # al día
+        elif sent or time.monotonic() >= deadline:
+            return
+        else:
+            time.sleep(EVENTS_POLL_INTERVAL)
+
+
+# -------------------------
+# Retención (job)
+# -------------------------
+def prune(conn: sqlite3.Connection, max_seconds: float, pause: float, batch: int = 5000) -> Dict[str, Any]:
+    """Borra en lotes los eventos de más de EVENTS_RETENTION_DAYS días (el seq no se reusa)."""
+    deadline = time.monotonic() + max_seconds
+    deleted = 0
+    more = True
+    while time.monotonic() < deadline:
+        inventory.begin_write(conn)
+        n = conn.execute(
+            """
+            DELETE FROM change_events WHERE seq IN (
+                SELECT seq FROM change_events
+                WHERE created_at <= datetime('now', ?)
+                ORDER BY seq LIMIT ?
+            )
+            """,
+            (f"-{EVENTS_RETENTION_DAYS} days", batch),
+        ).rowcount
+        conn.commit()
+        deleted += n
+        if n < batch:
+            more = False
+            break
+        time.sleep(pause)
+    return {"deleted": deleted, "more": more}
+
+
+# -------------------------
+# CLI
+# -------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Log de cambios (change_events)")
+    parser.add_argument("command", choices=["tail"])
+    parser.add_argument("--after", type=int, default=0)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--entity")
+    parser.add_argument("--db", type=Path, default=Path(os.getenv("RETAIL_DB_PATH", str(BASE_DIR / "retail.db"))))
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        for ev in read_after(conn, args.after, args.limit, args.entity):
+            print(json.dumps(ev, ensure_ascii=False))
+        print(f"📜 último seq: {last_seq(conn)}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
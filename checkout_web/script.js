@@ -61,13 +61,45 @@
 
   document.querySelector(".card-right").appendChild(table);
 
-  // Botón demo
+  // Botón de pago: con pasarela configurada (?gateway=, ver payment_gateway_stub.py)
+  // le avisa el pago y la pasarela notifica al backoffice; si no, demo.
   const btnConfirm = document.getElementById("btn-confirm");
   const confirmationMsg = document.getElementById("confirmation-message");
+  const orderId = params.get("order_id");
+  const gateway = params.get("gateway");
+  const store = params.get("store");
 
-  btnConfirm.addEventListener("click", () => {
-    confirmationMsg.hidden = false;
+  if (params.get("status") && params.get("status") !== "pending") {
     btnConfirm.disabled = true;
-    btnConfirm.textContent = "Pedido confirmado (demo)";
+    btnConfirm.textContent = params.get("status") === "paid" ? "Pedido ya pagado" : "Pago rechazado";
+  }
+
+  btnConfirm.addEventListener("click", async () => {
+    btnConfirm.disabled = true;
+    if (!gateway || !orderId) {
+      confirmationMsg.hidden = false;
+      btnConfirm.textContent = "Pedido confirmado (demo)";
+      return;
+    }
+    btnConfirm.textContent = "Procesando pago...";
+    try {
+      const resp = await fetch(`${gateway.replace(/\/$/, "")}/pay`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ order_id: Number(orderId), amount: amountNumber, store: store }),
+      });
+      const data = await resp.json();
+      if (resp.ok && data.payment_status === "paid") {
+        confirmationMsg.hidden = false;
+        btnConfirm.textContent = "Pago aprobado";
+      } else {
+        btnConfirm.textContent = "No se pudo registrar el pago";
+        console.error("Respuesta de la pasarela:", data);
+      }
+    } catch (e) {
+      btnConfirm.disabled = false;
+      btnConfirm.textContent = "Reintentar pago";
+      console.error("Error llamando a la pasarela:", e);
+    }
   });
 })();
@@ -0,0 +1,165 @@
+"""
+db_instrumentation.py
+Conexión SQLite instrumentada: mide cada statement que ejecuta el backoffice.
+
+Uso:
+    sqlite3.connect(path, factory=InstrumentedConnection)
+
+Cada statement (execute / executemany / executescript, tanto desde la
+conexión como desde cursores) se cronometra y se notifica a los
+observers registrados con `add_statement_observer`. Por defecto se
+registran dos observers: uno emite un span "sql" en la traza activa y
+otro alimenta las métricas sqlite_* (ver metrics.py).
+"""
+
+import re
+import sqlite3
+import time
+from typing import Any, Callable, List, Optional
+
+import metrics
+import tracing
+
+# observer(sql, params, started_at, elapsed_seconds, error)
+StatementObserver = Callable[[str, Any, float, float, Optional[BaseException]], None]
+
+_observers: List[StatementObserver] = []
+
+
+def add_statement_observer(fn: StatementObserver):
+    if fn not in _observers:
+        _observers.append(fn)
+
+
+def _notify(sql: str, params: Any, started: float, elapsed: float, error: Optional[BaseException]):
+    for fn in _observers:
+        try:
+            fn(sql, params, started, elapsed, error)
+        except Exception as e:  # un observer roto no puede romper la query
+            print(f"⚠️  statement observer {getattr(fn, '__name__', fn)} falló: {e}")
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started, t0, error = time.time(), time.perf_counter(), None
+        try:
+            return super().execute(sql, parameters)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _notify(sql, parameters, started, time.perf_counter() - t0, error)
+
+    def executemany(self, sql, seq_of_parameters):
+        started, t0, error = time.time(), time.perf_counter(), None
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _notify(sql, None, started, time.perf_counter() - t0, error)
+
+    def executescript(self, sql_script):
+        started, t0, error = time.time(), time.perf_counter(), None
+        try:
+            return super().executescript(sql_script)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _notify(sql_script, None, started, time.perf_counter() - t0, error)
+
+
+SQLITE_CONNECTIONS_OPENED = metrics.counter("sqlite_connections_opened_total", "Conexiones SQLite abiertas")
+SQLITE_CONNECTIONS_OPEN = metrics.gauge("sqlite_connections_open", "Conexiones SQLite abiertas en este momento")
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    sqlite3.Connection.execute (C) no pasa por Cursor.execute de Python,
+    así que redirigimos los atajos de la conexión a un InstrumentedCursor.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._counted_open = True
+        SQLITE_CONNECTIONS_OPENED.inc()
+        SQLITE_CONNECTIONS_OPEN.inc()
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._release_gauge()
+
+    def __del__(self):
+        # `with get_connection()` no cierra: la conexión se libera con el GC
+        self._release_gauge()
+
+    def _release_gauge(self):
+        if getattr(self, "_counted_open", False):
+            self._counted_open = False
+            SQLITE_CONNECTIONS_OPEN.dec()
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+# -------------------------
+# Observer por defecto: spans "sql"
+# -------------------------
+_STATEMENT_TARGET = re.compile(
+    r"^\s*(SELECT|INSERT|UPDATE|DELETE|REPLACE|PRAGMA|CREATE|BEGIN|COMMIT|WITH)\b"
+    r"(?:.*?\b(?:FROM|INTO|UPDATE|TABLE)\s+([\w.]+))?",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def statement_label(sql: str) -> str:
+    """'SELECT ... FROM products ...' -> 'SELECT products' (nombre corto del span)."""
+    m = _STATEMENT_TARGET.match(sql or "")
+    if not m:
+        return "SQL"
+    op = m.group(1).upper()
+    return f"{op} {m.group(2)}" if m.group(2) else op
+
+
+def _trace_statement(sql, params, started, elapsed, error):
+    if tracing.current_trace_id() is None:
+        return
+    tracing.record_span(
+        statement_label(sql),
+        "sql",
+        started,
+        elapsed,
+        status="error" if error else "ok",
+    )
+
+
+SQLITE_QUERIES = metrics.counter("sqlite_queries_total", "Statements SQLite ejecutados", ("statement", "status"))
+SQLITE_QUERY_LATENCY = metrics.histogram(
+    "sqlite_query_duration_seconds",
+    "Latencia de statements SQLite",
+    ("statement",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+
+
+def _measure_statement(sql, params, started, elapsed, error):
+    label = statement_label(sql)
+    SQLITE_QUERIES.inc(statement=label, status="error" if error else "ok")
+    SQLITE_QUERY_LATENCY.observe(elapsed, statement=label)
+
+
+add_statement_observer(_trace_statement)
+add_statement_observer(_measure_statement)
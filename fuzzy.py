@@ -0,0 +1,150 @@
+"""
+fuzzy.py
+Búsqueda tolerante a errores de tipeo ("cerbeza" -> cerveza, "yerva" -> yerba).
+
+Índice de dos niveles que se arma junto con el snapshot del catálogo:
+- Vocabulario: palabras distintas (fold_text) de nombres y categorías.
+- Trigramas -> palabras del vocabulario (al estilo pg_trgm: "  w" ... "w ").
+- Palabra -> filas del catálogo donde aparece.
+
+Una palabra de la consulta se compara contra el vocabulario (miles de
+palabras, no 100k productos): candidatas por trigramas en común,
+similitud = comunes / (trigramas(q) + trigramas(w) - comunes), y filtro
+final por distancia de edición (Damerau-Levenshtein, con tope: 1 error
+hasta 4 letras, 2 desde 5).
+
+Config (env):
+- FUZZY_MIN_SIMILARITY   similitud de trigramas para aceptar por prefijo (default 0.3)
+- FUZZY_WORDS            palabras del vocabulario por palabra buscada (default 5)
+"""
+
+import os
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+FUZZY_MIN_SIMILARITY = float(os.getenv("FUZZY_MIN_SIMILARITY", "0.3"))
+FUZZY_WORDS = int(os.getenv("FUZZY_WORDS", "5"))
+
+
+def trigrams(word: str) -> List[int]:
+    """Trigramas distintos de la palabra, codificados como enteros (3 code points de 21 bits)."""
+    padded = f"  {word} "
+    grams = {padded[i:i + 3] for i in range(len(padded) - 2)}
+    return sorted((ord(g[0]) << 42) | (ord(g[1]) << 21) | ord(g[2]) for g in grams)
+
+
+def max_edits(word: str) -> int:
+    return 1 if len(word) <= 4 else 2
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Distancia de edición con transposiciones ("paaps" -> "papas" = 1), con
+    corte: devuelve limit + 1 apenas se pasa.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i] + [0] * len(b)
+        best = i
+        for j, cb in enumerate(b, 1):
+            d = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb))
+            if prev2 is not None and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                d = min(d, prev2[j - 2] + 1)
+            cur[j] = d
+            if d < best:
+                best = d
+        if best > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+def _postings(mapping: Dict[int, List[int]], n_keys: int = None):
+    """dict clave -> lista de ints => (claves ordenadas, offsets, postings) como arrays."""
+    keys = array("Q", sorted(mapping)) if n_keys is None else None
+    offsets = array("Q", [0])
+    postings = array("I")
+    for k in (keys if keys is not None else range(n_keys)):
+        postings.extend(mapping.get(k, ()))
+        offsets.append(len(postings))
+    return keys, offsets, postings
+
+
+def build_index(texts: Iterable[str]):
+    """
+    texts: texto ya normalizado (fold_text) por fila.
+    Devuelve columnas para el snapshot: vocab (lista de str) y arrays
+    gram_keys/gram_offsets/gram_words, word_grams, word_offsets/word_rows.
+    """
+    word_ids: Dict[str, int] = {}
+    rows_by_word: Dict[int, List[int]] = {}
+    for row, text in enumerate(texts):
+        for w in set(text.split()):
+            if len(w) < 2:
+                continue
+            wid = word_ids.setdefault(w, len(word_ids))
+            rows_by_word.setdefault(wid, []).append(row)
+
+    # Vocabulario ordenado alfabéticamente (ids estables entre builds iguales)
+    vocab = sorted(word_ids)
+    remap = {word_ids[w]: i for i, w in enumerate(vocab)}
+    rows_by_word = {remap[k]: sorted(v) for k, v in rows_by_word.items()}
+
+    words_by_gram: Dict[int, List[int]] = {}
+    word_grams = array("H")
+    for wid, w in enumerate(vocab):
+        grams = trigrams(w)
+        word_grams.append(min(len(grams), 65535))
+        for g in grams:
+            words_by_gram.setdefault(g, []).append(wid)
+
+    gram_keys, gram_offsets, gram_words = _postings(words_by_gram)
+    _, word_offsets, word_rows = _postings(rows_by_word, len(vocab))
+    return {
+        "vocab": vocab,
+        "gram_keys": gram_keys,
+        "gram_offsets": gram_offsets,
+        "gram_words": gram_words,
+        "word_grams": word_grams,
+        "word_offsets": word_offsets,
+        "word_rows": word_rows,
+    }
+
+
+def similar_words(word: str, vocab_word, gram_keys: Sequence[int], gram_offsets: Sequence[int],
+                  gram_words: Sequence[int], word_grams: Sequence[int],
+                  limit: int = FUZZY_WORDS) -> List[Tuple[int, float]]:
+    """
+    Palabras del vocabulario parecidas a `word`: [(word_id, score)], mejor primero.
+    vocab_word(i) devuelve el texto de la palabra i.
+    """
+    grams = trigrams(word)
+    shared: Dict[int, int] = {}
+    for g in grams:
+        i = bisect_left(gram_keys, g)
+        if i < len(gram_keys) and gram_keys[i] == g:
+            for wid in gram_words[gram_offsets[i]:gram_offsets[i + 1]]:
+                shared[wid] = shared.get(wid, 0) + 1
+
+    limit_edits = max_edits(word)
+    out = []
+    for wid, common in shared.items():
+        sim = common / (len(grams) + word_grams[wid] - common)
+        candidate = vocab_word(wid)
+        # Palabras cortas con letras cambiadas comparten pocos trigramas: ahí decide
+        # la distancia de edición. Con similitud alta alcanza con prefijo
+        # ("fideo" -> "fideos", "cerv" -> "cerveza").
+        if sim < FUZZY_MIN_SIMILARITY and abs(len(candidate) - len(word)) > limit_edits:
+            continue
+        dist = edit_distance(word, candidate, limit_edits)
+        prefix = sim >= FUZZY_MIN_SIMILARITY and len(word) >= 3 and candidate.startswith(word)
+        if dist > limit_edits and not prefix:
+            continue
+        score = (sim + 1 - min(dist, limit_edits + 1) / max(len(word), len(candidate))) / 2
+        out.append((wid, score))
+    out.sort(key=lambda t: -t[1])
+    return out[:limit]
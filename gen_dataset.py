@@ -0,0 +1,430 @@
+"""
+gen_dataset.py
+Generador de datos sintéticos (realistas) para probar el backoffice a escala.
+
+Carga masivamente las tablas de schema.sql:
+
+- users:      nombres con acentos, emails únicos y teléfonos argentinos en
+              los formatos que aparecen en la vida real (+54 9 11 ..., 011 15-...,
+              (0351) 15 ..., sin prefijo, etc.).
+- products:   catálogo de N SKUs armado con tipo + marca + variante + tamaño,
+              por categoría, con ofertas y stock.
+- carts / cart_items / orders: carritos abiertos, abandonados y cerrados
+              (estos con su orden), con popularidad sesgada (Zipf) tanto de
+              productos como de clientes.
+
+Todo va con executemany en bloques, PRAGMAs de carga masiva e ids explícitos,
+así una base de ~10M filas se arma en minutos.
+
+Uso:
+    python gen_dataset.py --out retail_big.db --users 2000000 --products 100000 --carts 2000000
+    python gen_dataset.py --out retail_small.db --users 10000 --products 2000 --carts 20000 --product-skew 1.2
+    RETAIL_DB_PATH=retail_big.db uvicorn backoffice_app:app --port 8000
+"""
+
+import argparse
+import bisect
+import itertools
+import random
+import sqlite3
+import time
+import unicodedata
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+
+from normalization import fold_text, normalize_phone
+
+BASE_DIR = Path(__file__).resolve().parent
+SCHEMA_PATH = BASE_DIR / "schema.sql"
+
+# -------------------------
+# Vocabulario
+# -------------------------
+FIRST_NAMES = [
+    "Juan", "María", "José", "Lucía", "Martín", "Sofía", "Matías", "Valentina", "Agustín", "Camila",
+    "Nicolás", "Julieta", "Tomás", "Florencia", "Joaquín", "Micaela", "Santiago", "Agustina", "Facundo",
+    "Rocío", "Lautaro", "Milagros", "Ramón", "Inés", "Sebastián", "Belén", "Andrés", "Mónica", "Héctor",
+    "Verónica", "Germán", "Noelia", "Iván", "Marisa", "Óscar", "Ángeles", "Raúl", "Pilar", "Damián", "Eugenia",
+]
+LAST_NAMES = [
+    "González", "Rodríguez", "Gómez", "Fernández", "López", "Díaz", "Martínez", "Pérez", "García",
+    "Sánchez", "Romero", "Sosa", "Álvarez", "Torres", "Ruiz", "Ramírez", "Flores", "Benítez", "Acosta",
+    "Medina", "Herrera", "Suárez", "Aguirre", "Giménez", "Gutiérrez", "Pereyra", "Rojas", "Molina",
+    "Castro", "Ortiz", "Núñez", "Domínguez", "Peña", "Muñoz", "Ibáñez", "Cáceres", "Ríos", "Ledesma",
+]
+SEGMENTS = ["nuevo", "ocasional", "frecuente", "recuperar"]
+EMAIL_DOMAINS = ["gmail.com", "hotmail.com", "yahoo.com.ar", "outlook.com", "live.com.ar", "fibertel.com.ar"]
+
+# código de área -> dígitos del abonado (área + abonado = 10 dígitos)
+AREA_CODES = [("11", 8), ("351", 7), ("341", 7), ("261", 7), ("221", 7), ("381", 7), ("223", 7), ("387", 7), ("2944", 6)]
+AREA_WEIGHTS = [45, 10, 9, 7, 7, 6, 6, 5, 5]
+
+CATALOG = {
+    "Almacén": [("Arroz largo fino", ["1Kg", "500g"]), ("Fideos spaghetti", ["500g", "1Kg"]),
+                ("Yerba mate", ["500g", "1Kg", "2Kg"]), ("Aceite de girasol", ["900ml", "1.5L"]),
+                ("Azúcar común", ["1Kg"]), ("Harina 0000", ["1Kg"]), ("Café molido", ["250g", "500g"]),
+                ("Puré de tomate", ["520g"]), ("Lentejas", ["400g"]), ("Atún en aceite", ["170g"])],
+    "Lácteos": [("Leche entera", ["1L"]), ("Leche descremada", ["1L"]), ("Yogur bebible", ["1L", "200g"]),
+                ("Queso cremoso", ["500g", "1Kg"]), ("Manteca", ["100g", "200g"]), ("Dulce de leche", ["400g", "1Kg"])],
+    "Bebidas": [("Gaseosa cola", ["500ml", "1.5L", "2.25L"]), ("Agua mineral", ["500ml", "1.5L", "6L"]),
+                ("Cerveza rubia", ["473ml", "1L"]), ("Jugo de naranja", ["1L"]), ("Vino tinto Malbec", ["750ml"]),
+                ("Fernet", ["750ml", "1L"])],
+    "Panificados": [("Pan lactal", ["350g", "550g"]), ("Pan francés", ["x6", "x12"]), ("Galletitas de agua", ["300g"]),
+                    ("Medialunas", ["x6", "x12"]), ("Budín de limón", ["250g"])],
+    "Limpieza": [("Lavandina", ["1L", "2L"]), ("Detergente", ["500ml", "750ml"]), ("Jabón en polvo", ["800g", "3Kg"]),
+                 ("Limpiador multiuso", ["900ml"]), ("Esponja", ["x3"])],
+    "Higiene Personal": [("Shampoo", ["400ml", "750ml"]), ("Acondicionador", ["400ml"]), ("Jabón de tocador", ["x3"]),
+                         ("Pasta dental", ["90g"]), ("Desodorante", ["150ml"]), ("Papel higiénico", ["x4", "x12"])],
+    "Carnes": [("Milanesa de nalga", ["1Kg"]), ("Asado de tira", ["1Kg"]), ("Pechuga de pollo", ["1Kg"]),
+               ("Carne picada común", ["500g", "1Kg"]), ("Chorizo parrillero", ["x4"])],
+    "Verduras": [("Papa", ["1Kg", "3Kg"]), ("Cebolla", ["1Kg"]), ("Tomate perita", ["1Kg"]), ("Zapallo anco", ["1Kg"]),
+                 ("Lechuga criolla", ["unidad"])],
+    "Frutas": [("Manzana roja", ["1Kg"]), ("Banana Ecuador", ["1Kg"]), ("Naranja para jugo", ["2Kg"]), ("Limón", ["500g"])],
+    "Congelados": [("Hamburguesas", ["x4", "x12"]), ("Papas bastón", ["1Kg"]), ("Helado de dulce de leche", ["1Kg"]),
+                   ("Empanadas de carne", ["x12"])],
+    "Snacks": [("Papas fritas", ["80g", "250g"]), ("Maní salado", ["120g"]), ("Alfajor triple", ["unidad", "x6"]),
+               ("Chocolate con leche", ["100g"])],
+    "Bebés": [("Pañales", ["talle M x36", "talle G x32", "talle XG x30"]), ("Toallitas húmedas", ["x50"]),
+              ("Leche de fórmula", ["800g"])],
+}
+BRANDS = [
+    "La Serenísima", "Sancor", "Marolio", "Arcor", "Molinos", "Taragüí", "Cañuelas", "Ledesma", "Paty",
+    "Quilmes", "Villavicencio", "Cif", "Ayudín", "Dove", "Colgate", "Granja del Sol", "Bagley", "Cagnoli",
+    "Don Satur", "Mamá Cocina", "Patagonia", "Nevares", "Gallo", "Lucchetti", "Natura", "Bimbo",
+]
+VARIANTS = ["", "clásico", "light", "sin TACC", "orgánico", "familiar", "premium", "económico", "x2", "zero"]
+
+
+# -------------------------
+# Distribuciones
+# -------------------------
+def zipf_cum_weights(n: int, s: float):
+    """Pesos acumulados para elegir el rank r (0..n-1) con probabilidad ∝ 1/(r+1)^s."""
+    total, cum = 0.0, []
+    for r in range(1, n + 1):
+        total += 1.0 / (r ** s) if s else 1.0
+        cum.append(total)
+    return cum
+
+
+class Weighted:
+    """Elección ponderada precalculada (rng.choices recalcula todo en cada llamada)."""
+
+    def __init__(self, values, weights):
+        self.values = list(values)
+        self.cum = list(itertools.accumulate(weights))
+        self.total = self.cum[-1]
+
+    def __call__(self, rng: random.Random):
+        return self.values[bisect.bisect_right(self.cum, rng.random() * self.total)]
+
+
+class ZipfPicker:
+    """
+    Elige ids 1..n con popularidad sesgada. El rank se mapea a ids
+    permutados, así los "populares" no son siempre los primeros ids.
+    """
+
+    def __init__(self, rng: random.Random, n: int, s: float):
+        self.rng = rng
+        self.cum = zipf_cum_weights(n, s)
+        self.ids = list(range(1, n + 1))
+        rng.shuffle(self.ids)
+        self._buffer = []
+
+    def pick(self) -> int:
+        if not self._buffer:
+            ranks = self.rng.choices(range(len(self.ids)), cum_weights=self.cum, k=4096)
+            self._buffer = [self.ids[r] for r in ranks]
+        return self._buffer.pop()
+
+
+def ascii_fold(text: str) -> str:
+    return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+
+
+@lru_cache(maxsize=None)
+def _ts(start: datetime, minutes: int) -> str:
+    return (start + timedelta(minutes=minutes)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+_pick_area = Weighted(AREA_CODES, AREA_WEIGHTS)
+_pick_segment = Weighted(SEGMENTS, [40, 30, 20, 10])
+_pick_qty = Weighted([1, 2, 3, 4, 6], [60, 20, 10, 5, 5])
+_pick_payment = Weighted(["paid", "pending", "failed"], [70, 22, 8])
+
+
+def argentine_phone(rng: random.Random) -> str:
+    """Celular argentino en alguno de los formatos habituales (mismo número, distinta escritura)."""
+    area, digits = _pick_area(rng)
+    number = f"{rng.randrange(10 ** (digits - 1) * 2, 10 ** digits):0{digits}d}"
+    head, tail = number[:-4], number[-4:]
+    fmt = rng.random()
+    if fmt < 0.35:
+        return f"+549{area}{number}"                  # +5491122223333 (WhatsApp / E.164)
+    if fmt < 0.50:
+        return f"549{area}{number}"                   # 5491122223333
+    if fmt < 0.62:
+        return f"+54 9 {area} {head}-{tail}"          # +54 9 11 2222-3333
+    if fmt < 0.74:
+        return f"0{area} 15-{head}-{tail}"            # 011 15-2222-3333
+    if fmt < 0.84:
+        return f"(0{area}) 15 {head} {tail}"          # (0351) 15 555 1234
+    if fmt < 0.94:
+        return f"{area}{number}"                      # 1122223333
+    return f"15{head}-{tail}"                         # 152222-3333 (sin característica)
+
+
+# -------------------------
+# Generadores de filas
+# -------------------------
+def gen_users(rng: random.Random, start_id: int, n: int, start_date: datetime, days: int):
+    for i in range(start_id, start_id + n):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        if rng.random() < 0.2:
+            last = f"{last} {rng.choice(LAST_NAMES)}"
+        email_local = ascii_fold(f"{first}.{last}".lower()).replace(" ", "")
+        phone = argentine_phone(rng) if rng.random() < 0.95 else None
+        yield (
+            i,
+            f"{first} {last}",
+            fold_text(f"{first} {last}"),
+            f"{email_local}{i}@{rng.choice(EMAIL_DOMAINS)}",
+            phone,
+            normalize_phone(phone),
+            _pick_segment(rng),
+            _ts(start_date, rng.randrange(days * 1440)),
+        )
+
+
+def gen_products(rng: random.Random, start_id: int, n: int, offer_ratio: float):
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    base = [(cat, name, sizes) for cat, items in CATALOG.items() for name, sizes in items]
+    for i in range(start_id, start_id + n):
+        cat, name, sizes = base[i % len(base)]
+        brand = BRANDS[(i // len(base)) % len(BRANDS)]
+        variant = VARIANTS[(i // (len(base) * len(BRANDS))) % len(VARIANTS)]
+        size = sizes[i % len(sizes)]
+        full = " ".join(p for p in (name, brand, variant, size) if p)
+        yield (
+            i,
+            f"SKU{i:08d}",
+            full,
+            cat,
+            f"{name} {brand} {size}".strip(),
+            round(rng.lognormvariate(7.2, 0.6), 2),   # mediana ~ $1340
+            int(rng.random() < offer_ratio),
+            _stock(rng),
+            now,
+        )
+
+
+def _stock(rng: random.Random) -> int:
+    r = rng.random()
+    if r < 0.05:
+        return 0                       # sin stock
+    if r < 0.30:
+        return rng.randint(1, 20)      # stock bajo
+    return rng.randint(20, 500)
+
+
+def gen_carts(rng, start_id, n, users: ZipfPicker, products: ZipfPicker, prices, args, start_date):
+    """Devuelve tuplas (cart, [items], order|None) para que los tres INSERT queden consistentes."""
+    pick_status = Weighted(
+        ["open", "abandoned", "checked_out"],
+        [args.open_ratio, args.abandoned_ratio, max(0.0, 1 - args.open_ratio - args.abandoned_ratio)],
+    )
+    window = args.days * 1440
+    item_id = args._next_item_id
+    order_id = args._next_order_id
+    for cart_id in range(start_id, start_id + n):
+        user_id = users.pick()
+        status = pick_status(rng)
+        created = rng.randrange(window)
+        created_s, updated_s = _ts(start_date, created), _ts(start_date, created + rng.randint(1, 180))
+
+        n_items = max(1, min(40, int(rng.expovariate(1 / args.items_per_cart)) + 1))
+        seen, items, total = set(), [], 0.0
+        for _ in range(n_items):
+            pid = products.pick()
+            if pid in seen:
+                continue
+            seen.add(pid)
+            qty = _pick_qty(rng)
+            price = prices[pid - 1]
+            items.append((item_id, cart_id, pid, qty, price))
+            item_id += 1
+            total += qty * price
+
+        order = None
+        if status == "checked_out":
+            order = (order_id, user_id, cart_id, round(total, 2), _pick_payment(rng), updated_s)
+            order_id += 1
+        yield (cart_id, user_id, status, created_s, updated_s), items, order
+    args._next_item_id = item_id
+    args._next_order_id = order_id
+
+
+# -------------------------
+# Carga masiva
+# -------------------------
+def bulk_pragmas(conn: sqlite3.Connection):
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA locking_mode = EXCLUSIVE")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -262144")  # 256 MB
+    conn.execute("PRAGMA foreign_keys = OFF")
+
+
+def insert_chunks(conn, sql: str, rows, chunk: int, label: str, total: int):
+    done, t0 = 0, time.perf_counter()
+    while True:
+        batch = list(itertools.islice(rows, chunk))
+        if not batch:
+            break
+        conn.executemany(sql, batch)
+        done += len(batch)
+        _progress(label, done, total, t0)
+    conn.commit()
+    _progress(label, done, total, t0, end=True)
+
+
+def _progress(label, done, total, t0, end=False):
+    elapsed = time.perf_counter() - t0
+    rate = done / elapsed if elapsed else 0
+    print(f"\r   {label:<10} {done:>11,}/{total:,}  ({rate:,.0f} filas/s)", end="\n" if end else "", flush=True)
+
+
+@contextmanager
+def deferred_users_fts(conn: sqlite3.Connection):
+    """
+    Carga de users sin los triggers de users_fts: con ellos cada fila paga
+    su INSERT en el índice de trigramas (~6x más lento). Se sacan, se carga,
+    se reconstruye el índice de una vez y se vuelven a crear tal cual estaban.
+    """
+    triggers = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg_users_fts_%'"
+    ).fetchall()
+    for name, _ in triggers:
+        conn.execute(f"DROP TRIGGER {name}")
+    try:
+        yield
+    finally:
+        conn.execute("INSERT INTO users_fts(users_fts) VALUES ('rebuild')")
+        for _, sql in triggers:
+            conn.execute(sql)
+        conn.commit()
+
+
+def _next_id(conn, table: str) -> int:
+    return (conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0] or 0) + 1
+
+
+def build(args):
+    out = Path(args.out)
+    if out.exists() and not args.append:
+        raise SystemExit(f"❌ {out} ya existe (usá --append para sumar filas o borralo)")
+
+    rng = random.Random(args.seed)
+    start_date = (datetime.now() - timedelta(days=args.days)).replace(second=0, microsecond=0)
+    conn = sqlite3.connect(out)
+    conn.executescript(SCHEMA_PATH.read_text(encoding="utf-8"))
+    bulk_pragmas(conn)
+
+    t0 = time.perf_counter()
+    print(f"🏗️  Generando en {out}")
+
+    first_user = _next_id(conn, "users")
+    with deferred_users_fts(conn):
+        insert_chunks(
+            conn,
+            "INSERT INTO users (id, name, name_fold, email, phone, phone_norm, segment, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            gen_users(rng, first_user, args.users, start_date, args.days),
+            args.chunk, "users", args.users,
+        )
+
+    first_product = _next_id(conn, "products")
+    insert_chunks(
+        conn,
+        "INSERT INTO products (id, sku, name, category, description, price, is_offer, stock, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        gen_products(rng, first_product, args.products, args.offer_ratio),
+        args.chunk, "products", args.products,
+    )
+
+    if args.carts:
+        n_users = first_user + args.users - 1
+        n_products = first_product + args.products - 1
+        prices = [r[0] for r in conn.execute("SELECT price FROM products ORDER BY id")]
+        if len(prices) != n_products:
+            # ids con huecos (bases previas): indexamos por id
+            price_by_id = dict(conn.execute("SELECT id, price FROM products"))
+            prices = [price_by_id.get(i, 0.0) for i in range(1, n_products + 1)]
+        users = ZipfPicker(rng, n_users, args.user_skew)
+        products = ZipfPicker(rng, n_products, args.product_skew)
+        args._next_item_id = _next_id(conn, "cart_items")
+        args._next_order_id = _next_id(conn, "orders")
+
+        rows = gen_carts(rng, _next_id(conn, "carts"), args.carts, users, products, prices, args, start_date)
+        done, items_done, orders_done, t1 = 0, 0, 0, time.perf_counter()
+        while True:
+            batch = list(itertools.islice(rows, args.chunk))
+            if not batch:
+                break
+            conn.executemany(
+                "INSERT INTO carts (id, user_id, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [c for c, _, _ in batch],
+            )
+            items = [it for _, its, _ in batch for it in its]
+            conn.executemany(
+                "INSERT INTO cart_items (id, cart_id, product_id, quantity, unit_price) VALUES (?, ?, ?, ?, ?)",
+                items,
+            )
+            orders = [o for _, _, o in batch if o]
+            conn.executemany(
+                "INSERT INTO orders (id, user_id, cart_id, total, payment_status, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                orders,
+            )
+            done += len(batch)
+            items_done += len(items)
+            orders_done += len(orders)
+            _progress("carts", done, args.carts, t1)
+        conn.commit()
+        _progress("carts", done, args.carts, t1, end=True)
+        print(f"   cart_items {items_done:>11,}   orders {orders_done:,}")
+
+    print("🧹 ANALYZE")
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+
+    size_mb = out.stat().st_size / (1024 * 1024)
+    print(f"✅ Listo en {time.perf_counter() - t0:.1f} s  ({size_mb:,.0f} MB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera una base retail sintética para pruebas de escala")
+    parser.add_argument("--out", default="retail_big.db")
+    parser.add_argument("--append", action="store_true", help="sumar filas a una base existente")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--carts", type=int, default=1_000_000)
+    parser.add_argument("--items-per-cart", type=float, default=4.0, help="media de ítems por carrito")
+    parser.add_argument("--open-ratio", type=float, default=0.15, help="fracción de carritos abiertos")
+    parser.add_argument("--abandoned-ratio", type=float, default=0.10, help="fracción de carritos abandonados")
+    parser.add_argument("--offer-ratio", type=float, default=0.10, help="fracción de productos en oferta")
+    parser.add_argument("--product-skew", type=float, default=1.0, help="exponente Zipf de popularidad de productos (0 = uniforme)")
+    parser.add_argument("--user-skew", type=float, default=0.8, help="exponente Zipf de actividad de clientes (0 = uniforme)")
+    parser.add_argument("--days", type=int, default=365, help="ventana de fechas hacia atrás")
+    parser.add_argument("--chunk", type=int, default=50_000, help="filas por executemany")
+    parser.add_argument("--seed", type=int, default=42)
+    build(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+inventory.py
+Reservas de stock atómicas para carritos y checkout.
+
+Modelo:
+- `products.stock` es el stock disponible para prometer (ya descontadas
+  las reservas). NULL = sin control de stock (ilimitado, como antes).
+- Agregar al carrito reserva: `UPDATE products SET stock = stock - ?
+  WHERE id = ? AND stock >= ?` dentro de una transacción de escritura
+  corta (BEGIN IMMEDIATE). Si no afecta filas, no hay stock: nunca se
+  promete la misma unidad a dos carritos.
+- Cada reserva vive en `stock_reservations` (una fila por carrito y
+  producto) con vencimiento (STOCK_RESERVATION_TTL_MIN). Cada add_item
+  renueva el vencimiento de todo el carrito.
+- Vaciar / borrar el carrito o el vencimiento devuelven el stock.
+- El checkout confirma las reservas (status 'committed'); si alguna venció,
+  intenta reservar de nuevo y, si no alcanza, el checkout falla sin tocar nada.
+- Si el pago de la orden falla (payments.py), las reservas confirmadas
+  devuelven el stock y quedan 'released'. Si el admin la saca de failed,
+  se vuelven a tomar (reclaim_order) o el cambio no se hace.
+
+Todas las funciones reciben una conexión y corren dentro de la
+transacción del llamador (ver `begin_write`).
+
+Config (env):
+- STOCK_RESERVATION_TTL_MIN   minutos que un carrito abierto retiene el stock (default 30)
+- STOCK_RELEASE_BATCH         reservas vencidas liberadas por pasada (default 500)
+"""
+
+import os
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple
+
+import metrics
+
+STOCK_RESERVATION_TTL_MIN = int(os.getenv("STOCK_RESERVATION_TTL_MIN", "30"))
+STOCK_RELEASE_BATCH = int(os.getenv("STOCK_RELEASE_BATCH", "500"))
+
+STOCK_RESERVATIONS = metrics.counter(
+    "stock_reservations_total", "Intentos de reserva de stock", ("result",)
+)
+STOCK_RELEASED_UNITS = metrics.counter(
+    "stock_released_units_total", "Unidades de stock devueltas por reservas liberadas", ("reason",)
+)
+
+_TTL = f"+{STOCK_RESERVATION_TTL_MIN} minutes"
+
+
+def begin_write(conn: sqlite3.Connection):
+    """
+    Abre la transacción de escritura ya con el lock tomado (BEGIN IMMEDIATE):
+    evita que dos lectores "suban" a escritor a la vez y uno falle con
+    SQLITE_BUSY a mitad de camino. Se cierra con conn.commit() / rollback().
+    """
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+
+
+# -------------------------
+# Reserva
+# -------------------------
+def reserve(conn: sqlite3.Connection, cart_id: int, product_id: int, quantity: int) -> Tuple[bool, Optional[int]]:
+    """
+    Descuenta `quantity` del stock disponible y lo anota a nombre del carrito.
+    Devuelve (ok, stock_disponible_actual). Con ok=False no se modificó nada.
+    """
+    cur = conn.execute(
+        "UPDATE products SET stock = stock - ? WHERE id = ? AND (stock IS NULL OR stock >= ?)",
+        (quantity, product_id, quantity),
+    )
+    if cur.rowcount == 0:
+        STOCK_RESERVATIONS.inc(result="out_of_stock")
+        row = conn.execute("SELECT stock FROM products WHERE id = ?", (product_id,)).fetchone()
+        return False, (row[0] if row else 0)
+
+    conn.execute(
+        f"""
+        INSERT INTO stock_reservations (cart_id, product_id, quantity, status, expires_at)
+        VALUES (?, ?, ?, 'held', datetime('now', '{_TTL}'))
+        ON CONFLICT(cart_id, product_id) DO UPDATE SET
+            quantity = stock_reservations.quantity + excluded.quantity,
+            status = 'held',
+            expires_at = excluded.expires_at,
+            updated_at = CURRENT_TIMESTAMP
+        """,
+        (cart_id, product_id, quantity),
+    )
+    STOCK_RESERVATIONS.inc(result="reserved")
+    row = conn.execute("SELECT stock FROM products WHERE id = ?", (product_id,)).fetchone()
+    return True, row[0]
+
+
+def touch_cart(conn: sqlite3.Connection, cart_id: int):
+    """Renueva el vencimiento de las reservas del carrito (hay actividad)."""
+    conn.execute(
+        f"""
+        UPDATE stock_reservations
+        SET expires_at = datetime('now', '{_TTL}'), updated_at = CURRENT_TIMESTAMP
+        WHERE cart_id = ? AND status = 'held'
+        """,
+        (cart_id,),
+    )
+
+
+def held_units(conn: sqlite3.Connection, product_id: int) -> int:
+    """Unidades retenidas por carritos abiertos (ya descontadas de products.stock)."""
+    row = conn.execute(
+        "SELECT COALESCE(SUM(quantity), 0) FROM stock_reservations WHERE product_id = ? AND status = 'held'",
+        (product_id,),
+    ).fetchone()
+    return row[0]
+
+
+# -------------------------
+# Liberación
+# -------------------------
+def _restock(conn: sqlite3.Connection, rows, reason: str) -> int:
+    """rows: (reservation_id, product_id, quantity). Devuelve el stock y borra las reservas."""
+    if not rows:
+        return 0
+    conn.executemany(
+        "UPDATE products SET stock = stock + ? WHERE id = ?",
+        [(r[2], r[1]) for r in rows],
+    )
+    conn.executemany("DELETE FROM stock_reservations WHERE id = ?", [(r[0],) for r in rows])
+    units = sum(r[2] for r in rows)
+    STOCK_RELEASED_UNITS.inc(units, reason=reason)
+    return units
+
+
+def release_cart(conn: sqlite3.Connection, cart_id: int, reason: str = "cleared") -> int:
+    """Devuelve al stock todo lo retenido por el carrito. Devuelve las unidades liberadas."""
+    rows = conn.execute(
+        "SELECT id, product_id, quantity FROM stock_reservations WHERE cart_id = ? AND status = 'held'",
+        (cart_id,),
+    ).fetchall()
+    return _restock(conn, rows, reason)
+
+
+def release_order(conn: sqlite3.Connection, cart_id: int, reason: str = "payment_failed") -> List[Dict[str, int]]:
+    """
+    Devuelve al stock lo confirmado por el checkout del carrito (orden que no
+    se va a pagar) y deja las reservas en 'released'. Devuelve lo liberado.
+    """
+    rows = conn.execute(
+        "SELECT id, product_id, quantity FROM stock_reservations WHERE cart_id = ? AND status = 'committed'",
+        (cart_id,),
+    ).fetchall()
+    if not rows:
+        return []
+    conn.executemany(
+        "UPDATE products SET stock = stock + ? WHERE id = ?",
+        [(r[2], r[1]) for r in rows],
+    )
+    conn.executemany(
+        "UPDATE stock_reservations SET status = 'released', updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+        [(r[0],) for r in rows],
+    )
+    STOCK_RELEASED_UNITS.inc(sum(r[2] for r in rows), reason=reason)
+    return [{"product_id": r[1], "quantity": r[2]} for r in rows]
+
+
+def reclaim_order(conn: sqlite3.Connection, cart_id: int) -> Tuple[List[Dict[str, int]], List[Dict[str, Any]]]:
+    """
+    Inverso de release_order: vuelve a descontar lo liberado y confirma las
+    reservas. Devuelve (tomado, faltantes); con faltantes el llamador debe
+    hacer rollback (puede haber descontado parte).
+    """
+    rows = conn.execute(
+        """
+        SELECT r.id, r.product_id, r.quantity, p.name
+        FROM stock_reservations r JOIN products p ON p.id = r.product_id
+        WHERE r.cart_id = ? AND r.status = 'released'
+        """,
+        (cart_id,),
+    ).fetchall()
+    taken, shortages = [], []
+    for reservation_id, product_id, quantity, name in rows:
+        cur = conn.execute(
+            "UPDATE products SET stock = stock - ? WHERE id = ? AND (stock IS NULL OR stock >= ?)",
+            (quantity, product_id, quantity),
+        )
+        if cur.rowcount == 0:
+            available = conn.execute("SELECT stock FROM products WHERE id = ?", (product_id,)).fetchone()[0]
+            shortages.append({"product_id": product_id, "name": name, "requested": quantity, "available": available})
+            continue
+        conn.execute(
+            "UPDATE stock_reservations SET status = 'committed', updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (reservation_id,),
+        )
+        taken.append({"product_id": product_id, "quantity": quantity})
+    return taken, shortages
+
+
+def release_expired(conn: sqlite3.Connection, limit: int = STOCK_RELEASE_BATCH) -> int:
+    """
+    Libera hasta `limit` reservas vencidas (lote acotado: no retiene el lock
+    de escritura mucho tiempo). Devuelve las unidades devueltas al stock.
+    Los ítems quedan en el carrito: el checkout intenta reservarlos de nuevo.
+    """
+    rows = conn.execute(
+        """
+        SELECT id, product_id, quantity
+        FROM stock_reservations
+        WHERE status = 'held' AND expires_at <= datetime('now')
+        LIMIT ?
+        """,
+        (limit,),
+    ).fetchall()
+    return _restock(conn, rows, "expired")
+
+
+# -------------------------
+# Checkout
+# -------------------------
+def commit_cart(conn: sqlite3.Connection, cart_id: int) -> List[Dict[str, Any]]:
+    """
+    Alinea las reservas con los ítems del carrito y las confirma.
+    Ítems sin reserva (vencida o previa a este esquema) se reservan ahora.
+    Devuelve la lista de faltantes; si no está vacía el llamador debe hacer
+    rollback (puede haber reservado parte).
+    """
+    rows = conn.execute(
+        """
+        SELECT
+            ci.product_id,
+            p.name AS product_name,
+            SUM(ci.quantity) AS wanted,
+            COALESCE(r.quantity, 0) AS held
+        FROM cart_items ci
+        JOIN products p ON p.id = ci.product_id
+        LEFT JOIN stock_reservations r
+            ON r.cart_id = ci.cart_id AND r.product_id = ci.product_id AND r.status = 'held'
+        WHERE ci.cart_id = ?
+        GROUP BY ci.product_id
+        """,
+        (cart_id,),
+    ).fetchall()
+
+    shortages = []
+    for product_id, name, wanted, held in rows:
+        missing = wanted - held
+        if missing > 0:
+            ok, available = reserve(conn, cart_id, product_id, missing)
+            if not ok:
+                shortages.append({
+                    "product_id": product_id,
+                    "name": name,
+                    "requested": wanted,
+                    "available": (available or 0) + held,
+                })
+        elif missing < 0:
+            # Retenía de más (ítem editado a mano): devolvemos la diferencia
+            conn.execute("UPDATE products SET stock = stock + ? WHERE id = ?", (-missing, product_id))
+            conn.execute(
+                "UPDATE stock_reservations SET quantity = ? WHERE cart_id = ? AND product_id = ?",
+                (wanted, cart_id, product_id),
+            )
+    if shortages:
+        return shortages
+
+    # Reservas de productos que ya no están en el carrito
+    stale = conn.execute(
+        """
+        SELECT id, product_id, quantity FROM stock_reservations r
+        WHERE r.cart_id = ? AND r.status = 'held'
+          AND NOT EXISTS (SELECT 1 FROM cart_items ci WHERE ci.cart_id = r.cart_id AND ci.product_id = r.product_id)
+        """,
+        (cart_id,),
+    ).fetchall()
+    _restock(conn, stale, "cleared")
+
+    conn.execute(
+        """
+        UPDATE stock_reservations
+        SET status = 'committed', updated_at = CURRENT_TIMESTAMP
+        WHERE cart_id = ? AND status = 'held'
+        """,
+        (cart_id,),
+    )
+    return []
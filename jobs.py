@@ -0,0 +1,396 @@
+"""
+jobs.py
+Jobs periódicos dentro del proceso (sin cron ni workers aparte).
+
+- Un thread por proceso hace "tick" cada JOBS_TICK segundos.
+- Elección de líder con un lease en SQLite (tabla job_leases): con
+  uvicorn --workers N solo el worker que tiene el lease corre jobs. El
+  lease se renueva en cada tick y vence a los JOBS_LEASE_TTL segundos,
+  así que si el líder muere otro worker lo toma.
+- La agenda es compartida: un job está vencido si su última corrida en
+  job_runs (de cualquier worker) es más vieja que su intervalo.
+- Cada corrida queda en job_runs (duración, estado, resultado) y en las
+  métricas job_runs_total / job_duration_seconds. Se ven en /admin/jobs.
+
+Jobs de retail (register_retail_jobs):
+- sweep_abandoned_carts: carritos abiertos sin actividad por CART_IDLE_HOURS
+  pasan a 'expired', devuelven el stock retenido y se borran sus ítems
+  (CART_SWEEP_ITEMS=delete) en lotes de JOBS_BATCH_SIZE carritos, cada
+  lote en su propia transacción corta.
+- release_expired_reservations: devuelve el stock de reservas vencidas.
+- archive_cold_data (con ARCHIVE_ENABLED): ver archive.py.
+- refresh_recommendations (con RECO_ENABLED): ver recommendations.py.
+- prune_change_events (con EVENTS_RETENTION_DAYS > 0): ver change_events.py.
+
+Con varias tiendas (shards.py) el lease y job_runs viven en la base de la
+tienda default y cada corrida de un job de retail recorre todas las bases
+(each_store); el resultado queda por tienda.
+
+Config (env):
+- JOBS_ENABLED            (default true)
+- JOBS_TICK               segundos entre ticks (default 5)
+- JOBS_LEASE_TTL          segundos de vida del lease de líder (default 30)
+- JOBS_BATCH_SIZE         carritos por transacción (default 200)
+- JOBS_BATCH_PAUSE        pausa entre lotes para dejar pasar a otros escritores (default 0.05)
+- JOBS_MAX_RUN_SECONDS    tope de tiempo por corrida; lo que quede sigue en la próxima (default 10)
+- JOBS_HISTORY            corridas que se guardan por job (default 500)
+- CART_IDLE_HOURS         horas sin actividad para expirar un carrito abierto (default 24)
+- CART_SWEEP_INTERVAL     segundos entre barridas de carritos (default 300)
+- CART_SWEEP_ITEMS        delete | keep (default delete)
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+import archive
+import change_events
+import inventory
+import metrics
+import recommendations
+
+JOBS_ENABLED = os.getenv("JOBS_ENABLED", "true").lower() == "true"
+JOBS_TICK = float(os.getenv("JOBS_TICK", "5"))
+JOBS_LEASE_TTL = float(os.getenv("JOBS_LEASE_TTL", "30"))
+JOBS_BATCH_SIZE = int(os.getenv("JOBS_BATCH_SIZE", "200"))
+JOBS_BATCH_PAUSE = float(os.getenv("JOBS_BATCH_PAUSE", "0.05"))
+JOBS_MAX_RUN_SECONDS = float(os.getenv("JOBS_MAX_RUN_SECONDS", "10"))
+JOBS_HISTORY = int(os.getenv("JOBS_HISTORY", "500"))
+CART_IDLE_HOURS = float(os.getenv("CART_IDLE_HOURS", "24"))
+CART_SWEEP_INTERVAL = float(os.getenv("CART_SWEEP_INTERVAL", "300"))
+CART_SWEEP_ITEMS = os.getenv("CART_SWEEP_ITEMS", "delete").lower()
+
+JOB_RUNS = metrics.counter("job_runs_total", "Corridas de jobs periódicos", ("job", "status"))
+JOB_DURATION = metrics.histogram(
+    "job_duration_seconds", "Duración de cada corrida de job", ("job",),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+JOB_LEADER = metrics.gauge("jobs_leader", "1 si este proceso tiene el lease de jobs")
+
+# fn(conn) -> dict con el resultado (filas afectadas, etc.)
+JobFn = Callable[[sqlite3.Connection], Dict[str, Any]]
+
+
+class Scheduler:
+    LEASE_NAME = "scheduler"
+
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._connect: Optional[Callable[[], sqlite3.Connection]] = None
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.is_leader = False
+
+    # -------------------------
+    # Registro
+    # -------------------------
+    def configure(self, connect: Callable[[], sqlite3.Connection]):
+        self._connect = connect
+
+    def register(self, name: str, fn: JobFn, interval: float, description: str = ""):
+        self._jobs[name] = {"name": name, "fn": fn, "interval": interval, "description": description}
+
+    def jobs(self) -> List[Dict[str, Any]]:
+        return [{k: v for k, v in j.items() if k != "fn"} for j in self._jobs.values()]
+
+    # -------------------------
+    # Ciclo de vida
+    # -------------------------
+    def start(self):
+        """Arranca el thread de ticks (una sola vez por proceso)."""
+        if not JOBS_ENABLED or self._connect is None or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="jobs-scheduler", daemon=True)
+        self._thread.start()
+        print(f"⏰ Scheduler de jobs iniciado ({self.owner}, {len(self._jobs)} jobs)")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=JOBS_TICK + JOBS_MAX_RUN_SECONDS)
+            self._thread = None
+        if self.is_leader:
+            self._release_lease()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception as e:  # el scheduler nunca se cae por un tick roto
+                print(f"⚠️  Tick de jobs falló: {e}")
+            self._stop.wait(JOBS_TICK)
+
+    def tick(self):
+        conn = self._connect()
+        try:
+            self.is_leader = self._acquire_lease(conn)
+            if not self.is_leader:
+                return
+            for name in self._due_jobs(conn):
+                if self._stop.is_set():
+                    break
+                self._run(conn, name, trigger="schedule")
+        finally:
+            conn.close()
+
+    # -------------------------
+    # Lease (líder)
+    # -------------------------
+    def _acquire_lease(self, conn: sqlite3.Connection) -> bool:
+        """Toma o renueva el lease; solo pisa uno vencido o propio."""
+        now = time.time()
+        conn.execute(
+            """
+            INSERT INTO job_leases (name, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE job_leases.owner = excluded.owner OR job_leases.expires_at < ?
+            """,
+            (self.LEASE_NAME, self.owner, now + JOBS_LEASE_TTL, now),
+        )
+        conn.commit()
+        row = conn.execute("SELECT owner FROM job_leases WHERE name = ?", (self.LEASE_NAME,)).fetchone()
+        return row is not None and row[0] == self.owner
+
+    def _release_lease(self):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM job_leases WHERE name = ? AND owner = ?", (self.LEASE_NAME, self.owner))
+            conn.commit()
+        finally:
+            conn.close()
+        self.is_leader = False
+
+    def leader(self) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT owner, expires_at FROM job_leases WHERE name = ?", (self.LEASE_NAME,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if not row or row[1] < time.time():
+            return None
+        return {"owner": row[0], "expires_in": round(row[1] - time.time(), 1), "is_me": row[0] == self.owner}
+
+    # -------------------------
+    # Corridas
+    # -------------------------
+    def _due_jobs(self, conn: sqlite3.Connection) -> List[str]:
+        due = []
+        for name, job in self._jobs.items():
+            row = conn.execute(
+                "SELECT (julianday('now') - julianday(MAX(started_at))) * 86400 FROM job_runs WHERE job = ?",
+                (name,),
+            ).fetchone()
+            if row[0] is None or row[0] >= job["interval"]:
+                due.append(name)
+        return due
+
+    def run_now(self, name: str) -> Dict[str, Any]:
+        """Corrida manual (admin), sin esperar el intervalo ni el lease."""
+        if name not in self._jobs:
+            raise KeyError(name)
+        conn = self._connect()
+        try:
+            return self._run(conn, name, trigger="manual")
+        finally:
+            conn.close()
+
+    def _run(self, conn: sqlite3.Connection, name: str, trigger: str) -> Dict[str, Any]:
+        # Un job a la vez por proceso: la corrida manual no se pisa con la agendada
+        with self._run_lock:
+            job = self._jobs[name]
+            cur = conn.execute(
+                "INSERT INTO job_runs (job, owner, trigger, status) VALUES (?, ?, ?, 'running')",
+                (name, self.owner, trigger),
+            )
+            run_id = cur.lastrowid
+            conn.commit()
+
+            t0 = time.perf_counter()
+            result, error = {}, None
+            try:
+                result = job["fn"](conn) or {}
+            except Exception as e:
+                conn.rollback()
+                error = f"{type(e).__name__}: {e}"
+                print(f"❌ Job {name} falló: {error}")
+            elapsed = time.perf_counter() - t0
+            status = "error" if error else "ok"
+
+            conn.execute(
+                """
+                UPDATE job_runs
+                SET status = ?, finished_at = datetime('now'), duration_ms = ?, result = ?, error = ?
+                WHERE id = ?
+                """,
+                (status, round(elapsed * 1000, 1), json.dumps(result), error, run_id),
+            )
+            conn.execute(
+                """
+                DELETE FROM job_runs WHERE job = ? AND id <= (
+                    SELECT id FROM job_runs WHERE job = ? ORDER BY id DESC LIMIT 1 OFFSET ?
+                )
+                """,
+                (name, name, JOBS_HISTORY),
+            )
+            conn.commit()
+
+        JOB_RUNS.inc(job=name, status=status)
+        JOB_DURATION.observe(elapsed, job=name)
+        if result.get("expired_carts") or result.get("released_units"):
+            print(f"🧹 Job {name}: {result}")
+        return {"job": name, "status": status, "duration_ms": round(elapsed * 1000, 1), "result": result, "error": error}
+
+    # -------------------------
+    # Admin
+    # -------------------------
+    def summary(self, conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+        rows = {
+            r["job"]: dict(r)
+            for r in conn.execute(
+                """
+                SELECT job,
+                       COUNT(*) AS runs,
+                       SUM(status = 'error') AS errors,
+                       AVG(duration_ms) AS avg_ms,
+                       MAX(duration_ms) AS max_ms,
+                       MAX(started_at) AS last_started_at
+                FROM job_runs
+                GROUP BY job
+                """
+            )
+        }
+        out = []
+        for job in self.jobs():
+            stats = rows.get(job["name"], {})
+            out.append({**job, **{k: v for k, v in stats.items() if k != "job"}})
+        return out
+
+    def recent_runs(self, conn: sqlite3.Connection, limit: int = 50) -> List[Dict[str, Any]]:
+        runs = []
+        for r in conn.execute(
+            """
+            SELECT id, job, owner, trigger, status, started_at, finished_at, duration_ms, result, error
+            FROM job_runs ORDER BY id DESC LIMIT ?
+            """,
+            (limit,),
+        ):
+            run = dict(r)
+            run["result"] = json.loads(run["result"]) if run["result"] else {}
+            runs.append(run)
+        return runs
+
+
+scheduler = Scheduler()
+JOB_LEADER.set_function(lambda: [((), 1.0 if scheduler.is_leader else 0.0)])
+
+
+# -------------------------
+# Jobs de retail
+# -------------------------
+def sweep_abandoned_carts(conn: sqlite3.Connection) -> Dict[str, Any]:
+    """Expira carritos abiertos inactivos en lotes cortos, devolviendo su stock."""
+    deadline = time.monotonic() + JOBS_MAX_RUN_SECONDS
+    expired = released = deleted_items = 0
+    more = True
+    while time.monotonic() < deadline:
+        inventory.begin_write(conn)
+        ids = [
+            r[0]
+            for r in conn.execute(
+                """
+                SELECT id FROM carts
+                WHERE status = 'open' AND updated_at <= datetime('now', ?)
+                LIMIT ?
+                """,
+                (f"-{CART_IDLE_HOURS} hours", JOBS_BATCH_SIZE),
+            )
+        ]
+        if not ids:
+            conn.commit()
+            more = False
+            break
+        for cart_id in ids:
+            released += inventory.release_cart(conn, cart_id, reason="abandoned")
+        marks = ",".join("?" * len(ids))
+        conn.execute(
+            f"UPDATE carts SET status = 'expired', updated_at = CURRENT_TIMESTAMP WHERE id IN ({marks})",
+            ids,
+        )
+        if CART_SWEEP_ITEMS == "delete":
+            deleted_items += conn.execute(f"DELETE FROM cart_items WHERE cart_id IN ({marks})", ids).rowcount
+        for cart_id in ids:
+            change_events.record(conn, "cart", cart_id, "expired")
+        conn.commit()
+        expired += len(ids)
+        time.sleep(JOBS_BATCH_PAUSE)
+    return {"expired_carts": expired, "released_units": released, "deleted_items": deleted_items, "more": more}
+
+
+def release_expired_reservations(conn: sqlite3.Connection) -> Dict[str, Any]:
+    deadline = time.monotonic() + JOBS_MAX_RUN_SECONDS
+    released = 0
+    while time.monotonic() < deadline:
+        inventory.begin_write(conn)
+        units = inventory.release_expired(conn)
+        conn.commit()
+        if not units:
+            break
+        released += units
+        time.sleep(JOBS_BATCH_PAUSE)
+    return {"released_units": released}
+
+
+def register_retail_jobs(
+    connect: Callable[[], sqlite3.Connection],
+    each_store: Optional[Callable[[JobFn], Dict[str, Any]]] = None,
+) -> Scheduler:
+    """
+    connect: base de control (lease, job_runs). each_store(fn) corre fn sobre
+    la base de cada tienda y devuelve {tienda: resultado}; None = una sola base.
+    """
+    scheduler.configure(connect)
+
+    def _per_store_register(name, fn, interval, description=""):
+        scheduler.register(name, lambda conn: each_store(fn), interval, description)
+
+    register = scheduler.register if each_store is None else _per_store_register
+
+    register(
+        "sweep_abandoned_carts", sweep_abandoned_carts, CART_SWEEP_INTERVAL,
+        f"Expira carritos abiertos sin actividad por {CART_IDLE_HOURS:g} h y devuelve su stock",
+    )
+    register(
+        "release_expired_reservations", release_expired_reservations, 60,
+        "Devuelve al stock las reservas vencidas",
+    )
+    if archive.ARCHIVE_ENABLED:
+        register(
+            "archive_cold_data",
+            lambda conn: archive.archive_cold_data(conn, JOBS_MAX_RUN_SECONDS, JOBS_BATCH_PAUSE),
+            archive.ARCHIVE_INTERVAL,
+            f"Mueve órdenes pagadas y carritos expirados de más de {archive.ARCHIVE_AFTER_MONTHS} meses a {archive.ARCHIVE_DIR.name}/",
+        )
+    if change_events.EVENTS_RETENTION_DAYS > 0:
+        register(
+            "prune_change_events",
+            lambda conn: change_events.prune(conn, JOBS_MAX_RUN_SECONDS, JOBS_BATCH_PAUSE),
+            3600,
+            f"Borra del log de cambios los eventos de más de {change_events.EVENTS_RETENTION_DAYS:g} días",
+        )
+    if recommendations.RECO_ENABLED:
+        register(
+            "refresh_recommendations",
+            lambda conn: recommendations.refresh(conn, JOBS_MAX_RUN_SECONDS, JOBS_BATCH_PAUSE),
+            recommendations.RECO_INTERVAL,
+            "Suma las órdenes nuevas al índice 'se compra junto con'",
+        )
+    return scheduler
@@ -0,0 +1,346 @@
+"""
+live_feed.py
+Admin en vivo: UN lector del log de cambios (change_events) por tienda y
+proceso, repartido por Server-Sent Events a todas las pestañas abiertas de
+/admin, /admin/orders y /admin/carts (GET /admin/events/stream).
+
+- El lector (LiveFeed) arranca con el primer cliente y se apaga LIVE_LINGER
+  segundos después de que se va el último. Lee change_events con seq > el
+  último visto cada LIVE_POLL_INTERVAL segundos (búsqueda por PK).
+- Cada lote se enriquece UNA vez: una query para las órdenes y otra para
+  los carritos tocados, renderizadas con los mismos parciales que
+  orders.html y carts.html, más los deltas de los contadores del
+  dashboard. El mensaje SSE se arma una vez y se encola igual en cada
+  cliente: la carga de la base no depende de cuántas pestañas haya.
+- Los últimos LIVE_BUFFER mensajes quedan en memoria: la página abre el
+  stream con ?after=<seq con el que se renderizó> y EventSource reconecta
+  con Last-Event-ID; en los dos casos se pone al día desde el buffer sin
+  tocar la base. Si pide algo más viejo recibe "reload".
+- Cola acotada por cliente (LIVE_CLIENT_QUEUE): un cliente lento se corta
+  en vez de acumular memoria, y cada stream dura a lo sumo LIVE_STREAM_TTL
+  segundos (no traba el apagado de uvicorn). EventSource reconecta solo y
+  retoma desde su Last-Event-ID.
+
+Con varios workers de uvicorn hay un lector por worker, no por pestaña.
+
+Config (env):
+- LIVE_POLL_INTERVAL   segundos entre lecturas del log (default 1)
+- LIVE_BUFFER          mensajes recientes en memoria para reconexiones (default 1000)
+- LIVE_CLIENT_QUEUE    mensajes pendientes por cliente antes de cortarlo (default 256)
+- LIVE_HEARTBEAT       segundos entre comentarios keep-alive (default 15)
+- LIVE_STREAM_TTL      segundos que dura cada conexión antes de reconectar (default 300)
+- LIVE_MAX_CLIENTS     streams simultáneos por proceso (default 200; 0 = sin tope)
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import change_events
+import metrics
+
+LIVE_POLL_INTERVAL = float(os.getenv("LIVE_POLL_INTERVAL", "1"))
+LIVE_BUFFER = int(os.getenv("LIVE_BUFFER", "1000"))
+LIVE_CLIENT_QUEUE = int(os.getenv("LIVE_CLIENT_QUEUE", "256"))
+LIVE_HEARTBEAT = float(os.getenv("LIVE_HEARTBEAT", "15"))
+LIVE_STREAM_TTL = float(os.getenv("LIVE_STREAM_TTL", "300"))
+LIVE_MAX_CLIENTS = int(os.getenv("LIVE_MAX_CLIENTS", "200"))
+
+# Sin clientes, el lector sigue este tiempo: una pestaña que reconecta (o
+# cambia de página) se pone al día desde el buffer en vez de recibir "reload"
+LIVE_LINGER = 30.0
+
+LIVE_CLIENTS = metrics.gauge("live_feed_clients", "Streams SSE del admin abiertos", ("store",))
+LIVE_EVENTS = metrics.counter("live_feed_events_total", "Eventos leídos del log y repartidos", ("store",))
+LIVE_DROPPED = metrics.counter("live_feed_dropped_total", "Clientes cortados por cola llena", ("store",))
+
+# (entity, action) -> contador del dashboard y delta
+COUNTER_DELTAS = {
+    ("user", "created"): ("users", 1),
+    ("user", "deleted"): ("users", -1),
+    ("product", "created"): ("products", 1),
+    ("product", "deleted"): ("products", -1),
+    ("order", "created"): ("orders", 1),
+    ("order", "deleted"): ("orders", -1),
+}
+
+# Mismas columnas que admin_orders / admin_carts (solo la base caliente)
+ORDER_ROWS_SQL = """
+    SELECT
+        o.id, o.user_id, u.name AS user_name, u.email AS user_email,
+        o.cart_id, o.total, o.payment_status, o.created_at, 'hot' AS source
+    FROM orders o
+    JOIN users u ON u.id = o.user_id
+    WHERE o.id IN ({ids})
+"""
+
+CART_ROWS_SQL = """
+    SELECT
+        c.id, c.user_id, u.name AS user_name, u.email AS user_email,
+        c.status, c.created_at, c.updated_at,
+        COALESCE(SUM(ci.quantity * ci.unit_price), 0) AS total,
+        COALESCE(SUM(ci.quantity), 0) AS items_count
+    FROM carts c
+    JOIN users u ON u.id = c.user_id
+    LEFT JOIN cart_items ci ON ci.cart_id = c.id
+    WHERE c.id IN ({ids})
+    GROUP BY c.id
+"""
+
+RELOAD = "event: reload\ndata: {}\n\n"
+
+
+class TooManyClients(RuntimeError):
+    pass
+
+
+def format_sse(seq: int, data: Dict[str, Any], event: str = "change") -> str:
+    return f"id: {seq}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+def _fetch_rows(conn, sql: str, ids: Iterable[int]) -> Dict[int, Any]:
+    ids = sorted(set(ids))
+    if not ids:
+        return {}
+    rows = conn.execute(sql.format(ids=",".join("?" * len(ids))), ids).fetchall()
+    return {r["id"]: r for r in rows}
+
+
+def build_messages(conn, events: List[Dict[str, Any]],
+                   render: Callable[[str, Dict[str, Any]], str]) -> List[Tuple[int, str]]:
+    """
+    Un mensaje SSE por evento: deltas de contadores y filas a reemplazar
+    (html) o sacar (html null). Las filas se leen una vez por lote con su
+    estado actual; si un evento posterior las toca de nuevo, el reemplazo
+    es idempotente.
+    """
+    touched: List[Tuple[Dict[str, Any], List[Tuple[str, int]]]] = []
+    order_ids, cart_ids = set(), set()
+    for ev in events:
+        rows: List[Tuple[str, int]] = []
+        if ev["entity"] == "order" and ev["entity_id"] is not None:
+            rows.append(("orders", ev["entity_id"]))
+            order_ids.add(ev["entity_id"])
+            cart_id = ev["payload"].get("cart_id")
+            if cart_id is not None:  # el checkout cierra el carrito sin evento propio
+                rows.append(("carts", cart_id))
+                cart_ids.add(cart_id)
+        elif ev["entity"] == "cart" and ev["entity_id"] is not None:
+            rows.append(("carts", ev["entity_id"]))
+            cart_ids.add(ev["entity_id"])
+        touched.append((ev, rows))
+
+    current = {
+        "orders": _fetch_rows(conn, ORDER_ROWS_SQL, order_ids),
+        "carts": _fetch_rows(conn, CART_ROWS_SQL, cart_ids),
+    }
+    rendered: Dict[Tuple[str, int], Optional[str]] = {}
+    for table, found in current.items():
+        template, var = ("_order_row.html", "o") if table == "orders" else ("_cart_row.html", "c")
+        for row_id in order_ids if table == "orders" else cart_ids:
+            row = found.get(row_id)
+            rendered[(table, row_id)] = render(template, {var: row}) if row is not None else None
+
+    messages = []
+    for ev, rows in touched:
+        counters = {}
+        delta = COUNTER_DELTAS.get((ev["entity"], ev["action"]))
+        if delta:
+            counters[delta[0]] = delta[1]
+        data = {
+            "entity": ev["entity"],
+            "id": ev["entity_id"],
+            "action": ev["action"],
+            "counters": counters,
+            "rows": [{"table": t, "id": i, "html": rendered[(t, i)]} for t, i in rows],
+        }
+        messages.append((ev["seq"], format_sse(ev["seq"], data)))
+    return messages
+
+
+class Subscriber:
+    """Un stream abierto: cola en el event loop del request."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, after: int):
+        self.loop = loop
+        self.after = after
+        self.queue: asyncio.Queue = asyncio.Queue(LIVE_CLIENT_QUEUE)
+        self.closed = False
+        self.dropped = False
+
+    def push(self, messages: List[Tuple[int, str]]):
+        """Corre en el loop (call_soon_threadsafe). Cola llena: se corta el cliente."""
+        if self.closed:
+            return
+        for seq, msg in messages:
+            if seq <= self.after:
+                continue  # ya lo tenía (render de la página o backlog)
+            try:
+                self.queue.put_nowait(msg)
+            except asyncio.QueueFull:
+                self.dropped = True
+                self.close()
+                return
+            self.after = seq
+
+    def close(self):
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class LiveFeed:
+    """Lector del log de una tienda con fan-out a los streams abiertos."""
+
+    _clients = 0  # entre todas las tiendas del proceso (LIVE_MAX_CLIENTS)
+    _clients_lock = threading.Lock()
+
+    def __init__(self, store: str, connect, render: Callable[[str, Dict[str, Any]], str]):
+        self.store = store
+        self._connect = connect
+        self._render = render
+        self._lock = threading.Lock()
+        self._subscribers: set = set()
+        self._buffer: deque = deque()  # (seq, mensaje)
+        self._floor = 0  # el buffer cubre (floor, last_seq]
+        self._last_seq: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # --- clientes ---
+    def subscribe(self, loop: asyncio.AbstractEventLoop, after: Optional[int]) -> Tuple[Subscriber, List[str]]:
+        """Registra un stream; devuelve el suscriptor y lo pendiente desde `after` (sync: lee la base)."""
+        with LiveFeed._clients_lock:
+            if LIVE_MAX_CLIENTS and LiveFeed._clients >= LIVE_MAX_CLIENTS:
+                raise TooManyClients(f"Más de {LIVE_MAX_CLIENTS} streams abiertos")
+            LiveFeed._clients += 1
+        with self._lock:
+            if self._last_seq is None:
+                try:
+                    with self._connect() as conn:
+                        self._last_seq = self._floor = change_events.last_seq(conn)
+                except Exception:
+                    with LiveFeed._clients_lock:
+                        LiveFeed._clients -= 1
+                    raise
+            if after is None:
+                after = self._last_seq
+            if after < self._floor:
+                backlog = [RELOAD]
+            else:
+                backlog = [msg for seq, msg in self._buffer if seq > after]
+            sub = Subscriber(loop, max(after, self._last_seq))
+            self._subscribers.add(sub)
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name=f"live-feed-{self.store}", daemon=True)
+                self._thread.start()
+        LIVE_CLIENTS.inc(store=self.store)
+        return sub, backlog
+
+    def unsubscribe(self, sub: Subscriber):
+        with self._lock:
+            if sub not in self._subscribers:
+                return
+            self._subscribers.discard(sub)
+        with LiveFeed._clients_lock:
+            LiveFeed._clients -= 1
+        LIVE_CLIENTS.dec(store=self.store)
+
+    async def sse(self, sub: Subscriber, backlog: List[str],
+                  is_disconnected: Callable[[], Awaitable[bool]]):
+        """Cuerpo del StreamingResponse (text/event-stream)."""
+        deadline = time.monotonic() + LIVE_STREAM_TTL
+        try:
+            yield "retry: 3000\n\n"  # espera de EventSource antes de reconectar
+            for msg in backlog:
+                yield msg
+                if msg is RELOAD:
+                    return
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    msg = await asyncio.wait_for(sub.queue.get(), min(LIVE_HEARTBEAT, remaining))
+                except asyncio.TimeoutError:
+                    if await is_disconnected():
+                        return
+                    yield ": ping\n\n"
+                    continue
+                if msg is None:
+                    if sub.dropped:
+                        LIVE_DROPPED.inc(store=self.store)
+                    return
+                yield msg
+        finally:
+            self.unsubscribe(sub)
+
+    # --- lector ---
+    def _run(self):
+        idle_since: Optional[float] = None
+        while not self._stop.wait(LIVE_POLL_INTERVAL):
+            with self._lock:
+                if self._subscribers:
+                    idle_since = None
+                else:
+                    idle_since = idle_since or time.monotonic()
+                    if time.monotonic() - idle_since >= LIVE_LINGER:
+                        # Sin nadie mirando: el próximo cliente arranca desde MAX(seq)
+                        self._thread = None
+                        self._last_seq = None
+                        self._buffer.clear()
+                        return
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"⚠️ Live feed {self.store}: {e}")
+
+    def poll(self) -> int:
+        """Lee lo nuevo del log, arma los mensajes y los reparte. Devuelve cuántos eventos leyó."""
+        total = 0
+        while True:
+            with self._lock:
+                after = self._last_seq
+            if after is None:
+                return total
+            with self._connect() as conn:
+                events = change_events.read_after(conn, after, change_events.EVENTS_PAGE_SIZE)
+                if not events:
+                    return total
+                messages = build_messages(conn, events, self._render)
+            with self._lock:
+                for seq, msg in messages:
+                    if len(self._buffer) >= LIVE_BUFFER:
+                        self._floor = self._buffer.popleft()[0]
+                    self._buffer.append((seq, msg))
+                self._last_seq = events[-1]["seq"]
+                subscribers = list(self._subscribers)
+            for sub in subscribers:
+                try:
+                    sub.loop.call_soon_threadsafe(sub.push, messages)
+                except RuntimeError:  # loop cerrado
+                    self.unsubscribe(sub)
+            LIVE_EVENTS.inc(len(events), store=self.store)
+            total += len(events)
+            if len(events) < change_events.EVENTS_PAGE_SIZE:
+                return total
+
+    def stop(self):
+        """Corta los streams abiertos y el lector (shutdown)."""
+        self._stop.set()
+        with self._lock:
+            subscribers = list(self._subscribers)
+            thread = self._thread
+        for sub in subscribers:
+            try:
+                sub.loop.call_soon_threadsafe(sub.close)
+            except RuntimeError:
+                pass
+        if thread is not None:
+            thread.join(timeout=5)
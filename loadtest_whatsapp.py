@@ -0,0 +1,260 @@
+"""
+loadtest_whatsapp.py
+Load test offline del webhook /whatsapp.
+
+- Corre la app real de whatsapp_server in-process (httpx + ASGITransport).
+- Reemplaza Gemini por un modelo falso (RETAIL_MODEL_BACKEND, ver
+  retail_agent/fake_model.py): emite tool calls reales y determinísticas, sin red.
+- Levanta el backoffice real con uvicorn en 127.0.0.1 sobre una COPIA
+  temporal de retail.db (las tools le pegan por HTTP como en producción).
+- Simula N WaIds que conversan en paralelo (hola -> busco -> agregá -> ...),
+  con un ritmo global de mensajes por segundo.
+- Reporta throughput y latencias p50/p90/p99.
+
+Uso:
+    python loadtest_whatsapp.py --users 50 --rate 20 --duration 30
+    python loadtest_whatsapp.py --users 20 --rate 50 --retry-rate 0.1 --json out.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+
+CONVERSATION = [
+    "hola",
+    "busco leche",
+    "agregá 1 leche",
+    "busco arroz",
+    "agregá 2 arroz",
+    "ver carrito",
+    "pagar",
+]
+
+ERROR_REPLIES = (
+    "Perdón, hubo un problema técnico",
+    "Disculpá, tuve un problema técnico",
+    "Perdón, tuve un problema procesando tu mensaje",
+    "Perdón, no pude registrarte",
+)
+
+
+# -------------------------
+# Setup: env + backoffice local
+# -------------------------
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def prepare_env(db_path: Path, port: int, args):
+    """Todo lo que whatsapp_server / backoffice leen al importarse."""
+    os.environ["RETAIL_DB_PATH"] = str(db_path)
+    os.environ["BACKOFFICE_BASE_URL"] = f"http://127.0.0.1:{port}"
+    os.environ.setdefault("ENV", "loadtest")
+    os.environ.setdefault("ADMIN_USER", "loadtest")
+    os.environ.setdefault("ADMIN_PASSWORD", "loadtest")
+    os.environ.setdefault("BACKOFFICE_API_KEY", "loadtest-key")
+    os.environ.setdefault("CHECKOUT_BASE_URL", "http://localhost:8001/index.html")
+    os.environ.setdefault("GOOGLE_API_KEY", "offline")
+    os.environ["TWILIO_VALIDATE"] = "false"
+    os.environ["RETAIL_MODEL_BACKEND"] = args.backend
+    os.environ["RETAIL_MODEL_LATENCY_MS"] = str(args.llm_latency_ms)
+    os.environ["RETAIL_MODEL_JITTER_MS"] = str(args.llm_jitter_ms)
+    if args.script:
+        os.environ["RETAIL_MODEL_SCRIPT"] = str(args.script)
+    if not args.trace:
+        os.environ["TRACE_ENABLED"] = "false"
+
+
+def start_backoffice(port: int):
+    import uvicorn
+    from backoffice_app import app as backoffice_app
+
+    server = uvicorn.Server(
+        uvicorn.Config(backoffice_app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+    )
+    thread = threading.Thread(target=server.run, name="backoffice", daemon=True)
+    thread.start()
+    deadline = time.time() + 15
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("El backoffice local no arrancó")
+        time.sleep(0.05)
+    return server, thread
+
+
+# -------------------------
+# Payload Twilio
+# -------------------------
+def twilio_form(wa_id: str, body: str, message_sid: str) -> dict:
+    return {
+        "SmsMessageSid": message_sid,
+        "MessageSid": message_sid,
+        "SmsSid": message_sid,
+        "AccountSid": "AC" + "0" * 32,
+        "MessagingServiceSid": "MG" + "0" * 32,
+        "From": f"whatsapp:+{wa_id}",
+        "To": "whatsapp:+14155238886",
+        "Body": body,
+        "WaId": wa_id,
+        "ProfileName": f"Cliente {wa_id[-4:]}",
+        "NumMedia": "0",
+        "NumSegments": "1",
+        "MessageType": "text",
+        "SmsStatus": "received",
+        "ReferralNumMedia": "0",
+        "ApiVersion": "2010-04-01",
+    }
+
+
+# -------------------------
+# Generador de carga
+# -------------------------
+class Pacer:
+    """Libera un permiso cada 1/rate segundos (ritmo global, open-loop)."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.perf_counter()
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.perf_counter()
+            self._next = max(self._next + self.interval, now)
+            delay = self._next - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def simulate_user(client, wa_id: str, pacer: Pacer, stop_at: float, args, rng: random.Random, results: list):
+    for body in CONVERSATION:
+        if time.perf_counter() >= stop_at:
+            return
+        await pacer.wait()
+        sid = "SM" + uuid.uuid4().hex
+        form = twilio_form(wa_id, body, sid)
+        t0 = time.perf_counter()
+        try:
+            resp = await client.post("/whatsapp", data=form)
+            ok = resp.status_code == 200 and not any(e in resp.text for e in ERROR_REPLIES)
+        except Exception as e:
+            ok = False
+            print(f"❌ {wa_id}: {e}")
+        results.append((body, time.perf_counter() - t0, ok))
+
+        # Reintento de Twilio con el mismo MessageSid (ejercita el dedupe)
+        if args.retry_rate and rng.random() < args.retry_rate:
+            t0 = time.perf_counter()
+            resp = await client.post("/whatsapp", data=form)
+            results.append(("<retry>", time.perf_counter() - t0, resp.status_code == 200))
+
+
+async def run_load(app, args) -> dict:
+    import httpx
+
+    rng = random.Random(args.seed)
+    pacer = Pacer(args.rate)
+    results: list = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=120) as client:
+        started = time.perf_counter()
+        stop_at = started + args.duration if args.duration else math.inf
+        wa_ids = [f"54911{rng.randrange(10**8):08d}" for _ in range(args.users)]
+        await asyncio.gather(
+            *(simulate_user(client, w, pacer, stop_at, args, rng, results) for w in wa_ids)
+        )
+        elapsed = time.perf_counter() - started
+    return summarize(results, elapsed)
+
+
+def _pct(values, p):
+    if not values:
+        return 0.0
+    return values[max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))]
+
+
+def summarize(results: list, elapsed: float) -> dict:
+    latencies = sorted(r[1] * 1000 for r in results)
+    by_step = {}
+    for body, dt, _ in results:
+        by_step.setdefault(body, []).append(dt * 1000)
+    return {
+        "requests": len(results),
+        "errors": sum(1 for r in results if not r[2]),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(_pct(latencies, 50), 2),
+            "p90": round(_pct(latencies, 90), 2),
+            "p99": round(_pct(latencies, 99), 2),
+            "max": round(latencies[-1], 2) if latencies else 0.0,
+        },
+        "p50_by_step_ms": {k: round(_pct(sorted(v), 50), 2) for k, v in by_step.items()},
+    }
+
+
+def print_report(summary: dict):
+    lat = summary["latency_ms"]
+    print("=" * 50)
+    print(f"📊 Requests: {summary['requests']}  (errores: {summary['errors']})")
+    print(f"⏱️  Duración: {summary['elapsed_s']} s  →  {summary['throughput_rps']} req/s")
+    print(f"📈 Latencia ms: p50={lat['p50']}  p90={lat['p90']}  p99={lat['p99']}  max={lat['max']}")
+    for step, p50 in summary["p50_by_step_ms"].items():
+        print(f"   {step:<18} p50={p50} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test offline del webhook de WhatsApp")
+    parser.add_argument("--users", type=int, default=20, help="WaIds simulados en paralelo")
+    parser.add_argument("--rate", type=float, default=10.0, help="mensajes por segundo (0 = sin límite)")
+    parser.add_argument("--duration", type=float, default=0, help="corta a los N segundos (0 = conversación completa)")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="latencia artificial por llamada al modelo")
+    parser.add_argument("--llm-jitter-ms", type=float, default=0.0, help="variación ± de la latencia del modelo")
+    parser.add_argument("--backend", choices=["scripted", "replay"], default="scripted", help="modelo falso a usar")
+    parser.add_argument("--script", type=Path, help="guion JSON para --backend replay")
+    parser.add_argument("--retry-rate", type=float, default=0.0, help="fracción de mensajes que Twilio reintenta")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", type=Path, default=BASE_DIR / "retail.db", help="base a copiar para el backoffice")
+    parser.add_argument("--trace", action="store_true", help="dejar el tracing habilitado")
+    parser.add_argument("--json", type=Path, help="guardar el resumen en JSON")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="loadtest_"))
+    db_path = workdir / "retail.db"
+    shutil.copy(args.db, db_path)
+    port = _free_port()
+    prepare_env(db_path, port, args)
+
+    server, thread = start_backoffice(port)
+    try:
+        import whatsapp_server
+
+        print(f"🚀 {args.users} usuarios, {args.rate} msg/s, backoffice en {os.environ['BACKOFFICE_BASE_URL']}")
+        summary = asyncio.run(run_load(whatsapp_server.app, args))
+        print_report(summary)
+        if args.json:
+            args.json.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+    finally:
+        server.should_exit = True
+        thread.join(timeout=5)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
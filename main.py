@@ -1,14 +1,32 @@
 from fastapi import FastAPI, Request
 from fastapi.responses import PlainTextResponse
+import metrics
 from fastapi.staticfiles import StaticFiles
 
 # Importar apps
 from backoffice_app import app as backoffice_app
+import backoffice_app as backoffice
 
 # Importar el webhook de whatsapp directamente
 import whatsapp_server
 
 app = FastAPI(title="YopLabs Agent Demo")
+# Métricas de todo el proceso (incluye backoffice y bridge) en GET /metrics
+metrics.instrument_app(app, "main")
+
+# El Runner del agente (google-adk) se arma en background: /healthz responde sin esperarlo
+@app.on_event("startup")
+async def warmup_agent():
+    whatsapp_server.start_agent_warmup()
+
+# Las apps montadas no reciben startup/shutdown: schema y jobs del backoffice se arrancan acá
+@app.on_event("startup")
+def start_backoffice():
+    backoffice.on_startup()
+
+@app.on_event("shutdown")
+def stop_backoffice():
+    backoffice.on_shutdown()
 
 # Healthcheck
 @app.get("/healthz", response_class=PlainTextResponse)
@@ -21,6 +39,10 @@ def healthz():
 async def whatsapp_webhook(request: Request):
     return await whatsapp_server.whatsapp_webhook(request)
 
+@app.get("/whatsapp/dedupe_stats")
+async def whatsapp_dedupe_stats():
+    return await whatsapp_server.whatsapp_dedupe_stats()
+
 # Checkout UI
 app.mount(
     "/checkout-ui",
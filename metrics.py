@@ -0,0 +1,357 @@
+"""
+metrics.py
+Métricas estilo Prometheus (formato de texto 0.0.4) sin dependencias extra.
+
+- Counter / Gauge / Histogram con labels.
+- Registro barato: cada thread escribe en su propio shard (un dict), sin
+  locks en el camino caliente. El lock solo se toma la primera vez que un
+  thread registra su shard. Al exponer se suman todos los shards.
+- Gauges "callback": se calculan al momento de exponer (sesiones, tamaño
+  de caches, etc.).
+- Multi-worker (uvicorn --workers N): con METRICS_MULTIPROC_DIR cada
+  proceso vuelca su snapshot a <dir>/metrics_<pid>.json cada
+  METRICS_FLUSH_INTERVAL segundos, y /metrics (en cualquier worker) suma
+  los snapshots de todos. Los archivos sin actualizar en
+  METRICS_STALE_AFTER segundos (workers muertos) se ignoran.
+
+Uso:
+    REQUESTS = metrics.counter("x_total", "Descripción", ("route",))
+    REQUESTS.inc(route="/products")
+    metrics.instrument_app(app, "backoffice")   # middleware + GET /metrics
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR", "")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+METRICS_STALE_AFTER = float(os.getenv("METRICS_STALE_AFTER", "300"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Key = Tuple[str, Tuple[str, ...]]
+
+
+# -------------------------
+# Registro (shards por thread)
+# -------------------------
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, "_Metric"] = {}
+        self._shards: List[dict] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._callbacks: List[Tuple["Gauge", Callable[[], Iterable[Tuple[Tuple[str, ...], float]]]]] = []
+
+    def register(self, metric: "_Metric") -> "_Metric":
+        with self._lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                return existing  # re-import del módulo (reload): misma métrica
+            self.metrics[metric.name] = metric
+        return metric
+
+    def shard(self) -> dict:
+        d = getattr(self._local, "shard", None)
+        if d is None:
+            d = {}
+            self._local.shard = d
+            with self._lock:
+                self._shards.append(d)
+        return d
+
+    def add_callback(self, gauge: "Gauge", fn):
+        self._callbacks.append((gauge, fn))
+
+    def collect(self) -> Dict[Key, object]:
+        """Suma de todos los shards + gauges callback. Valor: float o lista (histogramas)."""
+        merged: Dict[Key, object] = {}
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            # list(d.items()) es atómico bajo el GIL: no hace falta frenar a los writers
+            for key, value in list(shard.items()):
+                _merge_value(merged, key, value, self.metrics[key[0]])
+        for gauge, fn in self._callbacks:
+            try:
+                for labels, value in fn():
+                    merged[(gauge.name, tuple(str(v) for v in labels))] = float(value)
+            except Exception as e:
+                print(f"⚠️  metrics callback {gauge.name} falló: {e}")
+        return merged
+
+
+def _merge_value(merged: dict, key: Key, value, metric: "_Metric"):
+    if isinstance(value, list):
+        current = merged.get(key)
+        if current is None:
+            merged[key] = list(value)
+        else:
+            for i, v in enumerate(value):
+                current[i] += v
+    elif metric.kind == "gauge" and metric.mode == "max":
+        merged[key] = max(merged.get(key, value), value)
+    else:
+        merged[key] = merged.get(key, 0.0) + value
+
+
+REGISTRY = Registry()
+
+
+# -------------------------
+# Tipos de métrica
+# -------------------------
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.mode = "sum"
+
+    def _key(self, labels: dict) -> Key:
+        return (self.name, tuple(str(labels.get(n, "")) for n in self.labelnames))
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        if not METRICS_ENABLED:
+            return
+        shard = REGISTRY.shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Gauge por deltas (inc/dec): se suma entre threads y workers.
+    mode="max" para valores que todos los workers ven iguales (ej.: tamaño de la DB).
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), mode: str = "sum"):
+        super().__init__(name, documentation, labelnames)
+        self.mode = mode
+
+    def inc(self, amount: float = 1.0, **labels):
+        if not METRICS_ENABLED:
+            return
+        shard = REGISTRY.shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn: Callable[[], Iterable[Tuple[Tuple[str, ...], float]]]):
+        """fn() -> [(label_values, valor), ...], evaluada al exponer."""
+        REGISTRY.add_callback(self, fn)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        shard = REGISTRY.shard()
+        key = self._key(labels)
+        data = shard.get(key)
+        if data is None:
+            # [count, sum, bucket_0 ... bucket_n, +Inf] (no acumulados)
+            data = [0.0, 0.0] + [0.0] * (len(self.buckets) + 1)
+            shard[key] = data
+        data[0] += 1
+        data[1] += value
+        data[2 + bisect.bisect_left(self.buckets, value)] += 1
+
+
+def counter(name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Tuple[str, ...] = (), mode: str = "sum") -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames, mode))
+
+
+def histogram(name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# -------------------------
+# Multi-worker: snapshots por proceso
+# -------------------------
+def _snapshot_path(pid: Optional[int] = None) -> Path:
+    return Path(METRICS_MULTIPROC_DIR) / f"metrics_{pid or os.getpid()}.json"
+
+
+def write_snapshot():
+    if not METRICS_MULTIPROC_DIR:
+        return
+    series = [[name, list(labels), value] for (name, labels), value in REGISTRY.collect().items()]
+    path = _snapshot_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps({"pid": os.getpid(), "ts": time.time(), "series": series}), encoding="utf-8")
+    os.replace(tmp, path)  # atómico: otro worker nunca lee un JSON a medias
+
+
+def collect_all_workers() -> Dict[Key, object]:
+    if not METRICS_MULTIPROC_DIR:
+        return REGISTRY.collect()
+    write_snapshot()
+    merged: Dict[Key, object] = {}
+    now = time.time()
+    for path in Path(METRICS_MULTIPROC_DIR).glob("metrics_*.json"):
+        try:
+            if now - path.stat().st_mtime > METRICS_STALE_AFTER:
+                continue
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue  # lo está reemplazando otro worker
+        for name, labels, value in data.get("series", []):
+            metric = REGISTRY.metrics.get(name)
+            if metric is not None:
+                _merge_value(merged, (name, tuple(labels)), value, metric)
+    return merged
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            write_snapshot()
+        except Exception as e:
+            print(f"⚠️  metrics snapshot falló: {e}")
+
+
+_flusher_started = False
+
+
+def start_flusher():
+    global _flusher_started
+    if METRICS_MULTIPROC_DIR and not _flusher_started:
+        _flusher_started = True
+        threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True).start()
+
+
+# -------------------------
+# Exposición (texto Prometheus)
+# -------------------------
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_num(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+def render(samples: Optional[Dict[Key, object]] = None) -> str:
+    samples = collect_all_workers() if samples is None else samples
+    by_metric: Dict[str, List[Tuple[Tuple[str, ...], object]]] = {}
+    for (name, labels), value in samples.items():
+        by_metric.setdefault(name, []).append((labels, value))
+
+    lines: List[str] = []
+    for name in sorted(REGISTRY.metrics):
+        metric = REGISTRY.metrics[name]
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for labels, value in sorted(by_metric.get(name, []), key=lambda x: x[0]):
+            if metric.kind != "histogram":
+                lines.append(f"{name}{_fmt_labels(metric.labelnames, labels)} {_fmt_num(value)}")
+                continue
+            cumulative = 0.0
+            for bound, n in zip(list(metric.buckets) + [float("inf")], value[2:]):
+                cumulative += n
+                le = f'le="{_fmt_num(bound)}"'
+                lines.append(f"{name}_bucket{_fmt_labels(metric.labelnames, labels, le)} {_fmt_num(cumulative)}")
+            lines.append(f"{name}_sum{_fmt_labels(metric.labelnames, labels)} {_fmt_num(value[1])}")
+            lines.append(f"{name}_count{_fmt_labels(metric.labelnames, labels)} {_fmt_num(value[0])}")
+    return "\n".join(lines) + "\n"
+
+
+# -------------------------
+# HTTP: middleware + endpoint
+# -------------------------
+HTTP_REQUESTS = counter(
+    "http_requests_total", "Requests HTTP atendidos", ("app", "method", "route", "status")
+)
+HTTP_LATENCY = histogram(
+    "http_request_duration_seconds", "Latencia de requests HTTP", ("app", "method", "route")
+)
+HTTP_IN_FLIGHT = gauge("http_requests_in_flight", "Requests HTTP en curso", ("app",))
+
+# Marca en el scope: si una app instrumentada está montada dentro de otra
+# (main -> backoffice), mide la más interna y la externa no duplica.
+_SCOPE_MARK = "retail_metrics_app"
+
+
+def _route_label(scope) -> str:
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if path is None:
+        return "<unmatched>"
+    if hasattr(route, "app") and not hasattr(route, "endpoint"):  # Mount (static, sub-apps)
+        return f"{path}/*"
+    return path
+
+
+def instrument_app(app, app_name: str, expose: bool = True):
+    """Agrega el middleware de métricas HTTP y (opcional) GET /metrics a una app FastAPI."""
+    from fastapi.responses import Response
+
+    @app.middleware("http")
+    async def metrics_middleware(request, call_next):
+        scope = request.scope
+        outer = _SCOPE_MARK not in scope
+        scope[_SCOPE_MARK] = app_name
+        if outer:
+            HTTP_IN_FLIGHT.inc(app=app_name)
+        t0 = time.perf_counter()
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+            return response
+        finally:
+            if outer:
+                HTTP_IN_FLIGHT.dec(app=app_name)
+            # Si una app interna ya la midió, la marca quedó con su nombre
+            if scope.get(_SCOPE_MARK) == app_name:
+                route = _route_label(scope)
+                HTTP_LATENCY.observe(time.perf_counter() - t0, app=app_name, method=request.method, route=route)
+                HTTP_REQUESTS.inc(app=app_name, method=request.method, route=route, status=str(status_code))
+
+    if expose:
+        @app.get("/metrics", include_in_schema=False)
+        def metrics_endpoint():
+            return Response(render(), media_type=CONTENT_TYPE)
+
+    start_flusher()
+    return app
@@ -0,0 +1,124 @@
+"""
+normalization.py
+Normalización de texto para búsquedas (catálogo, usuarios).
+
+fold_text("Café  con LECHE") -> "cafe con leche"
+- minúsculas
+- sin acentos ni diéresis (á -> a, ü -> u, ñ -> n)
+- espacios colapsados
+
+Camino rápido: texto ASCII sale tal cual; str.translate para el español y
+NFKD solo si queda algún carácter no ASCII (otros alfabetos, símbolos).
+
+normalize_phone("011 15-2222-3333") -> "+5491122223333"
+Forma canónica (E.164) del teléfono para users.phone_norm: la misma que
+manda WhatsApp como WaId, con "+". Ver normalize_phone.
+
+Config (env):
+- PHONE_COUNTRY_CODE   país de los números sin código internacional (default 54)
+"""
+
+import os
+import re
+import unicodedata
+from typing import Optional
+
+PHONE_COUNTRY_CODE = os.getenv("PHONE_COUNTRY_CODE", "54")
+
+_FOLD_TABLE = str.maketrans(
+    "áéíóúàèìòùâêîôûäëïöüãõñç",
+    "aeiouaeiouaeiouaeiouaonc",
+)
+_SPACES = re.compile(r"\s+")
+
+
+def fold_text(text) -> str:
+    if not text:
+        return ""
+    s = str(text).lower()
+    if not s.isascii():
+        s = s.translate(_FOLD_TABLE)
+        if not s.isascii():
+            s = "".join(c for c in unicodedata.normalize("NFKD", s) if not unicodedata.combining(c))
+    return _SPACES.sub(" ", s).strip()
+
+
+# -------------------------
+# Teléfonos
+# -------------------------
+_NON_DIGITS = re.compile(r"\D+")
+
+
+def _argentina(national: str) -> Optional[str]:
+    """
+    Número nacional argentino (sin 0 ni 54) -> 10 dígitos característica + abonado.
+    Saca el "15" de celular que va después de la característica: 11 es la única
+    de 2 dígitos; si no, se prueba 3 y después 4 ("351 15 555-1234", "2944 15 55-1234").
+    """
+    if len(national) == 12:
+        for area in ((2,) if national.startswith("11") else (3, 4)):
+            if national[area:area + 2] == "15":
+                national = national[:area] + national[area + 2:]
+                break
+    # Las características empiezan con 11, 2 o 3 ("15 2222-3333" no tiene)
+    if len(national) != 10 or not (national.startswith("11") or national[0] in "23"):
+        return None
+    return national
+
+
+def _bare_international(text: str, digits: str, country: str) -> bool:
+    """WaId sin "+" de otro país: solo dígitos, 11+, sin 0 de larga distancia."""
+    if not text.isdigit() or len(digits) < 11 or digits.startswith("0"):
+        return False
+    # "111522223333" (nacional con 15) sigue siendo argentino
+    return not (country == "54" and _argentina(digits) is not None)
+
+
+def normalize_phone(raw, country: str = PHONE_COUNTRY_CODE) -> Optional[str]:
+    """
+    "+54 9 11 2222-3333", "whatsapp:5491122223333", "011 15-2222-3333",
+    "1122223333" -> "+5491122223333". None si no hay un número reconocible.
+
+    - Con "+", "00" o empezando con el código de país (y largo internacional),
+      el número ya es internacional; si no, es nacional: sin el 0 de larga
+      distancia y con `country` adelante.
+    - Argentina (54): WhatsApp identifica a los celulares como 54 9 + 10 dígitos,
+      así que se agrega el 9 y se saca el 15. Un fijo queda con el 9 igual: para
+      buscar por WaId da lo mismo, siempre que ambos lados pasen por acá.
+    - Sin característica ("15 2222-3333") no se puede saber el número: None.
+    - Solo dígitos, 11 o más, sin 0 adelante y que no son un número nacional
+      válido: es un WaId de otro país sin "+" ("14155551234" -> "+14155551234").
+    """
+    if raw is None:
+        return None
+    text = str(raw).strip().lower()
+    if text.startswith("whatsapp:"):
+        text = text[len("whatsapp:"):].strip()
+    digits = _NON_DIGITS.sub("", text)
+    if not digits:
+        return None
+
+    if text.startswith("+"):
+        pass
+    elif digits.startswith("00"):
+        digits = digits[2:]
+    elif digits.startswith(country) and len(digits) >= len(country) + 10:
+        pass
+    elif _bare_international(text, digits, country):
+        pass
+    else:
+        digits = country + digits.lstrip("0")
+
+    if digits.startswith("54"):
+        national = digits[2:]
+        if national.startswith("9"):
+            national = national[1:]
+        national = _argentina(national.lstrip("0"))
+        if national is None:
+            return None
+        digits = "549" + national
+
+    # E.164: hasta 15 dígitos; menos de 8 no es un teléfono
+    if not 8 <= len(digits) <= 15:
+        return None
+    return "+" + digits
@@ -0,0 +1,151 @@
+"""
+payment_gateway_stub.py
+Pasarela de pago de mentira para probar el webhook en local (sin red ni
+cuentas): recibe el "pago" del checkout web y le manda al backoffice la
+notificación firmada, igual que haría la pasarela real.
+
+- POST /pay {"order_id", "amount", "store"?, "outcome"?: "paid" | "failed"}
+  → POST {BACKOFFICE_BASE_URL}/payments/webhook con x-payment-signature
+  (HMAC con PAYMENT_WEBHOOK_SECRET, ver payments.py). Devuelve la respuesta
+  del backoffice.
+- Como las pasarelas reales, reintenta con el MISMO event_id si el
+  backoffice no contesta o responde 5xx (PAYMENT_STUB_RETRIES).
+- El checkout web (checkout_web/) la usa si el backoffice tiene
+  PAYMENT_GATEWAY_URL=http://localhost:8002.
+
+Uso:
+    uvicorn payment_gateway_stub:app --port 8002
+    python payment_gateway_stub.py send --order-id 12 --amount 4500.50 [--outcome failed] [--bad-signature]
+    python payment_gateway_stub.py csv --db retail.db --out liquidacion.csv   # conciliación de las pendientes
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import requests
+from dotenv import load_dotenv
+from fastapi import FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+import payments
+
+BASE_DIR = Path(__file__).resolve().parent
+load_dotenv(BASE_DIR / ".env")
+
+BACKOFFICE_BASE_URL = os.getenv("BACKOFFICE_BASE_URL", "http://localhost:8000").rstrip("/")
+PAYMENT_WEBHOOK_SECRET = os.getenv("PAYMENT_WEBHOOK_SECRET", "")
+PAYMENT_STUB_RETRIES = int(os.getenv("PAYMENT_STUB_RETRIES", "3"))
+
+
+def notification(order_id: int, amount: Optional[float], status: str = "paid",
+                 store: Optional[str] = None, event_id: Optional[str] = None) -> bytes:
+    return json.dumps({
+        "event_id": event_id or f"evt_{uuid.uuid4().hex}",
+        "order_id": order_id,
+        "status": status,
+        "amount": amount,
+        "store": store,
+        "created": int(time.time()),
+    }).encode()
+
+
+def send(body: bytes, secret: str = PAYMENT_WEBHOOK_SECRET, bad_signature: bool = False) -> requests.Response:
+    """POST firmado al webhook, con reintentos (mismo cuerpo = mismo event_id)."""
+    last_error: Optional[Exception] = None
+    for attempt in range(PAYMENT_STUB_RETRIES + 1):
+        signature = payments.sign(body, "otra-clave" if bad_signature else secret)
+        try:
+            resp = requests.post(
+                f"{BACKOFFICE_BASE_URL}/payments/webhook",
+                data=body,
+                headers={"Content-Type": "application/json", payments.SIGNATURE_HEADER: signature},
+                timeout=15,
+            )
+            if resp.status_code < 500:
+                return resp
+        except requests.RequestException as e:
+            last_error = e
+        time.sleep(0.5 * 2 ** attempt)
+    if last_error is not None:
+        raise last_error
+    return resp
+
+
+# -------------------------
+# App (la usa el checkout web)
+# -------------------------
+app = FastAPI(title="Pasarela de pago (stub)")
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["POST"], allow_headers=["*"])
+
+
+class PayRequest(BaseModel):
+    order_id: int
+    amount: Optional[float] = None
+    store: Optional[str] = None
+    outcome: str = "paid"
+
+
+@app.post("/pay")
+def pay(payload: PayRequest):
+    resp = send(notification(payload.order_id, payload.amount, payload.outcome, payload.store))
+    try:
+        content: Dict[str, Any] = resp.json()
+    except ValueError:
+        content = {"detail": resp.text}
+    return JSONResponse(status_code=resp.status_code, content=content)
+
+
+# -------------------------
+# CLI
+# -------------------------
+def write_reconcile_csv(db: Path, out: Path, fail_rate: float = 0.1, seed: int = 7) -> int:
+    """Archivo de conciliación con todas las órdenes pendientes (una fracción como failed)."""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db)
+    rows = conn.execute("SELECT id, total FROM orders WHERE payment_status = 'pending' ORDER BY id").fetchall()
+    conn.close()
+    with open(out, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["order_id", "status", "amount"])
+        for order_id, total in rows:
+            w.writerow([order_id, "failed" if rng.random() < fail_rate else "paid", f"{total:.2f}"])
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pasarela de pago de prueba")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_send = sub.add_parser("send", help="mandar una notificación firmada al backoffice")
+    p_send.add_argument("--order-id", type=int, required=True)
+    p_send.add_argument("--amount", type=float)
+    p_send.add_argument("--outcome", choices=sorted(payments.NOTIFIABLE), default="paid")
+    p_send.add_argument("--store")
+    p_send.add_argument("--event-id")
+    p_send.add_argument("--bad-signature", action="store_true")
+    p_csv = sub.add_parser("csv", help="archivo de conciliación con las órdenes pendientes")
+    p_csv.add_argument("--db", type=Path, default=Path(os.getenv("RETAIL_DB_PATH", str(BASE_DIR / "retail.db"))))
+    p_csv.add_argument("--out", type=Path, default=Path("liquidacion.csv"))
+    p_csv.add_argument("--fail-rate", type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.command == "send":
+        body = notification(args.order_id, args.amount, args.outcome, args.store, args.event_id)
+        resp = send(body, bad_signature=args.bad_signature)
+        print(f"💳 {resp.status_code} {resp.text}")
+    else:
+        n = write_reconcile_csv(args.db, args.out, args.fail_rate)
+        print(f"📄 {n} órdenes pendientes en {args.out}")
+
+
+if __name__ == "__main__":
+    main()
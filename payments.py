@@ -0,0 +1,385 @@
+"""
+payments.py
+Notificaciones de la pasarela de pago: firma, máquina de estados de la
+orden y escritura en lotes.
+
+Webhook (POST /payments/webhook):
+- Cuerpo JSON: {"event_id", "order_id", "status": "paid" | "failed",
+  "amount", "store"}. La tienda viaja en el cuerpo (firmado): un mismo id de
+  orden existe en varias tiendas.
+- Header x-payment-signature: "t=<epoch>,v1=<hex>", con
+  hex = HMAC-SHA256(PAYMENT_WEBHOOK_SECRET, "<t>.<cuerpo crudo>"). Se
+  rechaza si no coincide o si t está a más de PAYMENT_SIGNATURE_TOLERANCE
+  segundos (replay).
+
+Máquina de estados (TRANSITIONS): pending → paid | failed. paid y failed son
+finales: un "paid" sobre una orden failed (o al revés) es illegal_transition
+y no se aplica. El admin puede seguir corrigiendo a mano desde
+/admin/orders/{id}/edit. Entrar en failed devuelve al stock lo que
+confirmó el checkout y salir de failed (solo el admin) lo vuelve a tomar,
+en la misma transacción (stock_effects, también para el admin).
+
+Resultados por notificación: applied, unchanged (ya estaba en ese estado),
+duplicate (event_id ya procesado: la pasarela reintentó), not_found,
+illegal_transition, amount_mismatch. Cada event_id queda en payment_events
+con su resultado (idempotencia y auditoría) y cada cambio aplicado agrega
+un evento "order" status_changed al log de cambios (change_events.py), en
+la misma transacción (con `released` si devolvió stock).
+
+Group commit: las notificaciones de una tienda van a una cola; un thread
+escritor toma hasta PAYMENT_BATCH_MAX y las aplica en UNA transacción (un
+solo fsync para todo el lote). Mientras escribe, las siguientes se juntan
+solas; PAYMENT_BATCH_WINDOW_MS agrega una espera opcional para llenar más
+el lote. Cada request espera el resultado de su notificación.
+
+Conciliación: un CSV de la pasarela (order_id, status[, amount][, event_id])
+se aplica en transacciones de PAYMENT_RECONCILE_BATCH filas con las mismas
+reglas. Sin event_id se usa "reconcile:<orden>:<estado>": volver a subir el
+mismo archivo no cambia nada.
+
+Config (env):
+- PAYMENT_WEBHOOK_SECRET        clave HMAC compartida con la pasarela (vacía = webhook deshabilitado)
+- PAYMENT_SIGNATURE_TOLERANCE   segundos de diferencia aceptados en t (default 300)
+- PAYMENT_GROUP_COMMIT          true | false (una transacción por notificación) (default true)
+- PAYMENT_BATCH_MAX             notificaciones por transacción (default 500)
+- PAYMENT_BATCH_WINDOW_MS       espera para juntar más notificaciones (default 0)
+- PAYMENT_WEBHOOK_TIMEOUT       segundos que un request espera su lote (default 10)
+- PAYMENT_RECONCILE_BATCH       filas por transacción al conciliar (default 2000)
+
+Uso:
+    python payments.py reconcile liquidacion.csv --db retail.db
+"""
+
+import argparse
+import csv
+import hashlib
+import hmac
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import change_events
+import inventory
+import metrics
+
+BASE_DIR = Path(__file__).resolve().parent
+
+PAYMENT_WEBHOOK_SECRET = os.getenv("PAYMENT_WEBHOOK_SECRET", "")
+PAYMENT_SIGNATURE_TOLERANCE = float(os.getenv("PAYMENT_SIGNATURE_TOLERANCE", "300"))
+PAYMENT_GROUP_COMMIT = os.getenv("PAYMENT_GROUP_COMMIT", "true").lower() == "true"
+PAYMENT_BATCH_MAX = int(os.getenv("PAYMENT_BATCH_MAX", "500"))
+PAYMENT_BATCH_WINDOW_MS = float(os.getenv("PAYMENT_BATCH_WINDOW_MS", "0"))
+PAYMENT_WEBHOOK_TIMEOUT = float(os.getenv("PAYMENT_WEBHOOK_TIMEOUT", "10"))
+PAYMENT_RECONCILE_BATCH = int(os.getenv("PAYMENT_RECONCILE_BATCH", "2000"))
+
+SIGNATURE_HEADER = "x-payment-signature"
+
+# Estado actual -> estados a los que puede pasar
+TRANSITIONS: Dict[str, tuple] = {
+    "pending": ("paid", "failed"),
+}
+NOTIFIABLE = {s for targets in TRANSITIONS.values() for s in targets}
+
+PAYMENT_UPDATES = metrics.counter(
+    "payment_updates_total", "Notificaciones de pago procesadas", ("source", "result")
+)
+PAYMENT_BATCH_SIZE = metrics.histogram(
+    "payment_batch_size", "Notificaciones por transacción (group commit)", ("source",),
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2000),
+)
+
+
+class InvalidSignature(ValueError):
+    pass
+
+
+class StockUnavailable(Exception):
+    """Sacar la orden de failed necesita volver a tomar su stock y ya no alcanza."""
+
+    def __init__(self, shortages: List[Dict[str, Any]]):
+        super().__init__("; ".join(f"{x['name']}: {x['requested']} (disponible {x['available']})" for x in shortages))
+        self.shortages = shortages
+
+
+class InvalidNotification(ValueError):
+    pass
+
+
+# -------------------------
+# Firma
+# -------------------------
+def sign(body: bytes, secret: str, timestamp: Optional[int] = None) -> str:
+    """Valor del header x-payment-signature para `body` (lo usa la pasarela de prueba)."""
+    t = int(time.time()) if timestamp is None else int(timestamp)
+    mac = hmac.new(secret.encode(), f"{t}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"t={t},v1={mac}"
+
+
+def verify(body: bytes, header: str, secret: str, tolerance: float = PAYMENT_SIGNATURE_TOLERANCE,
+           now: Optional[float] = None):
+    """Levanta InvalidSignature si el header no firma `body` con `secret` o está vencido."""
+    parts = dict(p.split("=", 1) for p in (header or "").split(",") if "=" in p)
+    try:
+        t = int(parts["t"])
+    except (KeyError, ValueError):
+        raise InvalidSignature("firma sin timestamp")
+    if abs((time.time() if now is None else now) - t) > tolerance:
+        raise InvalidSignature("firma vencida")
+    expected = hmac.new(secret.encode(), f"{t}.".encode() + body, hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected, parts.get("v1", "")):
+        raise InvalidSignature("firma inválida")
+
+
+def parse_notification(body: bytes) -> Dict[str, Any]:
+    try:
+        data = json.loads(body)
+        update = {
+            "event_id": str(data["event_id"]),
+            "order_id": int(data["order_id"]),
+            "status": str(data["status"]).lower(),
+            "amount": float(data["amount"]) if data.get("amount") is not None else None,
+            "store": data.get("store") or None,
+        }
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidNotification(f"notificación inválida: {e}")
+    if update["status"] not in NOTIFIABLE:
+        raise InvalidNotification(f"estado desconocido: {update['status']}")
+    return update
+
+
+# -------------------------
+# Máquina de estados (un lote = una transacción)
+# -------------------------
+def _decide(order, status: str, amount: Optional[float]) -> str:
+    if order is None:
+        return "not_found"
+    current = order["payment_status"]
+    if current == status:
+        return "unchanged"
+    if status not in TRANSITIONS.get(current, ()):
+        return "illegal_transition"
+    if amount is not None and abs(amount - float(order["total"])) > 0.005:
+        return "amount_mismatch"
+    return "applied"
+
+
+def stock_effects(conn: sqlite3.Connection, cart_id: int, previous: str, status: str) -> Dict[str, Any]:
+    """
+    Lo que un cambio de estado de la orden hace con su stock, en la
+    transacción del llamador (webhook, conciliación o admin). Entrar en
+    failed devuelve lo confirmado; salir de failed lo vuelve a tomar o
+    levanta StockUnavailable (el llamador hace rollback). Devuelve lo que
+    va al evento status_changed.
+    """
+    if status == previous:
+        return {}
+    if status == "failed":
+        # La orden no se va a pagar: lo reservado vuelve a estar a la venta
+        return {"released": inventory.release_order(conn, cart_id)}
+    if previous == "failed":
+        taken, shortages = inventory.reclaim_order(conn, cart_id)
+        if shortages:
+            raise StockUnavailable(shortages)
+        return {"reclaimed": taken}
+    return {}
+
+
+def apply_updates(conn: sqlite3.Connection, updates: List[Dict[str, Any]], source: str) -> List[Dict[str, Any]]:
+    """
+    Aplica las notificaciones en orden dentro de una sola transacción y hace
+    commit. Devuelve un resultado por notificación.
+    """
+    results = []
+    inventory.begin_write(conn)
+    try:
+        for u in updates:
+            seen = conn.execute(
+                "SELECT order_id, status, result FROM payment_events WHERE event_id = ?", (u["event_id"],)
+            ).fetchone()
+            if seen:
+                results.append({"event_id": u["event_id"], "order_id": seen[0], "result": "duplicate",
+                                "original_result": seen[2]})
+                continue
+            order = conn.execute(
+                "SELECT payment_status, total, cart_id FROM orders WHERE id = ?", (u["order_id"],)
+            ).fetchone()
+            result = _decide(order, u["status"], u.get("amount"))
+            if result == "applied":
+                conn.execute("UPDATE orders SET payment_status = ? WHERE id = ?", (u["status"], u["order_id"]))
+                extra = stock_effects(conn, order["cart_id"], order["payment_status"], u["status"])
+                change_events.record(
+                    conn, "order", u["order_id"], "status_changed",
+                    payment_status=u["status"], previous=order["payment_status"], source=source,
+                    event_id=u["event_id"], **extra,
+                )
+            conn.execute(
+                """
+                INSERT INTO payment_events (event_id, order_id, status, amount, source, result)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (u["event_id"], u["order_id"], u["status"], u.get("amount"), source, result),
+            )
+            results.append({
+                "event_id": u["event_id"],
+                "order_id": u["order_id"],
+                "result": result,
+                "payment_status": u["status"] if result == "applied" else (order["payment_status"] if order else None),
+            })
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    PAYMENT_BATCH_SIZE.observe(len(updates), source=source)
+    for r in results:
+        PAYMENT_UPDATES.inc(source=source, result=r["result"])
+    return results
+
+
+# -------------------------
+# Group commit
+# -------------------------
+class GroupCommitter:
+    """
+    Cola + un thread escritor por tienda: submit() encola y espera; el
+    escritor aplica lo acumulado en una transacción por lote.
+    """
+
+    def __init__(self, name: str, apply: Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]],
+                 max_batch: int = PAYMENT_BATCH_MAX, window_ms: float = PAYMENT_BATCH_WINDOW_MS):
+        self.name = name
+        self._apply = apply
+        self._max_batch = max_batch
+        self._window = window_ms / 1000.0
+        self._queue: List[tuple] = []
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+    def submit(self, update: Dict[str, Any], timeout: float = PAYMENT_WEBHOOK_TIMEOUT) -> Dict[str, Any]:
+        fut: Future = Future()
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("group commit detenido")
+            self._queue.append((update, fut))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"payments-{self.name}", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        try:
+            return fut.result(timeout=timeout)
+        except FutureTimeout:
+            raise TimeoutError(f"lote de pagos de {self.name} sin confirmar en {timeout:g} s")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopping:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                short = len(self._queue) < self._max_batch
+            if short and self._window > 0:
+                time.sleep(self._window)
+            with self._cond:
+                batch = self._queue[:self._max_batch]
+                del self._queue[:self._max_batch]
+            try:
+                results = self._apply([u for u, _ in batch])
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            for (_, fut), r in zip(batch, results):
+                fut.set_result(r)
+
+    def stop(self):
+        """Termina de escribir lo encolado y frena el thread."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout=PAYMENT_WEBHOOK_TIMEOUT)
+
+
+# -------------------------
+# Conciliación
+# -------------------------
+def read_reconcile_csv(text: str) -> Iterator[Dict[str, Any]]:
+    """Filas válidas del CSV de la pasarela; las que no se entienden se saltean (se cuentan como invalid)."""
+    for row in csv.DictReader(io.StringIO(text)):
+        row = {(k or "").strip().lower(): (v or "").strip() for k, v in row.items()}
+        try:
+            order_id = int(row.get("order_id") or row.get("orden") or "")
+            status = (row.get("status") or row.get("estado") or "").lower()
+            amount = row.get("amount") or row.get("monto")
+            amount = float(amount) if amount else None
+        except ValueError:
+            yield {"invalid": True}
+            continue
+        if status not in NOTIFIABLE:
+            yield {"invalid": True}
+            continue
+        yield {
+            "event_id": row.get("event_id") or f"reconcile:{order_id}:{status}",
+            "order_id": order_id,
+            "status": status,
+            "amount": amount,
+        }
+
+
+def _chunks(rows: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk = []
+    for r in rows:
+        chunk.append(r)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def reconcile(conn: sqlite3.Connection, text: str, batch: int = PAYMENT_RECONCILE_BATCH) -> Dict[str, Any]:
+    """Aplica un CSV de conciliación. Devuelve el conteo por resultado y las filas/s."""
+    t0 = time.perf_counter()
+    counts: Dict[str, int] = {}
+    rows = 0
+    for chunk in _chunks(read_reconcile_csv(text), batch):
+        valid = [u for u in chunk if not u.get("invalid")]
+        if len(valid) < len(chunk):
+            counts["invalid"] = counts.get("invalid", 0) + len(chunk) - len(valid)
+        for r in apply_updates(conn, valid, "reconcile") if valid else []:
+            counts[r["result"]] = counts.get(r["result"], 0) + 1
+        rows += len(chunk)
+    elapsed = time.perf_counter() - t0
+    return {"rows": rows, "results": counts, "seconds": round(elapsed, 3),
+            "rows_per_s": round(rows / elapsed, 1) if elapsed else None}
+
+
+# -------------------------
+# CLI
+# -------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Conciliación de pagos (CSV de la pasarela)")
+    parser.add_argument("command", choices=["reconcile"])
+    parser.add_argument("file", type=Path)
+    parser.add_argument("--db", type=Path, default=Path(os.getenv("RETAIL_DB_PATH", str(BASE_DIR / "retail.db"))))
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        out = reconcile(conn, args.file.read_text(encoding="utf-8-sig"))
+    finally:
+        conn.close()
+    print(f"💳 {out['rows']} filas en {out['seconds']} s ({out['rows_per_s']} filas/s): {out['results']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+rate_limit.py
+Rate limiting por clave (IP, usuario, ...) con token bucket.
+
+Cada clave tiene un balde de `capacity` tokens que se recarga a
+`capacity / window` tokens por segundo; cada intento consume uno.
+Es O(1) por chequeo y el estado por clave son dos números.
+
+Backends:
+- memory: dict acotado (LRU) por proceso. Default.
+- sqlite: archivo SQLite compartido entre workers de uvicorn del mismo host;
+  el chequeo es un único UPSERT ... RETURNING (atómico).
+
+Memoria acotada: un balde que ya se recargó completo es idéntico a una
+clave nueva, así que se puede borrar sin perder nada (poda "sin pérdida").
+Si aun así se supera el tope de claves, se descartan las menos recientes.
+
+Config (env):
+- LOGIN_RATE_BACKEND    memory | sqlite | off   (default: memory)
+- LOGIN_RATE_DB         path del archivo sqlite (default: ./rate_limit.db)
+- LOGIN_RATE_MAX        intentos por ventana (default: 5)
+- LOGIN_RATE_WINDOW     segundos de la ventana (default: 60)
+- LOGIN_RATE_MAX_KEYS   tope de claves en memoria / en la tabla (default: 50000)
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Tuple
+
+import metrics
+
+BASE_DIR = Path(__file__).resolve().parent
+
+RATE_LIMIT_CHECKS = metrics.counter("rate_limit_checks_total", "Chequeos de rate limit", ("limiter", "result"))
+
+
+# -------------------------
+# Backend en memoria
+# -------------------------
+class MemoryRateLimiter:
+    """Token bucket por clave en un LRU acotado. Sirve para un único proceso."""
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, name: str, capacity: int, window: float, max_keys: int):
+        self.name = name
+        self.capacity = float(capacity)
+        self.rate = capacity / window
+        self.window = window
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        # key -> [tokens, updated_at]
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+        self._checks = 0
+
+    def hit(self, key: str, now: float = None) -> Tuple[bool, float]:
+        """Consume un token. Devuelve (permitido, segundos hasta el próximo token)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                # Hacemos lugar antes de insertar: si no, _prune ve el balde nuevo lleno y lo borra
+                if len(self._buckets) >= self.max_keys:
+                    self._evict(now)
+                bucket = [self.capacity, now]
+                self._buckets[key] = bucket
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            allowed = bucket[0] >= 1.0
+            if allowed:
+                bucket[0] -= 1.0
+            retry_after = 0.0 if allowed else (1.0 - bucket[0]) / self.rate
+            self._checks += 1
+            if self._checks % self.PRUNE_EVERY == 0:
+                self._prune(now)
+        RATE_LIMIT_CHECKS.inc(limiter=self.name, result="allowed" if allowed else "limited")
+        return allowed, retry_after
+
+    def _prune(self, now: float):
+        # Los más viejos están al principio: cortamos en el primero que no se recargó
+        while self._buckets:
+            key, (tokens, updated) = next(iter(self._buckets.items()))
+            if tokens + (now - updated) * self.rate < self.capacity:
+                break
+            self._buckets.popitem(last=False)
+
+    def _evict(self, now: float):
+        # Deja lugar para una clave nueva
+        self._prune(now)
+        while len(self._buckets) >= self.max_keys:
+            self._buckets.popitem(last=False)
+
+    def reset(self, key: str):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+# -------------------------
+# Backend SQLite (compartido entre workers)
+# -------------------------
+class SQLiteRateLimiter:
+    """
+    Misma interfaz que MemoryRateLimiter, con los baldes en un archivo SQLite.
+    Recarga + consumo en un único UPSERT ... RETURNING (SQLite >= 3.35):
+    dos workers nunca gastan el mismo token.
+    """
+
+    PRUNE_EVERY = 500
+
+    def __init__(self, name: str, path: Path, capacity: int, window: float, max_keys: int):
+        if sqlite3.sqlite_version_info < (3, 35, 0):
+            raise RuntimeError(f"SQLite {sqlite3.sqlite_version} no soporta RETURNING (>= 3.35)")
+        self.name = name
+        self.path = Path(path)
+        self.capacity = float(capacity)
+        self.rate = capacity / window
+        self.window = window
+        self.max_keys = max_keys
+        self._local = threading.local()
+        self._checks = 0
+        self._conn().execute(
+            """
+            CREATE TABLE IF NOT EXISTS rate_limit (
+                limiter    TEXT NOT NULL,
+                key        TEXT NOT NULL,
+                tokens     REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                allowed    INTEGER NOT NULL,
+                PRIMARY KEY (limiter, key)
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn().execute(
+            "CREATE INDEX IF NOT EXISTS idx_rate_limit_updated ON rate_limit(limiter, updated_at)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def hit(self, key: str, now: float = None) -> Tuple[bool, float]:
+        now = time.time() if now is None else now
+        # En el SET todas las expresiones ven la fila vieja: refilled es el balde recargado
+        refilled = "MIN(:cap, rate_limit.tokens + (:now - rate_limit.updated_at) * :rate)"
+        allowed, tokens = self._conn().execute(
+            f"""
+            INSERT INTO rate_limit (limiter, key, tokens, updated_at, allowed)
+            VALUES (:limiter, :key, :cap - 1, :now, 1)
+            ON CONFLICT(limiter, key) DO UPDATE SET
+                tokens = CASE WHEN {refilled} >= 1 THEN {refilled} - 1 ELSE {refilled} END,
+                allowed = CASE WHEN {refilled} >= 1 THEN 1 ELSE 0 END,
+                updated_at = :now
+            RETURNING allowed, tokens
+            """,
+            {"limiter": self.name, "key": key, "cap": self.capacity, "now": now, "rate": self.rate},
+        ).fetchone()
+        self._checks += 1
+        if self._checks % self.PRUNE_EVERY == 0:
+            self.prune(now)
+        allowed = bool(allowed)
+        RATE_LIMIT_CHECKS.inc(limiter=self.name, result="allowed" if allowed else "limited")
+        return allowed, 0.0 if allowed else (1.0 - tokens) / self.rate
+
+    def prune(self, now: float = None):
+        """Borra baldes ya recargados (sin pérdida) y recorta al tope de claves."""
+        now = time.time() if now is None else now
+        conn = self._conn()
+        conn.execute(
+            "DELETE FROM rate_limit WHERE limiter = ? AND updated_at <= ?",
+            (self.name, now - self.window),
+        )
+        conn.execute(
+            """
+            DELETE FROM rate_limit WHERE limiter = ? AND key IN (
+                SELECT key FROM rate_limit WHERE limiter = ?
+                ORDER BY updated_at DESC
+                LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.name, self.name, self.max_keys),
+        )
+
+    def reset(self, key: str):
+        self._conn().execute("DELETE FROM rate_limit WHERE limiter = ? AND key = ?", (self.name, key))
+
+    def __len__(self) -> int:
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM rate_limit WHERE limiter = ?", (self.name,)
+        ).fetchone()[0]
+
+
+# -------------------------
+# Factory
+# -------------------------
+def build_limiter_from_env(name: str = "login"):
+    backend = (os.getenv("LOGIN_RATE_BACKEND", "memory") or "memory").lower()
+    if backend == "off":
+        return None
+    capacity = int(os.getenv("LOGIN_RATE_MAX", "5"))
+    window = float(os.getenv("LOGIN_RATE_WINDOW", "60"))
+    max_keys = int(os.getenv("LOGIN_RATE_MAX_KEYS", "50000"))
+    if backend == "sqlite":
+        path = Path(os.getenv("LOGIN_RATE_DB", str(BASE_DIR / "rate_limit.db")))
+        return SQLiteRateLimiter(name, path, capacity, window, max_keys)
+    return MemoryRateLimiter(name, capacity, window, max_keys)
@@ -0,0 +1,302 @@
+"""
+recommendations.py
+"Se compra junto con": índice item-item de co-ocurrencia en órdenes.
+
+- Cada orden nueva (orders.id > reco_state.last_order_id) suma 1 a
+  product_pairs(a, b) por cada par de productos distintos de su carrito
+  (a < b) y 1 a product_order_counts de cada producto. Es incremental:
+  el job solo lee las órdenes que llegaron desde la corrida anterior.
+- Los pares de cada lote se arman vectorizados con NumPy (matriz dispersa
+  en formato COO: claves a*N+b + np.unique con conteos) y se suman a la
+  base con UPSERT.
+- Para los productos tocados se recalcula el top-k de vecinos con score
+  coseno: pares(a, b) / sqrt(órdenes(a) * órdenes(b)), con un soporte
+  mínimo de RECO_MIN_SUPPORT órdenes, y se guarda en product_related.
+- GET /products/{id}/related y la tool get_related_products leen
+  product_related: una lectura por PK de k filas, sin cálculo en la request.
+
+Config (env):
+- RECO_ENABLED          (default true) agenda el job refresh_recommendations
+- RECO_INTERVAL         segundos entre corridas (default 60)
+- RECO_TOP_K            vecinos guardados por producto (default 20)
+- RECO_MIN_SUPPORT      órdenes mínimas en común para recomendar (default 2)
+- RECO_BATCH_ORDERS     órdenes por lote (default 5000)
+- RECO_MAX_CART_ITEMS   carritos más grandes no suman pares (default 60)
+
+Uso:
+    python recommendations.py rebuild --db retail.db
+    python recommendations.py refresh --db retail.db
+    python recommendations.py related 123 --db retail.db
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List
+
+import inventory
+import metrics
+
+BASE_DIR = Path(__file__).resolve().parent
+
+RECO_ENABLED = os.getenv("RECO_ENABLED", "true").lower() == "true"
+RECO_INTERVAL = float(os.getenv("RECO_INTERVAL", "60"))
+RECO_TOP_K = int(os.getenv("RECO_TOP_K", "20"))
+RECO_MIN_SUPPORT = int(os.getenv("RECO_MIN_SUPPORT", "2"))
+RECO_BATCH_ORDERS = int(os.getenv("RECO_BATCH_ORDERS", "5000"))
+RECO_MAX_CART_ITEMS = int(os.getenv("RECO_MAX_CART_ITEMS", "60"))
+
+_CHUNK = 500  # productos por recálculo de top-k (límite de parámetros de SQLite)
+
+RECO_ORDERS = metrics.counter("reco_orders_ingested_total", "Órdenes sumadas al índice de co-ocurrencia")
+RECO_PRODUCTS = metrics.counter("reco_products_recomputed_total", "Productos con top-k recalculado")
+
+
+# -------------------------
+# Ingesta incremental
+# -------------------------
+def _watermark(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT last_order_id FROM reco_state WHERE id = 1").fetchone()
+    return row[0] if row else 0
+
+
+def order_pairs(order_ids, product_ids, max_items: int = RECO_MAX_CART_ITEMS):
+    """
+    Pares (a, b, órdenes) con a < b a partir de filas (orden, producto).
+    Devuelve (a, b, count, productos, count_productos) como arrays de NumPy.
+    """
+    import numpy as np
+
+    orders = np.asarray(order_ids, dtype=np.int64)
+    products = np.asarray(product_ids, dtype=np.int64)
+    # Una fila por (orden, producto), ordenadas por orden y producto
+    rows = np.unique(np.stack([orders, products], axis=1), axis=0) if len(orders) else np.empty((0, 2), np.int64)
+    orders, products = rows[:, 0], rows[:, 1]
+    prod_ids, prod_counts = np.unique(products, return_counts=True)
+
+    # Segmento de cada orden: [start, end)
+    _, starts, sizes = np.unique(orders, return_index=True, return_counts=True)
+    keep = (sizes >= 2) & (sizes <= max_items)
+    starts, sizes = starts[keep], sizes[keep]
+    if not len(starts):
+        empty = np.empty(0, np.int64)
+        return empty, empty, empty, prod_ids, prod_counts
+
+    # Para cada fila i de una orden, pares con las filas j > i de la misma orden
+    seg_end = np.repeat(starts + sizes, sizes)
+    idx = np.repeat(starts, sizes) + (np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes))
+    per_row = seg_end - idx - 1
+    left = np.repeat(idx, per_row)
+    first = np.cumsum(per_row) - per_row
+    right = left + 1 + (np.arange(per_row.sum()) - np.repeat(first, per_row))
+
+    # products viene ordenado dentro de cada orden: products[left] < products[right]
+    n = int(products.max()) + 1
+    keys, counts = np.unique(products[left] * n + products[right], return_counts=True)
+    return keys // n, keys % n, counts, prod_ids, prod_counts
+
+
+def ingest_orders(conn: sqlite3.Connection, batch: int = RECO_BATCH_ORDERS) -> Dict[str, Any]:
+    """Suma al índice el próximo lote de órdenes. Devuelve órdenes leídas y productos tocados."""
+    inventory.begin_write(conn)
+    try:
+        last = _watermark(conn)
+        order_rows = conn.execute(
+            "SELECT id, cart_id FROM orders WHERE id > ? ORDER BY id LIMIT ?", (last, batch)
+        ).fetchall()
+        if not order_rows:
+            conn.commit()
+            return {"orders": 0, "products": []}
+        new_last = order_rows[-1][0]
+        items = conn.execute(
+            """
+            SELECT o.id, ci.product_id
+            FROM orders o JOIN cart_items ci ON ci.cart_id = o.cart_id
+            WHERE o.id > ? AND o.id <= ?
+            """,
+            (last, new_last),
+        ).fetchall()
+
+        a, b, counts, prod_ids, prod_counts = order_pairs([r[0] for r in items], [r[1] for r in items])
+        conn.executemany(
+            """
+            INSERT INTO product_pairs (a, b, orders) VALUES (?, ?, ?)
+            ON CONFLICT(a, b) DO UPDATE SET orders = orders + excluded.orders
+            """,
+            zip(a.tolist(), b.tolist(), counts.tolist()),
+        )
+        conn.executemany(
+            """
+            INSERT INTO product_order_counts (product_id, orders) VALUES (?, ?)
+            ON CONFLICT(product_id) DO UPDATE SET orders = orders + excluded.orders
+            """,
+            zip(prod_ids.tolist(), prod_counts.tolist()),
+        )
+        conn.execute(
+            """
+            INSERT INTO reco_state (id, last_order_id, updated_at) VALUES (1, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(id) DO UPDATE SET last_order_id = excluded.last_order_id, updated_at = excluded.updated_at
+            """,
+            (new_last,),
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    RECO_ORDERS.inc(len(order_rows))
+    # Se recalculan los productos de estas órdenes; sus vecinos se ponen al día
+    # cuando les llega una orden propia (o con rebuild)
+    return {"orders": len(order_rows), "products": prod_ids.tolist()}
+
+
+# -------------------------
+# Top-k por producto
+# -------------------------
+def recompute(conn: sqlite3.Connection, product_ids: Iterable[int], k: int = RECO_TOP_K,
+              min_support: int = RECO_MIN_SUPPORT) -> int:
+    """Recalcula product_related para estos productos. Devuelve cuántos se procesaron."""
+    import numpy as np
+
+    ids = sorted(set(int(p) for p in product_ids))
+    if not ids:
+        return 0
+    # Órdenes por producto como array denso indexado por id
+    counts = conn.execute("SELECT product_id, orders FROM product_order_counts").fetchall()
+    totals = np.ones(max([c[0] for c in counts] + ids) + 1, dtype=np.float64)
+    if counts:
+        c = np.array(counts, dtype=np.int64)
+        totals[c[:, 0]] = c[:, 1]
+
+    done = 0
+    for i in range(0, len(ids), _CHUNK):
+        chunk = ids[i:i + _CHUNK]
+        marks = ",".join("?" * len(chunk))
+        pairs = conn.execute(
+            f"""
+            SELECT a, b, orders FROM product_pairs WHERE a IN ({marks}) AND orders >= ?
+            UNION ALL
+            SELECT b, a, orders FROM product_pairs WHERE b IN ({marks}) AND orders >= ?
+            """,
+            (*chunk, min_support, *chunk, min_support),
+        ).fetchall()
+
+        rows: List[tuple] = []
+        if pairs:
+            arr = np.array(pairs, dtype=np.int64)
+            src, dst, together = arr[:, 0], arr[:, 1], arr[:, 2].astype(np.float64)
+            score = together / np.sqrt(totals[src] * totals[dst])
+
+            # Orden por producto y score descendente; rank dentro de cada producto
+            order = np.lexsort((dst, -score, src))
+            src, dst, together, score = src[order], dst[order], together[order], score[order]
+            _, first = np.unique(src, return_index=True)
+            group_start = np.repeat(first, np.diff(np.append(first, len(src))))
+            rank = np.arange(len(src)) - group_start
+            top = rank < k
+            rows = list(zip(
+                src[top].tolist(), rank[top].tolist(), dst[top].tolist(),
+                np.round(score[top], 6).tolist(), together[top].astype(np.int64).tolist(),
+            ))
+
+        inventory.begin_write(conn)
+        conn.execute(f"DELETE FROM product_related WHERE product_id IN ({marks})", chunk)
+        conn.executemany(
+            "INSERT INTO product_related (product_id, rank, related_id, score, orders) VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        conn.commit()
+        done += len(chunk)
+    RECO_PRODUCTS.inc(done)
+    return done
+
+
+def refresh(conn: sqlite3.Connection, max_seconds: float = 10.0, pause: float = 0.05) -> Dict[str, Any]:
+    """Job incremental: ingesta de órdenes nuevas y recálculo de los productos tocados."""
+    deadline = time.monotonic() + max_seconds
+    orders = products = 0
+    more = True
+    while time.monotonic() < deadline:
+        r = ingest_orders(conn)
+        if not r["orders"]:
+            more = False
+            break
+        orders += r["orders"]
+        products += recompute(conn, r["products"])
+        time.sleep(pause)
+    return {"orders": orders, "products_recomputed": products, "more": more}
+
+
+def rebuild(conn: sqlite3.Connection) -> Dict[str, Any]:
+    """Borra el índice y lo arma de cero con todas las órdenes."""
+    inventory.begin_write(conn)
+    for table in ("product_pairs", "product_order_counts", "product_related", "reco_state"):
+        conn.execute(f"DELETE FROM {table}")
+    conn.commit()
+    orders = 0
+    touched = set()
+    while True:
+        r = ingest_orders(conn)
+        if not r["orders"]:
+            break
+        orders += r["orders"]
+        touched.update(r["products"])
+    return {"orders": orders, "products_recomputed": recompute(conn, touched)}
+
+
+# -------------------------
+# Lectura
+# -------------------------
+def related(conn: sqlite3.Connection, product_id: int, limit: int = 5) -> List[Dict[str, Any]]:
+    rows = conn.execute(
+        """
+        SELECT p.id, p.sku, p.name, p.category, p.price, p.is_offer, p.stock,
+               r.score, r.orders
+        FROM product_related r
+        JOIN products p ON p.id = r.related_id
+        WHERE r.product_id = ?
+        ORDER BY r.rank
+        LIMIT ?
+        """,
+        (product_id, limit),
+    ).fetchall()
+    return [
+        {
+            "id": r[0], "sku": r[1], "name": r[2], "category": r[3], "price": r[4],
+            "is_offer": bool(r[5]), "stock": r[6], "score": r[7], "orders_together": r[8],
+        }
+        for r in rows
+    ]
+
+
+# -------------------------
+# CLI
+# -------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Índice 'se compra junto con'")
+    parser.add_argument("command", choices=["rebuild", "refresh", "related"])
+    parser.add_argument("product_id", nargs="?", type=int)
+    parser.add_argument("--db", type=Path, default=Path(os.getenv("RETAIL_DB_PATH", str(BASE_DIR / "retail.db"))))
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, timeout=30)
+    conn.executescript((BASE_DIR / "schema.sql").read_text(encoding="utf-8"))
+    if args.command == "related":
+        if args.product_id is None:
+            parser.error("related necesita un product_id")
+        t0 = time.perf_counter()
+        items = related(conn, args.product_id, args.limit)
+        elapsed = (time.perf_counter() - t0) * 1e6
+        for it in items:
+            print(f"  #{it['id']:<7} {it['name']:<50} score {it['score']:.3f} ({it['orders_together']} órdenes)")
+        print(f"{len(items)} relacionados en {elapsed:.0f} µs")
+        return
+    t0 = time.perf_counter()
+    result = rebuild(conn) if args.command == "rebuild" else refresh(conn, max_seconds=3600)
+    print(f"🔗 {args.command}: {result} en {time.perf_counter() - t0:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,13 +10,16 @@ from agent_tools_backoffice import (
     search_users,
     create_user,
     search_products,
+    resolve_shopping_list,
     add_product_to_cart,
     get_cart_summary,
     checkout_cart,
     get_last_order_status,
     get_checkout_link_for_last_order,
-    clear_cart    
+    clear_cart,
+    get_related_products,
 )
+from fake_model import build_model
 
 
 # =========================
@@ -25,7 +28,8 @@ from agent_tools_backoffice import (
 
 root_agent = Agent(
     name="retail_assistant",
-    model="gemini-2.0-flash-exp",
+    # RETAIL_MODEL_BACKEND=scripted|replay usa un modelo falso (ver fake_model.py)
+    model=build_model("gemini-2.0-flash-exp"),
     description=(
         "Sos Milo, un asistente virtual de supermercado que atiende clientes por WhatsApp. "
         "Ayudás a encontrar productos del catálogo, armar y revisar el carrito, generar el link de pago "
@@ -118,6 +122,8 @@ root_agent = Agent(
         # =========================
         "2) PRODUCTOS (CATÁLOGO REAL):\n"
         "- Para buscar: search_products(query, category, only_offers).\n"
+        "- Si el pedido es una descripción y no un producto ('algo para el desayuno', 'bebida sin alcohol',\n"
+        "  'cosas para limpiar'), usá search_products(query, mode='hybrid').\n"
         "- Mostrá opciones reales (nombre + precio). No inventes.\n"
         "- Si el usuario pide algo genérico ('quiero fideos', 'quiero cerveza'):\n"
         "  * Mostrá 2 a 5 opciones reales y preguntá cuál quiere.\n"
@@ -137,12 +143,23 @@ root_agent = Agent(
         "  * No menciones marcas, precios ni disponibilidad en esta etapa.\n\n"
 
         "- Luego ofrecé buscar esos ingredientes en el catálogo real.\n"
-        "  * Solo confirmes disponibilidad o precios después de usar search_products.\n"
-        "  * Si un ingrediente no existe en el catálogo, decilo explícitamente.\n\n"
+        "  * Buscalos TODOS juntos con UNA sola llamada a resolve_shopping_list(items) "
+        "(no llames search_products una vez por ingrediente).\n"
+        "  * Por cada ingrediente mostrá la mejor opción (nombre + precio) de candidates.\n"
+        "  * status='out_of_stock' → decí que no hay stock; status='not_found' → decí que no está en el catálogo.\n"
+        "  * Si la respuesta trae degraded=true, la búsqueda fue parcial: para los 'not_found' no digas que no "
+        "existen; decí que no los encontraste por ahora y ofrecé volver a buscarlos en un rato.\n"
+        "  * Solo confirmes disponibilidad o precios después de usar resolve_shopping_list o search_products.\n\n"
 
         "- Nunca asumas que un ingrediente existe en el catálogo sin buscarlo.\n"
         "- Nunca agregues productos al carrito sin confirmación explícita del usuario.\n\n"
 
+        "- COMPLEMENTOS ('se compra junto con'):\n"
+        "  * Después de agregar un producto al carrito podés usar get_related_products(product_id) "
+        "y ofrecer 1 o 2 de los items devueltos (nombre + precio), en una sola línea.\n"
+        "  * Solo sugerí lo que devuelva la tool; si devuelve 0 items, no sugieras nada.\n"
+        "  * No insistas: si el usuario no los quiere, seguí con lo que pidió.\n\n"
+
         # =========================
         # 3) CARRITO
         # =========================
@@ -215,11 +232,13 @@ root_agent = Agent(
         search_users,
         create_user,
         search_products,
+        resolve_shopping_list,
         add_product_to_cart,
         get_cart_summary,
         checkout_cart,
         get_last_order_status,
         get_checkout_link_for_last_order,
-        clear_cart
+        clear_cart,
+        get_related_products,
     ],
 )
@@ -6,12 +6,14 @@ Incluye:
 - search_users (NUEVA - busca usuarios y devuelve candidatos)
 - create_user (NUEVA - crea usuario directamente)
 - search_products
+- resolve_shopping_list
 - add_product_to_cart
 - get_cart_summary
 - clear_cart
 - checkout_cart
 - get_last_order_status
 - get_checkout_link_for_last_order
+- get_related_products
 """
 
 import os
@@ -19,6 +21,9 @@ from typing import List, Dict, Any, Optional
 
 import requests
 
+import shards
+import tracing
+
 # =====================================================
 # ENV / CONFIG
 # =====================================================
@@ -66,7 +71,15 @@ _session.mount("https://", adapter)
 
 def _auth_headers() -> Dict[str, str]:
     # EXACTO como lo espera FastAPI (Header -> x-api-key)
-    return {"x-api-key": BACKOFFICE_API_KEY}
+    # + contexto de traza para que el backoffice cuelgue sus spans del turno
+    # + tienda del turno (x-store-id) cuando hay una base por tienda
+    return {"x-api-key": BACKOFFICE_API_KEY, **tracing.outgoing_header(), **shards.outgoing_header()}
+
+
+def _checkout_url(order_id: int) -> str:
+    """Link corto de pago; con varias tiendas lleva ?store= (el id de orden se repite entre tiendas)."""
+    url = f"{BACKOFFICE_BASE_URL}/checkout/{order_id}"
+    return f"{url}?store={shards.current_store()}" if shards.SHARDED else url
 
 # =====================================================
 # HTTP HELPERS (UNA SOLA DEFINICIÓN, SIN DUPLICADOS)
@@ -80,12 +93,15 @@ def _api_get(path: str, params: Optional[Dict[str, Any]] = None) -> Any:
     - Si devuelve otro error -> levanta excepción (las tools lo capturan y normalizan).
     """
     url = f"{BACKOFFICE_BASE_URL}{path}"
-    # Timeout más agresivo: (connect_timeout, read_timeout)
-    resp = _session.get(url, params=params, headers=_auth_headers(), timeout=(2, 8))
-    if resp.status_code == 404:
-        return None
-    resp.raise_for_status()
-    return resp.json()
+    with tracing.span(f"GET {tracing.route_name(path)}", "http") as s:
+        # Timeout más agresivo: (connect_timeout, read_timeout)
+        resp = _session.get(url, params=params, headers=_auth_headers(), timeout=(2, 8))
+        if s is not None:
+            s.set(status_code=resp.status_code)
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        return resp.json()
 
 def _api_post(path: str, json_data: Dict[str, Any]) -> Any:
     """
@@ -94,10 +110,13 @@ def _api_post(path: str, json_data: Dict[str, Any]) -> Any:
     - Si devuelve error -> levanta excepción (las tools lo capturan y normalizan).
     """
     url = f"{BACKOFFICE_BASE_URL}{path}"
-    # Timeout más agresivo
-    resp = _session.post(url, json=json_data, headers=_auth_headers(), timeout=(2, 8))
-    resp.raise_for_status()
-    return resp.json()
+    with tracing.span(f"POST {tracing.route_name(path)}", "http") as s:
+        # Timeout más agresivo
+        resp = _session.post(url, json=json_data, headers=_auth_headers(), timeout=(2, 8))
+        if s is not None:
+            s.set(status_code=resp.status_code)
+        resp.raise_for_status()
+        return resp.json()
 
 # =====================================================
 # TOOL 1: search_users (mejorada + normalización)
@@ -112,7 +131,7 @@ def search_users(
     Busca usuarios en la base de datos usando cualquier combinación de:
     - name (búsqueda parcial)
     - email (búsqueda exacta)
-    - phone (búsqueda exacta)
+    - phone (búsqueda exacta; el backoffice lo normaliza, ej. "whatsapp:+549..." o "011 15-...")
 
     Devuelve:
     - status: "found" | "multiple" | "not_found" | "error"
@@ -211,8 +230,6 @@ def create_user(
     
     OPTIMIZADO: Intenta crear directamente. Si falla por duplicado, es porque ya existe.
     """
-    print(f"🆕 create_user called: name={name}, email={email}, phone={phone}")
-
     # Normalización
     name = " ".join((name or "").strip().split())
     email = (email or "").strip().lower()
@@ -241,8 +258,6 @@ def create_user(
             },
         )
 
-        print(f"✅ Usuario creado: id={new_user['id']}")
-        
         return {
             "status": "created",
             "message": f"Usuario creado exitosamente: {new_user.get('name','')} ({new_user.get('email','')})",
@@ -291,23 +306,27 @@ def create_user(
         }
 
 # =====================================================
-# TOOL 3: search_products (sin cambios)
+# TOOL 3: search_products
 # =====================================================
 
 def search_products(
     query: str,
     category: Optional[str] = None,
     only_offers: bool = False,
+    mode: str = "auto",
 ) -> Dict[str, Any]:
     """
     Busca productos en el catálogo real del backoffice.
 
     Implementación:
-    - GET /products
-    - Filtra en memoria:
+    - GET /products/search (el backoffice filtra sobre el snapshot del catálogo):
       - texto (name, description, category, sku) - SIN ACENTOS
+      - si no hay coincidencia exacta, tolera errores de tipeo ("cerbeza", "yerva")
+        y después busca por similitud
       - categoría (opcional)
       - solo ofertas (opcional).
+    - mode: "auto" (default) para nombres de producto; "hybrid" para pedidos
+      descriptivos ("algo para el desayuno", "bebida sin alcohol", "cosas para limpiar").
 
     Devuelve:
       {
@@ -315,55 +334,22 @@ def search_products(
         "items": [ {id, sku, name, category, price, is_offer, stock}, ... ]
       }
     """
-    import unicodedata
-    
-    def remove_accents(text: str) -> str:
-        """Remueve acentos para búsqueda flexible"""
-        return ''.join(
-            c for c in unicodedata.normalize('NFD', text)
-            if unicodedata.category(c) != 'Mn'
-        )
-    
+    params: Dict[str, Any] = {"q": (query or "").strip(), "limit": 25}
+    if mode in ("exact", "fuzzy", "semantic", "hybrid"):
+        params["mode"] = mode
+    if category:
+        params["category"] = category
+    if only_offers:
+        params["only_offers"] = "true"
+
     try:
-        products = _api_get("/products") or []
+        products = _api_get("/products/search", params=params) or []
     except Exception as e:
         return {
             "status": "error",
             "error_message": f"No pude consultar el catálogo del backoffice. Detalle: {e}",
         }
 
-    # Normalizar query (sin acentos, lowercase)
-    q = remove_accents((query or "").strip().lower())
-
-    def matches(p: Dict[str, Any]) -> bool:
-        # filtro textual (sin acentos)
-        if q:
-            text = " ".join(
-                [
-                    str(p.get("name", "")),
-                    str(p.get("description", "")),
-                    str(p.get("category", "")),
-                    str(p.get("sku", "")),
-                ]
-            )
-            text_normalized = remove_accents(text.lower())
-            if q not in text_normalized:
-                return False
-
-        # filtro por categoría
-        if category:
-            cat = str(p.get("category") or "").lower()
-            if category.lower() not in cat:
-                return False
-
-        # filtro por ofertas
-        if only_offers:
-            if not bool(p.get("is_offer")):
-                return False
-
-        return True
-
-    filtered = [p for p in products if matches(p)]
     simplified = [
         {
             "id": p["id"],
@@ -374,7 +360,7 @@ def search_products(
             "is_offer": bool(p.get("is_offer")),
             "stock": p.get("stock", 0),
         }
-        for p in filtered[:25]
+        for p in products
     ]
 
     return {
@@ -382,6 +368,60 @@ def search_products(
         "items": simplified,
     }
 
+# =====================================================
+# TOOL 3.5: resolve_shopping_list (recetas: todos los ingredientes de una)
+# =====================================================
+
+def resolve_shopping_list(items: List[str]) -> Dict[str, Any]:
+    """
+    Busca en el catálogo TODOS los ingredientes de una lista en una sola llamada.
+
+    Implementación:
+    - POST /products/resolve  body: {"items": [...], "per_item": 3}
+
+    Devuelve:
+      {
+        "status": "success",
+        "items": [
+          {"item": "2 tomates", "status": "found" | "out_of_stock" | "not_found",
+           "quantity": 2, "candidates": [ {id, sku, name, category, price, is_offer, stock}, ... ]},
+          ...
+        ],
+        "degraded": false
+      }
+
+    degraded=True: el backoffice buscó sin el índice difuso (solo coincidencias
+    exactas), así que un "not_found" puede ser un producto que sí existe.
+    """
+    clean = [str(i).strip() for i in (items or []) if str(i).strip()]
+    if not clean:
+        return {
+            "status": "error",
+            "error_message": "La lista de ingredientes está vacía.",
+        }
+
+    try:
+        result = _api_post("/products/resolve", {"items": clean[:50], "per_item": 3}) or {}
+    except Exception as e:
+        return {
+            "status": "error",
+            "error_message": f"No pude consultar el catálogo del backoffice. Detalle: {e}",
+        }
+
+    return {
+        "status": "success",
+        "items": [
+            {
+                "item": it["item"],
+                "status": it["status"],
+                "quantity": it.get("quantity"),
+                "candidates": it.get("candidates", []),
+            }
+            for it in result.get("items", [])
+        ],
+        "degraded": bool(result.get("degraded")),
+    }
+
 # =====================================================
 # TOOL 4: add_product_to_cart (mejorado con validación)
 # =====================================================
@@ -433,11 +473,7 @@ def add_product_to_cart(
     # Validar stock disponible
     # -------------------------
     try:
-        products = _api_get("/products") or []
-        p = next(
-            (x for x in products if int(x.get("id")) == int(product_id)),
-            None
-        )
+        p = _api_get(f"/products/{int(product_id)}")
 
         if not p:
             return {
@@ -629,7 +665,7 @@ def checkout_cart(user_id: int, email: str) -> Dict[str, Any]:
     short_url = None
     if order_id is not None:
         # Usa la API del backoffice para redirigir a index.html
-        short_url = f"{BACKOFFICE_BASE_URL}/checkout/{order_id}"
+        short_url = _checkout_url(order_id)
 
     return {
         "status": "success",
@@ -706,7 +742,7 @@ def get_checkout_link_for_last_order(user_id: int) -> Dict[str, Any]:
         return {
             "status": "success",
             "order_id": order_id,
-            "payment_url": f"{BACKOFFICE_BASE_URL}/checkout/{order_id}"
+            "payment_url": _checkout_url(order_id)
         }
 
     except Exception as e:
@@ -714,3 +750,47 @@ def get_checkout_link_for_last_order(user_id: int) -> Dict[str, Any]:
             "status": "error",
             "message": f"Error al obtener el link de pago: {e}"
         }
+
+
+# =====================================================
+# TOOL: get_related_products ("se compra junto con")
+# =====================================================
+
+def get_related_products(product_id: int, limit: int = 5) -> Dict[str, Any]:
+    """
+    Productos que otros clientes compraron junto con product_id.
+
+    Implementación:
+    - GET /products/{product_id}/related (índice precalculado de co-ocurrencia en órdenes)
+
+    Devuelve:
+      {
+        "status": "success",
+        "items": [ {id, sku, name, category, price, is_offer, stock, orders_together}, ... ]
+      }
+    """
+    try:
+        limit = max(1, min(int(limit or 5), 10))
+        result = _api_get(f"/products/{int(product_id)}/related", params={"limit": limit}) or {}
+    except Exception as e:
+        return {
+            "status": "error",
+            "error_message": f"No pude consultar productos relacionados. Detalle: {e}",
+        }
+
+    items = [
+        {
+            "id": p["id"],
+            "sku": p["sku"],
+            "name": p["name"],
+            "category": p.get("category"),
+            "price": p["price"],
+            "is_offer": bool(p.get("is_offer")),
+            "stock": p.get("stock", 0),
+            "orders_together": p.get("orders_together", 0),
+        }
+        # Sin stock no tiene sentido sugerirlo
+        for p in result.get("items", [])
+        if (p.get("stock") or 0) > 0
+    ]
+    return {"status": "success", "items": items}
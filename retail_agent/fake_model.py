@@ -0,0 +1,295 @@
+"""
+fake_model.py
+Modelos falsos y determinísticos para correr `root_agent` sin llamar a Gemini.
+
+Se eligen con RETAIL_MODEL_BACKEND (ver `build_model`):
+
+- gemini   (default) -> el modelo real.
+- scripted -> ScriptedShopperLlm, un "cliente" que entiende mensajes fijos.
+- replay   -> ReplayLlm, reproduce un guion JSON de tool calls y textos.
+
+Ambos aceptan latencia artificial (RETAIL_MODEL_LATENCY_MS, con
+RETAIL_MODEL_JITTER_MS de variación) para medir tools, sesiones y bridge
+de punta a punta sin red.
+
+ScriptedShopperLlm interpreta mensajes con un formato fijo (los que genera
+loadtest_whatsapp.py) y emite las mismas tool calls que haría Milo:
+
+- "hola"                 -> identificación (search_users / create_user)
+- "busco <texto>"        -> search_products(query=<texto>)
+- "agregá <n> <texto>"   -> search_products + add_product_to_cart
+- "ver carrito"          -> get_cart_summary
+- "vaciar carrito"       -> clear_cart
+- "pagar"                -> checkout_cart
+
+Antes de cualquier intención identifica al usuario por el número de
+WhatsApp que el bridge inyecta en "[INFO INTERNA: Usuario WhatsApp #...]".
+No hay aleatoriedad: la misma conversación produce las mismas llamadas.
+"""
+
+import abc
+import asyncio
+import json
+import os
+import random
+import re
+from pathlib import Path
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.genai import types
+
+_WA_ID = re.compile(r"Usuario WhatsApp #(\S+?)\]")
+_ADD = re.compile(r"^agreg[aá]\s+(\d+)\s+(.+)$", re.IGNORECASE)
+_SEARCH = re.compile(r"^busco\s+(.+)$", re.IGNORECASE)
+
+
+def _text_of(content: types.Content) -> str:
+    return "".join(p.text for p in (content.parts or []) if getattr(p, "text", None))
+
+
+def _function_responses(content: types.Content) -> List[Tuple[str, Dict[str, Any]]]:
+    out = []
+    for p in content.parts or []:
+        fr = getattr(p, "function_response", None)
+        if fr is not None:
+            out.append((fr.name, dict(fr.response or {})))
+    return out
+
+
+def _call(tool: str, args: Dict[str, Any]) -> LlmResponse:
+    return LlmResponse(
+        content=types.Content(
+            role="model",
+            parts=[types.Part(function_call=types.FunctionCall(name=tool, args=args))],
+        )
+    )
+
+
+def _say(text: str) -> LlmResponse:
+    return LlmResponse(content=types.Content(role="model", parts=[types.Part(text=text)]))
+
+
+class _FakeLlm(BaseLlm, abc.ABC):
+    """
+    Base común: latencia artificial `latency_ms` ± `jitter_ms` por llamada.
+    Cada modelo falso define next_response.
+    """
+
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+
+    async def _simulate_latency(self):
+        delay = self.latency_ms
+        if self.jitter_ms:
+            delay += random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        await self._simulate_latency()
+        yield self.next_response(llm_request.contents or [])
+
+    @abc.abstractmethod
+    def next_response(self, contents: List[types.Content]) -> LlmResponse:
+        """Respuesta del modelo para el historial de la sesión."""
+
+
+class ScriptedShopperLlm(_FakeLlm):
+    """BaseLlm determinístico que interpreta los mensajes del load test."""
+
+    model: str = "scripted-shopper"
+
+    # -------------------------
+    # Lógica del guion
+    # -------------------------
+    def next_response(self, contents: List[types.Content]) -> LlmResponse:
+        # Último mensaje de texto del usuario = inicio del turno actual
+        turn_start = 0
+        for i, c in enumerate(contents):
+            if c.role == "user" and _text_of(c):
+                turn_start = i
+        message = _text_of(contents[turn_start]) if contents else ""
+        m = _WA_ID.search(message)
+        wa_id = m.group(1) if m else "0"
+        body = message.split("\n\n", 1)[-1].strip()
+
+        # Respuestas de tools: de toda la sesión (para el user_id) y del turno actual
+        history: List[Tuple[str, Dict[str, Any]]] = []
+        for c in contents:
+            history.extend(_function_responses(c))
+        turn: List[Tuple[str, Dict[str, Any]]] = []
+        for c in contents[turn_start + 1:]:
+            turn.extend(_function_responses(c))
+        turn_names = [name for name, _ in turn]
+
+        # 1) Identificación
+        user_id = self._known_user_id(history)
+        if user_id is None:
+            if "search_users" not in turn_names:
+                return _call("search_users", {"phone": wa_id})
+            if "create_user" not in turn_names:
+                return _call(
+                    "create_user",
+                    {"name": f"Cliente {wa_id[-4:]}", "email": f"{wa_id}@loadtest.example.com", "phone": wa_id},
+                )
+            return _say("Perdón, no pude registrarte. Probá de nuevo en un ratito.")
+
+        # 2) Intención del mensaje
+        low = body.lower()
+        add = _ADD.match(body)
+        search = _SEARCH.match(body)
+        if add or search:
+            query = (add or search).group(2 if add else 1).strip()
+            products = self._last(turn, "search_products")
+            if products is None:
+                return _call("search_products", {"query": query})
+            items = products.get("items") or []
+            if not items:
+                return _say(f"No encontré '{query}' en el catálogo.")
+            if search:
+                listing = ", ".join(f"{p['name']} (${p['price']})" for p in items[:3])
+                return _say(f"Tengo: {listing}")
+            added = self._last(turn, "add_product_to_cart")
+            if added is None:
+                return _call(
+                    "add_product_to_cart",
+                    {"user_id": user_id, "product_id": items[0]["id"], "quantity": int(add.group(1))},
+                )
+            if added.get("status") != "success":
+                return _say(added.get("error_message") or "No pude agregarlo.")
+            return _say(added.get("message") or "Listo, agregado.")
+
+        if "carrito" in low and "vaciar" in low:
+            cleared = self._last(turn, "clear_cart")
+            if cleared is None:
+                return _call("clear_cart", {"user_id": user_id})
+            return _say("Listo, vacié tu carrito.")
+
+        if "carrito" in low:
+            summary = self._last(turn, "get_cart_summary")
+            if summary is None:
+                return _call("get_cart_summary", {"user_id": user_id})
+            return _say(f"Tenés {len(summary.get('items') or [])} productos, total ${summary.get('total', 0)}")
+
+        if "pagar" in low:
+            checkout = self._last(turn, "checkout_cart")
+            if checkout is None:
+                return _call("checkout_cart", {"user_id": user_id, "email": f"{wa_id}@loadtest.example.com"})
+            if checkout.get("status") != "success":
+                return _say(checkout.get("error_message") or "No pude cerrar la compra.")
+            return _say(f"Te dejo el link de pago:\n{checkout.get('payment_url')}")
+
+        return _say("¡Hola! Soy Milo. Puedo buscar productos, armar tu carrito y pasarte el link de pago.")
+
+    @staticmethod
+    def _last(responses: List[Tuple[str, Dict[str, Any]]], name: str) -> Optional[Dict[str, Any]]:
+        for n, r in reversed(responses):
+            if n == name:
+                return r
+        return None
+
+    @staticmethod
+    def _known_user_id(history: List[Tuple[str, Dict[str, Any]]]) -> Optional[int]:
+        for name, r in reversed(history):
+            if name == "search_users" and r.get("status") == "found":
+                return r["users"][0]["id"]
+            if name == "create_user" and r.get("status") in ("created", "exists"):
+                return r["user"]["id"]
+        return None
+
+
+# -------------------------
+# ReplayLlm: guion JSON
+# -------------------------
+_REF = re.compile(r"^\{([\w.]+)\}$")
+
+
+class ReplayLlm(_FakeLlm):
+    """
+    Reproduce un guion fijo, paso por paso. Formato del JSON (lista o {"steps": [...]}):
+
+        [
+          {"call": "search_users", "args": {"phone": "{wa_id}"}},
+          {"text": "¡Hola! Soy Milo."},
+          {"call": "get_cart_summary", "args": {"user_id": "{search_users.users.0.id}"}},
+          {"text": "Tu carrito está listo."}
+        ]
+
+    El paso a emitir es la cantidad de respuestas del modelo que ya hay en
+    la sesión, así que cada sesión recorre el guion desde el principio (sin
+    estado compartido entre usuarios concurrentes). Al terminar vuelve a
+    empezar. En los args, "{wa_id}" es el número del usuario y
+    "{tool.campo.0.x}" toma un valor de la última respuesta de esa tool.
+    """
+
+    model: str = "replay"
+    steps: List[Dict[str, Any]]
+
+    def next_response(self, contents: List[types.Content]) -> LlmResponse:
+        if not self.steps:
+            return _say("")
+        done = sum(1 for c in contents if c.role == "model")
+        step = self.steps[done % len(self.steps)]
+        if "call" not in step:
+            return _say(step.get("text", ""))
+
+        ctx: Dict[str, Any] = {}
+        for c in contents:
+            if c.role == "user":
+                m = _WA_ID.search(_text_of(c))
+                if m:
+                    ctx["wa_id"] = m.group(1)
+            for name, response in _function_responses(c):
+                ctx[name] = response
+        args = {k: self._resolve(v, ctx) for k, v in (step.get("args") or {}).items()}
+        return _call(step["call"], args)
+
+    @staticmethod
+    def _resolve(value: Any, ctx: Dict[str, Any]) -> Any:
+        if not isinstance(value, str):
+            return value
+        m = _REF.match(value)
+        if not m:
+            return value
+        current: Any = ctx
+        for key in m.group(1).split("."):
+            try:
+                current = current[int(key)] if isinstance(current, list) else current[key]
+            except (KeyError, IndexError, ValueError, TypeError):
+                return None
+        return current
+
+
+def load_script(path: Path) -> List[Dict[str, Any]]:
+    data = json.loads(Path(path).read_text(encoding="utf-8"))
+    return data["steps"] if isinstance(data, dict) else data
+
+
+# -------------------------
+# Selección del backend
+# -------------------------
+def build_model(default: str):
+    """
+    Devuelve el modelo a usar por el agente según RETAIL_MODEL_BACKEND.
+    Con "gemini" (o sin variable) devuelve `default` tal cual.
+    """
+    backend = os.getenv("RETAIL_MODEL_BACKEND", "gemini").strip().lower()
+    latency = dict(
+        latency_ms=float(os.getenv("RETAIL_MODEL_LATENCY_MS", "0")),
+        jitter_ms=float(os.getenv("RETAIL_MODEL_JITTER_MS", "0")),
+    )
+    if backend == "gemini":
+        return default
+    if backend == "scripted":
+        print(f"🧪 Modelo falso: scripted ({latency['latency_ms']} ms)")
+        return ScriptedShopperLlm(**latency)
+    if backend == "replay":
+        script = Path(os.getenv("RETAIL_MODEL_SCRIPT", str(Path(__file__).parent / "replay_compra.json")))
+        print(f"🧪 Modelo falso: replay de {script} ({latency['latency_ms']} ms)")
+        return ReplayLlm(steps=load_script(script), **latency)
+    raise ValueError(f"RETAIL_MODEL_BACKEND inválido: {backend!r} (gemini | scripted | replay)")
@@ -7,6 +7,8 @@ CREATE TABLE IF NOT EXISTS users (
     name        TEXT NOT NULL,
     email       TEXT NOT NULL UNIQUE,
     phone       TEXT,
+    phone_norm  TEXT,                  -- normalization.normalize_phone(phone): +549...
+    name_fold   TEXT,                  -- normalization.fold_text(name): lo indexa users_fts
     segment     TEXT DEFAULT 'nuevo',
     created_at  TEXT DEFAULT (datetime('now'))
 );
@@ -52,3 +54,182 @@ CREATE TABLE IF NOT EXISTS orders (
     FOREIGN KEY (user_id) REFERENCES users(id),
     FOREIGN KEY (cart_id) REFERENCES carts(id)
 );
+
+-- Stock retenido por carritos abiertos (ver inventory.py).
+-- products.stock ya tiene descontadas estas unidades.
+CREATE TABLE IF NOT EXISTS stock_reservations (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    cart_id     INTEGER NOT NULL,
+    product_id  INTEGER NOT NULL,
+    quantity    INTEGER NOT NULL,
+    status      TEXT NOT NULL DEFAULT 'held', -- held | committed | released (pago fallido)
+    expires_at  TEXT NOT NULL,
+    created_at  TEXT DEFAULT (datetime('now')),
+    updated_at  TEXT DEFAULT (datetime('now')),
+    UNIQUE (cart_id, product_id),
+    FOREIGN KEY (cart_id) REFERENCES carts(id),
+    FOREIGN KEY (product_id) REFERENCES products(id)
+);
+
+-- Identidad por WhatsApp (WaId): búsqueda exacta por teléfono canónico.
+-- No es UNIQUE: las cargas históricas pueden repetir teléfono entre usuarios.
+CREATE INDEX IF NOT EXISTS idx_users_phone_norm
+    ON users(phone_norm);
+
+-- Búsqueda de usuarios por nombre/email (/users/search, admin): FTS5 con
+-- trigramas = substrings y prefijos de 3+ letras por índice. Contenido externo
+-- (no duplica filas): lo mantienen sincronizado los triggers. Sin acentos ni
+-- mayúsculas porque indexa name_fold, que completa la aplicación al escribir.
+CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+    name_fold, email,
+    content = 'users', content_rowid = 'id',
+    tokenize = 'trigram'
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_users_fts_insert AFTER INSERT ON users
+BEGIN
+    INSERT INTO users_fts(rowid, name_fold, email) VALUES (new.id, new.name_fold, new.email);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_users_fts_delete AFTER DELETE ON users
+BEGIN
+    INSERT INTO users_fts(users_fts, rowid, name_fold, email) VALUES ('delete', old.id, old.name_fold, old.email);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_users_fts_update AFTER UPDATE OF name_fold, email ON users
+BEGIN
+    INSERT INTO users_fts(users_fts, rowid, name_fold, email) VALUES ('delete', old.id, old.name_fold, old.email);
+    INSERT INTO users_fts(rowid, name_fold, email) VALUES (new.id, new.name_fold, new.email);
+END;
+
+CREATE INDEX IF NOT EXISTS idx_stock_reservations_expiry
+    ON stock_reservations(status, expires_at);
+
+-- Búsqueda del carrito abierto del usuario (WHERE user_id = ? AND status = 'open' ORDER BY created_at DESC)
+CREATE INDEX IF NOT EXISTS idx_carts_user_status_created
+    ON carts(user_id, status, created_at);
+
+-- Barrida de carritos abandonados (status = 'open' AND updated_at <= ?)
+CREATE INDEX IF NOT EXISTS idx_carts_status_updated
+    ON carts(status, updated_at);
+
+-- Jobs periódicos (ver jobs.py)
+CREATE TABLE IF NOT EXISTS job_leases (
+    name        TEXT PRIMARY KEY,
+    owner       TEXT NOT NULL,
+    expires_at  REAL NOT NULL  -- epoch (segundos)
+);
+
+CREATE TABLE IF NOT EXISTS job_runs (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    job          TEXT NOT NULL,
+    owner        TEXT NOT NULL,
+    trigger      TEXT NOT NULL DEFAULT 'schedule', -- schedule | manual
+    status       TEXT NOT NULL,                    -- running | ok | error
+    started_at   TEXT DEFAULT (datetime('now')),
+    finished_at  TEXT,
+    duration_ms  REAL,
+    result       TEXT,                             -- JSON
+    error        TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_job_runs_job
+    ON job_runs(job, id);
+
+-- Órdenes por usuario (/orders/by_user, /orders/last) y candidatas a archivar
+CREATE INDEX IF NOT EXISTS idx_orders_user_created
+    ON orders(user_id, created_at);
+
+CREATE INDEX IF NOT EXISTS idx_orders_status_created
+    ON orders(payment_status, created_at);
+
+-- Versión del catálogo: cualquier cambio en products la incrementa y el
+-- builder de catalog_snapshot.py rearma el snapshot mapeado en memoria.
+-- Los cambios de stock solo (carrito, checkout, vencimientos, pagos) no:
+-- el stock se lee al vuelo de products (ver catalog_snapshot.py).
+CREATE TABLE IF NOT EXISTS catalog_meta (
+    id       INTEGER PRIMARY KEY CHECK (id = 1),
+    version  INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO catalog_meta (id, version) VALUES (1, 0);
+
+CREATE TRIGGER IF NOT EXISTS trg_products_catalog_insert
+AFTER INSERT ON products
+BEGIN
+    UPDATE catalog_meta SET version = version + 1 WHERE id = 1;
+END;
+
+DROP TRIGGER IF EXISTS trg_products_catalog_update;
+
+CREATE TRIGGER IF NOT EXISTS trg_products_catalog_update_v2
+AFTER UPDATE OF sku, name, category, description, price, is_offer ON products
+BEGIN
+    UPDATE catalog_meta SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_products_catalog_delete
+AFTER DELETE ON products
+BEGIN
+    UPDATE catalog_meta SET version = version + 1 WHERE id = 1;
+END;
+
+-- "Se compra junto con" (recommendations.py): co-ocurrencia de productos en
+-- órdenes, sumada incrementalmente desde reco_state.last_order_id.
+CREATE TABLE IF NOT EXISTS product_pairs (
+    a       INTEGER NOT NULL,   -- a < b
+    b       INTEGER NOT NULL,
+    orders  INTEGER NOT NULL,
+    PRIMARY KEY (a, b)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_product_pairs_b
+    ON product_pairs(b, a);
+
+CREATE TABLE IF NOT EXISTS product_order_counts (
+    product_id  INTEGER PRIMARY KEY,
+    orders      INTEGER NOT NULL
+);
+
+-- Top-k precalculado por producto (lo lee GET /products/{id}/related)
+CREATE TABLE IF NOT EXISTS product_related (
+    product_id  INTEGER NOT NULL,
+    rank        INTEGER NOT NULL,
+    related_id  INTEGER NOT NULL,
+    score       REAL NOT NULL,
+    orders      INTEGER NOT NULL,
+    PRIMARY KEY (product_id, rank)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS reco_state (
+    id             INTEGER PRIMARY KEY CHECK (id = 1),
+    last_order_id  INTEGER NOT NULL DEFAULT 0,
+    updated_at     TEXT
+);
+
+-- Log de cambios (outbox, ver change_events.py): cada mutación de carritos,
+-- órdenes y productos agrega una fila en su misma transacción. seq creciente
+-- y sin reuso (AUTOINCREMENT); GET /events?after= lee por PK.
+CREATE TABLE IF NOT EXISTS change_events (
+    seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+    entity      TEXT NOT NULL,     -- cart | order | product
+    entity_id   INTEGER,
+    action      TEXT NOT NULL,     -- item_added | cleared | created | status_changed | updated | deleted ...
+    payload     TEXT,              -- JSON
+    created_at  TEXT DEFAULT (datetime('now'))
+);
+
+-- Notificaciones de la pasarela de pago ya procesadas (payments.py): un
+-- event_id repetido (reintento) devuelve el resultado guardado sin reaplicar.
+CREATE TABLE IF NOT EXISTS payment_events (
+    event_id     TEXT PRIMARY KEY,
+    order_id     INTEGER NOT NULL,
+    status       TEXT NOT NULL,     -- paid | failed (lo que pidió la pasarela)
+    amount       REAL,
+    source       TEXT NOT NULL,     -- webhook | reconcile
+    result       TEXT NOT NULL,     -- applied | unchanged | not_found | illegal_transition | amount_mismatch
+    received_at  TEXT DEFAULT (datetime('now'))
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_payment_events_order
+    ON payment_events(order_id);
@@ -0,0 +1,107 @@
+-- schema_pg.sql
+-- Tablas del camino de compra en PostgreSQL (STORAGE_BACKEND=postgres, ver
+-- storage.py). Mismas columnas e índices que schema.sql; idempotente.
+
+CREATE TABLE IF NOT EXISTS users (
+    id          BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    name        TEXT NOT NULL,
+    email       TEXT NOT NULL UNIQUE,
+    phone       TEXT,
+    phone_norm  TEXT,
+    name_fold   TEXT,
+    segment     TEXT DEFAULT 'nuevo',
+    created_at  TIMESTAMPTZ DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS products (
+    id          BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    sku         TEXT NOT NULL UNIQUE,
+    name        TEXT NOT NULL,
+    category    TEXT,
+    description TEXT,
+    price       DOUBLE PRECISION NOT NULL,
+    is_offer    BOOLEAN NOT NULL DEFAULT false,
+    stock       INTEGER DEFAULT 0,
+    updated_at  TIMESTAMPTZ DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS carts (
+    id          BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    user_id     BIGINT NOT NULL REFERENCES users(id),
+    status      TEXT NOT NULL DEFAULT 'active',
+    created_at  TIMESTAMPTZ DEFAULT now(),
+    updated_at  TIMESTAMPTZ DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS cart_items (
+    id          BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    cart_id     BIGINT NOT NULL REFERENCES carts(id),
+    product_id  BIGINT NOT NULL REFERENCES products(id),
+    quantity    INTEGER NOT NULL,
+    unit_price  DOUBLE PRECISION NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS orders (
+    id             BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    user_id        BIGINT NOT NULL REFERENCES users(id),
+    cart_id        BIGINT NOT NULL REFERENCES carts(id),
+    total          DOUBLE PRECISION NOT NULL,
+    payment_status TEXT NOT NULL DEFAULT 'pending', -- pending | paid | failed
+    created_at     TIMESTAMPTZ DEFAULT now()
+);
+
+-- Stock retenido por carritos abiertos: products.stock ya lo tiene descontado
+CREATE TABLE IF NOT EXISTS stock_reservations (
+    id          BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    cart_id     BIGINT NOT NULL REFERENCES carts(id),
+    product_id  BIGINT NOT NULL REFERENCES products(id),
+    quantity    INTEGER NOT NULL,
+    status      TEXT NOT NULL DEFAULT 'held', -- held | committed | released (pago fallido)
+    expires_at  TIMESTAMPTZ NOT NULL,
+    created_at  TIMESTAMPTZ DEFAULT now(),
+    updated_at  TIMESTAMPTZ DEFAULT now(),
+    UNIQUE (cart_id, product_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_users_phone_norm
+    ON users(phone_norm);
+
+CREATE INDEX IF NOT EXISTS idx_stock_reservations_expiry
+    ON stock_reservations(status, expires_at);
+
+CREATE INDEX IF NOT EXISTS idx_carts_user_status_created
+    ON carts(user_id, status, created_at);
+
+CREATE INDEX IF NOT EXISTS idx_carts_status_updated
+    ON carts(status, updated_at);
+
+CREATE INDEX IF NOT EXISTS idx_cart_items_cart_product
+    ON cart_items(cart_id, product_id);
+
+CREATE INDEX IF NOT EXISTS idx_orders_user_created
+    ON orders(user_id, created_at);
+
+CREATE INDEX IF NOT EXISTS idx_orders_status_created
+    ON orders(payment_status, created_at);
+
+-- Log de cambios de las compras hechas con este backend (change_events.py).
+-- El seq sale de change_events_seq (una fila, con lock hasta el commit) y no
+-- de una secuencia: con IDENTITY dos transacciones confirman sus seq en
+-- cualquier orden y un lector con after= se saltea el que confirma último.
+CREATE TABLE IF NOT EXISTS change_events (
+    seq         BIGINT PRIMARY KEY,
+    entity      TEXT NOT NULL,
+    entity_id   BIGINT,
+    action      TEXT NOT NULL,
+    payload     JSONB,
+    created_at  TIMESTAMPTZ DEFAULT now()
+);
+ALTER TABLE change_events ALTER COLUMN seq DROP IDENTITY IF EXISTS;
+
+CREATE TABLE IF NOT EXISTS change_events_seq (
+    id          SMALLINT PRIMARY KEY CHECK (id = 1),
+    last        BIGINT NOT NULL
+);
+INSERT INTO change_events_seq (id, last)
+SELECT 1, COALESCE(MAX(seq), 0) FROM change_events
+ON CONFLICT (id) DO NOTHING;
@@ -0,0 +1,214 @@
+"""
+semantic.py
+Búsqueda por similitud (vectorial) local sobre el catálogo, sin servicios externos.
+
+Consultas como "algo para el desayuno" o "bebida sin alcohol" no comparten
+substrings con los nombres de producto. Se resuelven así:
+
+- Cada producto es un vector TF-IDF "hasheado" de SEMANTIC_DIM dimensiones
+  (int8 en el snapshot, ver quantize): palabras (fold_text, sin stopwords) y 4-gramas de caracteres
+  de nombre, categoría y descripción, cada feature a un bucket con zlib.crc32
+  y signo ±1 (hashing trick). Filas normalizadas L2.
+- La consulta se vectoriza igual y se expande con CONCEPTS, un léxico chico
+  de intenciones de compra ("desayuno" -> café, leche, galletitas...).
+  "sin X" resta los términos del concepto X ("sin alcohol").
+- Top-k por coseno = un producto matriz-vector (M @ q) y argpartition. La
+  matriz se guarda por dimensión (dim x count): la consulta solo lee las
+  dimensiones donde no es cero.
+
+La matriz se arma junto con el snapshot del catálogo (catalog_snapshot.py)
+y se mapea desde el mismo archivo: todos los workers la comparten.
+
+Config (env):
+- SEMANTIC_DIM          dimensiones del vector (default 512; 100k SKUs ≈ 50 MB en int8).
+                        Menos dimensiones = más colisiones del hashing entre palabras
+- SEMANTIC_MIN_SCORE    coseno mínimo para devolver un producto (default 0.18)
+- SEMANTIC_ALPHA        peso del match léxico en modo hybrid (default 0.6)
+- SEMANTIC_PER_GROUP    productos del mismo tipo antes de repetir (default 3; 0 = sin límite)
+"""
+
+import math
+import os
+import zlib
+from array import array
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from normalization import fold_text
+
+SEMANTIC_DIM = int(os.getenv("SEMANTIC_DIM", "512"))
+SEMANTIC_MIN_SCORE = float(os.getenv("SEMANTIC_MIN_SCORE", "0.18"))
+SEMANTIC_ALPHA = float(os.getenv("SEMANTIC_ALPHA", "0.6"))
+SEMANTIC_PER_GROUP = int(os.getenv("SEMANTIC_PER_GROUP", "3"))
+
+_NGRAM = 4
+_NGRAM_WEIGHT = 0.5
+_EXPANSION_WEIGHT = 1.0
+_CONCEPT_WORD_WEIGHT = 0.3
+
+STOPWORDS = {
+    "a", "al", "algo", "algun", "alguna", "algunas", "alguno", "algunos", "con", "de", "del", "el", "en",
+    "hay", "la", "las", "lo", "los", "me", "mi", "para", "por", "que", "quiero", "se", "sin", "su",
+    "tenes", "tienen", "un", "una", "unas", "uno", "unos", "y", "o", "busco", "necesito", "dame",
+}
+
+# Intenciones de compra -> términos del catálogo (ya normalizados)
+CONCEPTS: Dict[str, List[str]] = {
+    "desayuno": ["cafe", "leche", "yerba", "galletitas", "pan", "manteca", "medialunas", "dulce de leche", "yogur", "te"],
+    "merienda": ["cafe", "leche", "yerba", "galletitas", "medialunas", "budin", "dulce de leche", "alfajor", "te"],
+    "mate": ["yerba", "azucar", "galletitas"],
+    "alcohol": ["cerveza", "vino", "fernet"],
+    "bebida": ["gaseosa", "agua", "jugo", "cerveza", "vino"],
+    "tomar": ["gaseosa", "agua", "jugo", "cerveza", "vino"],
+    "asado": ["asado", "chorizo", "carne", "vino", "pan"],
+    "parrilla": ["asado", "chorizo", "carne"],
+    "picada": ["mani", "papas fritas", "queso", "salame"],
+    "postre": ["helado", "dulce de leche", "chocolate", "budin", "alfajor"],
+    "dulce": ["chocolate", "alfajor", "dulce de leche", "helado", "budin"],
+    "limpiar": ["lavandina", "detergente", "limpiador", "esponja", "jabon en polvo"],
+    "limpieza": ["lavandina", "detergente", "limpiador", "esponja", "jabon en polvo"],
+    "ropa": ["jabon en polvo"],
+    "higiene": ["shampoo", "jabon", "pasta dental", "desodorante", "papel higienico"],
+    "bano": ["shampoo", "jabon", "papel higienico"],
+    "bebe": ["panales", "toallitas", "leche de formula"],
+    "pasta": ["fideos", "pure de tomate", "queso"],
+    "ensalada": ["lechuga", "tomate", "cebolla", "aceite"],
+    "guiso": ["lentejas", "papa", "cebolla", "carne", "zapallo"],
+    "fruta": ["manzana", "banana", "naranja", "limon"],
+    "verdura": ["papa", "cebolla", "tomate", "zapallo", "lechuga"],
+    "congelado": ["hamburguesas", "papas baston", "helado", "empanadas"],
+    "snack": ["papas fritas", "mani", "alfajor", "chocolate"],
+}
+
+
+def _bucket(feature: str, dim: int) -> Tuple[int, float]:
+    h = zlib.crc32(feature.encode("utf-8"))
+    return h % dim, (1.0 if (h >> 31) & 1 else -1.0)
+
+
+def content_words(text: str, folded: bool = False) -> List[str]:
+    """Palabras normalizadas sin stopwords ("algo para el desayuno" -> ["desayuno"])."""
+    return [w for w in (text if folded else fold_text(text)).split() if w not in STOPWORDS and len(w) > 1]
+
+
+def _word_features(word: str, weight: float, out: Dict[str, float]):
+    out["w:" + word] = out.get("w:" + word, 0.0) + weight
+    padded = f"<{word}>"
+    for i in range(max(1, len(padded) - _NGRAM + 1)):
+        g = "g:" + padded[i:i + _NGRAM]
+        out[g] = out.get(g, 0.0) + weight * _NGRAM_WEIGHT
+
+
+# El vocabulario del catálogo es chico (miles de palabras para 100k productos):
+# el build hashea cada palabra una sola vez
+@lru_cache(maxsize=100_000)
+def _word_vector(word: str, dim: int) -> Tuple[array, array]:
+    raw: Dict[str, float] = {}
+    _word_features(word, 1.0, raw)
+    out: Dict[int, float] = {}
+    for f, v in raw.items():
+        b, sign = _bucket(f, dim)
+        out[b] = out.get(b, 0.0) + sign * v
+    return array("I", out.keys()), array("f", out.values())
+
+
+def features(text: str, dim: int = SEMANTIC_DIM, folded: bool = False) -> Tuple[array, array]:
+    """
+    (buckets, valores con signo) de un texto de producto. tf binario: en textos
+    tan cortos repetir una palabra (nombre y descripción) no la hace más relevante.
+    Un bucket puede repetirse: build_matrix los suma.
+    """
+    idx, vals = array("I"), array("f")
+    for w in set(content_words(text, folded)):
+        wi, wv = _word_vector(w, dim)
+        idx.extend(wi)
+        vals.extend(wv)
+    return idx, vals
+
+
+def concept_terms(word: str) -> Optional[List[str]]:
+    """Términos de CONCEPTS para una palabra normalizada, con plural simple ("bebidas")."""
+    return CONCEPTS.get(word) or (CONCEPTS.get(word[:-1]) if word.endswith("s") else None)
+
+
+def query_features(query: str, dim: int = SEMANTIC_DIM) -> List[Tuple[int, float]]:
+    """Como features(), con expansión por CONCEPTS y "sin X" restando X."""
+    raw: Dict[str, float] = {}
+    tokens = fold_text(query).split()
+    negate = False
+    for tok in tokens:
+        if tok == "sin":
+            negate = True
+            continue
+        concept = concept_terms(tok)
+        sign = -1.0 if negate and concept else 1.0
+        negate = False
+        if tok in STOPWORDS or len(tok) < 2:
+            continue
+        # Una palabra negada no suma su propio texto ("sin alcohol" no busca "alcohol");
+        # la de un concepto pesa poco: casi nunca está en el nombre del producto
+        if sign > 0:
+            _word_features(tok, _CONCEPT_WORD_WEIGHT if concept else 1.0, raw)
+        if concept:
+            w = sign * _EXPANSION_WEIGHT / math.sqrt(len(concept))
+            for term in concept:
+                for t in term.split():
+                    _word_features(t, w, raw)
+    out: Dict[int, float] = {}
+    for f, v in raw.items():
+        b, s = _bucket(f, dim)
+        out[b] = out.get(b, 0.0) + s * v
+    return list(out.items())
+
+
+def build_matrix(feature_lists: Iterable[Tuple[array, array]], n: int, dim: int = SEMANTIC_DIM):
+    """
+    feature_lists: (buckets, valores) por fila (ver features()).
+    Devuelve la matriz (n, dim) float32 con TF-IDF normalizado por fila y el vector idf (dim,).
+    """
+    import numpy as np
+
+    all_idx, all_vals, lengths = array("I"), array("f"), array("q")
+    for idx, vals in feature_lists:
+        all_idx.extend(idx)
+        all_vals.extend(vals)
+        lengths.append(len(idx))
+    matrix = np.zeros((n, dim), dtype=np.float32)
+    if len(all_idx):
+        rows = np.repeat(np.arange(n), np.frombuffer(lengths, dtype=np.int64))
+        np.add.at(matrix, (rows, np.frombuffer(all_idx, dtype=np.uint32)), np.frombuffer(all_vals, dtype=np.float32))
+    df = np.count_nonzero(matrix, axis=0)
+    idf = (np.log((1.0 + n) / (1.0 + df)) + 1.0).astype(np.float32)
+    matrix *= idf
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix, idf
+
+
+def quantize_scale(matrix) -> float:
+    """Factor float -> int8 para la matriz: el mayor valor absoluto va a 127."""
+    import numpy as np
+
+    peak = float(np.abs(matrix).max()) if matrix.size else 0.0
+    return 127.0 / peak if peak > 0 else 1.0
+
+
+def quantize(matrix, scale: float):
+    """
+    int8 = round(valor * scale): un cuarto de memoria que float32 y, a diferencia
+    de float16, NumPy lo convierte rápido al sumar (el coseno se acumula en float32).
+    """
+    import numpy as np
+
+    return np.rint(matrix * scale).astype(np.int8)
+
+
+def query_vector(query: str, idf, dim: int = SEMANTIC_DIM):
+    import numpy as np
+
+    q = np.zeros(dim, dtype=np.float32)
+    for b, v in query_features(query, dim):
+        q[b] += v
+    q *= idf
+    norm = float(np.linalg.norm(q))
+    return q / norm if norm > 0 else None
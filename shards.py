@@ -0,0 +1,299 @@
+"""
+shards.py
+Una base SQLite por sucursal (tienda): el lock de escritura de una tienda
+no frena los carritos y checkouts de las otras.
+
+- RETAIL_STORES vacío (default): una sola tienda "default" sobre
+  RETAIL_DB_PATH, igual que antes.
+- RETAIL_STORES=centro,norte,sur: cada tienda en RETAIL_SHARDS_DIR/<tienda>.db
+  con el schema completo. La primera es la default: requests sin tienda y
+  tablas de control (lease e historial de jobs).
+
+Ruteo de cada request (resolve_store):
+1) STORE_API_KEYS=centro=clave1,norte=clave2: la clave fija la tienda (no
+   puede leer otra).
+2) Con la clave interna (BACKOFFICE_API_KEY: agente, bridge de WhatsApp) la
+   tienda viene en el header x-store-id, en ?store= (link público de pago) o
+   en la sesión del admin.
+3) Si no, la tienda default.
+
+WhatsApp: STORE_WHATSAPP_NUMBERS=+5491100000001=centro,... asigna la tienda
+por el número al que escribió el cliente (campo To de Twilio); el bridge la
+deja en el contexto (use_store) y las tools la mandan en x-store-id.
+
+Conexiones: un pool por tienda (hasta SHARD_POOL_SIZE conexiones ociosas).
+`with shard_set.connect(store) as conn:` hace commit/rollback al salir del
+bloque y devuelve la conexión al pool; conn.close() la cierra de verdad.
+
+Vista cruzada: fan_out(fn) corre fn(store, conn) en paralelo sobre todas las
+tiendas (SHARD_FANOUT_WORKERS threads); merge_rows junta listas ya ordenadas.
+
+Config (env):
+- RETAIL_STORES           tiendas separadas por coma (default vacío = una sola base)
+- RETAIL_SHARDS_DIR       carpeta de las bases por tienda (default ./stores)
+- STORE_API_KEYS          tienda=clave,... (claves de API fijadas a una tienda)
+- STORE_WHATSAPP_NUMBERS  numero=tienda,... (número de WhatsApp de cada tienda)
+- SHARD_POOL_SIZE         conexiones ociosas por tienda (default 8)
+- SHARD_FANOUT_WORKERS    threads de la vista cruzada (default 8)
+"""
+
+import contextvars
+import heapq
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import metrics
+from db_instrumentation import InstrumentedConnection
+
+BASE_DIR = Path(__file__).resolve().parent
+
+STORE_HEADER = "x-store-id"
+SINGLE_STORE = "default"
+
+
+def _pairs(raw: str) -> Dict[str, str]:
+    """'a=1, b=2' -> {'a': '1', 'b': '2'}"""
+    out = {}
+    for item in (raw or "").split(","):
+        if "=" in item:
+            k, v = item.split("=", 1)
+            if k.strip() and v.strip():
+                out[k.strip()] = v.strip()
+    return out
+
+
+def _digits(number: str) -> str:
+    return re.sub(r"\D", "", number or "")
+
+
+STORES: List[str] = [s.strip() for s in os.getenv("RETAIL_STORES", "").split(",") if s.strip()]
+SHARDED = bool(STORES)
+if not SHARDED:
+    STORES = [SINGLE_STORE]
+DEFAULT_STORE = STORES[0]
+SHARDS_DIR = Path(os.getenv("RETAIL_SHARDS_DIR", str(BASE_DIR / "stores")))
+# clave -> tienda
+STORE_API_KEYS: Dict[str, str] = {key: store for store, key in _pairs(os.getenv("STORE_API_KEYS", "")).items()}
+# dígitos del número -> tienda
+STORE_WHATSAPP_NUMBERS: Dict[str, str] = {
+    _digits(number): store for number, store in _pairs(os.getenv("STORE_WHATSAPP_NUMBERS", "")).items()
+}
+SHARD_POOL_SIZE = int(os.getenv("SHARD_POOL_SIZE", "8"))
+SHARD_FANOUT_WORKERS = int(os.getenv("SHARD_FANOUT_WORKERS", "8"))
+
+for _store in set(STORE_API_KEYS.values()) | set(STORE_WHATSAPP_NUMBERS.values()):
+    if _store not in STORES:
+        raise RuntimeError(f"Tienda '{_store}' configurada pero no está en RETAIL_STORES")
+
+POOL_CHECKOUTS = metrics.counter(
+    "sqlite_pool_checkouts_total", "Conexiones pedidas al pool por tienda", ("store", "result")
+)
+
+
+class UnknownStore(ValueError):
+    pass
+
+
+# -------------------------
+# Tienda del contexto
+# -------------------------
+_current: contextvars.ContextVar[str] = contextvars.ContextVar("retail_store", default=DEFAULT_STORE)
+
+
+def current_store() -> str:
+    return _current.get()
+
+
+@contextmanager
+def use_store(store: Optional[str]) -> Iterator[str]:
+    """Fija la tienda de lo que corra adentro (y de las requests salientes, ver outgoing_header)."""
+    token = _current.set(store or DEFAULT_STORE)
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+
+
+def outgoing_header() -> Dict[str, str]:
+    """Header x-store-id para llamar al backoffice (vacío con una sola tienda)."""
+    return {STORE_HEADER: current_store()} if SHARDED else {}
+
+
+def check_store(store: str) -> str:
+    if store not in STORES:
+        raise UnknownStore(store)
+    return store
+
+
+def resolve_store(api_key: str = "", requested: Optional[str] = None) -> str:
+    """
+    Tienda de una request: la de la clave de API si es una clave de tienda;
+    si no, la pedida (header / query / sesión) o la default.
+    """
+    if api_key in STORE_API_KEYS:
+        return STORE_API_KEYS[api_key]
+    return check_store(requested) if requested else DEFAULT_STORE
+
+
+def is_api_key(api_key: str, internal_key: str) -> bool:
+    return bool(api_key) and (api_key == internal_key or api_key in STORE_API_KEYS)
+
+
+def store_for_whatsapp(to_number: str) -> str:
+    """Tienda por el número de WhatsApp de destino ("whatsapp:+54911..."); default si no está mapeado."""
+    return STORE_WHATSAPP_NUMBERS.get(_digits(to_number), DEFAULT_STORE)
+
+
+# -------------------------
+# Bases y pools
+# -------------------------
+def shard_path(store: str, single_path: Path) -> Path:
+    return Path(single_path) if not SHARDED else SHARDS_DIR / f"{store}.db"
+
+
+def store_of_path(path) -> Optional[str]:
+    """Tienda de un archivo de base (None con una sola tienda o si no es un shard)."""
+    if not SHARDED:
+        return None
+    p = Path(path).resolve()
+    for store in STORES:
+        if (SHARDS_DIR / f"{store}.db").resolve() == p:
+            return store
+    return None
+
+
+class PooledConnection(InstrumentedConnection):
+    """Al salir de `with` (commit o rollback) vuelve al pool de su tienda."""
+
+    _pool: Optional["ConnectionPool"] = None
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            return super().__exit__(exc_type, exc, tb)
+        finally:
+            if self._pool is not None:
+                self._pool.release(self)
+
+
+class ConnectionPool:
+    def __init__(self, store: str, path: Path, timeout: float, size: int = SHARD_POOL_SIZE):
+        self.store = store
+        self.path = Path(path)
+        self.timeout = timeout
+        self.size = size
+        self._idle: List[PooledConnection] = []
+        self._lock = threading.Lock()
+
+    def acquire(self) -> PooledConnection:
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        POOL_CHECKOUTS.inc(store=self.store, result="hit" if conn is not None else "miss")
+        if conn is None:
+            # check_same_thread=False: la conexión vuelve al pool desde cualquier thread
+            conn = sqlite3.connect(
+                self.path, timeout=self.timeout, factory=PooledConnection, check_same_thread=False
+            )
+            conn.row_factory = sqlite3.Row
+            conn._pool = self
+        return conn
+
+    def release(self, conn: PooledConnection):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.ProgrammingError:
+            return  # ya cerrada
+        with self._lock:
+            if len(self._idle) < self.size and conn not in self._idle:
+                self._idle.append(conn)
+                return
+        conn._pool = None
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn._pool = None
+            conn.close()
+
+
+class ShardSet:
+    def __init__(self, single_path: Path, timeout: float):
+        if SHARDED:
+            SHARDS_DIR.mkdir(parents=True, exist_ok=True)
+        self.pools = {s: ConnectionPool(s, shard_path(s, single_path), timeout) for s in STORES}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def stores(self) -> List[str]:
+        return list(self.pools)
+
+    def path(self, store: str) -> Path:
+        return self.pools[check_store(store)].path
+
+    def connect(self, store: Optional[str] = None) -> PooledConnection:
+        return self.pools[check_store(store or current_store())].acquire()
+
+    def for_each(self, fn: Callable[[sqlite3.Connection], Any]) -> Dict[str, Any]:
+        """fn(conn) sobre cada tienda, una después de otra (jobs)."""
+        out = {}
+        for store in self.stores:
+            with use_store(store), self.connect(store) as conn:
+                out[store] = fn(conn)
+        return out
+
+    def fan_out(self, fn: Callable[[str, sqlite3.Connection], Any],
+                stores: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        fn(store, conn) en paralelo sobre las tiendas; {tienda: resultado}.
+        Cada thread hereda el contexto (traza del request) y fija su tienda.
+        """
+        stores = [check_store(s) for s in (stores or self.stores)]
+
+        def run(store):
+            with use_store(store), self.connect(store) as conn:
+                return fn(store, conn)
+
+        if len(stores) == 1:
+            return {stores[0]: run(stores[0])}
+        executor = self._pool_executor()
+        futures = [(s, executor.submit(contextvars.copy_context().run, run, s)) for s in stores]
+        return {s: f.result() for s, f in futures}
+
+    def _pool_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=max(1, min(SHARD_FANOUT_WORKERS, len(self.pools))), thread_name_prefix="shard-fanout"
+                )
+            return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        for pool in self.pools.values():
+            pool.close()
+
+
+def merge_rows(results: Dict[str, Iterable[Any]], key: str, reverse: bool = True,
+               limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Junta filas de varias tiendas, cada lista ya ordenada por `key`, en un
+    solo orden global. Cada fila sale como dict con la columna "store".
+    """
+    tagged = [[{**dict(r), "store": store} for r in rows] for store, rows in results.items()]
+    merged = heapq.merge(*tagged, key=lambda r: r[key], reverse=reverse)
+    out = []
+    for row in merged:
+        if limit is not None and len(out) >= limit:
+            break
+        out.append(row)
+    return out
@@ -0,0 +1,130 @@
+"""
+shopping_list.py
+Resolución de listas de compras (ingredientes genéricos -> productos reales).
+
+resolve_shopping_list(["2 tomates", "queso rallado", "huevos"], search)
+devuelve, por cada ítem, los mejores candidatos CON STOCK del catálogo:
+
+- Limpia el texto: cantidad y unidad al principio ("2 kg de ...") salen
+  como `quantity`; el resto se normaliza con fold_text.
+- Prueba variantes en orden: frase completa, frase en singular y, si no
+  hubo nada, la primera palabra ("queso rallado fino" -> "queso").
+- Ranking: el texto está en el nombre (no solo en la descripción), el
+  nombre empieza con él, está en oferta; a igualdad, nombre más corto y
+  precio más bajo.
+
+`search(query, limit)` es la fuente de candidatos (filas tipo Product):
+el snapshot mapeado del catálogo o, si no hay, un filtro sobre SQLite.
+"""
+
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+from normalization import fold_text
+
+# Candidatos que se rankean por variante
+CANDIDATES_PER_QUERY = 200
+
+_QUANTITY = re.compile(
+    r"^\s*(?P<qty>\d+(?:[.,]\d+)?)?\s*"
+    r"(?P<unit>kg|kilos?|g|gr|gramos?|l|lts?|litros?|ml|cc|u|unidad(?:es)?|paquetes?|latas?|docenas?|"
+    r"botellas?|frascos?|cajas?|sobres?|atados?|planchas?)?\.?\s+(?:de\s+)?",
+)
+
+SearchFn = Callable[[str, int], List[Dict[str, Any]]]
+
+
+def parse_item(text: str):
+    """'2 kg de papas' -> ('papas', 2.0, 'kg')."""
+    folded = fold_text(text)
+    m = _QUANTITY.match(folded + " ")
+    qty = unit = None
+    if m and (m.group("qty") or m.group("unit")):
+        rest = folded[m.end():].strip() if m.end() <= len(folded) else ""
+        if rest:
+            folded = rest
+            qty = float(m.group("qty").replace(",", ".")) if m.group("qty") else None
+            unit = m.group("unit")
+    return folded, qty, unit
+
+
+def singular(word: str) -> str:
+    if len(word) > 4 and word.endswith("ces"):
+        return word[:-3] + "z"  # nueces -> nuez
+    if len(word) > 4 and word.endswith("es") and word[-3] in "rlndj":
+        return word[:-2]  # panes -> pan, limones -> limon
+    if len(word) > 3 and word.endswith("s"):
+        return word[:-1]  # tomates -> tomate
+    return word
+
+
+def variants(query: str) -> List[str]:
+    out = [query]
+    single = " ".join(singular(w) for w in query.split())
+    if single != query:
+        out.append(single)
+    return out
+
+
+def _in_stock(p: Dict[str, Any]) -> bool:
+    # stock NULL = sin control de stock
+    return p.get("stock") is None or p["stock"] > 0
+
+
+def _rank(query: str, p: Dict[str, Any]):
+    name = fold_text(p.get("name"))
+    return (
+        0 if query in name else 1,
+        0 if name.startswith(query) else 1,
+        0 if p.get("is_offer") else 1,
+        len(name),
+        p.get("price") or 0,
+    )
+
+
+def resolve_item(text: str, search: SearchFn, per_item: int = 3) -> Dict[str, Any]:
+    query, qty, unit = parse_item(text)
+    result: Dict[str, Any] = {
+        "item": text,
+        "query": query,
+        "quantity": qty,
+        "unit": unit,
+        "status": "not_found",
+        "candidates": [],
+    }
+    if not query:
+        return result
+
+    tries = variants(query)
+    # En español el sustantivo va primero: "queso rallado" -> "queso"
+    words = query.split()
+    if len(words) > 1:
+        tries += [w for w in variants(words[0]) if w not in tries]
+
+    for q in tries:
+        found = search(q, CANDIDATES_PER_QUERY)
+        if not found:
+            continue
+        available = [p for p in found if _in_stock(p)]
+        result["query"] = q
+        if not available:
+            result["status"] = "out_of_stock"
+            continue  # quizás una variante más amplia sí tiene stock
+        available.sort(key=lambda p: _rank(q, p))
+        result["status"] = "found"
+        result["candidates"] = available[:per_item]
+        break
+    return result
+
+
+def resolve_shopping_list(items: List[str], search: SearchFn, per_item: int = 3,
+                          max_items: Optional[int] = None) -> List[Dict[str, Any]]:
+    seen = set()
+    out = []
+    for text in items[:max_items]:
+        key = fold_text(text)
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        out.append(resolve_item(text, search, per_item))
+    return out
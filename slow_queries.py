@@ -0,0 +1,203 @@
+"""
+slow_queries.py
+Log de queries lentas con EXPLAIN QUERY PLAN automático.
+
+Se engancha como observer de db_instrumentation: cada statement que tarda
+más de SLOW_QUERY_MS se agrupa por "fingerprint" (SQL normalizado: literales
+y listas IN colapsados, espacios normalizados) y se registra con:
+
+- forma de los parámetros ("(int, str)", "{email: str}", ...), sin valores
+- EXPLAIN QUERY PLAN (una vez por fingerprint, en una conexión aparte de
+  solo lectura), marcando los SCAN de tabla completa
+- cantidad, tiempo total / máximo y último SQL visto
+
+Las fingerprints viven en memoria (LRU de SLOW_QUERY_MAX_FINGERPRINTS) y se
+ven en /admin/slow-queries. Con SLOW_QUERY_LOG además se agrega una línea
+JSON por ocurrencia.
+
+Variables:
+    SLOW_QUERY_ENABLED            (default true)
+    SLOW_QUERY_MS                 (default 100; 0 = todas)
+    SLOW_QUERY_EXPLAIN            (default true)
+    SLOW_QUERY_MAX_FINGERPRINTS   (default 200)
+    SLOW_QUERY_LOG                (archivo JSONL opcional)
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import metrics
+from db_instrumentation import add_statement_observer, statement_label
+
+SLOW_QUERY_ENABLED = os.getenv("SLOW_QUERY_ENABLED", "true").lower() == "true"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "true").lower() == "true"
+SLOW_QUERY_MAX_FINGERPRINTS = int(os.getenv("SLOW_QUERY_MAX_FINGERPRINTS", "200"))
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "")
+
+SLOW_QUERIES = metrics.counter("sqlite_slow_queries_total", "Statements SQLite sobre el umbral de lentitud", ("statement",))
+
+_EXPLAINABLE = re.compile(r"^\s*(SELECT|WITH|UPDATE|DELETE|INSERT|REPLACE)\b", re.IGNORECASE)
+
+
+# -------------------------
+# Normalización
+# -------------------------
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_SPACES = re.compile(r"\s+")
+
+
+def fingerprint(sql: str) -> str:
+    """SQL sin literales: dos queries que solo difieren en valores comparten fingerprint."""
+    s = _STRING.sub("?", sql or "")
+    s = _NUMBER.sub("?", s)
+    s = _IN_LIST.sub("IN (?)", s)
+    return _SPACES.sub(" ", s).strip().rstrip(";")
+
+
+def param_shape(params: Any) -> str:
+    if params is None:
+        return "many"  # executemany / executescript
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{k}: {type(v).__name__}" for k, v in params.items()) + "}"
+    try:
+        return "(" + ", ".join(type(v).__name__ for v in params) + ")"
+    except TypeError:
+        return type(params).__name__
+
+
+# -------------------------
+# Registro de fingerprints
+# -------------------------
+class SlowQueryLog:
+    def __init__(self, db_path: Union[Path, Callable[[], Path], None] = None, threshold_ms: float = SLOW_QUERY_MS):
+        self.threshold_s = threshold_ms / 1000
+        self._db_path = db_path
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._explain_lock = threading.Lock()
+        self._explain_conns: Dict[str, sqlite3.Connection] = {}
+
+    def observe(self, sql, params, started, elapsed, error):
+        if elapsed < self.threshold_s or error is not None:
+            return
+        fp = fingerprint(sql)
+        label = statement_label(sql)
+        SLOW_QUERIES.inc(statement=label)
+        shape = param_shape(params)
+        with self._lock:
+            entry = self._entries.get(fp)
+            if entry is None:
+                entry = {
+                    "fingerprint": fp,
+                    "label": label,
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "param_shapes": [],
+                    "plan": None,
+                    "full_scan": False,
+                    "last_sql": "",
+                    "last_seen": 0.0,
+                }
+                self._entries[fp] = entry
+                while len(self._entries) > SLOW_QUERY_MAX_FINGERPRINTS:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(fp)
+            ms = elapsed * 1000
+            entry["count"] += 1
+            entry["total_ms"] += ms
+            entry["max_ms"] = max(entry["max_ms"], ms)
+            if shape not in entry["param_shapes"] and len(entry["param_shapes"]) < 5:
+                entry["param_shapes"].append(shape)
+            entry["last_sql"] = _SPACES.sub(" ", sql).strip()[:2000]
+            entry["last_seen"] = started
+            need_plan = entry["plan"] is None
+
+        if need_plan and SLOW_QUERY_EXPLAIN:
+            plan = self.explain(sql, params)
+            with self._lock:
+                entry["plan"] = plan
+                entry["full_scan"] = any(_is_full_scan(line) for line in plan)
+
+        print(f"🐢 Query lenta {ms:.1f} ms [{label}] {fp[:160]}")
+        if SLOW_QUERY_LOG:
+            self._append_log(fp, label, ms, shape, started, entry.get("plan"))
+
+    def explain(self, sql: str, params: Any) -> List[str]:
+        if not _EXPLAINABLE.match(sql or "") or self._db_path is None:
+            return []
+        db_path = self._db_path() if callable(self._db_path) else self._db_path
+        try:
+            with self._explain_lock:
+                conn = self._explain_conns.get(str(db_path))
+                if conn is None:
+                    # Conexión propia (no instrumentada, solo lectura): EXPLAIN no ejecuta la query
+                    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+                    self._explain_conns[str(db_path)] = conn
+                rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params if params is not None else ()).fetchall()
+            # filas: (id, parent, notused, detail) -> árbol indentado
+            depth: Dict[int, int] = {0: -1}
+            lines = []
+            for node_id, parent, _, detail in rows:
+                depth[node_id] = depth.get(parent, -1) + 1
+                lines.append("  " * depth[node_id] + detail)
+            return lines
+        except sqlite3.Error as e:
+            return [f"(EXPLAIN falló: {e})"]
+
+    def _append_log(self, fp, label, ms, shape, started, plan):
+        record = {
+            "ts": started,
+            "ms": round(ms, 3),
+            "statement": label,
+            "fingerprint": fp,
+            "params": shape,
+            "plan": plan,
+        }
+        try:
+            path = Path(SLOW_QUERY_LOG)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with path.open("a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"⚠️  No pude escribir {SLOW_QUERY_LOG}: {e}")
+
+    def top(self, limit: int = 50, order_by: str = "total_ms") -> List[Dict[str, Any]]:
+        with self._lock:
+            entries = [dict(e, avg_ms=e["total_ms"] / e["count"]) for e in self._entries.values()]
+        entries.sort(key=lambda e: e[order_by], reverse=True)
+        return entries[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _is_full_scan(detail: str) -> bool:
+    # "SCAN users" es tabla completa; "SCAN users USING INDEX ..." / "SEARCH ..." no
+    d = detail.strip().upper()
+    return d.startswith("SCAN ") and "USING" not in d and "CONSTANT ROW" not in d
+
+
+slow_log: Optional[SlowQueryLog] = None
+
+
+def install(db_path: Union[Path, Callable[[], Path]]) -> Optional[SlowQueryLog]:
+    """Registra el observer (una sola vez por proceso)."""
+    global slow_log
+    if not SLOW_QUERY_ENABLED:
+        return None
+    if slow_log is None:
+        slow_log = SlowQueryLog(db_path)
+        add_statement_observer(slow_log.observe)
+    return slow_log
@@ -0,0 +1,231 @@
+"""
+stress_stock.py
+Stress de concurrencia de las reservas de stock (inventory.py).
+
+Arma una base temporal con pocos productos de stock chico y muchos
+compradores, y lanza cientos de compras en paralelo (varios procesos,
+varios threads por proceso, como uvicorn --workers N) contra los handlers
+reales del backoffice: add_item → checkout, y una fracción que vacía el
+carrito en vez de comprar.
+
+Con --stores N reparte los compradores en N tiendas, cada una con su base
+(shards.py): las compras de una tienda no esperan el lock de escritura de
+las otras.
+
+Al final verifica los invariantes (por tienda):
+- ningún producto con stock negativo
+- unidades vendidas (órdenes) <= stock inicial, por producto
+- stock inicial == stock actual + vendidas + retenidas (nada se pierde ni se duplica)
+
+Uso:
+    python stress_stock.py
+    python stress_stock.py --buyers 800 --processes 4 --threads 32 --stock 25 --products 3
+    python stress_stock.py --buyers 2000 --stock 500 --stores 4
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+SCHEMA_PATH = BASE_DIR / "schema.sql"
+
+STRESS_ENV = {
+    "ENV": "bench",
+    "ADMIN_USER": "bench",
+    "ADMIN_PASSWORD": "bench",
+    "BACKOFFICE_API_KEY": "bench-key",
+    "BACKOFFICE_BASE_URL": "http://127.0.0.1:9",
+    "CHECKOUT_BASE_URL": "http://localhost:8001/index.html",
+    "TRACE_ENABLED": "false",
+    "SLOW_QUERY_ENABLED": "false",
+    "METRICS_ENABLED": "false",
+}
+
+
+def seed(path: Path, buyers: int, products: int, stock: int):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.executescript(SCHEMA_PATH.read_text(encoding="utf-8"))
+    conn.executemany(
+        "INSERT INTO users (name, name_fold, email, phone, phone_norm) VALUES (?, ?, ?, ?, ?)",
+        [
+            (f"Comprador {i}", f"comprador {i}", f"comprador{i}@stress.example.com", f"54911{i:08d}", f"+54911{i:08d}")
+            for i in range(1, buyers + 1)
+        ],
+    )
+    conn.executemany(
+        "INSERT INTO products (sku, name, category, price, stock) VALUES (?, ?, 'Almacén', 1000, ?)",
+        [(f"STRESS{i:03d}", f"Último producto {i}", stock) for i in range(1, products + 1)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def store_name(i: int) -> str:
+    return f"tienda{i}"
+
+
+def store_of(uid: int, stores: int) -> str:
+    return store_name(uid % stores)
+
+
+def worker(db_path: str, user_ids, products: int, threads: int, clear_rate: float, seed_: int, queue,
+           stores: int = 1):
+    os.environ.update(STRESS_ENV)
+    os.environ["RETAIL_DB_PATH"] = db_path
+    if stores > 1:
+        os.environ["RETAIL_STORES"] = ",".join(store_name(i) for i in range(stores))
+        os.environ["RETAIL_SHARDS_DIR"] = str(Path(db_path).parent)
+    sys.path.insert(0, str(BASE_DIR))
+    from fastapi import HTTPException
+
+    import backoffice_app as bo
+    import shards
+
+    rng = random.Random(seed_)
+    plan = [(uid, rng.randint(1, products), rng.randint(1, 2), rng.random() < clear_rate) for uid in user_ids]
+
+    def shop(step):
+        # Los handlers se llaman directo (sin middleware): la tienda se fija acá
+        with shards.use_store(store_of(step[0], stores) if stores > 1 else None):
+            return _shop(step)
+
+    def _shop(step):
+        uid, product_id, qty, clear = step
+        result = {"added": 0, "rejected": 0, "orders": 0, "conflicts": 0, "cleared": 0, "errors": 0}
+        try:
+            bo.api_cart_add_item(bo.CartAddItemRequest(user_id=uid, product_id=product_id, quantity=qty))
+            result["added"] += 1
+        except HTTPException as e:
+            result["rejected" if e.status_code == 400 else "errors"] += 1
+            return result
+        except sqlite3.OperationalError:
+            result["errors"] += 1
+            return result
+        try:
+            if clear:
+                bo.api_cart_clear(bo.CartClearRequest(user_id=uid))
+                result["cleared"] += 1
+            else:
+                bo.api_checkout(bo.CheckoutRequest(user_id=uid, email=f"comprador{uid}@stress.example.com"))
+                result["orders"] += 1
+        except HTTPException as e:
+            result["conflicts" if e.status_code == 409 else "errors"] += 1
+        except sqlite3.OperationalError:
+            result["errors"] += 1
+        return result
+
+    totals = {}
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for r in pool.map(shop, plan):
+            for k, v in r.items():
+                totals[k] = totals.get(k, 0) + v
+    queue.put(totals)
+
+
+def check_invariants(path: Path, stock: int) -> list:
+    conn = sqlite3.connect(path)
+    rows = conn.execute(
+        """
+        SELECT
+            p.id, p.name, p.stock,
+            COALESCE((SELECT SUM(ci.quantity) FROM cart_items ci JOIN orders o ON o.cart_id = ci.cart_id
+                      WHERE ci.product_id = p.id AND o.payment_status != 'failed'), 0) AS sold,
+            COALESCE((SELECT SUM(r.quantity) FROM stock_reservations r
+                      WHERE r.product_id = p.id AND r.status = 'held'), 0) AS held,
+            COALESCE((SELECT SUM(r.quantity) FROM stock_reservations r
+                      WHERE r.product_id = p.id AND r.status = 'committed'), 0) AS committed
+        FROM products p ORDER BY p.id
+        """
+    ).fetchall()
+    conn.close()
+    failures = []
+    for pid, name, current, sold, held, committed in rows:
+        print(f"   {name}: inicial {stock}, vendido {sold}, retenido {held}, disponible {current}")
+        if current < 0:
+            failures.append(f"{name}: stock negativo ({current})")
+        if sold > stock:
+            failures.append(f"{name}: oversell ({sold} vendidas de {stock})")
+        if sold != committed:
+            failures.append(f"{name}: órdenes ({sold}) != reservas confirmadas ({committed})")
+        if current + sold + held != stock:
+            failures.append(f"{name}: {current} + {sold} + {held} != {stock}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress de reservas de stock (sin oversell)")
+    parser.add_argument("--buyers", type=int, default=400)
+    parser.add_argument("--products", type=int, default=2)
+    parser.add_argument("--stock", type=int, default=20, help="stock inicial por producto")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=25, help="threads por proceso")
+    parser.add_argument("--clear-rate", type=float, default=0.2, help="fracción que vacía el carrito en vez de comprar")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--stores", type=int, default=1, help="tiendas, cada una con su base (shards.py)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "stress.db"
+        if args.stores > 1:
+            # Mismos ids de usuario en todas las bases; cada comprador compra en una sola tienda
+            db_paths = [Path(tmp) / f"{store_name(i)}.db" for i in range(args.stores)]
+        else:
+            db_paths = [db_path]
+        for path in db_paths:
+            seed(path, args.buyers, args.products, args.stock)
+
+        users = list(range(1, args.buyers + 1))
+        chunks = [users[i::args.processes] for i in range(args.processes)]
+        queue = mp.get_context("spawn").Queue()
+        procs = [
+            mp.get_context("spawn").Process(
+                target=worker,
+                args=(str(db_path), chunk, args.products, args.threads, args.clear_rate, args.seed + i, queue,
+                      args.stores),
+            )
+            for i, chunk in enumerate(chunks)
+        ]
+        t0 = time.perf_counter()
+        for p in procs:
+            p.start()
+        totals = {}
+        for _ in procs:
+            for k, v in queue.get().items():
+                totals[k] = totals.get(k, 0) + v
+        for p in procs:
+            p.join()
+        elapsed = time.perf_counter() - t0
+
+        print(
+            f"🛒 {args.buyers} compradores en {args.stores} tienda(s), {args.processes}×{args.threads} en paralelo, "
+            f"{elapsed:.1f} s ({totals.get('orders', 0) / elapsed:.0f} órdenes/s): "
+            f"{totals.get('added', 0)} reservas, {totals.get('rejected', 0)} sin stock, "
+            f"{totals.get('orders', 0)} órdenes, {totals.get('conflicts', 0)} checkouts sin stock, "
+            f"{totals.get('cleared', 0)} carritos vaciados, {totals.get('errors', 0)} errores"
+        )
+        failures = []
+        for path in db_paths:
+            if args.stores > 1:
+                print(f"   [{path.stem}]")
+            failures += check_invariants(path, args.stock)
+        if totals.get("errors"):
+            failures.append(f"{totals['errors']} errores inesperados (lock / HTTP)")
+
+    if failures:
+        for f in failures:
+            print(f"❌ {f}")
+        sys.exit(1)
+    print("✅ Sin oversell: stock consistente")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Fixtures comunes: base temporal armada con schema.sql (la de
+stress_stock.py: pocos productos, muchos compradores) y el backoffice
+importado contra ella, sin red, jobs ni métricas.
+
+Las variables de entorno se fijan ANTES de importar los módulos del repo
+(leen la config al importarse).
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "retail_agent"))
+
+import stress_stock  # noqa: E402
+
+TMP_DIR = Path(tempfile.mkdtemp(prefix="retail_tests_"))
+DB_PATH = TMP_DIR / "retail.db"
+
+os.environ.update(stress_stock.STRESS_ENV)
+os.environ.update({
+    "RETAIL_DB_PATH": str(DB_PATH),
+    "JOBS_ENABLED": "false",
+    "CATALOG_SNAPSHOT_DIR": str(TMP_DIR / "catalog"),
+    "WEBHOOK_DEDUPE_BACKEND": "memory",
+    "PAYMENT_WEBHOOK_SECRET": "test-payments-secret",
+    "LOGIN_RATE_MAX": "1000",
+})
+os.environ.pop("RETAIL_STORES", None)
+os.environ.pop("STORAGE_BACKEND", None)
+
+stress_stock.seed(DB_PATH, buyers=50, products=5, stock=100)
+
+API_HEADERS = {"x-api-key": os.environ["BACKOFFICE_API_KEY"]}
+
+
+@pytest.fixture(scope="session")
+def bo():
+    import backoffice_app
+
+    return backoffice_app
+
+
+@pytest.fixture(scope="session")
+def client(bo):
+    from fastapi.testclient import TestClient
+
+    with TestClient(bo.app) as c:
+        yield c
+
+
+@pytest.fixture
+def admin(client):
+    r = client.post(
+        "/admin/login",
+        data={"username": os.environ["ADMIN_USER"], "password": os.environ["ADMIN_PASSWORD"]},
+        follow_redirects=False,
+    )
+    assert r.status_code == 303
+    yield client
+    client.cookies.clear()
+
+
+@pytest.fixture
+def db():
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    yield conn
+    conn.close()
+
+
+_counter = [0]
+
+
+def new_user(conn, phone=None) -> int:
+    """Usuario nuevo (email único por test)."""
+    _counter[0] += 1
+    cur = conn.execute(
+        "INSERT INTO users (name, name_fold, email, phone) VALUES (?, ?, ?, ?)",
+        (f"Test {_counter[0]}", f"test {_counter[0]}", f"test{_counter[0]}-{os.getpid()}@example.com", phone),
+    )
+    conn.commit()
+    return cur.lastrowid
+
+
+def new_product(conn, stock: int = 10, price: float = 100.0) -> int:
+    _counter[0] += 1
+    cur = conn.execute(
+        "INSERT INTO products (sku, name, category, price, stock) VALUES (?, ?, 'Test', ?, ?)",
+        (f"TEST{_counter[0]:05d}", f"Producto test {_counter[0]}", price, stock),
+    )
+    conn.commit()
+    return cur.lastrowid
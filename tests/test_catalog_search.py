@@ -0,0 +1,70 @@
+"""Búsqueda de catálogo (/products/search) con y sin snapshot."""
+
+import time
+
+from conftest import API_HEADERS
+
+
+def _wait_snapshot(bo, seconds=10.0):
+    deadline = time.monotonic() + seconds
+    while bo.current_catalog().current() is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return bo.current_catalog().current()
+
+
+def test_startup_does_not_wait_for_the_first_snapshot(bo, monkeypatch, tmp_path):
+    # Sin snapshot en disco el startup no arma nada en el thread de la request
+    store = bo.catalog_snapshot.CatalogStore(tmp_path / "catalog")
+    builder = bo.catalog_snapshot.SnapshotBuilder(lambda: bo.get_connection(), store, should_build=lambda: False)
+    monkeypatch.setattr(bo, "catalog_builders", [builder])
+    monkeypatch.setattr(bo, "catalogs", {s: store for s in bo.catalogs})
+    monkeypatch.setattr(bo.scheduler, "start", lambda: None)
+    bo.on_startup()
+    builder.stop()
+    # No es líder: no arma nada y la búsqueda queda degradada
+    assert store.current() is None
+    assert bo._catalog_searcher().exact_only
+
+
+def test_fuzzy_works_once_the_builder_runs(client, bo):
+    # El thread del builder arma el primer snapshot: "ultimo prodcto" tolera el typo
+    assert _wait_snapshot(bo) is not None
+    r = client.get("/products/search", params={"q": "prodcto", "mode": "fuzzy"}, headers=API_HEADERS)
+    assert r.status_code == 200
+    assert "X-Search-Degraded" not in r.headers
+    assert any("producto" in p["name"].lower() for p in r.json())
+
+
+def test_without_snapshot_search_says_degraded(client, bo, monkeypatch):
+    monkeypatch.setattr(bo.catalog_snapshot.CatalogStore, "current", lambda self: None)
+    r = client.get("/products/search", params={"q": "prodcto", "mode": "fuzzy"}, headers=API_HEADERS)
+    assert r.headers["X-Search-Degraded"] == "exact-only"
+    r = client.post("/products/resolve", json={"items": ["prodcto"]}, headers=API_HEADERS)
+    assert r.json()["degraded"] is True
+    r = client.get("/products/search", params={"q": "producto", "mode": "exact"}, headers=API_HEADERS)
+    assert "X-Search-Degraded" not in r.headers
+
+
+def test_stock_changes_do_not_rebuild_but_are_served_live(client, bo, db):
+    from conftest import new_user
+
+    product_id = db.execute(
+        "INSERT INTO products (sku, name, category, price, stock) VALUES ('ZAPECO1', 'Yerba Zapecó', 'Almacén', 900, 4)"
+    ).lastrowid
+    db.commit()
+    bo.catalog_builders[0].build_if_stale(force=True)
+    version = bo.catalog_snapshot.catalog_version(db)
+
+    bo.checkout_storage.add_item(new_user(db), product_id, 4)
+    # Solo cambió el stock: la versión del catálogo sigue igual (no hay rebuild)
+    assert bo.catalog_snapshot.catalog_version(db) == version
+    r = client.get(f"/products/{product_id}", headers=API_HEADERS)
+    assert r.json()["stock"] == 0
+    r = client.post("/products/resolve", json={"items": ["yerba zapeco"]}, headers=API_HEADERS)
+    assert r.json()["items"][0]["status"] == "out_of_stock"
+    r = client.get("/products/search", params={"q": "zapeco"}, headers=API_HEADERS)
+    assert [p["stock"] for p in r.json()] == [0]
+
+    db.execute("UPDATE products SET price = 950 WHERE id = ?", (product_id,))
+    db.commit()
+    assert bo.catalog_snapshot.catalog_version(db) == version + 1
@@ -0,0 +1,19 @@
+"""Modelos falsos de retail_agent/fake_model.py (load tests sin Gemini)."""
+
+import pytest
+from google.genai import types
+
+import fake_model
+
+
+def test_base_is_abstract():
+    with pytest.raises(TypeError):
+        fake_model._FakeLlm(model="x")
+
+
+def test_scripted_identifies_user_first():
+    llm = fake_model.ScriptedShopperLlm()
+    msg = types.Content(role="user", parts=[types.Part(text="[INFO INTERNA: Usuario WhatsApp #5491100000000]\n\nhola")])
+    call = llm.next_response([msg]).content.parts[0].function_call
+    assert call.name == "search_users"
+    assert call.args == {"phone": "5491100000000"}
@@ -0,0 +1,42 @@
+"""Carga masiva de gen_dataset.py / bench_backoffice.py con users_fts diferido."""
+
+import sqlite3
+from argparse import Namespace
+
+import bench_backoffice
+import gen_dataset
+
+TRIGGERS = {"trg_users_fts_insert", "trg_users_fts_delete", "trg_users_fts_update"}
+
+
+def _triggers(conn):
+    return {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+
+
+def _fts_ids(conn, term):
+    return {r[0] for r in conn.execute("SELECT rowid FROM users_fts WHERE users_fts MATCH ?", (term,))}
+
+
+def test_build_rebuilds_fts_and_restores_triggers(tmp_path):
+    out = tmp_path / "small.db"
+    gen_dataset.build(Namespace(
+        out=str(out), append=False, seed=1, days=30, users=300, products=50, carts=0,
+        chunk=100, offer_ratio=0.1, user_skew=1.0, product_skew=1.0,
+    ))
+    conn = sqlite3.connect(out)
+    assert TRIGGERS <= _triggers(conn)
+    name_fold = conn.execute("SELECT name_fold FROM users WHERE id = 123").fetchone()[0]
+    assert 123 in _fts_ids(conn, f'"{name_fold}"')
+    # los triggers volvieron: un alta nueva entra al índice
+    conn.execute("INSERT INTO users (name, name_fold, email) VALUES ('Zoe Quiroga', 'zoe quiroga', 'zq@x.com')")
+    assert _fts_ids(conn, '"zoe quiroga"')
+    conn.close()
+
+
+def test_bench_seed_indexes_users(tmp_path):
+    path = tmp_path / "bench.db"
+    bench_backoffice.seed_db(path, 200)
+    conn = sqlite3.connect(path)
+    assert TRIGGERS <= _triggers(conn)
+    assert _fts_ids(conn, '"cliente 150"') == {150}
+    conn.close()
@@ -0,0 +1,71 @@
+"""Stock disponible vs retenido en las acciones del admin (inventory.py + backoffice_app.py)."""
+
+from conftest import API_HEADERS, new_product, new_user
+
+
+def stock(db, product_id):
+    return db.execute("SELECT stock FROM products WHERE id = ?", (product_id,)).fetchone()[0]
+
+
+def reservations(db, **where):
+    col, val = next(iter(where.items()))
+    return db.execute(f"SELECT COUNT(*) FROM stock_reservations WHERE {col} = ?", (val,)).fetchone()[0]
+
+
+def add(client, user_id, product_id, qty):
+    r = client.post("/carts/add_item", json={"user_id": user_id, "product_id": product_id, "quantity": qty},
+                    headers=API_HEADERS)
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def test_edit_sets_on_hand_and_keeps_holds(admin, db):
+    pid, uid = new_product(db, stock=10), new_user(db)
+    add(admin, uid, pid, 3)
+    assert stock(db, pid) == 7
+
+    form = {"sku": f"EDIT{pid}", "name": "Editado", "price": "100", "stock": "20"}
+    r = admin.post(f"/admin/products/{pid}/edit", data=form, follow_redirects=False)
+    assert r.status_code == 303
+    # 20 físicas, 3 retenidas: 17 disponibles
+    assert stock(db, pid) == 17
+    # Al vaciar el carrito vuelven las 3: nunca más de lo físico
+    assert admin.post("/carts/clear", json={"user_id": uid}, headers=API_HEADERS).status_code == 200
+    assert stock(db, pid) == 20
+
+
+def test_edit_below_held_is_rejected(admin, db):
+    pid, uid = new_product(db, stock=10), new_user(db)
+    add(admin, uid, pid, 4)
+    form = {"sku": f"LOW{pid}", "name": "Bajo", "price": "100", "stock": "2"}
+    r = admin.post(f"/admin/products/{pid}/edit", data=form, follow_redirects=False)
+    assert r.headers["location"].endswith("?error=held")
+    assert stock(db, pid) == 6
+
+
+def test_user_delete_releases_holds(admin, db):
+    pid, uid = new_product(db, stock=10), new_user(db)
+    add(admin, uid, pid, 5)
+    assert stock(db, pid) == 5
+    r = admin.post(f"/admin/users/{uid}/delete", follow_redirects=False)
+    assert r.status_code == 303
+    assert stock(db, pid) == 10
+    assert reservations(db, product_id=pid) == 0
+
+
+def test_user_delete_drops_committed_reservations(admin, db):
+    pid, uid = new_product(db, stock=10), new_user(db)
+    add(admin, uid, pid, 2)
+    email = db.execute("SELECT email FROM users WHERE id = ?", (uid,)).fetchone()[0]
+    assert admin.post("/orders/checkout", json={"user_id": uid, "email": email}, headers=API_HEADERS).status_code == 200
+    admin.post(f"/admin/users/{uid}/delete", follow_redirects=False)
+    assert reservations(db, product_id=pid) == 0
+    assert stock(db, pid) == 8  # lo vendido no vuelve
+
+
+def test_product_delete_drops_reservations(admin, db):
+    pid, uid = new_product(db, stock=10), new_user(db)
+    add(admin, uid, pid, 1)
+    r = admin.post(f"/admin/products/{pid}/delete", follow_redirects=False)
+    assert r.status_code == 303
+    assert reservations(db, product_id=pid) == 0
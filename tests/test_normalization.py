@@ -0,0 +1,51 @@
+"""normalize_phone / fold_text (normalization.py)."""
+
+import sqlite3
+
+import pytest
+
+from normalization import fold_text, normalize_phone
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("+54 9 11 2222-3333", "+5491122223333"),
+    ("whatsapp:5491122223333", "+5491122223333"),
+    ("011 15-2222-3333", "+5491122223333"),
+    ("1122223333", "+5491122223333"),
+    ("111522223333", "+5491122223333"),
+    ("351 15 555-1234", "+5493515551234"),
+    # WaId de otro país, sin "+"
+    ("14155551234", "+14155551234"),
+    ("447911123456", "+447911123456"),
+    ("+1 415 555 1234", "+14155551234"),
+    ("whatsapp:+14155551234", "+14155551234"),
+    ("15 2222-3333", None),
+    ("", None),
+    (None, None),
+])
+def test_normalize_phone(raw, expected):
+    assert normalize_phone(raw) == expected
+
+
+def test_waid_matches_stored_foreign_number():
+    assert normalize_phone("14155551234") == normalize_phone("+1 415 555 1234")
+
+
+def test_fold_text():
+    assert fold_text("Café  con LECHE") == "cafe con leche"
+    assert fold_text("Ñandú") == "nandu"
+
+
+def test_user_migration_is_idempotent_and_resumes_backfill(bo, tmp_path):
+    conn = sqlite3.connect(tmp_path / "legacy.db")
+    conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT, phone TEXT)")
+    conn.execute("INSERT INTO users (name, phone) VALUES ('José Pérez', '11 2222-3333')")
+    conn.commit()
+    bo._migrate_users(conn)
+    # Otro worker (o un arranque después de una caída) no falla con "duplicate column name"
+    conn.execute("INSERT INTO users (name, phone) VALUES ('Ñandú', '+54 9 351 555-1234')")
+    conn.commit()
+    bo._migrate_users(conn)
+    rows = conn.execute("SELECT phone_norm, name_fold FROM users ORDER BY id").fetchall()
+    assert rows == [("+5491122223333", "jose perez"), ("+5493515551234", "nandu")]
+    conn.close()
@@ -0,0 +1,101 @@
+"""Webhook de pagos (payments.py): un pago fallido devuelve el stock de la orden."""
+
+import json
+import uuid
+
+import payments
+from conftest import new_product, new_user
+
+
+def _order(bo, db, quantity=3, stock=5):
+    user_id = new_user(db)
+    product_id = new_product(db, stock=stock, price=100.0)
+    bo.checkout_storage.add_item(user_id, product_id, quantity)
+    order = bo.checkout_storage.checkout(user_id)
+    return order, product_id
+
+
+def _notify(client, order_id, status, amount):
+    body = json.dumps({
+        "event_id": uuid.uuid4().hex, "order_id": order_id, "status": status, "amount": amount,
+    }).encode()
+    return client.post(
+        "/payments/webhook", content=body,
+        headers={payments.SIGNATURE_HEADER: payments.sign(body, "test-payments-secret")},
+    )
+
+
+def _stock(db, product_id):
+    return db.execute("SELECT stock FROM products WHERE id = ?", (product_id,)).fetchone()[0]
+
+
+def test_failed_payment_returns_stock(bo, client, db):
+    order, product_id = _order(bo, db)
+    assert _stock(db, product_id) == 2
+
+    r = _notify(client, order["order_id"], "failed", order["total"])
+    assert r.status_code == 200, r.text
+    assert r.json()["result"] == "applied"
+    assert _stock(db, product_id) == 5
+    statuses = [row[0] for row in db.execute(
+        "SELECT status FROM stock_reservations WHERE cart_id = ?", (order["cart_id"],)
+    )]
+    assert statuses == ["released"]
+    event = db.execute(
+        "SELECT payload FROM change_events WHERE entity = 'order' AND entity_id = ? AND action = 'status_changed'",
+        (order["order_id"],),
+    ).fetchone()
+    assert json.loads(event[0])["released"] == [{"product_id": product_id, "quantity": 3}]
+
+    # Un reintento o un "paid" tardío no devuelven el stock dos veces
+    assert _notify(client, order["order_id"], "failed", order["total"]).json()["result"] == "unchanged"
+    assert _notify(client, order["order_id"], "paid", order["total"]).status_code == 409
+    assert _stock(db, product_id) == 5
+
+
+def test_paid_keeps_stock_committed(bo, client, db):
+    order, product_id = _order(bo, db)
+    assert _notify(client, order["order_id"], "paid", order["total"]).json()["result"] == "applied"
+    assert _stock(db, product_id) == 2
+    status = db.execute(
+        "SELECT status FROM stock_reservations WHERE cart_id = ?", (order["cart_id"],)
+    ).fetchone()[0]
+    assert status == "committed"
+
+
+def _admin_set(admin, order_id, status):
+    return admin.post(f"/admin/orders/{order_id}/edit", data={"payment_status": status}, follow_redirects=False)
+
+
+def _payment_status(db, order_id):
+    return db.execute("SELECT payment_status FROM orders WHERE id = ?", (order_id,)).fetchone()[0]
+
+
+def test_admin_failed_and_back_moves_stock(bo, admin, db):
+    order, product_id = _order(bo, db)
+    r = _admin_set(admin, order["order_id"], "failed")
+    assert r.status_code == 303
+    assert _stock(db, product_id) == 5
+
+    r = _admin_set(admin, order["order_id"], "paid")
+    assert r.headers["location"] == f"/admin/orders/{order['order_id']}"
+    assert _payment_status(db, order["order_id"]) == "paid"
+    assert _stock(db, product_id) == 2
+    status = db.execute(
+        "SELECT status FROM stock_reservations WHERE cart_id = ?", (order["cart_id"],)
+    ).fetchone()[0]
+    assert status == "committed"
+
+
+def test_admin_cannot_leave_failed_without_stock(bo, admin, db):
+    order, product_id = _order(bo, db)
+    assert _notify(admin, order["order_id"], "failed", order["total"]).json()["result"] == "applied"
+    # Otro comprador se lleva lo que la orden fallida devolvió
+    other = new_user(db)
+    bo.checkout_storage.add_item(other, product_id, 5)
+
+    r = _admin_set(admin, order["order_id"], "paid")
+    assert r.status_code == 303
+    assert r.headers["location"].endswith("/edit?error=stock")
+    assert _payment_status(db, order["order_id"]) == "failed"
+    assert _stock(db, product_id) == 0
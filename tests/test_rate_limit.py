@@ -0,0 +1,26 @@
+"""Rate limiter en memoria (rate_limit.py): tope de claves sin perder la clave nueva."""
+
+from rate_limit import MemoryRateLimiter
+
+
+def test_new_key_survives_eviction_of_refilled_buckets():
+    lim = MemoryRateLimiter("test", capacity=5, window=60, max_keys=3)
+    for key in ("a", "b", "c"):
+        assert lim.hit(key, now=0) == (True, 0.0)
+    # Para t=1000 los tres baldes se recargaron: se borran, pero "d" queda contado
+    assert lim.hit("d", now=1000) == (True, 0.0)
+    assert list(lim._buckets) == ["d"]
+    assert lim._buckets["d"][0] == 4
+
+
+def test_over_cap_drops_the_oldest_key():
+    lim = MemoryRateLimiter("test", capacity=5, window=60, max_keys=3)
+    for key in ("a", "b", "c"):
+        lim.hit(key, now=0)
+    lim.hit("a", now=1)
+    lim.hit("d", now=2)
+    assert list(lim._buckets) == ["c", "a", "d"]
+    assert len(lim) == 3
+    # "b" perdió su historial: vuelve con el balde lleno
+    assert lim.hit("b", now=3) == (True, 0.0)
+    assert lim._buckets["b"][0] == 4
@@ -0,0 +1,56 @@
+"""Cableado por tienda: EXPLAIN de slow_queries y jobs de retail con RETAIL_STORES."""
+
+import sqlite3
+
+import pytest
+
+import jobs
+import shards
+import slow_queries
+
+
+@pytest.fixture
+def two_stores(bo, monkeypatch, tmp_path):
+    monkeypatch.setattr(shards, "STORES", ["centro", "norte"])
+    monkeypatch.setattr(shards, "SHARDED", True)
+    monkeypatch.setattr(shards, "SHARDS_DIR", tmp_path)
+    shard_set = shards.ShardSet(tmp_path / "unused.db", 5)
+    for store, index in (("centro", True), ("norte", False)):
+        conn = sqlite3.connect(shard_set.path(store))
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        if index:
+            conn.execute("CREATE INDEX idx_t_x ON t(x)")
+        conn.commit()
+        conn.close()
+    monkeypatch.setattr(bo, "shard_set", shard_set)
+    return shard_set
+
+
+def test_slow_query_explain_uses_current_store(bo, two_stores):
+    log = slow_queries.SlowQueryLog(bo.current_db_path)
+    with shards.use_store("centro"):
+        centro = log.explain("SELECT * FROM t WHERE x = ?", (1,))
+    with shards.use_store("norte"):
+        norte = log.explain("SELECT * FROM t WHERE x = ?", (1,))
+    assert any("idx_t_x" in line for line in centro)
+    assert any("SCAN" in line for line in norte)
+
+
+def test_register_retail_jobs_wraps_each_store(monkeypatch):
+    scheduler = jobs.Scheduler()
+    monkeypatch.setattr(jobs, "scheduler", scheduler)
+    calls = []
+
+    def each_store(fn):
+        calls.append(fn)
+        return {"centro": "ok"}
+
+    jobs.register_retail_jobs(lambda: None, each_store=each_store)
+    fn = scheduler._jobs["release_expired_reservations"]["fn"]
+    assert fn(None) == {"centro": "ok"}
+    assert calls == [jobs.release_expired_reservations]
+
+    single = jobs.Scheduler()
+    monkeypatch.setattr(jobs, "scheduler", single)
+    jobs.register_retail_jobs(lambda: None)
+    assert single._jobs["release_expired_reservations"]["fn"] is jobs.release_expired_reservations
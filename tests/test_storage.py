@@ -0,0 +1,181 @@
+"""
+Camino de compra de storage.py contra los dos backends (mismos resultados y
+mismos errores). Postgres necesita DATABASE_URL (base descartable: se vacía
+en cada test) y asyncpg; sin eso esa mitad se saltea.
+"""
+
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import shards
+import storage
+import stress_stock
+from storage import StorageError
+
+STOCK = 3
+PRODUCTS = 2
+BUYERS = 3
+
+
+class Backend:
+    """Storage de un backend más lo que el test necesita tocar por fuera de la interfaz."""
+
+    def __init__(self, store, expire_sql, run_sql):
+        self.store = store
+        self._expire_sql = expire_sql
+        self._run_sql = run_sql
+
+    def expire_reservations(self, user_id: int):
+        self._run_sql(self._expire_sql, user_id)
+
+    def event_seqs(self):
+        return [r[0] for r in self._run_sql("SELECT seq FROM change_events ORDER BY seq")]
+
+    def stock(self):
+        return {r["id"]: r for r in self.store.stock_report()}
+
+
+@pytest.fixture(scope="module")
+def pg():
+    dsn = os.getenv("DATABASE_URL", "")
+    if not dsn:
+        pytest.skip("sin DATABASE_URL (Postgres descartable, ver CONFIG.md 9.0)")
+    pytest.importorskip("asyncpg")
+    pg = storage.PostgresStorage(dsn, min_size=1, max_size=4)
+    pg.migrate()
+    yield pg
+    pg.close()
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def backend(request, tmp_path):
+    db_path = tmp_path / "storage.db"
+    stress_stock.seed(db_path, buyers=BUYERS, products=PRODUCTS, stock=STOCK)
+    if request.param == "sqlite":
+        pool = shards.ConnectionPool("test", db_path, timeout=5, size=2)
+
+        def run_sql(sql, *args):
+            with pool.acquire() as conn:
+                rows = conn.execute(sql, args).fetchall()
+                conn.commit()
+                return rows
+
+        yield Backend(
+            storage.SQLiteStorage(pool.acquire),
+            "UPDATE stock_reservations SET expires_at = datetime('now', '-1 minute') "
+            "WHERE cart_id IN (SELECT id FROM carts WHERE user_id = ?)",
+            run_sql,
+        )
+        pool.close()
+        return
+
+    pg = request.getfixturevalue("pg")
+    pg.copy_from_sqlite(db_path, truncate=True)
+
+    def run_sql(sql, *args):
+        async def run():
+            async with pg._pool.acquire() as conn:
+                return await conn.fetch(sql, *args)
+        return pg._run(run())
+
+    yield Backend(
+        pg,
+        "UPDATE stock_reservations SET expires_at = now() - interval '1 minute' "
+        "WHERE cart_id IN (SELECT id FROM carts WHERE user_id = $1)",
+        run_sql,
+    )
+
+
+def _assert_invariant(backend):
+    for r in backend.store.stock_report():
+        assert r["sold"] == r["committed"], r
+        assert r["stock"] + r["sold"] + r["held"] == STOCK, r
+
+
+def test_add_item_reserves_stock(backend):
+    summary = backend.store.add_item(1, 1, 2)
+    assert [(i["product_id"], i["quantity"]) for i in summary["items"]] == [(1, 2)]
+    assert float(summary["total"]) == 2000
+    again = backend.store.add_item(1, 1, 1)
+    assert again["cart_id"] == summary["cart_id"]
+    assert again["items"][0]["quantity"] == 3
+    stock = backend.stock()
+    assert (stock[1]["stock"], stock[1]["held"]) == (0, 3)
+    assert backend.store.cart_summary(1)["items"][0]["quantity"] == 3
+    _assert_invariant(backend)
+
+
+def test_add_item_errors(backend):
+    with pytest.raises(StorageError) as e:
+        backend.store.add_item(999, 1, 1)
+    assert e.value.status_code == 404
+    with pytest.raises(StorageError) as e:
+        backend.store.add_item(1, 999, 1)
+    assert e.value.status_code == 404
+    backend.store.add_item(1, 1, 2)
+    with pytest.raises(StorageError) as e:
+        backend.store.add_item(2, 1, 2)
+    assert e.value.status_code == 400
+    assert "Disponible: 1" in e.value.detail
+    _assert_invariant(backend)
+
+
+def test_clear_returns_stock(backend):
+    cart_id = backend.store.add_item(1, 1, 2)["cart_id"]
+    assert backend.store.clear_cart(1) == cart_id
+    assert backend.store.cart_summary(1)["items"] == []
+    assert backend.stock()[1]["stock"] == STOCK
+    assert backend.store.clear_cart(2) is None
+    _assert_invariant(backend)
+
+
+def test_checkout_commits_reservations(backend):
+    backend.store.add_item(1, 1, 2)
+    backend.store.add_item(1, 2, 1)
+    order = backend.store.checkout(1)
+    assert order["order_id"]
+    assert order["user"]["id"] == 1
+    assert float(order["total"]) == 3000
+    stock = backend.stock()
+    assert (stock[1]["stock"], stock[1]["sold"], stock[1]["held"]) == (1, 2, 0)
+    assert (stock[2]["stock"], stock[2]["sold"]) == (2, 1)
+    # El carrito quedó cerrado: otro checkout no tiene qué comprar
+    with pytest.raises(StorageError) as e:
+        backend.store.checkout(1)
+    assert e.value.status_code == 400
+    _assert_invariant(backend)
+
+
+def test_checkout_out_of_stock_is_409(backend):
+    backend.store.add_item(1, 1, 2)
+    # La reserva de 1 vence y otro comprador se lleva todo el stock
+    backend.expire_reservations(1)
+    backend.store.add_item(2, 1, STOCK)
+    with pytest.raises(StorageError) as e:
+        backend.store.checkout(1)
+    assert e.value.status_code == 409
+    assert "pediste 2, disponible 0" in e.value.detail
+    # El rollback no dejó nada a medias: el carrito sigue abierto y 2 compra
+    assert backend.store.cart_summary(1)["items"][0]["quantity"] == 2
+    backend.store.checkout(2)
+    stock = backend.stock()
+    assert (stock[1]["stock"], stock[1]["sold"], stock[1]["held"]) == (0, STOCK, 0)
+    _assert_invariant(backend)
+
+
+def test_event_seqs_have_no_gaps(backend):
+    # Compras concurrentes: los seq del log quedan 1..N, sin huecos
+    with ThreadPoolExecutor(max_workers=BUYERS) as pool:
+        list(pool.map(lambda uid: backend.store.add_item(uid, 2, 1), range(1, BUYERS + 1)))
+    backend.store.checkout(1)
+    backend.store.clear_cart(2)
+    assert backend.event_seqs() == list(range(1, BUYERS + 3))
+
+
+def test_postgres_backend_refuses_to_start(monkeypatch):
+    monkeypatch.setattr(storage, "STORAGE_BACKEND", "postgres")
+    with pytest.raises(RuntimeError, match="STORAGE_BACKEND=postgres"):
+        storage.build_storage_from_env(lambda: sqlite3.connect(":memory:"))
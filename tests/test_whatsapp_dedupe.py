@@ -0,0 +1,63 @@
+"""Dedupe de reintentos de Twilio (whatsapp_server.py): solo se cachean los turnos exitosos."""
+
+from types import SimpleNamespace
+
+import pytest
+
+
+@pytest.fixture
+def ws(monkeypatch):
+    import whatsapp_server
+
+    async def fake_session(user_id, session_id):
+        return session_id
+
+    monkeypatch.setattr(whatsapp_server, "ensure_session", fake_session)
+    return whatsapp_server
+
+
+class FakeRunner:
+    """Falla las primeras `failures` corridas y después contesta `reply`."""
+
+    def __init__(self, failures: int, reply: str):
+        self.failures = failures
+        self.reply = reply
+        self.calls = 0
+
+    async def run_async(self, **_):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RuntimeError("modelo caído")
+        part = SimpleNamespace(text=self.reply)
+        yield SimpleNamespace(is_final_response=lambda: True, content=SimpleNamespace(parts=[part]))
+
+
+def post(client, sid):
+    return client.post("/whatsapp", data={"Body": "hola", "WaId": "5491100000000", "MessageSid": sid})
+
+
+def test_failed_turn_is_not_cached(ws, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    fake = FakeRunner(failures=1, reply="¡Hola! ¿Qué necesitás?")
+    monkeypatch.setattr(ws, "runner", fake)
+    client = TestClient(ws.app)
+
+    first = post(client, "SM-fail-then-ok")
+    assert ws.TURN_ERROR_REPLY in first.text
+    # El reintento de Twilio vuelve a correr el turno en vez de repetir el error
+    retry = post(client, "SM-fail-then-ok")
+    assert "¿Qué necesitás?" in retry.text
+    assert fake.calls == 2
+    # Y ahora sí queda cacheado
+    again = post(client, "SM-fail-then-ok")
+    assert "¿Qué necesitás?" in again.text
+    assert fake.calls == 2
+
+
+def test_run_whatsapp_turn_reports_failure(ws, monkeypatch):
+    import asyncio
+
+    monkeypatch.setattr(ws, "runner", FakeRunner(failures=1, reply="ok"))
+    assert asyncio.run(ws.run_whatsapp_turn("u1", "hola")) == (ws.TURN_ERROR_REPLY, False)
+    assert asyncio.run(ws.run_whatsapp_turn("u1", "hola")) == ("ok", True)
@@ -0,0 +1,352 @@
+"""
+tracing.py
+Tracing liviano por turno (spans) para el bridge de WhatsApp, las tools del
+agente y el backoffice.
+
+- Cada webhook / request abre una traza con trace_id propio.
+- Dentro de la traza se abren spans (session, llm, tool, http, sql, ...).
+- Los spans terminados se encolan y un thread de fondo los escribe en JSONL
+  rotativo: el hot path nunca toca disco (si la cola se llena, se descartan).
+- Muestreo por traza (head sampling): si la traza no está muestreada,
+  todos sus spans son no-op.
+- La traza se propaga al backoffice con el header x-trace-context.
+
+Config (env):
+- TRACE_ENABLED       true | false  (default: true)
+- TRACE_SAMPLE_RATE   0.0 - 1.0     (default: 0.1)
+- TRACE_DIR           carpeta de salida (default: ./traces)
+- TRACE_MAX_BYTES     tamaño por archivo antes de rotar (default: 5 MB)
+- TRACE_BACKUPS       archivos rotados que se conservan (default: 3)
+
+Resumen de latencias:
+    python tracing.py summary traces/spans.jsonl* [--by kind|name]
+"""
+
+import atexit
+import contextvars
+import json
+import math
+import os
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+BASE_DIR = Path(__file__).resolve().parent
+
+TRACE_ENABLED = (os.getenv("TRACE_ENABLED", "true") or "").lower() == "true"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+TRACE_DIR = Path(os.getenv("TRACE_DIR", str(BASE_DIR / "traces")))
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(5 * 1024 * 1024)))
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", "3"))
+TRACE_QUEUE_SIZE = 10000
+
+TRACE_HEADER = "x-trace-context"
+
+# (trace_id, span_id) del span activo; None si no hay traza muestreada
+_current: contextvars.ContextVar[Optional[Tuple[str, str]]] = contextvars.ContextVar(
+    "trace_current", default=None
+)
+
+
+def _new_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+# -------------------------
+# Writer no bloqueante (JSONL rotativo)
+# -------------------------
+class JsonlSink:
+    """Thread de fondo que drena una cola acotada y escribe JSONL con rotación."""
+
+    def __init__(self, directory: Path, max_bytes: int, backups: int):
+        self.path = Path(directory) / "spans.jsonl"
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(TRACE_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, record: Dict[str, Any]):
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name="trace-sink", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            src = self.path.with_name(f"{self.path.name}.{i}")
+            if src.exists():
+                os.replace(src, self.path.with_name(f"{self.path.name}.{i + 1}"))
+        if self.backups > 0:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink()
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            batch = [record]
+            # Drenamos lo que haya para escribir en bloque
+            while len(batch) < 500:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            lines = "".join(
+                json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in batch if r is not None
+            )
+            try:
+                if self.path.exists() and self.path.stat().st_size >= self.max_bytes:
+                    self._rotate()
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+            except OSError as e:
+                print(f"⚠️  trace sink: no pude escribir spans: {e}")
+            if stop:
+                return
+
+    def close(self):
+        if self._thread is None or not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(None, timeout=1)
+            self._thread.join(timeout=2)
+        except queue.Full:
+            pass
+
+
+_sink = JsonlSink(TRACE_DIR, TRACE_MAX_BYTES, TRACE_BACKUPS)
+
+
+def _emit(trace_id: str, span_id: str, parent_id: Optional[str], name: str, kind: str,
+          start: float, duration: float, status: str, attrs: Dict[str, Any]):
+    _sink.submit(
+        {
+            "trace_id": trace_id,
+            "span_id": span_id,
+            "parent_id": parent_id,
+            "name": name,
+            "kind": kind,
+            "start": round(start, 6),
+            "duration_ms": round(duration * 1000, 3),
+            "status": status,
+            "attrs": attrs,
+        }
+    )
+
+
+# -------------------------
+# API de spans
+# -------------------------
+class Span:
+    """
+    Span abierto. Se usa vía `span()` / `start_trace()` o manualmente con
+    `begin_span()` + `end()` (para callbacks del ADK que abren y cierran
+    en funciones distintas).
+    """
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "attrs", "start", "_t0", "_ended")
+
+    def __init__(self, trace_id: str, parent_id: Optional[str], name: str, kind: str, attrs: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = _new_id()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attrs = attrs
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self._ended = False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def end(self, status: str = "ok", **attrs):
+        if self._ended:
+            return
+        self._ended = True
+        if attrs:
+            self.attrs.update(attrs)
+        _emit(self.trace_id, self.span_id, self.parent_id, self.name, self.kind,
+              self.start, time.perf_counter() - self._t0, status, self.attrs)
+        # Volvemos al padre como span activo (si seguimos en el mismo contexto)
+        if _current.get() == (self.trace_id, self.span_id):
+            _current.set((self.trace_id, self.parent_id) if self.parent_id else None)
+
+
+def current_trace_id() -> Optional[str]:
+    cur = _current.get()
+    return cur[0] if cur else None
+
+
+def begin_span(name: str, kind: str, **attrs) -> Optional[Span]:
+    """Abre un span hijo del activo. Devuelve None si no hay traza muestreada."""
+    cur = _current.get()
+    if cur is None:
+        return None
+    s = Span(cur[0], cur[1], name, kind, attrs)
+    _current.set((s.trace_id, s.span_id))
+    return s
+
+
+def _should_sample() -> bool:
+    return TRACE_ENABLED and random.random() < TRACE_SAMPLE_RATE
+
+
+@contextmanager
+def _run_span(s: Optional[Span], token) -> Iterator[Optional[Span]]:
+    try:
+        yield s
+    except BaseException as e:
+        if s is not None:
+            s.end(status="error", error=f"{type(e).__name__}: {e}")
+        raise
+    else:
+        if s is not None:
+            s.end()
+    finally:
+        if token is not None:
+            _current.reset(token)
+
+
+@contextmanager
+def start_trace(name: str, kind: str, parent_header: Optional[str] = None, **attrs) -> Iterator[Optional[Span]]:
+    """
+    Abre la traza de un turno/request. Si viene `parent_header`
+    (x-trace-context), continúa esa traza en vez de muestrear de nuevo.
+    """
+    s = None
+    parent = parse_header(parent_header) if parent_header else None
+    if parent is not None:
+        trace_id, parent_id, sampled = parent
+        if sampled and TRACE_ENABLED:
+            s = Span(trace_id, parent_id, name, kind, attrs)
+    elif _should_sample():
+        s = Span(_new_id() + _new_id(), None, name, kind, attrs)
+    token = _current.set((s.trace_id, s.span_id) if s else None)
+    with _run_span(s, token) as active:
+        yield active
+
+
+@contextmanager
+def span(name: str, kind: str, **attrs) -> Iterator[Optional[Span]]:
+    """Span hijo del activo; no-op si la traza no está muestreada."""
+    cur = _current.get()
+    if cur is None:
+        yield None
+        return
+    s = Span(cur[0], cur[1], name, kind, attrs)
+    token = _current.set((s.trace_id, s.span_id))
+    with _run_span(s, token) as active:
+        yield active
+
+
+def record_span(name: str, kind: str, start: float, duration: float, status: str = "ok", **attrs):
+    """Registra un span ya medido (ej: un statement SQL) como hijo del activo."""
+    cur = _current.get()
+    if cur is None:
+        return
+    _emit(cur[0], _new_id(), cur[1], name, kind, start, duration, status, attrs)
+
+
+# -------------------------
+# Propagación entre servicios
+# -------------------------
+def outgoing_header() -> Dict[str, str]:
+    cur = _current.get()
+    if cur is None:
+        return {}
+    return {TRACE_HEADER: f"{cur[0]}:{cur[1]}:1"}
+
+
+def parse_header(value: str) -> Optional[Tuple[str, str, bool]]:
+    parts = (value or "").split(":")
+    if len(parts) != 3 or not parts[0] or not parts[1]:
+        return None
+    return parts[0], parts[1], parts[2] == "1"
+
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def route_name(path: str) -> str:
+    """/users/123/edit -> /users/{id}/edit (para agrupar spans)."""
+    return _ID_SEGMENT.sub("/{id}", path)
+
+
+# -------------------------
+# CLI: resumen p50/p95/p99
+# -------------------------
+def _percentile(sorted_values, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # nearest-rank
+    k = max(0, min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def summarize(paths, by: str = "kind") -> Dict[str, Dict[str, float]]:
+    groups: Dict[str, list] = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                key = rec.get("kind", "?") if by == "kind" else f"{rec.get('kind', '?')}:{rec.get('name', '?')}"
+                groups.setdefault(key, []).append(float(rec.get("duration_ms", 0.0)))
+    result = {}
+    for key, values in groups.items():
+        values.sort()
+        result[key] = {
+            "count": len(values),
+            "p50": _percentile(values, 50),
+            "p95": _percentile(values, 95),
+            "p99": _percentile(values, 99),
+            "max": values[-1],
+        }
+    return result
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Resumen de latencias de spans (JSONL).")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_sum = sub.add_parser("summary", help="p50/p95/p99 por tipo de span")
+    p_sum.add_argument("files", nargs="+")
+    p_sum.add_argument("--by", choices=["kind", "name"], default="kind")
+    args = parser.parse_args(argv)
+
+    stats = summarize(args.files, by=args.by)
+    width = max([len(k) for k in stats] + [4])
+    print(f"{'span':<{width}}  {'count':>7}  {'p50 ms':>9}  {'p95 ms':>9}  {'p99 ms':>9}  {'max ms':>9}")
+    for key, s in sorted(stats.items(), key=lambda kv: -kv[1]["p95"]):
+        print(
+            f"{key:<{width}}  {s['count']:>7}  {s['p50']:>9.2f}  {s['p95']:>9.2f}  "
+            f"{s['p99']:>9.2f}  {s['max']:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
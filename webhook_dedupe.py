@@ -0,0 +1,238 @@
+"""
+webhook_dedupe.py
+Deduplicación de webhooks de Twilio por MessageSid.
+
+Cuando un turno del agente tarda, Twilio reintenta el POST a /whatsapp con
+el mismo MessageSid. Este módulo guarda el estado de cada mensaje:
+
+- in_flight: el turno original todavía se está procesando.
+- done: el turno terminó y tenemos la respuesta cacheada.
+
+Backends:
+- memory: dict acotado (LRU + TTL) por proceso. Default.
+- sqlite: archivo SQLite compartido entre workers de uvicorn del mismo host.
+
+Config (env):
+- WEBHOOK_DEDUPE_BACKEND   memory | sqlite | off   (default: memory)
+- WEBHOOK_DEDUPE_DB        path del archivo sqlite (default: ./webhook_dedupe.db)
+- WEBHOOK_DEDUPE_TTL       segundos que se guarda una respuesta (default: 3600)
+- WEBHOOK_DEDUPE_INFLIGHT_TTL  segundos antes de considerar muerto un in_flight (default: 120)
+- WEBHOOK_DEDUPE_MAX_ENTRIES   tope de entradas (default: 10000)
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+BASE_DIR = Path(__file__).resolve().parent
+
+STATE_NEW = "new"
+STATE_IN_FLIGHT = "in_flight"
+STATE_DONE = "done"
+
+
+# -------------------------
+# Métricas (hit rate)
+# -------------------------
+class DedupeStats:
+    """Contadores por proceso para medir cuánta carga generan los reintentos."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0
+        self.new = 0
+        self.duplicate_done = 0
+        self.duplicate_in_flight = 0
+        self.in_flight_resolved = 0
+        self.in_flight_acked = 0
+        self.failed_released = 0  # turnos fallidos: no se cachean, el reintento corre de nuevo
+
+    def incr(self, field: str, n: int = 1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + n)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            duplicates = self.duplicate_done + self.duplicate_in_flight
+            return {
+                "total": self.total,
+                "new": self.new,
+                "duplicates": duplicates,
+                "duplicate_done": self.duplicate_done,
+                "duplicate_in_flight": self.duplicate_in_flight,
+                "in_flight_resolved": self.in_flight_resolved,
+                "in_flight_acked": self.in_flight_acked,
+                "failed_released": self.failed_released,
+                "hit_rate": (duplicates / self.total) if self.total else 0.0,
+            }
+
+
+# -------------------------
+# Backend en memoria
+# -------------------------
+class MemoryDedupeStore:
+    """LRU acotado con TTL. Sirve para un único proceso."""
+
+    def __init__(self, ttl: float, inflight_ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.inflight_ttl = inflight_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # sid -> (state, reply, expires_at)
+        self._entries: "OrderedDict[str, Tuple[str, Optional[str], float]]" = OrderedDict()
+
+    def claim(self, sid: str) -> Tuple[str, Optional[str]]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry and entry[2] > now:
+                self._entries.move_to_end(sid)
+                return entry[0], entry[1]
+            self._entries[sid] = (STATE_IN_FLIGHT, None, now + self.inflight_ttl)
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return STATE_NEW, None
+
+    def get(self, sid: str) -> Tuple[Optional[str], Optional[str]]:
+        with self._lock:
+            entry = self._entries.get(sid)
+        if not entry or entry[2] <= time.time():
+            return None, None
+        return entry[0], entry[1]
+
+    def complete(self, sid: str, reply: str):
+        with self._lock:
+            self._entries[sid] = (STATE_DONE, reply, time.time() + self.ttl)
+            self._entries.move_to_end(sid)
+
+    def release(self, sid: str):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# -------------------------
+# Backend SQLite (compartido entre workers)
+# -------------------------
+class SQLiteDedupeStore:
+    """
+    Misma interfaz que MemoryDedupeStore pero persistida en un archivo SQLite,
+    así todos los workers del host ven los mismos MessageSid.
+    El claim es atómico: un único INSERT ... ON CONFLICT DO UPDATE.
+    """
+
+    PRUNE_EVERY = 200
+
+    def __init__(self, path: Path, ttl: float, inflight_ttl: float, max_entries: int):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.inflight_ttl = inflight_ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._claims = 0
+        with self._conn() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS webhook_dedupe (
+                    sid        TEXT PRIMARY KEY,
+                    state      TEXT NOT NULL,
+                    reply      TEXT,
+                    expires_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_webhook_dedupe_expires ON webhook_dedupe(expires_at)"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def claim(self, sid: str) -> Tuple[str, Optional[str]]:
+        now = time.time()
+        conn = self._conn()
+        cur = conn.execute(
+            """
+            INSERT INTO webhook_dedupe (sid, state, reply, expires_at)
+            VALUES (?, ?, NULL, ?)
+            ON CONFLICT(sid) DO UPDATE SET
+                state = excluded.state,
+                reply = NULL,
+                expires_at = excluded.expires_at
+            WHERE webhook_dedupe.expires_at <= ?
+            """,
+            (sid, STATE_IN_FLIGHT, now + self.inflight_ttl, now),
+        )
+        self._claims += 1
+        if self._claims % self.PRUNE_EVERY == 0:
+            self.prune()
+        if cur.rowcount == 1:
+            return STATE_NEW, None
+        state, reply = self.get(sid)
+        # Si justo expiró entre el INSERT y el SELECT, lo tratamos como nuevo
+        return (state, reply) if state else (STATE_NEW, None)
+
+    def get(self, sid: str) -> Tuple[Optional[str], Optional[str]]:
+        row = self._conn().execute(
+            "SELECT state, reply FROM webhook_dedupe WHERE sid = ? AND expires_at > ?",
+            (sid, time.time()),
+        ).fetchone()
+        if not row:
+            return None, None
+        return row[0], row[1]
+
+    def complete(self, sid: str, reply: str):
+        self._conn().execute(
+            "UPDATE webhook_dedupe SET state = ?, reply = ?, expires_at = ? WHERE sid = ?",
+            (STATE_DONE, reply, time.time() + self.ttl, sid),
+        )
+
+    def release(self, sid: str):
+        self._conn().execute("DELETE FROM webhook_dedupe WHERE sid = ?", (sid,))
+
+    def prune(self):
+        """Borra vencidos y recorta al tope de entradas (los que vencen antes primero)."""
+        conn = self._conn()
+        conn.execute("DELETE FROM webhook_dedupe WHERE expires_at <= ?", (time.time(),))
+        conn.execute(
+            """
+            DELETE FROM webhook_dedupe WHERE sid IN (
+                SELECT sid FROM webhook_dedupe
+                ORDER BY expires_at DESC
+                LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_entries,),
+        )
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM webhook_dedupe").fetchone()[0]
+
+
+# -------------------------
+# Factory
+# -------------------------
+def build_store_from_env():
+    backend = (os.getenv("WEBHOOK_DEDUPE_BACKEND", "memory") or "memory").lower()
+    if backend == "off":
+        return None
+    ttl = float(os.getenv("WEBHOOK_DEDUPE_TTL", "3600"))
+    inflight_ttl = float(os.getenv("WEBHOOK_DEDUPE_INFLIGHT_TTL", "120"))
+    max_entries = int(os.getenv("WEBHOOK_DEDUPE_MAX_ENTRIES", "10000"))
+    if backend == "sqlite":
+        path = Path(os.getenv("WEBHOOK_DEDUPE_DB", str(BASE_DIR / "webhook_dedupe.db")))
+        return SQLiteDedupeStore(path, ttl, inflight_ttl, max_entries)
+    return MemoryDedupeStore(ttl, inflight_ttl, max_entries)
@@ -1,17 +1,16 @@
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.responses import Response
-from twilio.twiml.messaging_response import MessagingResponse
 
-# Validación Twilio (opcional)
-from twilio.request_validator import RequestValidator
-
-from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
-from google.genai import types
+# google-adk / google-genai / twilio se importan recién al primer uso
+# (get_runner, get_twilio_validator, _twiml_*): el cold start no los paga.
 
 import os
 import sys
+import asyncio
+import threading
+import time
 from pathlib import Path
+from typing import Tuple
 from dotenv import load_dotenv
 
 # --- Paths base ---
@@ -23,19 +22,64 @@ ENV_PATH = RETAIL_AGENT_DIR / ".env"
 if (os.getenv("ENV", "") or "").lower() in ("dev", "local", ""):
     load_dotenv(ENV_PATH, override=False)
 
-# --- ADK import ---
+# --- ADK: el agente vive en retail_agent/ ---
 sys.path.insert(0, str(RETAIL_AGENT_DIR))
-from agent import root_agent  # noqa
+
+import metrics
+import shards
+import tracing
+from webhook_dedupe import (
+    DedupeStats,
+    build_store_from_env,
+    STATE_DONE,
+    STATE_IN_FLIGHT,
+)
 
 APP_NAME = "retail_whatsapp"
 
 # -------------------------
-# ADK: Runner + sesiones
+# ADK: Runner + sesiones (construcción diferida)
 # -------------------------
-session_service = InMemorySessionService()
-runner = Runner(agent=root_agent, app_name=APP_NAME, session_service=session_service)
+AGENT_WARMUP = (os.getenv("AGENT_WARMUP", "true") or "").lower() == "true"
+
+runner = None
+session_service = None
+_runner_lock = threading.Lock()
+
+
+def get_runner():
+    """
+    Construye el Runner la primera vez que se necesita. Importar google-adk
+    y el agente lleva ~1 s, así que no lo hacemos al importar el módulo.
+    """
+    global runner, session_service
+    if runner is None:
+        with _runner_lock:
+            if runner is None:
+                t0 = time.perf_counter()
+                from google.adk.apps import App
+                from google.adk.runners import Runner
+                from google.adk.sessions import InMemorySessionService
+
+                from agent import root_agent  # noqa
+                from agent_plugins import MetricsPlugin, TracingPlugin
+
+                session_service = InMemorySessionService()
+                runner = Runner(
+                    app=App(name=APP_NAME, root_agent=root_agent, plugins=[TracingPlugin(), MetricsPlugin()]),
+                    session_service=session_service,
+                )
+                print(f"🤖 Runner del agente listo en {time.perf_counter() - t0:.2f} s")
+    return runner
+
+
+def start_agent_warmup():
+    """Arma el Runner en un thread aparte, sin demorar el arranque ni /healthz."""
+    if AGENT_WARMUP and runner is None:
+        threading.Thread(target=get_runner, name="agent-warmup", daemon=True).start()
 
 app = FastAPI(title="Retail WhatsApp Bridge")
+metrics.instrument_app(app, "whatsapp")
 
 # -------------------------
 # Twilio validation (toggle)
@@ -43,7 +87,51 @@ app = FastAPI(title="Retail WhatsApp Bridge")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN", "")
 TWILIO_VALIDATE = (os.getenv("TWILIO_VALIDATE", "false") or "").lower() == "true"
 
-twilio_validator = RequestValidator(TWILIO_AUTH_TOKEN) if (TWILIO_VALIDATE and TWILIO_AUTH_TOKEN) else None
+twilio_validator = None
+
+
+def get_twilio_validator():
+    global twilio_validator
+    if twilio_validator is None and TWILIO_VALIDATE and TWILIO_AUTH_TOKEN:
+        from twilio.request_validator import RequestValidator
+
+        twilio_validator = RequestValidator(TWILIO_AUTH_TOKEN)
+    return twilio_validator
+
+# -------------------------
+# Dedupe de reintentos de Twilio (MessageSid)
+# -------------------------
+dedupe_store = build_store_from_env()
+dedupe_stats = DedupeStats()
+# Cuánto esperamos a que termine el turno original antes de solo "acusar recibo"
+DEDUPE_INFLIGHT_WAIT = float(os.getenv("WEBHOOK_DEDUPE_INFLIGHT_WAIT", "10"))
+DEDUPE_POLL_INTERVAL = 0.25
+
+async def wait_for_inflight_reply(message_sid: str):
+    """Espera (acotado) la respuesta del turno original; None si no llegó a tiempo."""
+    deadline = asyncio.get_running_loop().time() + DEDUPE_INFLIGHT_WAIT
+    while asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(DEDUPE_POLL_INTERVAL)
+        state, reply = dedupe_store.get(message_sid)
+        if state == STATE_DONE:
+            return reply
+        if state is None:
+            # El original falló y liberó el sid
+            return None
+    return None
+
+def _twiml_reply(text: str) -> Response:
+    from twilio.twiml.messaging_response import MessagingResponse
+
+    twiml = MessagingResponse()
+    twiml.message(text)
+    return Response(content=str(twiml), media_type="application/xml")
+
+def _twiml_ack() -> Response:
+    """TwiML vacío: Twilio lo toma como recibido y no manda nada al usuario."""
+    from twilio.twiml.messaging_response import MessagingResponse
+
+    return Response(content=str(MessagingResponse()), media_type="application/xml")
 
 def _public_url_from_request(request: Request) -> str:
     proto = request.headers.get("x-forwarded-proto", request.url.scheme)
@@ -52,7 +140,8 @@ def _public_url_from_request(request: Request) -> str:
     return f"{proto}://{host}{path}"
 
 def validate_twilio_request(request: Request, form_data: dict):
-    if not twilio_validator:
+    validator = get_twilio_validator()
+    if not validator:
         return  # desactivado
 
     signature = request.headers.get("X-Twilio-Signature", "")
@@ -60,13 +149,30 @@ def validate_twilio_request(request: Request, form_data: dict):
         raise HTTPException(status_code=403, detail="Forbidden")
 
     url = _public_url_from_request(request)
-    ok = twilio_validator.validate(url, form_data, signature)
+    ok = validator.validate(url, form_data, signature)
     if not ok:
         raise HTTPException(status_code=403, detail="Forbidden")
 
-async def ensure_session(user_id: str) -> str:
+# -------------------------
+# Métricas del bridge
+# -------------------------
+AGENT_TURN_LATENCY = metrics.histogram(
+    "agent_turn_duration_seconds", "Duración de un turno completo del agente", ("outcome",)
+)
+ADK_SESSIONS = metrics.gauge("adk_sessions", "Sesiones ADK en memoria (por proceso)")
+ADK_SESSIONS.set_function(
+    lambda: [(
+        (),
+        sum(len(by_user) for users in session_service.sessions.values() for by_user in users.values())
+        if session_service is not None else 0,
+    )]
+)
+WEBHOOK_DEDUPE_ENTRIES = metrics.gauge("webhook_dedupe_entries", "Entradas en el store de dedupe", mode="max")
+WEBHOOK_DEDUPE_ENTRIES.set_function(lambda: [((), len(dedupe_store) if dedupe_store else 0)])
+
+
+async def ensure_session(user_id: str, session_id: str) -> str:
     """Asegura que existe una sesión para el usuario"""
-    session_id = user_id
     try:
         session = await session_service.get_session(app_name=APP_NAME, user_id=user_id, session_id=session_id)
         if session is None:
@@ -78,10 +184,32 @@ async def ensure_session(user_id: str) -> str:
         session = await session_service.create_session(app_name=APP_NAME, user_id=user_id, session_id=session_id)
         return session.id
 
-async def run_whatsapp_turn(user_id: str, body: str) -> str:
-    """Ejecuta un turno de conversación con el agente"""
+TURN_ERROR_REPLY = "Perdón, hubo un problema técnico. Probá de nuevo en un ratito."
+
+
+async def run_whatsapp_turn(user_id: str, body: str, store: str = shards.DEFAULT_STORE) -> Tuple[str, bool]:
+    """
+    Ejecuta un turno de conversación con el agente. Las tools llaman al
+    backoffice con la tienda del contexto (x-store-id).
+
+    Devuelve (respuesta, ok). Con ok=False la respuesta es el mensaje de
+    error genérico: no se cachea en el dedupe, así el reintento de Twilio
+    vuelve a correr el turno.
+    """
+    with shards.use_store(store):
+        return await _run_whatsapp_turn(user_id, body, store)
+
+async def _run_whatsapp_turn(user_id: str, body: str, store: str) -> Tuple[str, bool]:
+    t0 = time.perf_counter()
+    outcome = "error"
     try:
-        session_id = await ensure_session(user_id)
+        # Primer mensaje del proceso (si el warmup no terminó): armamos el Runner fuera del event loop
+        turn_runner = runner or await asyncio.to_thread(get_runner)
+        from google.genai import types
+
+        with tracing.span("session_load", "session"):
+            # Un mismo cliente puede escribirle a dos tiendas: una conversación por tienda
+            session_id = await ensure_session(user_id, f"{store}:{user_id}" if shards.SHARDED else user_id)
 
         # Contexto simplificado para evitar que el modelo piense en voz alta
         enriched_text = (
@@ -94,41 +222,38 @@ async def run_whatsapp_turn(user_id: str, body: str) -> str:
         final_text = "Perdón, tuve un problema procesando tu mensaje. Probá de nuevo en un toque."
         
         # Iterar sobre TODOS los eventos hasta obtener la respuesta final de texto
-        async for event in runner.run_async(user_id=user_id, session_id=session_id, new_message=content):
-            # Debug: ver qué tipo de evento es
-            if hasattr(event, 'content') and event.content:
-                for part in event.content.parts:
-                    func_call = getattr(part, 'function_call', None)
-                    if func_call and hasattr(func_call, 'name'):
-                        print(f"🔧 Tool call: {func_call.name}")
-                    
-                    func_resp = getattr(part, 'function_response', None)
-                    if func_resp and hasattr(func_resp, 'name'):
-                        # Mostrar la respuesta de la tool para debug
-                        response_data = getattr(func_resp, 'response', {})
-                        print(f"✅ Tool response: {func_resp.name}")
-                        print(f"📊 Response data: {response_data}")
-            
-            # Solo procesamos el evento final que contiene la respuesta de texto
-            if event.is_final_response():
-                if event.content and event.content.parts:
-                    # Buscar la primera part que sea texto
-                    for part in event.content.parts:
-                        txt = getattr(part, "text", None)
-                        if txt:
-                            final_text = txt
-                            break
-                # Una vez encontrada la respuesta final, salimos
-                if final_text != "Perdón, tuve un problema procesando tu mensaje. Probá de nuevo en un toque.":
-                    break
-
-        return final_text
+        # (las llamadas al modelo y a las tools quedan en spans vía TracingPlugin)
+        with tracing.span("agent_run", "turn") as turn_span:
+            async for event in turn_runner.run_async(user_id=user_id, session_id=session_id, new_message=content):
+                # Solo procesamos el evento final que contiene la respuesta de texto
+                if event.is_final_response():
+                    if event.content and event.content.parts:
+                        # Buscar la primera part que sea texto
+                        for part in event.content.parts:
+                            txt = getattr(part, "text", None)
+                            if txt:
+                                final_text = txt
+                                break
+                    # Una vez encontrada la respuesta final, salimos
+                    if final_text != "Perdón, tuve un problema procesando tu mensaje. Probá de nuevo en un toque.":
+                        break
+            if turn_span is not None:
+                turn_span.set(reply_chars=len(final_text))
+
+        outcome = "ok"
+        return final_text, True
         
     except Exception as e:
         print(f"❌ Error en run_whatsapp_turn: {e}")
         import traceback
         traceback.print_exc()
-        return "Perdón, hubo un problema técnico. Probá de nuevo en un ratito."
+        return TURN_ERROR_REPLY, False
+    finally:
+        AGENT_TURN_LATENCY.observe(time.perf_counter() - t0, outcome=outcome)
+
+@app.on_event("startup")
+async def warmup_agent():
+    start_agent_warmup()
 
 @app.on_event("startup")
 async def warmup_backoffice():
@@ -172,6 +297,11 @@ async def health_check():
 @app.post("/whatsapp/")
 async def whatsapp_webhook(request: Request):
     """Webhook principal para mensajes de WhatsApp vía Twilio"""
+    with tracing.start_trace("whatsapp_webhook", "webhook") as webhook_span:
+        response = await _handle_whatsapp_webhook(request, webhook_span)
+    return response
+
+async def _handle_whatsapp_webhook(request: Request, webhook_span) -> Response:
     try:
         form = await request.form()
         form_dict = dict(form)
@@ -188,25 +318,61 @@ async def whatsapp_webhook(request: Request):
         body = (form.get("Body") or "").strip()
         wa_id = (form.get("WaId") or "").strip()
         from_raw = (form.get("From") or "").strip()
+        # Tienda por el número al que escribió el cliente (STORE_WHATSAPP_NUMBERS)
+        store = shards.store_for_whatsapp(form.get("To") or "")
+
+        message_sid = (form.get("MessageSid") or form.get("SmsMessageSid") or "").strip()
+        if webhook_span is not None:
+            webhook_span.set(message_sid=message_sid, body_chars=len(body), store=store)
 
         # Priorizar WaId, luego From limpio
         user_id = wa_id or from_raw.replace("whatsapp:", "").replace("+", "") or "unknown"
 
         print(f"🔔 Incoming WhatsApp from {user_id[:10]}***: '{body[:50]}...'")
 
-        # 3) Procesar mensaje
+        # 3) Procesar mensaje (deduplicando reintentos de Twilio)
         if not body:
             reply_text = "No recibí ningún texto 🙂"
+        elif dedupe_store is None or not message_sid:
+            reply_text, _ = await run_whatsapp_turn(user_id, body, store)
         else:
-            reply_text = await run_whatsapp_turn(user_id, body)
+            dedupe_stats.incr("total")
+            state, cached_reply = dedupe_store.claim(message_sid)
+            if webhook_span is not None:
+                webhook_span.set(dedupe=state)
+
+            if state == STATE_DONE:
+                dedupe_stats.incr("duplicate_done")
+                print(f"♻️  Reintento de {message_sid}: respondo desde cache")
+                return _twiml_reply(cached_reply or "")
+
+            if state == STATE_IN_FLIGHT:
+                dedupe_stats.incr("duplicate_in_flight")
+                print(f"⏳ Reintento de {message_sid}: el turno original sigue en curso")
+                cached_reply = await wait_for_inflight_reply(message_sid)
+                if cached_reply is None:
+                    dedupe_stats.incr("in_flight_acked")
+                    return _twiml_ack()
+                dedupe_stats.incr("in_flight_resolved")
+                return _twiml_reply(cached_reply)
+
+            dedupe_stats.incr("new")
+            try:
+                reply_text, ok = await run_whatsapp_turn(user_id, body, store)
+            except BaseException:
+                dedupe_store.release(message_sid)
+                raise
+            if ok:
+                dedupe_store.complete(message_sid, reply_text)
+            else:
+                # Falla transitoria (modelo, backoffice): el reintento corre el turno de nuevo
+                dedupe_stats.incr("failed_released")
+                dedupe_store.release(message_sid)
 
         # 4) Responder con TwiML
-        twiml = MessagingResponse()
-        twiml.message(reply_text)
-        
         print(f"✅ Respuesta enviada: '{reply_text[:100]}...'")
-        
-        return Response(content=str(twiml), media_type="application/xml")
+
+        return _twiml_reply(reply_text)
         
     except Exception as e:
         print(f"❌ Error en whatsapp_webhook: {e}")
@@ -214,9 +380,15 @@ async def whatsapp_webhook(request: Request):
         traceback.print_exc()
         
         # Responder con mensaje genérico en caso de error
-        twiml = MessagingResponse()
-        twiml.message("Disculpá, tuve un problema técnico. Probá de nuevo en un ratito.")
-        return Response(content=str(twiml), media_type="application/xml")
+        return _twiml_reply("Disculpá, tuve un problema técnico. Probá de nuevo en un ratito.")
+
+@app.get("/whatsapp/dedupe_stats")
+async def whatsapp_dedupe_stats():
+    """Hit rate del dedupe de reintentos (por proceso)."""
+    stats = dedupe_stats.snapshot()
+    stats["backend"] = type(dedupe_store).__name__ if dedupe_store else "off"
+    stats["entries"] = len(dedupe_store) if dedupe_store else 0
+    return stats
 
 # Endpoint alternativo para compatibilidad
 @app.post("/")